@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import json
+import math
+import os
+import shlex
+import shutil
+import subprocess
+import argparse
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from samba_sim import SimulatedBoard
+from sizebatch import BatchError, find_configuration, read_configuration
+from tracing import TRACE_FILE_VARIABLE, Tracer, read_events, stage_durations
+
+assert sys.version_info >= (3, 7)
+
+
+TOOLCHAIN_DIR = Path(__file__).parent
+DEFAULT_FLASH_START = 0x2000
+# The binary image written by size.py next to the firmware target of `arm_gcc_link()`.
+FIRMWARE_BINARY = 'firmware.bin'
+# The stage with the total time of one pass through the pipeline.
+TOTAL_STAGE = 'pipeline: total'
+
+
+class BenchmarkError(Exception):
+    """
+    An error while running the pipeline.
+    """
+    pass
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Get a percentile of values, with linear interpolation between the closest ranks.
+
+    :param values: The values, which must not be empty.
+    :param fraction: The percentile as fraction, like 0.9 for the 90th percentile.
+    :return: The percentile.
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def run_step(tracer: Tracer, name: str, command: List[str], env: Dict[str, str], log_path: Path):
+    """
+    Run one step of the pipeline and record its time.
+
+    :param tracer: The tracer of the iteration.
+    :param name: The name of the step.
+    :param command: The command to run.
+    :param env: The environment for the command.
+    :param log_path: The file for the output of the command.
+    """
+    with open(log_path, 'a', encoding='utf-8') as log_file:
+        log_file.write(f'$ {" ".join(shlex.quote(argument) for argument in command)}\n')
+        log_file.flush()
+        with tracer.span(name, 'pipeline'):
+            try:
+                result = subprocess.run(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+            except OSError as e:
+                raise BenchmarkError(f'Could not run {command[0]}: {e}')
+    if result.returncode != 0:
+        raise BenchmarkError(f'The step "{name}" failed, see {log_path} for details.')
+
+
+def find_binary(build_dir: Path) -> Path:
+    """
+    Find the binary image of the firmware target written by the build.
+
+    :param build_dir: The build directory.
+    :return: The path to the binary image.
+    """
+    binaries = sorted(path for path in build_dir.rglob(FIRMWARE_BINARY)
+                      if path.is_file() and 'CMakeFiles' not in path.relative_to(build_dir).parts)
+    if not binaries:
+        raise BenchmarkError(f'The build wrote no {FIRMWARE_BINARY} into {build_dir}.')
+    return binaries[0]
+
+
+def flash_start_of(binary: Path) -> int:
+    """
+    Get the start address of the firmware, from the configuration of the build.
+
+    :param binary: The binary image in the build directory.
+    :return: The start address in flash.
+    """
+    config = find_configuration(binary)
+    if config is None or not config.is_file():
+        return DEFAULT_FLASH_START
+    try:
+        return read_configuration(config).flash_start
+    except BatchError:
+        return DEFAULT_FLASH_START
+
+
+def run_iteration(args, index: int, board: Optional[SimulatedBoard]) -> Dict[str, float]:
+    """
+    Run the whole pipeline once, in a fresh build directory.
+
+    :param args: The command line arguments.
+    :param index: The index of the iteration.
+    :param board: The simulated board for the upload, or None to skip the upload.
+    :return: The total duration in seconds for each stage of the trace.
+    """
+    work_dir = Path(args.work_dir).resolve()
+    build_dir = work_dir/f'build-{index}'
+    trace_path = work_dir/f'trace-{index}.json'
+    log_path = work_dir/f'log-{index}.txt'
+    if build_dir.exists():
+        shutil.rmtree(build_dir)
+    for path in (trace_path, log_path):
+        if path.exists():
+            path.unlink()
+    env = dict(os.environ)
+    env[TRACE_FILE_VARIABLE] = str(trace_path)
+    tracer = Tracer(trace_path, 'buildbench.py')
+    python = sys.executable
+    with tracer.span('total', 'pipeline', iteration=index):
+        if args.configure_args is not None:
+            run_step(tracer, 'configure.py', [python, str(TOOLCHAIN_DIR/'configure.py')] +
+                     shlex.split(args.configure_args), env, log_path)
+        run_step(tracer, 'cmake configure', ['cmake', '-S', str(Path(args.project).resolve()), '-B', str(build_dir),
+                                             f'-DCMAKE_TOOLCHAIN_FILE={Path(args.toolchain).resolve()}',
+                                             f'-DHAL_TRACE_FILE={trace_path}'], env, log_path)
+        run_step(tracer, 'cmake build', ['cmake', '--build', str(build_dir), '--parallel', str(args.jobs)],
+                 env, log_path)
+        if board is not None:
+            binary = find_binary(build_dir)
+            run_step(tracer, 'upload', [python, str(TOOLCHAIN_DIR/'upload.py'), '-r', '-u', '-t', 'samba',
+                                        '-p', str(board.link_path), '-f', str(binary),
+                                        '-b', hex(flash_start_of(binary))], env, log_path)
+    return stage_durations(read_events(trace_path))
+
+
+def print_results(samples: Dict[str, List[float]], iterations: int):
+    """
+    Print the percentiles of each stage.
+
+    :param samples: The durations of each stage, one value for each iteration with the stage.
+    :param iterations: The number of iterations.
+    """
+    width = max([len(stage) for stage in samples] + [5])
+    print(f'{"Stage":<{width}} {"Count":>6} {"p50":>9} {"p90":>9} {"Max":>9}')
+    ordered = sorted(samples.items(), key=lambda item: (item[0] != TOTAL_STAGE, -percentile(item[1], 0.5)))
+    for stage, values in ordered:
+        print(f'{stage:<{width}} {len(values):>3}/{iterations:<2} {percentile(values, 0.5):>8.3f}s '
+              f'{percentile(values, 0.9):>8.3f}s {max(values):>8.3f}s')
+
+
+def write_json(path: Path, samples: Dict[str, List[float]], iterations: int):
+    """
+    Write the results into a JSON file.
+
+    :param path: The path to the file.
+    :param samples: The durations of each stage.
+    :param iterations: The number of iterations.
+    """
+    stages = {}
+    for stage, values in sorted(samples.items()):
+        stages[stage] = {
+            'p50': percentile(values, 0.5),
+            'p90': percentile(values, 0.9),
+            'max': max(values),
+            'samples': values,
+        }
+    path.write_text(json.dumps({'iterations': iterations, 'stages': stages}, indent=2) + '\n', encoding='utf-8')
+
+
+def run_benchmark(args) -> int:
+    """
+    Run the pipeline repeatedly and report the percentiles of each stage.
+
+    :param args: The command line arguments.
+    :return: The exit code.
+    """
+    work_dir = Path(args.work_dir).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    board = None
+    if not args.no_upload:
+        board = SimulatedBoard(work_dir/'board', enumeration_delay=args.enumeration_delay)
+        board.start()
+    samples: Dict[str, List[float]] = {}
+    try:
+        for index in range(args.iterations):
+            print(f'Iteration {index + 1} of {args.iterations}...')
+            for stage, duration in run_iteration(args, index, board).items():
+                samples.setdefault(stage, []).append(duration)
+    finally:
+        if board is not None:
+            board.stop()
+    print()
+    print_results(samples, args.iterations)
+    print()
+    print(f'The traces are in {work_dir}, open them with chrome://tracing or https://ui.perfetto.dev.')
+    if args.json:
+        write_json(Path(args.json), samples, args.iterations)
+    return 0
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Run the whole toolchain pipeline repeatedly for a project, '
+                                                 'and report the percentiles of the time of each stage.')
+    parser.add_argument('project',
+                        help='The source directory of the project to build.')
+    parser.add_argument('--iterations', '-n',
+                        dest='iterations',
+                        type=int,
+                        action='store',
+                        default=5,
+                        help='The number of times the pipeline is run.')
+    parser.add_argument('--toolchain',
+                        dest='toolchain',
+                        type=str,
+                        action='store',
+                        default=str(TOOLCHAIN_DIR/'toolchain.cmake'),
+                        help='The CMake toolchain file.')
+    parser.add_argument('--configure-args',
+                        dest='configure_args',
+                        type=str,
+                        action='store',
+                        help='Run configure.py with these arguments in each iteration, like "--mcu SAMD21G18A".')
+    parser.add_argument('--no-upload',
+                        dest='no_upload',
+                        action='store_true',
+                        help='Do not upload the firmware to the simulated board.')
+    parser.add_argument('--enumeration-delay',
+                        dest='enumeration_delay',
+                        type=float,
+                        action='store',
+                        default=0.3,
+                        help='The time in seconds the simulated board needs for the USB enumeration.')
+    parser.add_argument('--work-dir',
+                        dest='work_dir',
+                        type=str,
+                        action='store',
+                        default='build-benchmark',
+                        help='The directory for the build directories, traces and logs.')
+    parser.add_argument('--json',
+                        dest='json',
+                        type=str,
+                        action='store',
+                        help='Write the results into this JSON file.')
+    parser.add_argument('--jobs', '-j',
+                        dest='jobs',
+                        type=int,
+                        action='store',
+                        default=os.cpu_count() or 4,
+                        help='The number of parallel build jobs.')
+    args = parser.parse_args()
+    if args.iterations < 1:
+        parser.error('At least one iteration is required.')
+    args.jobs = max(1, args.jobs)
+    try:
+        exit(run_benchmark(args))
+    except (BenchmarkError, OSError) as e:
+        exit(f'ERROR! {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -17,31 +17,50 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 
+import json
+import os
 import re
 import subprocess
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from functools import total_ordering
+from functools import lru_cache, total_ordering
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+
+from mcudb import BOARDS, McuDatabaseError, Variant, load_index, find_families, find_variants, print_variants
+from tracing import span
 
 assert sys.version_info >= (3, 7)
 
 
-TARGET_PLATFORM = 'feather-m0'
-TARGET_MCU = 'samd21'
-TARGET_MCU_VARIANT = 'SAMD21G18A'
-TARGET_CPU_TYPE = 'cortex-m0plus'
+DEFAULT_BOARD = 'feather-m0'
 TARGET_CPU_INSTRUCTIONS = 'thumb'
+PLATFORM_DIR = Path(__file__).parent/'platform'
 CONFIG_FILE = 'configuration.cmake'
-FLASH_SIZE = 0x00040000
-FLASH_START = 0x00002000
-RAM_SIZE = 0x00008000
+MATRIX_CONFIG_FILE = 'configuration-{variant}.cmake'
+OPTIMIZATION_PROFILES = ['size', 'speed', 'fast', 'size-lto', 'speed-lto', 'fast-lto']
+DEFAULT_OPTIMIZATION_PROFILE = 'size'
+BOOT_CLOCKS = ['locked', 'dfll', 'osc8m']
+DEFAULT_BOOT_CLOCK = 'locked'
 
-BIN_DIRS = [Path('/usr/bin'), Path('/usr/local/bin')]
+BIN_DIRS = [Path('/usr/local/bin'), Path('/usr/bin')]
+BIN_DIR_PATTERNS = [
+    'opt/homebrew/bin',
+    'opt/arm-gnu-toolchain*/bin',
+    'opt/gcc-arm-none-eabi*/bin',
+    'opt/*/arm-none-eabi/bin',
+    'opt/*/bin',
+    'usr/local/gcc-arm-none-eabi*/bin',
+    'usr/local/opt/*/bin',
+    'Applications/ArmGNUToolchain/*/arm-none-eabi/bin',
+    'Applications/Arm/bin',
+]
+PROBE_CACHE_FILE = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'probe-cache.json'
 COMPILER_NAME = 'arm-none-eabi-gcc'
 BOSSAC_NAME = 'bossac'
+COMPILER_LAUNCHER_NAMES = ['ccache', 'sccache']
 PYTHON3_PATH = sys.executable
 
 
@@ -71,7 +90,29 @@ class Configuration:
     """The configuration created for the system."""
     verbose: bool = False
     compiler_path: Optional[Path] = None
+    compiler_version: Optional[Version] = None
     bossac_path: Optional[Path] = None
+    use_probe_cache: bool = True
+    compiler_launcher: Optional[Path] = None
+    use_compiler_launcher: bool = True
+    precompile_headers: bool = False
+    optimization_profile: str = DEFAULT_OPTIMIZATION_PROFILE
+    boot_clock: str = DEFAULT_BOOT_CLOCK
+
+
+@dataclass
+class Target:
+    """The target for one configuration."""
+    platform: str
+    variant: Variant
+    flash_start: int
+
+
+@dataclass
+class ProbeResult:
+    """The result of running a tool to check its version."""
+    returncode: int
+    output: str
 
 
 COMPILER_MIN_VERSION = Version('6.3.1')
@@ -81,108 +122,330 @@ BOSSAC_MIN_VERSION = Version('1.9.0')
 config = Configuration()  # The configuration used for this tool.
 
 
-def scan_compiler():
+@lru_cache(maxsize=None)
+def search_dirs() -> List[Path]:
+    """
+    Get all directories to search for the tools.
+
+    The directories are only searched once, all tools are searched in the same list.
+
+    :return: The directories from the PATH, the regular binary directories and common install locations.
+    """
+    dirs = []
+    for entry in os.environ.get('PATH', '').split(os.pathsep):
+        if entry:
+            dirs.append(Path(entry))
+    dirs.extend(BIN_DIRS)
+    for base_dir in [Path('/'), Path.home()]:
+        for pattern in BIN_DIR_PATTERNS:
+            dirs.extend(sorted(base_dir.glob(pattern), reverse=True))
+    unique_dirs = []
+    for bin_dir in dirs:
+        if bin_dir not in unique_dirs:
+            unique_dirs.append(bin_dir)
+    return unique_dirs
+
+
+def find_tool(name: str) -> Optional[Path]:
     """
-    Scan for the compiler.
+    Search for a tool.
+
+    :param name: The file name of the tool.
+    :return: The path to the first found tool, or None if the tool was not found.
+    """
+    for bin_dir in search_dirs():
+        if (bin_dir/name).is_file():
+            return bin_dir/name
+    return None
+
+
+def probe_key(tool: Path, args: List[str]) -> Optional[str]:
+    """
+    Create the key for the probe cache.
+
+    :param tool: The path to the tool.
+    :param args: The arguments for the tool.
+    :return: The key, or None if the tool does not exist.
+    """
+    try:
+        stat = tool.resolve().stat()
+    except OSError:
+        return None
+    return f'{tool.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{stat.st_ino}|{" ".join(args)}'
+
+
+def is_current_probe_key(key: str) -> bool:
+    """
+    Check if a key of the probe cache still matches its tool.
+
+    :param key: The key from the cache.
+    :return: True if the tool exists and was not changed since it was probed.
+    """
+    parts = key.split('|', 4)
+    if len(parts) != 5:
+        return False
+    path, _, _, _, args = parts
+    return probe_key(Path(path), args.split()) == key
+
+
+def run_probe(tool: Path, args: List[str]) -> ProbeResult:
+    """
+    Run a tool to check its version.
+
+    :param tool: The path to the tool.
+    :param args: The arguments for the tool.
+    :return: The result of the probe.
+    """
+    command = [str(tool)] + args
+    if config.verbose:
+        print(f'Running: {" ".join(command)}')
+    try:
+        result = subprocess.run(command, capture_output=True)
+    except (OSError, subprocess.SubprocessError):
+        raise Error(f'Could not start command at: {str(tool)}')
+    return ProbeResult(returncode=result.returncode, output=result.stdout.decode('utf-8', errors='replace'))
+
+
+def probe_tools(probes: List[Tuple[Path, List[str]]]) -> List[ProbeResult]:
+    """
+    Probe multiple tools, using the cache and running all missing probes in parallel.
+
+    The cache is keyed by the path, size, modification time and inode of each tool, so a changed
+    tool is always probed again. Failed probes are not cached, and the results for removed or
+    changed tools are removed from the cache.
+
+    :param probes: A list of tools and their arguments.
+    :return: A list with the results, in the order of the probes.
+    """
+    cache = {}
+    if config.use_probe_cache:
+        try:
+            cache = json.loads(PROBE_CACHE_FILE.read_text('utf-8'))
+        except (OSError, ValueError):
+            cache = {}
+    keys = [probe_key(tool, args) for tool, args in probes]
+    results: List[Optional[ProbeResult]] = []
+    missing = []
+    for index, key in enumerate(keys):
+        if key and key in cache:
+            results.append(ProbeResult(**cache[key]))
+            if config.verbose:
+                print(f'Using cached probe result for: {probes[index][0]}')
+        else:
+            results.append(None)
+            missing.append(index)
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = {index: executor.submit(run_probe, *probes[index]) for index in missing}
+            for index, future in futures.items():
+                results[index] = future.result()
+                if keys[index] and results[index].returncode == 0:
+                    cache[keys[index]] = {'returncode': results[index].returncode, 'output': results[index].output}
+        if config.use_probe_cache:
+            cache = {key: value for key, value in cache.items()
+                     if value.get('returncode') == 0 and is_current_probe_key(key)}
+            try:
+                PROBE_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = PROBE_CACHE_FILE.with_suffix(f'.{os.getpid()}.tmp')
+                temp_path.write_text(json.dumps(cache, indent=1), 'utf-8')
+                temp_path.replace(PROBE_CACHE_FILE)
+            except OSError:
+                pass
+    return results
+
+
+def find_compiler() -> Path:
+    """
+    Find the compiler binary.
+
+    :return: The path to the compiler.
     """
     compiler_path = config.compiler_path
     if not compiler_path:
-        for bin_dir in BIN_DIRS:
-            if (bin_dir/COMPILER_NAME).is_file():
-                compiler_path = bin_dir
+        compiler_bin = find_tool(COMPILER_NAME)
+        if compiler_bin:
+            compiler_path = compiler_bin.parent
     if not compiler_path:
         raise Error('Could not find the ARM compiler in your path. Please specify the compiler directory using '
                     'the -c command line argument.')
-    compiler_bin = compiler_path/COMPILER_NAME
-    args = [str(compiler_bin), '--version']
-    if config.verbose:
-        print(f'Checking compiler version: {" ".join(args)}')
-    try:
-        result = subprocess.run(args, capture_output=True)
-    except subprocess.SubprocessError:
-        raise Error(f'Could not start compiler command at: {str(compiler_bin)}')
-    if not result:
-        raise Error(f'Could not start compiler command at: {str(compiler_bin)}')
+    config.compiler_path = compiler_path
+    return compiler_path/COMPILER_NAME
+
+
+def check_compiler(compiler_bin: Path, result: ProbeResult):
+    """
+    Check the version of the compiler.
+
+    :param compiler_bin: The path to the compiler.
+    :param result: The result of running the compiler with `--version`.
+    """
     if result.returncode != 0:
         if config.verbose:
-            print(f'Output: {result.stdout.decode("utf-8")}')
+            print(f'Output: {result.output}')
         raise Error(f'Compiler version check returned non-zero: {str(compiler_bin)}')
     re_version = re.compile(R'\s+(\d+\.\d+\.\d+)\s+')
-    match = re_version.search(result.stdout.decode('utf-8'))
+    match = re_version.search(result.output)
     if not match:
         raise Error(f'Could not detect the ARM compiler version.')
     compiler_version = Version(match.group(1))
     if compiler_version < COMPILER_MIN_VERSION:
         raise Error(f'Found compiler version {compiler_version}, but minimum version '
                     f'{COMPILER_MIN_VERSION} is required.')
-    config.compiler_path = compiler_path
+    config.compiler_version = compiler_version
     if config.verbose:
         print(f'Found compiler version {compiler_version} here: {config.compiler_path}')
 
 
-def scan_bossac():
+def find_bossac() -> Path:
     """
-    Search for the bossac tool.
+    Find the bossac tool.
+
+    :return: The path to the tool.
     """
     bossac_path = config.bossac_path
     if not bossac_path:
-        for bin_dir in BIN_DIRS:
-            if (bin_dir/BOSSAC_NAME).is_file():
-                bossac_path = bin_dir/BOSSAC_NAME
+        bossac_path = find_tool(BOSSAC_NAME)
     if not bossac_path:
         raise Error('Could not find the "bossac" tool in the regular binary paths. Please specify the '
                     'path to the tool using the -b command line argument.')
-    args = [str(bossac_path), '-h']
-    if config.verbose:
-        print(f'Checking bossac version: {" ".join(args)}')
-    try:
-        result = subprocess.run(args, capture_output=True)
-    except subprocess.SubprocessError:
-        raise Error(f'Could not start bossac command at: {str(bossac_path)}')
-    if not result:
-        raise Error(f'Could not start bossac command at: {str(bossac_path)}')
+    config.bossac_path = bossac_path
+    return bossac_path
+
+
+def check_bossac(bossac_path: Path, result: ProbeResult):
+    """
+    Check the version of the bossac tool.
+
+    :param bossac_path: The path to the tool.
+    :param result: The result of running the tool with `-h`.
+    """
     re_version = re.compile(R'\s+(\d+\.\d+\.\d+)\s+')
-    match = re_version.search(result.stdout.decode('utf-8'))
+    match = re_version.search(result.output)
     if not match:
         if config.verbose:
-            print(f'Output: {result.stdout.decode("utf-8")}')
+            print(f'Output: {result.output}')
         raise Error(f'Could not detect the bossac version.')
     bossac_version = Version(match.group(1))
     if bossac_version < BOSSAC_MIN_VERSION:
         raise Error(f'Found bossac version {bossac_version}, but minimum version '
                     f'{BOSSAC_MIN_VERSION} is required.')
-    config.bossac_path = bossac_path
     if config.verbose:
         print(f'Found bossac version {bossac_version} here: {config.bossac_path}')
 
 
+def find_compiler_launcher() -> Optional[Path]:
+    """
+    Find a compiler cache to use as compiler launcher.
+
+    :return: The path to the compiler launcher, or None if no launcher shall be used.
+    """
+    if not config.use_compiler_launcher:
+        return None
+    launcher_path = config.compiler_launcher
+    if launcher_path:
+        if not launcher_path.is_file():
+            raise Error(f'Could not find the compiler launcher at: {launcher_path}')
+        return launcher_path
+    for name in COMPILER_LAUNCHER_NAMES:
+        launcher_path = find_tool(name)
+        if launcher_path:
+            break
+    config.compiler_launcher = launcher_path
+    if config.verbose:
+        if launcher_path:
+            print(f'Found compiler launcher here: {launcher_path}')
+        else:
+            print('No compiler launcher found, building without compiler cache.')
+    return launcher_path
+
+
 def scan_system():
     """
     Scan the system for required directories.
     """
-    scan_compiler()
-    scan_bossac()
+    with span('find tools', 'configure'):
+        compiler_bin = find_compiler()
+        bossac_path = find_bossac()
+    with span('probe tools', 'configure'):
+        compiler_result, bossac_result = probe_tools([(compiler_bin, ['--version']), (bossac_path, ['-h'])])
+    check_compiler(compiler_bin, compiler_result)
+    check_bossac(bossac_path, bossac_result)
+    with span('find compiler launcher', 'configure'):
+        find_compiler_launcher()
+
+
+def select_targets(board_name: str, variant_patterns: List[str]) -> List[Target]:
+    """
+    Select the targets to configure.
+
+    Only variants of families with a directory in `platform` are selected, the skipped families are reported.
+
+    :param board_name: The name of the board.
+    :param variant_patterns: Names or patterns of MCU variants, or an empty list to use the variant of the board.
+    :return: A list with the targets.
+    """
+    if board_name not in BOARDS:
+        raise Error(f'Unknown board "{board_name}". Known boards: {", ".join(sorted(BOARDS))}')
+    board = BOARDS[board_name]
+    try:
+        index = load_index()
+        variants = find_variants(index, variant_patterns or [board.variant])
+        families = find_families(variant_patterns)
+    except (McuDatabaseError, OSError) as e:
+        raise Error(str(e))
+    platforms = sorted(path.name for path in PLATFORM_DIR.iterdir() if path.is_dir())
+    unsupported = sorted({variant.family for variant in variants if variant.family.lower() not in platforms})
+    if unsupported:
+        print(f'Skipping the MCU families without a platform: {", ".join(unsupported)}')
+    without_variants = sorted(set(families) - {variant.family for variant in variants})
+    if without_variants:
+        print(f'Skipping the MCU families without a supported variant: {", ".join(without_variants)}')
+    variants = [variant for variant in variants if variant.family.lower() in platforms]
+    if not variants:
+        raise Error(f'None of the selected MCU variants is supported. Supported families: {", ".join(platforms)}')
+    targets = []
+    for variant in variants:
+        targets.append(Target(platform=board.platform,
+                              variant=variant,
+                              flash_start=variant.flash_address + board.bootloader_size))
+    return targets
 
 
-def write_config():
+def write_config(target: Target, config_path: Path):
     """
     Write the final configuration.
+
+    :param target: The target for the configuration.
+    :param config_path: The path of the configuration file.
     """
     if config.verbose:
-        print('Preparing configuration...')
+        print(f'Preparing configuration for {target.variant.name}...')
     variables = {
-        'MCU_NAME': TARGET_MCU.lower(),
-        'MCU_VARIANT': TARGET_MCU_VARIANT.upper(),
-        'TARGET_PLATFORM': TARGET_PLATFORM.lower(),
-        'CPU_TARGET': TARGET_CPU_TYPE.lower(),
+        'MCU_NAME': target.variant.family.lower(),
+        'MCU_VARIANT': target.variant.name.upper(),
+        'MCU_INCLUDE_DIR': target.variant.include_dir,
+        'TARGET_PLATFORM': target.platform.lower(),
+        'CPU_TARGET': target.variant.cpu.lower(),
         'CPU_INST': TARGET_CPU_INSTRUCTIONS.lower(),
         'APP_TOOLS_PATH': str(config.compiler_path),
+        'COMPILER_VERSION': str(config.compiler_version),
         'BOSSAC_PATH': str(config.bossac_path),
         'PYTHON3_PATH': str(PYTHON3_PATH),
-        'FLASH_SIZE': f'{FLASH_SIZE:#010x}',
-        'FLASH_START': f'{FLASH_START:#010x}',
-        'RAM_SIZE': f'{RAM_SIZE:#010x}',
+        'FLASH_SIZE': f'{target.variant.flash_size:#010x}',
+        'FLASH_START': f'{target.flash_start:#010x}',
+        'RAM_START': f'{target.variant.ram_address:#010x}',
+        'RAM_SIZE': f'{target.variant.ram_size:#010x}',
+        'OPTIMIZATION_PROFILE': config.optimization_profile,
+        'BOOT_CLOCK': config.boot_clock,
     }
+    if target.variant.lp_ram_size:
+        variables['LP_RAM_START'] = f'{target.variant.lp_ram_address:#010x}'
+        variables['LP_RAM_SIZE'] = f'{target.variant.lp_ram_size:#010x}'
+    if config.compiler_launcher:
+        variables['CMAKE_C_COMPILER_LAUNCHER'] = str(config.compiler_launcher)
+        variables['CMAKE_CXX_COMPILER_LAUNCHER'] = str(config.compiler_launcher)
+    if config.precompile_headers:
+        variables['HAL_PRECOMPILE_HEADERS'] = 'ON'
     if config.verbose:
         print(' - Configuration:')
         for key, value in variables.items():
@@ -196,7 +459,6 @@ def write_config():
     for key, value in variables.items():
         lines.append(f'set({key} "{value}")')
     lines.extend(['', '', ''])
-    config_path = Path(__file__).parent / CONFIG_FILE
     print(f'Writing configuration: {config_path}')
     config_path.write_text('\n'.join(lines), 'utf-8')
 
@@ -223,16 +485,109 @@ def main():
                         action='store',
                         dest='bossac_path',
                         help='Set the path to the BOSSAc executable manually if it can not be detected.')
+    parser.add_argument('--no-probe-cache',
+                        required=False,
+                        action='store_true',
+                        dest='no_probe_cache',
+                        help='Always run the tools to check their versions, instead of using cached results.')
+    parser.add_argument('-l', '--launcher',
+                        required=False,
+                        action='store',
+                        dest='launcher_path',
+                        help='Set the path to the compiler launcher, like "ccache", if it can not be detected.')
+    parser.add_argument('--no-launcher',
+                        required=False,
+                        action='store_true',
+                        dest='no_launcher',
+                        help='Do not use a compiler launcher, even if a compiler cache is installed.')
+    parser.add_argument('--precompile-headers',
+                        required=False,
+                        action='store_true',
+                        dest='precompile_headers',
+                        help='Precompile the MCU and DSP headers for the firmware.')
+    parser.add_argument('-O', '--profile',
+                        required=False,
+                        action='store',
+                        dest='profile',
+                        choices=OPTIMIZATION_PROFILES,
+                        default=DEFAULT_OPTIMIZATION_PROFILE,
+                        help='The optimization profile: "size" (-Os), "speed" (-O2) or "fast" (-O3), '
+                             'optionally with link time optimization, e.g. "size-lto".')
+    parser.add_argument('--boot-clock',
+                        required=False,
+                        action='store',
+                        dest='boot_clock',
+                        choices=BOOT_CLOCKS,
+                        default=DEFAULT_BOOT_CLOCK,
+                        help='The clock until the main clock is locked to the crystal: "locked" waits for the '
+                             'lock before main() is called, "dfll" and "osc8m" start main() immediately with '
+                             'the open loop DFLL48M or the OSC8M at 8MHz, and lock in the background.')
+    parser.add_argument('--board',
+                        required=False,
+                        action='store',
+                        dest='board',
+                        default=DEFAULT_BOARD,
+                        help=f'The board to configure. Known boards: {", ".join(sorted(BOARDS))}')
+    parser.add_argument('--mcu',
+                        required=False,
+                        action='store',
+                        dest='mcu',
+                        help='Use this MCU variant instead of the one of the board, e.g. "SAMD21J18A".')
+    parser.add_argument('--matrix',
+                        required=False,
+                        nargs='+',
+                        dest='matrix',
+                        help='Write one configuration for each matching MCU variant or family, e.g. "samd21*". '
+                             'The configurations are named "configuration-<variant>.cmake".')
+    parser.add_argument('-o', '--output',
+                        required=False,
+                        action='store',
+                        dest='output',
+                        help='The directory for the configuration files.')
+    parser.add_argument('--list-variants',
+                        required=False,
+                        nargs='*',
+                        dest='list_variants',
+                        help='List all known MCU variants, or the ones matching the given patterns, and exit.')
     args = parser.parse_args()
+    if args.list_variants is not None:
+        try:
+            index = load_index()
+            print_variants(find_variants(index, args.list_variants or ['*']))
+        except (McuDatabaseError, OSError) as e:
+            exit(f'ERROR! {e}')
+        exit(0)
+    if args.no_probe_cache:
+        config.use_probe_cache = False
     if args.verbose:
         config.verbose = True
     if args.compiler_path:
         config.compiler_path = Path(args.compiler_path)
     if args.bossac_path:
         config.bossac_path = Path(args.bossac_path)
+    if args.launcher_path:
+        config.compiler_launcher = Path(args.launcher_path)
+    if args.no_launcher:
+        config.use_compiler_launcher = False
+    if args.precompile_headers:
+        config.precompile_headers = True
+    config.optimization_profile = args.profile
+    config.boot_clock = args.boot_clock
     try:
+        with span('select targets', 'configure'):
+            if args.matrix:
+                targets = select_targets(args.board, args.matrix)
+            else:
+                targets = select_targets(args.board, [args.mcu] if args.mcu else [])
         scan_system()
-        write_config()
+        output_dir = Path(args.output) if args.output else Path(__file__).parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with span('write configuration', 'configure', count=len(targets)):
+            for target in targets:
+                if args.matrix:
+                    write_config(target, output_dir/MATRIX_CONFIG_FILE.format(variant=target.variant.name.lower()))
+                else:
+                    write_config(target, output_dir/CONFIG_FILE)
         print('SUCCESS!')
         exit(0)
     except Error as error:
@@ -0,0 +1,393 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import json
+import os
+import struct
+import time
+import argparse
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from debugline import DebugLineError
+from elffile import ElfFile, ElfError
+from frames import FRAME_TYPE_CRASH_DUMP, FrameDecoder
+from logformat import firmware_hash
+from samba import SambaError, SerialPort
+from symbolindex import LineIndex, SymbolIndex
+from upload import PortNotFound, auto_int, find_port
+
+assert sys.version_info >= (3, 7)
+
+
+CRASH_DUMP_MAGIC = 0x31504443
+CRASH_DUMP_HEADER = struct.Struct('<II20s16I3I')
+BUILD_ID_SIZE = 20
+SYMBOL_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'symbols'
+CACHE_FORMAT = 1
+REGISTER_NAMES = ['r0', 'r1', 'r2', 'r3', 'r4', 'r5', 'r6', 'r7', 'r8', 'r9', 'r10', 'r11', 'r12', 'sp', 'lr', 'pc']
+FIRMWARE_PATTERNS = ['firmware', '*.elf']
+
+
+class Error(Exception):
+    """The error class for this script."""
+
+
+@dataclass
+class CrashDump:
+    """A crash dump saved by the HardFault handler of the firmware."""
+    build_id: bytes
+    registers: List[int]
+    xpsr: int
+    exc_return: int
+    stack: List[int]
+
+    @property
+    def exception_number(self) -> int:
+        """The number of the active exception at the fault, or zero for thread mode."""
+        return self.xpsr & 0x3f
+
+    @property
+    def uses_process_stack(self) -> bool:
+        return (self.exc_return & 0x4) != 0
+
+
+def parse_dump(payload: bytes) -> CrashDump:
+    """
+    Parse the payload of a crash dump frame.
+
+    :param payload: The contents of the `CrashDump` structure from `hal-core/CrashDump.h`.
+    :return: The crash dump.
+    """
+    if len(payload) < CRASH_DUMP_HEADER.size or (len(payload) - CRASH_DUMP_HEADER.size) % 4:
+        raise Error(f'The crash dump has an invalid size of {len(payload)} bytes.')
+    values = CRASH_DUMP_HEADER.unpack_from(payload)
+    magic, checksum, build_id = values[0:3]
+    if magic != CRASH_DUMP_MAGIC:
+        raise Error(f'Unknown crash dump format {magic:#010x}.')
+    words = struct.unpack_from(f'<{(len(payload) - 8) // 4}I', payload, 8)
+    if (~sum(words)) & 0xffffffff != checksum:
+        raise Error('The checksum of the crash dump does not match.')
+    registers = list(values[3:19])
+    xpsr, exc_return, stack_size = values[19:22]
+    stack = list(struct.unpack_from(f'<{(len(payload) - CRASH_DUMP_HEADER.size) // 4}I', payload,
+                                    CRASH_DUMP_HEADER.size))
+    return CrashDump(build_id=build_id, registers=registers, xpsr=xpsr, exc_return=exc_return,
+                     stack=stack[:stack_size])
+
+
+class FirmwareIndex:
+    """
+    The symbol and line index of one firmware build, to symbolize addresses.
+    """
+
+    def __init__(self, path: Path, build_id: Optional[bytes], functions: SymbolIndex, lines: LineIndex,
+                 code_ranges: List[Tuple[int, int]]):
+        self.path = path
+        self.build_id = build_id
+        self.functions = functions
+        self.lines = lines
+        self.code_ranges = code_ranges
+
+    @staticmethod
+    def create(elf: ElfFile) -> 'FirmwareIndex':
+        """
+        Create the index from a firmware.
+
+        :param elf: The firmware.
+        :return: The index.
+        """
+        code_ranges = [(section.address, section.address + section.size) for section in elf.sections
+                       if section.is_alloc and section.is_code and section.size > 0]
+        return FirmwareIndex(elf.path, elf.build_id(), SymbolIndex.from_elf(elf), LineIndex.from_elf(elf),
+                             code_ranges)
+
+    @staticmethod
+    def cache_key(path: Path, build_id: Optional[bytes]) -> str:
+        return build_id.hex() if build_id else firmware_hash(path)
+
+    def save(self, cache_dir: Path):
+        """
+        Save the index in the cache directory, using the build ID or the hash of the firmware as key.
+
+        :param cache_dir: The directory for the cached indexes.
+        """
+        stat = self.path.stat()
+        data = {'format': CACHE_FORMAT,
+                'elf': str(self.path.resolve()),
+                'elf_size': stat.st_size,
+                'elf_mtime': stat.st_mtime_ns,
+                'build_id': self.build_id.hex() if self.build_id else None,
+                'functions': self.functions.to_data(),
+                'lines': self.lines.to_data(),
+                'code_ranges': self.code_ranges}
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_path = cache_dir/f'{self.cache_key(self.path, self.build_id)}.json'
+            temp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+            temp_path.write_text(json.dumps(data, separators=(',', ':')), 'utf-8')
+            temp_path.replace(cache_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def load_cached(cache_path: Path) -> Optional['FirmwareIndex']:
+        """
+        Load an index from the cache.
+
+        :param cache_path: The path to the cached index.
+        :return: The index, or None if there is no valid index for an existing firmware file.
+        """
+        try:
+            data = json.loads(cache_path.read_text('utf-8'))
+            if data.get('format') != CACHE_FORMAT:
+                return None
+            path = Path(data['elf'])
+            stat = path.stat()
+            if stat.st_size != data['elf_size'] or stat.st_mtime_ns != data['elf_mtime']:
+                return None
+            build_id = bytes.fromhex(data['build_id']) if data['build_id'] else None
+            return FirmwareIndex(path, build_id, SymbolIndex.from_data(data['functions']),
+                                 LineIndex.from_data(data['lines']),
+                                 [tuple(code_range) for code_range in data['code_ranges']])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def is_code(self, address: int) -> bool:
+        address &= ~1
+        return any(start <= address < end for start, end in self.code_ranges)
+
+    def symbolize(self, address: int) -> str:
+        """
+        Get the function and the source line of an address.
+
+        :param address: The address.
+        :return: A text with the address, the function with the offset and the source line.
+        """
+        text = f'{address:#010x}'
+        function = self.functions.find(address)
+        if function:
+            text += f' {function[0]}+{function[1]:#x}'
+        line = self.lines.lookup(address)
+        if line:
+            text += f' ({line[0]}:{line[1]})'
+        return text
+
+
+def load_index(path: Path, cache_dir: Optional[Path]) -> FirmwareIndex:
+    """
+    Load the index for a firmware file, from the cache if possible.
+
+    :param path: The path to the firmware ELF file.
+    :param cache_dir: The directory for the cached indexes, or None to disable the cache.
+    :return: The index.
+    """
+    try:
+        with ElfFile(path) as elf:
+            build_id = elf.build_id()
+            if cache_dir:
+                index = FirmwareIndex.load_cached(cache_dir/f'{FirmwareIndex.cache_key(path, build_id)}.json')
+                if index is not None and index.path == path.resolve():
+                    return index
+            index = FirmwareIndex.create(elf)
+    except (ElfError, DebugLineError, OSError) as e:
+        raise Error(f'Could not read the firmware {path}: {e}')
+    if cache_dir:
+        index.save(cache_dir)
+    return index
+
+
+def find_index(build_id: bytes, search_dirs: List[Path], cache_dir: Optional[Path]) -> FirmwareIndex:
+    """
+    Find the firmware with the given build ID.
+
+    The cached index of the build is used, as long as its firmware file is unchanged. Otherwise the
+    search directories are scanned for firmware files with the build ID.
+
+    :param build_id: The build ID, or its start, from the crash dump.
+    :param search_dirs: The directories to search for firmware files.
+    :param cache_dir: The directory for the cached indexes, or None to disable the cache.
+    :return: The index of the firmware.
+    """
+    if cache_dir and cache_dir.is_dir():
+        for cache_path in cache_dir.glob(f'{build_id.hex()}*.json'):
+            index = FirmwareIndex.load_cached(cache_path)
+            if index is not None:
+                return index
+    for search_dir in search_dirs:
+        for pattern in FIRMWARE_PATTERNS:
+            for path in sorted(search_dir.rglob(pattern)):
+                if not path.is_file():
+                    continue
+                try:
+                    with ElfFile(path) as elf:
+                        file_build_id = elf.build_id()
+                except (ElfError, OSError):
+                    continue
+                if file_build_id and file_build_id[:len(build_id)] == build_id:
+                    return load_index(path, cache_dir)
+    raise Error(f'Found no firmware with the build ID {build_id.hex()}.')
+
+
+def read_dump_from_port(port: str, timeout: float) -> bytes:
+    """
+    Wait for a crash dump frame sent by the firmware.
+
+    :param port: The path to the port.
+    :param timeout: The maximum time in seconds to wait for the frame.
+    :return: The payload of the frame.
+    """
+    decoder = FrameDecoder([FRAME_TYPE_CRASH_DUMP])
+    deadline = time.monotonic() + timeout
+    try:
+        with SerialPort(port) as serial_port:
+            while time.monotonic() < deadline:
+                data = serial_port.read_available(timeout=0.1)
+                for frame in decoder.feed(data):
+                    return frame.payload
+    except SambaError as e:
+        raise Error(str(e))
+    raise Error(f'Received no crash dump within {timeout} seconds.')
+
+
+def read_dump_from_file(path: Path) -> bytes:
+    """
+    Read a crash dump from a file with the received data, or with the raw dump.
+
+    :param path: The path to the file.
+    :return: The payload of the crash dump frame.
+    """
+    data = path.read_bytes()
+    frames = FrameDecoder([FRAME_TYPE_CRASH_DUMP]).feed(data)
+    if frames:
+        return frames[0].payload
+    return data
+
+
+def print_dump(dump: CrashDump, index: FirmwareIndex):
+    """
+    Print the registers and the possible call stack of a crash dump.
+
+    :param dump: The crash dump.
+    :param index: The index of the matching firmware.
+    """
+    print(f'Firmware: {index.path}')
+    if dump.exception_number:
+        context = f'exception {dump.exception_number}'
+    else:
+        context = 'thread mode'
+    print(f'HardFault in {context}, using the {"process" if dump.uses_process_stack else "main"} stack.')
+    print(f'PC: {index.symbolize(dump.registers[15])}')
+    print(f'LR: {index.symbolize(dump.registers[14])}')
+    print()
+    for row in range(0, 16, 4):
+        print('  '.join(f'{REGISTER_NAMES[i]:>3}={dump.registers[i]:08x}' for i in range(row, row + 4)))
+    print(f'xpsr={dump.xpsr:08x}  exc_return={dump.exc_return:08x}')
+    print()
+    print(f'Possible return addresses in the {len(dump.stack)} saved stack words:')
+    found = False
+    for offset, value in enumerate(dump.stack):
+        # Return addresses pushed by a call have the thumb bit set and point after the call instruction.
+        if value & 1 and index.is_code(value):
+            found = True
+            print(f'  sp+{offset * 4:<4} {index.symbolize((value & ~1) - 2)}')
+    if not found:
+        print('  None')
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Read the crash dump of a firmware and symbolize it.')
+    parser.add_argument('--port', '-p',
+                        dest='port',
+                        type=str,
+                        action='store',
+                        default='/dev/cu.usbmodem*',
+                        help='The serial port of the board. Can contain wildcards to select the first '
+                             'matching device.')
+    parser.add_argument('--input', '-i',
+                        dest='input',
+                        type=str,
+                        action='store',
+                        help='Read the crash dump from a file, instead of the port.')
+    parser.add_argument('--timeout', '-t',
+                        dest='timeout',
+                        type=float,
+                        action='store',
+                        default=10.0,
+                        help='The maximum time in seconds to wait for the crash dump.')
+    parser.add_argument('--elf', '-e',
+                        dest='elf',
+                        type=str,
+                        action='store',
+                        help='The firmware ELF file. By default, the firmware is located by its build ID.')
+    parser.add_argument('--search', '-s',
+                        dest='search_dirs',
+                        action='append',
+                        default=[],
+                        help='A directory to search for the firmware with the build ID of the dump. '
+                             'Defaults to the current directory.')
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        type=str,
+                        action='store',
+                        default=str(SYMBOL_CACHE_DIR),
+                        help='The directory for the cached symbol indexes.')
+    parser.add_argument('--address', '-a',
+                        dest='addresses',
+                        type=auto_int,
+                        nargs='+',
+                        help='Only symbolize the given addresses, using the firmware from --elf.')
+    args = parser.parse_args()
+    cache_dir = Path(args.cache_dir).expanduser()
+    try:
+        if args.addresses:
+            if not args.elf:
+                exit('Please specify the firmware with --elf.')
+            index = load_index(Path(args.elf), cache_dir)
+            print('\n'.join(index.symbolize(address) for address in args.addresses))
+            return
+        if args.input:
+            payload = read_dump_from_file(Path(args.input))
+        else:
+            port = find_port(args.port)
+            print(f'Waiting for a crash dump from {port}...')
+            payload = read_dump_from_port(port, args.timeout)
+        dump = parse_dump(payload)
+        if args.elf:
+            index = load_index(Path(args.elf), cache_dir)
+            if index.build_id and index.build_id[:BUILD_ID_SIZE] != dump.build_id and any(dump.build_id):
+                print('WARNING! The build ID of the firmware does not match the crash dump.')
+        else:
+            if not any(dump.build_id):
+                exit('The crash dump has no build ID, please specify the firmware with --elf.')
+            search_dirs = [Path(path) for path in args.search_dirs] or [Path.cwd()]
+            index = find_index(dump.build_id, search_dirs, cache_dir)
+        print_dump(dump, index)
+    except (Error, PortNotFound, OSError) as e:
+        exit(f'ERROR! {e}')
+
+
+if __name__ == '__main__':
+    main()
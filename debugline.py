@@ -0,0 +1,289 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import os
+import struct
+import sys
+from typing import List, Optional, Tuple
+
+from elffile import ElfFile
+
+assert sys.version_info >= (3, 7)
+
+
+DEBUG_LINE_SECTION = '.debug_line'
+DEBUG_LINE_STR_SECTION = '.debug_line_str'
+DEBUG_STR_SECTION = '.debug_str'
+
+DW_LNS_COPY = 1
+DW_LNS_ADVANCE_PC = 2
+DW_LNS_ADVANCE_LINE = 3
+DW_LNS_SET_FILE = 4
+DW_LNS_CONST_ADD_PC = 8
+DW_LNS_FIXED_ADVANCE_PC = 9
+DW_LNE_END_SEQUENCE = 1
+DW_LNE_SET_ADDRESS = 2
+DW_LNE_DEFINE_FILE = 3
+DW_LNCT_PATH = 1
+DW_LNCT_DIRECTORY_INDEX = 2
+
+DW_FORM_DATA2 = 0x05
+DW_FORM_DATA4 = 0x06
+DW_FORM_DATA8 = 0x07
+DW_FORM_STRING = 0x08
+DW_FORM_BLOCK = 0x09
+DW_FORM_DATA1 = 0x0b
+DW_FORM_STRP = 0x0e
+DW_FORM_UDATA = 0x0f
+DW_FORM_DATA16 = 0x1e
+DW_FORM_LINE_STRP = 0x1f
+FIXED_FORM_SIZES = {DW_FORM_DATA1: 1, DW_FORM_DATA2: 2, DW_FORM_DATA4: 4, DW_FORM_DATA8: 8, DW_FORM_DATA16: 16}
+
+
+class DebugLineError(Exception):
+    """
+    Exception if the line table of a firmware can not be read.
+    """
+    pass
+
+
+class _Reader:
+    """Sequential reader for the DWARF data of one section."""
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, fmt: str) -> int:
+        value = struct.unpack_from('<' + fmt, self.data, self.offset)[0]
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def uleb(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                return result
+
+    def sleb(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                if byte & 0x40:
+                    result -= 1 << shift
+                return result
+
+    def string(self) -> str:
+        end = self.data.index(b'\0', self.offset)
+        value = self.data[self.offset:end].decode('utf-8', errors='replace')
+        self.offset = end + 1
+        return value
+
+
+def _string_at(data: bytes, offset: int) -> str:
+    end = data.find(b'\0', offset)
+    if end < 0:
+        end = len(data)
+    return data[offset:end].decode('utf-8', errors='replace')
+
+
+class _LineProgram:
+    """The header and the file table of one line number program."""
+
+    def __init__(self, reader: _Reader, line_strings: bytes, strings: bytes):
+        self.line_strings = line_strings
+        self.strings = strings
+        unit_length = reader.unpack('I')
+        if unit_length >= 0xfffffff0:
+            raise DebugLineError('The 64-bit DWARF format is not supported.')
+        self.end = reader.offset + unit_length
+        self.version = reader.unpack('H')
+        if not 2 <= self.version <= 5:
+            raise DebugLineError(f'Unsupported line table version {self.version}.')
+        if self.version >= 5:
+            reader.offset += 2  # The address size and the segment selector size.
+        header_length = reader.unpack('I')
+        self.program_start = reader.offset + header_length
+        self.minimum_instruction_length = reader.unpack('B')
+        if self.version >= 4:
+            reader.offset += 1  # The maximum operations per instruction, only used for VLIW.
+        self.default_is_stmt = reader.unpack('B')
+        self.line_base = reader.unpack('b')
+        self.line_range = reader.unpack('B')
+        self.opcode_base = reader.unpack('B')
+        self.opcode_lengths = list(reader.data[reader.offset:reader.offset + self.opcode_base - 1])
+        reader.offset += self.opcode_base - 1
+        if self.version >= 5:
+            directories = [entry[0] for entry in self._read_entries(reader)]
+            self.files = []
+            for path, directory_index in self._read_entries(reader):
+                self.files.append(self._join(directories, directory_index, path))
+        else:
+            directories = ['']
+            while True:
+                directory = reader.string()
+                if not directory:
+                    break
+                directories.append(directory)
+            # The files are numbered starting with one, before version 5.
+            self.files = ['']
+            while True:
+                path = reader.string()
+                if not path:
+                    break
+                directory_index = reader.uleb()
+                reader.uleb()
+                reader.uleb()
+                self.files.append(self._join(directories, directory_index, path))
+        self.directories = directories
+
+    @staticmethod
+    def _join(directories: List[str], index: int, path: str) -> str:
+        if os.path.isabs(path) or not 0 <= index < len(directories) or not directories[index]:
+            return path
+        return os.path.join(directories[index], path)
+
+    def _read_entries(self, reader: _Reader) -> List[Tuple[str, int]]:
+        formats = []
+        for _ in range(reader.unpack('B')):
+            formats.append((reader.uleb(), reader.uleb()))
+        entries = []
+        for _ in range(reader.uleb()):
+            path = ''
+            directory_index = 0
+            for content_type, form in formats:
+                value = self._read_form(reader, form)
+                if content_type == DW_LNCT_PATH:
+                    path = value
+                elif content_type == DW_LNCT_DIRECTORY_INDEX:
+                    directory_index = value
+            entries.append((path, directory_index))
+        return entries
+
+    def _read_form(self, reader: _Reader, form: int):
+        if form == DW_FORM_STRING:
+            return reader.string()
+        if form == DW_FORM_LINE_STRP:
+            return _string_at(self.line_strings, reader.unpack('I'))
+        if form == DW_FORM_STRP:
+            return _string_at(self.strings, reader.unpack('I'))
+        if form == DW_FORM_UDATA:
+            return reader.uleb()
+        if form == DW_FORM_BLOCK:
+            reader.offset += reader.uleb()
+            return 0
+        size = FIXED_FORM_SIZES.get(form)
+        if size is None:
+            raise DebugLineError(f'Unsupported form {form:#x} in the line table header.')
+        value = int.from_bytes(reader.data[reader.offset:reader.offset + size], 'little')
+        reader.offset += size
+        return value
+
+    def file_name(self, index: int) -> str:
+        if 0 <= index < len(self.files):
+            return self.files[index]
+        return '??'
+
+
+def read_line_rows(elf: ElfFile) -> List[Tuple[int, Optional[str], int]]:
+    """
+    Read the line number table of a firmware, from the DWARF debug information.
+
+    Only the rows are returned, without columns or flags. The end of each sequence is returned
+    as row without file, which marks the end of the code covered by the previous row.
+
+    :param elf: The firmware.
+    :return: A list with the address, the file name and the line of each row.
+    """
+    section = elf.section(DEBUG_LINE_SECTION)
+    if section is None:
+        return []
+    data = bytes(elf.section_data(section))
+    line_strings_section = elf.section(DEBUG_LINE_STR_SECTION)
+    line_strings = bytes(elf.section_data(line_strings_section)) if line_strings_section else b''
+    strings_section = elf.section(DEBUG_STR_SECTION)
+    strings = bytes(elf.section_data(strings_section)) if strings_section else b''
+    rows = []
+    reader = _Reader(data)
+    try:
+        while reader.offset + 4 <= len(data):
+            program = _LineProgram(reader, line_strings, strings)
+            reader.offset = program.program_start
+            _run_program(reader, program, rows)
+            reader.offset = program.end
+    except (IndexError, ValueError, struct.error) as e:
+        raise DebugLineError(f'The line table is corrupt: {e}')
+    return rows
+
+
+def _run_program(reader: _Reader, program: _LineProgram, rows: List[Tuple[int, Optional[str], int]]):
+    minimum_length = program.minimum_instruction_length
+    address = 0
+    file_index = 1
+    line = 1
+    while reader.offset < program.end:
+        opcode = reader.unpack('B')
+        if opcode >= program.opcode_base:
+            adjusted = opcode - program.opcode_base
+            address += (adjusted // program.line_range) * minimum_length
+            line += program.line_base + adjusted % program.line_range
+            rows.append((address, program.file_name(file_index), line))
+        elif opcode == 0:
+            length = reader.uleb()
+            end = reader.offset + length
+            if length:
+                extended = reader.unpack('B')
+                if extended == DW_LNE_END_SEQUENCE:
+                    rows.append((address, None, 0))
+                    address = 0
+                    file_index = 1
+                    line = 1
+                elif extended == DW_LNE_SET_ADDRESS:
+                    address = int.from_bytes(reader.data[reader.offset:end], 'little')
+                elif extended == DW_LNE_DEFINE_FILE:
+                    path = reader.string()
+                    directory_index = reader.uleb()
+                    program.files.append(program._join(program.directories, directory_index, path))
+            reader.offset = end
+        elif opcode == DW_LNS_COPY:
+            rows.append((address, program.file_name(file_index), line))
+        elif opcode == DW_LNS_ADVANCE_PC:
+            address += reader.uleb() * minimum_length
+        elif opcode == DW_LNS_ADVANCE_LINE:
+            line += reader.sleb()
+        elif opcode == DW_LNS_SET_FILE:
+            file_index = reader.uleb()
+        elif opcode == DW_LNS_CONST_ADD_PC:
+            address += ((255 - program.opcode_base) // program.line_range) * minimum_length
+        elif opcode == DW_LNS_FIXED_ADVANCE_PC:
+            address += reader.unpack('H')
+        else:
+            # Skip the arguments of all other standard opcodes, like the column and the flags.
+            for _ in range(program.opcode_lengths[opcode - 1]):
+                reader.uleb()
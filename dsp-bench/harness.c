@@ -0,0 +1,550 @@
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+// The benchmark harness for the kernels of the DSP library, driven by `dspbench.py`.
+//
+// The harness is compiled for the host, to measure the throughput and the accuracy, and
+// for the Cortex-M0+, to analyze the instructions of the kernels.
+
+
+#include "arm_math.h"
+#include "arm_const_structs.h"
+
+#include <stdbool.h>
+#include <string.h>
+#include <time.h>
+
+
+#ifndef BENCH_BUFFER_SIZE
+#define BENCH_BUFFER_SIZE 0x20000u
+#endif
+
+
+/// The input of the kernel, which is restored before each run of an in-place kernel.
+///
+static uint32_t gInput[BENCH_BUFFER_SIZE / 4];
+
+/// The coefficients of the kernel, like the taps of a filter or the second matrix.
+///
+static uint32_t gCoefficients[BENCH_BUFFER_SIZE / 4];
+
+/// The buffer for in-place kernels.
+///
+static uint32_t gWork[BENCH_BUFFER_SIZE / 4];
+
+/// The output of the kernel.
+///
+static uint32_t gOutput[BENCH_BUFFER_SIZE / 4];
+
+/// The state or scratch buffer of the kernel.
+///
+static uint32_t gState[BENCH_BUFFER_SIZE / 4];
+
+/// The number of input bytes.
+///
+static uint32_t gInputSize = 0;
+
+/// The number of coefficient bytes.
+///
+static uint32_t gCoefficientSize = 0;
+
+/// The size of the current kernel.
+///
+static uint32_t gSize = 0;
+
+/// The instances of the kernels.
+///
+static union {
+    const arm_cfft_instance_f32 *cfftF32;
+    const arm_cfft_instance_q31 *cfftQ31;
+    const arm_cfft_instance_q15 *cfftQ15;
+    arm_rfft_fast_instance_f32 rfftFastF32;
+    arm_rfft_instance_q31 rfftQ31;
+    arm_rfft_instance_q15 rfftQ15;
+    arm_fir_instance_f32 firF32;
+    arm_fir_instance_q31 firQ31;
+    arm_fir_instance_q15 firQ15;
+    arm_biquad_casd_df1_inst_f32 biquadF32;
+    arm_biquad_casd_df1_inst_q31 biquadQ31;
+    arm_biquad_casd_df1_inst_q15 biquadQ15;
+} gInstance;
+
+/// The additional instances for the DCT4 and the matrix kernels.
+///
+static union {
+    struct {
+        arm_dct4_instance_q31 dct;
+        arm_rfft_instance_q31 rfft;
+        arm_cfft_radix4_instance_q31 cfft;
+    } dct4Q31;
+    struct {
+        arm_dct4_instance_q15 dct;
+        arm_rfft_instance_q15 rfft;
+        arm_cfft_radix4_instance_q15 cfft;
+    } dct4Q15;
+    struct {
+        arm_matrix_instance_f32 a, b, c;
+    } matrixF32;
+    struct {
+        arm_matrix_instance_q31 a, b, c;
+    } matrixQ31;
+    struct {
+        arm_matrix_instance_q15 a, b, c;
+    } matrixQ15;
+} gExtra;
+
+
+/// One kernel of the benchmark.
+///
+typedef struct {
+    const char *name;
+    /// Initialize the instance for the size. Returns false if the size is not supported.
+    bool (*setup)(uint32_t size, int32_t parameter);
+    /// Run the kernel once.
+    void (*run)(void);
+    /// The buffer with the output.
+    const uint32_t *output;
+    /// If the input has to be restored before each run.
+    bool isInPlace;
+} Kernel;
+
+
+static void restoreInput(void)
+{
+    memcpy(gWork, gInput, gInputSize);
+}
+
+
+#if !defined(__arm__)
+// The bit reversal is written in assembler for the ARM build, this is the same algorithm in C.
+void arm_bitreversal_32(uint32_t *pSrc, const uint16_t bitRevLen, const uint16_t *pBitRevTable)
+{
+    for (uint32_t i = 0; i < bitRevLen; i += 2) {
+        const uint32_t a = pBitRevTable[i] >> 2;
+        const uint32_t b = pBitRevTable[i + 1] >> 2;
+        for (uint32_t j = 0; j < 2; ++j) {
+            const uint32_t value = pSrc[a + j];
+            pSrc[a + j] = pSrc[b + j];
+            pSrc[b + j] = value;
+        }
+    }
+}
+
+void arm_bitreversal_16(uint16_t *pSrc, const uint16_t bitRevLen, const uint16_t *pBitRevTable)
+{
+    for (uint32_t i = 0; i < bitRevLen; i += 2) {
+        const uint32_t a = pBitRevTable[i] >> 2;
+        const uint32_t b = pBitRevTable[i + 1] >> 2;
+        for (uint32_t j = 0; j < 2; ++j) {
+            const uint16_t value = pSrc[a + j];
+            pSrc[a + j] = pSrc[b + j];
+            pSrc[b + j] = value;
+        }
+    }
+}
+#endif
+
+
+#define CFFT_INSTANCE(format, size, result) \
+    switch (size) { \
+    case 16: result = &arm_cfft_sR_##format##_len16; break; \
+    case 32: result = &arm_cfft_sR_##format##_len32; break; \
+    case 64: result = &arm_cfft_sR_##format##_len64; break; \
+    case 128: result = &arm_cfft_sR_##format##_len128; break; \
+    case 256: result = &arm_cfft_sR_##format##_len256; break; \
+    case 512: result = &arm_cfft_sR_##format##_len512; break; \
+    case 1024: result = &arm_cfft_sR_##format##_len1024; break; \
+    case 2048: result = &arm_cfft_sR_##format##_len2048; break; \
+    case 4096: result = &arm_cfft_sR_##format##_len4096; break; \
+    default: return false; \
+    }
+
+
+static bool setupCfftF32(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    CFFT_INSTANCE(f32, size, gInstance.cfftF32);
+    return true;
+}
+
+static void runCfftF32(void)
+{
+    restoreInput();
+    arm_cfft_f32(gInstance.cfftF32, (float32_t*)gWork, 0, 1);
+}
+
+static bool setupCfftQ31(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    CFFT_INSTANCE(q31, size, gInstance.cfftQ31);
+    return true;
+}
+
+static void runCfftQ31(void)
+{
+    restoreInput();
+    arm_cfft_q31(gInstance.cfftQ31, (q31_t*)gWork, 0, 1);
+}
+
+static bool setupCfftQ15(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    CFFT_INSTANCE(q15, size, gInstance.cfftQ15);
+    return true;
+}
+
+static void runCfftQ15(void)
+{
+    restoreInput();
+    arm_cfft_q15(gInstance.cfftQ15, (q15_t*)gWork, 0, 1);
+}
+
+
+static bool setupRfftFastF32(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    return arm_rfft_fast_init_f32(&gInstance.rfftFastF32, (uint16_t)size) == ARM_MATH_SUCCESS;
+}
+
+static void runRfftFastF32(void)
+{
+    restoreInput();
+    arm_rfft_fast_f32(&gInstance.rfftFastF32, (float32_t*)gWork, (float32_t*)gOutput, 0);
+}
+
+static bool setupRfftQ31(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    return arm_rfft_init_q31(&gInstance.rfftQ31, size, 0, 1) == ARM_MATH_SUCCESS;
+}
+
+static void runRfftQ31(void)
+{
+    restoreInput();
+    arm_rfft_q31(&gInstance.rfftQ31, (q31_t*)gWork, (q31_t*)gOutput);
+}
+
+static bool setupRfftQ15(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    return arm_rfft_init_q15(&gInstance.rfftQ15, size, 0, 1) == ARM_MATH_SUCCESS;
+}
+
+static void runRfftQ15(void)
+{
+    restoreInput();
+    arm_rfft_q15(&gInstance.rfftQ15, (q15_t*)gWork, (q15_t*)gOutput);
+}
+
+
+static bool setupDct4Q31(uint32_t size, int32_t parameter)
+{
+    return arm_dct4_init_q31(&gExtra.dct4Q31.dct, &gExtra.dct4Q31.rfft, &gExtra.dct4Q31.cfft,
+        (uint16_t)size, (uint16_t)(size / 2), (q31_t)parameter) == ARM_MATH_SUCCESS;
+}
+
+static void runDct4Q31(void)
+{
+    restoreInput();
+    arm_dct4_q31(&gExtra.dct4Q31.dct, (q31_t*)gState, (q31_t*)gWork);
+}
+
+static bool setupDct4Q15(uint32_t size, int32_t parameter)
+{
+    return arm_dct4_init_q15(&gExtra.dct4Q15.dct, &gExtra.dct4Q15.rfft, &gExtra.dct4Q15.cfft,
+        (uint16_t)size, (uint16_t)(size / 2), (q15_t)parameter) == ARM_MATH_SUCCESS;
+}
+
+static void runDct4Q15(void)
+{
+    restoreInput();
+    arm_dct4_q15(&gExtra.dct4Q15.dct, (q15_t*)gState, (q15_t*)gWork);
+}
+
+
+static bool setupFirF32(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    memset(gState, 0, sizeof(gState));
+    arm_fir_init_f32(&gInstance.firF32, (uint16_t)(gCoefficientSize / sizeof(float32_t)),
+        (float32_t*)gCoefficients, (float32_t*)gState, size);
+    return true;
+}
+
+static void runFirF32(void)
+{
+    arm_fir_f32(&gInstance.firF32, (float32_t*)gInput, (float32_t*)gOutput, gSize);
+}
+
+static bool setupFirQ31(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    memset(gState, 0, sizeof(gState));
+    arm_fir_init_q31(&gInstance.firQ31, (uint16_t)(gCoefficientSize / sizeof(q31_t)),
+        (q31_t*)gCoefficients, (q31_t*)gState, size);
+    return true;
+}
+
+static void runFirQ31(void)
+{
+    arm_fir_q31(&gInstance.firQ31, (q31_t*)gInput, (q31_t*)gOutput, gSize);
+}
+
+static bool setupFirQ15(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    memset(gState, 0, sizeof(gState));
+    return arm_fir_init_q15(&gInstance.firQ15, (uint16_t)(gCoefficientSize / sizeof(q15_t)),
+        (q15_t*)gCoefficients, (q15_t*)gState, size) == ARM_MATH_SUCCESS;
+}
+
+static void runFirQ15(void)
+{
+    arm_fir_q15(&gInstance.firQ15, (q15_t*)gInput, (q15_t*)gOutput, gSize);
+}
+
+
+static bool setupBiquadF32(uint32_t size, int32_t parameter)
+{
+    (void)size;
+    (void)parameter;
+    memset(gState, 0, sizeof(gState));
+    arm_biquad_cascade_df1_init_f32(&gInstance.biquadF32, (uint8_t)(gCoefficientSize / (5 * sizeof(float32_t))),
+        (float32_t*)gCoefficients, (float32_t*)gState);
+    return true;
+}
+
+static void runBiquadF32(void)
+{
+    arm_biquad_cascade_df1_f32(&gInstance.biquadF32, (float32_t*)gInput, (float32_t*)gOutput, gSize);
+}
+
+static bool setupBiquadQ31(uint32_t size, int32_t parameter)
+{
+    (void)size;
+    memset(gState, 0, sizeof(gState));
+    arm_biquad_cascade_df1_init_q31(&gInstance.biquadQ31, (uint8_t)(gCoefficientSize / (5 * sizeof(q31_t))),
+        (q31_t*)gCoefficients, (q31_t*)gState, (int8_t)parameter);
+    return true;
+}
+
+static void runBiquadQ31(void)
+{
+    arm_biquad_cascade_df1_q31(&gInstance.biquadQ31, (q31_t*)gInput, (q31_t*)gOutput, gSize);
+}
+
+static bool setupBiquadQ15(uint32_t size, int32_t parameter)
+{
+    (void)size;
+    memset(gState, 0, sizeof(gState));
+    arm_biquad_cascade_df1_init_q15(&gInstance.biquadQ15, (uint8_t)(gCoefficientSize / (6 * sizeof(q15_t))),
+        (q15_t*)gCoefficients, (q15_t*)gState, (int8_t)parameter);
+    return true;
+}
+
+static void runBiquadQ15(void)
+{
+    arm_biquad_cascade_df1_q15(&gInstance.biquadQ15, (q15_t*)gInput, (q15_t*)gOutput, gSize);
+}
+
+
+static bool setupMatrixF32(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    arm_mat_init_f32(&gExtra.matrixF32.a, (uint16_t)size, (uint16_t)size, (float32_t*)gInput);
+    arm_mat_init_f32(&gExtra.matrixF32.b, (uint16_t)size, (uint16_t)size, (float32_t*)gCoefficients);
+    arm_mat_init_f32(&gExtra.matrixF32.c, (uint16_t)size, (uint16_t)size, (float32_t*)gOutput);
+    return true;
+}
+
+static void runMatrixF32(void)
+{
+    arm_mat_mult_f32(&gExtra.matrixF32.a, &gExtra.matrixF32.b, &gExtra.matrixF32.c);
+}
+
+static bool setupMatrixQ31(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    arm_mat_init_q31(&gExtra.matrixQ31.a, (uint16_t)size, (uint16_t)size, (q31_t*)gInput);
+    arm_mat_init_q31(&gExtra.matrixQ31.b, (uint16_t)size, (uint16_t)size, (q31_t*)gCoefficients);
+    arm_mat_init_q31(&gExtra.matrixQ31.c, (uint16_t)size, (uint16_t)size, (q31_t*)gOutput);
+    return true;
+}
+
+static void runMatrixQ31(void)
+{
+    arm_mat_mult_q31(&gExtra.matrixQ31.a, &gExtra.matrixQ31.b, &gExtra.matrixQ31.c);
+}
+
+static bool setupMatrixQ15(uint32_t size, int32_t parameter)
+{
+    (void)parameter;
+    arm_mat_init_q15(&gExtra.matrixQ15.a, (uint16_t)size, (uint16_t)size, (q15_t*)gInput);
+    arm_mat_init_q15(&gExtra.matrixQ15.b, (uint16_t)size, (uint16_t)size, (q15_t*)gCoefficients);
+    arm_mat_init_q15(&gExtra.matrixQ15.c, (uint16_t)size, (uint16_t)size, (q15_t*)gOutput);
+    return true;
+}
+
+static void runMatrixQ15(void)
+{
+    arm_mat_mult_q15(&gExtra.matrixQ15.a, &gExtra.matrixQ15.b, &gExtra.matrixQ15.c, (q15_t*)gState);
+}
+
+
+/// All kernels, the names match the kernels in `dspbench.py`.
+///
+static const Kernel cKernels[] = {
+    {"cfft_f32", setupCfftF32, runCfftF32, gWork, true},
+    {"cfft_q31", setupCfftQ31, runCfftQ31, gWork, true},
+    {"cfft_q15", setupCfftQ15, runCfftQ15, gWork, true},
+    {"rfft_fast_f32", setupRfftFastF32, runRfftFastF32, gOutput, true},
+    {"rfft_q31", setupRfftQ31, runRfftQ31, gOutput, true},
+    {"rfft_q15", setupRfftQ15, runRfftQ15, gOutput, true},
+    {"dct4_q31", setupDct4Q31, runDct4Q31, gWork, true},
+    {"dct4_q15", setupDct4Q15, runDct4Q15, gWork, true},
+    {"fir_f32", setupFirF32, runFirF32, gOutput, false},
+    {"fir_q31", setupFirQ31, runFirQ31, gOutput, false},
+    {"fir_q15", setupFirQ15, runFirQ15, gOutput, false},
+    {"biquad_f32", setupBiquadF32, runBiquadF32, gOutput, false},
+    {"biquad_q31", setupBiquadQ31, runBiquadQ31, gOutput, false},
+    {"biquad_q15", setupBiquadQ15, runBiquadQ15, gOutput, false},
+    {"mat_mult_f32", setupMatrixF32, runMatrixF32, gOutput, false},
+    {"mat_mult_q31", setupMatrixQ31, runMatrixQ31, gOutput, false},
+    {"mat_mult_q15", setupMatrixQ15, runMatrixQ15, gOutput, false},
+};
+
+/// The selected kernel.
+///
+static const Kernel *gKernel = 0;
+
+
+uint32_t Bench_bufferSize(void)
+{
+    return BENCH_BUFFER_SIZE;
+}
+
+
+void Bench_setInput(const void *data, uint32_t size)
+{
+    gInputSize = size < BENCH_BUFFER_SIZE ? size : BENCH_BUFFER_SIZE;
+    memcpy(gInput, data, gInputSize);
+}
+
+
+void Bench_setCoefficients(const void *data, uint32_t size)
+{
+    gCoefficientSize = size < BENCH_BUFFER_SIZE ? size : BENCH_BUFFER_SIZE;
+    memcpy(gCoefficients, data, gCoefficientSize);
+}
+
+
+int Bench_setup(const char *name, uint32_t size, int32_t parameter)
+{
+    gKernel = 0;
+    for (uint32_t i = 0; i < sizeof(cKernels) / sizeof(cKernels[0]); ++i) {
+        if (strcmp(cKernels[i].name, name) == 0) {
+            gSize = size;
+            if (!cKernels[i].setup(size, parameter)) {
+                return -2;
+            }
+            gKernel = &cKernels[i];
+            return 0;
+        }
+    }
+    return -1;
+}
+
+
+void Bench_run(void)
+{
+    if (gKernel != 0) {
+        gKernel->run();
+    }
+}
+
+
+const void *Bench_output(void)
+{
+    return gKernel != 0 ? gKernel->output : 0;
+}
+
+
+#if !defined(__arm__)
+/// Measure the time for repeated runs of the kernel.
+///
+/// @param count The number of runs.
+/// @param restoreOnly If only the input is restored, to subtract this time from the runs.
+/// @return The elapsed time in nanoseconds.
+///
+uint64_t Bench_time(uint32_t count, int restoreOnly)
+{
+    if (gKernel == 0) {
+        return 0;
+    }
+    struct timespec start;
+    struct timespec end;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    if (restoreOnly) {
+        if (gKernel->isInPlace) {
+            for (uint32_t i = 0; i < count; ++i) {
+                restoreInput();
+                __asm__ volatile("" ::: "memory");
+            }
+        }
+    } else {
+        for (uint32_t i = 0; i < count; ++i) {
+            gKernel->run();
+            __asm__ volatile("" ::: "memory");
+        }
+    }
+    clock_gettime(CLOCK_MONOTONIC, &end);
+    return (uint64_t)(end.tv_sec - start.tv_sec) * 1000000000u + (uint64_t)(end.tv_nsec - start.tv_nsec);
+}
+#endif
+
+
+#ifdef BENCH_COVERAGE
+extern void __gcov_reset(void);
+extern void __gcov_dump(void);
+
+/// Reset the execution counts, after the setup of a kernel.
+///
+void Bench_resetCoverage(void)
+{
+    __gcov_reset();
+}
+
+/// Write the execution counts of the run.
+///
+void Bench_dumpCoverage(void)
+{
+    __gcov_dump();
+}
+#endif
+
+
+#if defined(__arm__)
+/// The entry point of the ARM build, which is only analyzed and never executed.
+///
+void Bench_main(void)
+{
+    Bench_setup("", 0, 0);
+    Bench_run();
+}
+#endif
@@ -0,0 +1,810 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import ctypes
+import fnmatch
+import json
+import math
+import os
+import random
+import shutil
+import struct
+import subprocess
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from configure import COMPILER_NAME, find_tool
+from dsplib import Error as LibraryError, cache_key, compile_source, source_files
+from dsptables import TRANSFORM_SIZES
+from elffile import ElfError, ElfFile
+from thumbmodel import ThumbProgram
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+assert sys.version_info >= (3, 7)
+
+
+HARNESS_SOURCE = Path(__file__).parent/'dsp-bench'/'harness.c'
+INCLUDE_DIR = Path(__file__).parent/'cmsis-atmel'/'Include'
+COMMON_FLAGS = ['-DARM_MATH_CM0PLUS', f'-I{INCLUDE_DIR}']
+HOST_FLAGS = ['-O2', '-fPIC']
+COVERAGE_FLAGS = ['-O0', '-fPIC', '--coverage', '-DBENCH_COVERAGE']
+ARM_FLAGS = ['-mcpu=cortex-m0plus', '-mthumb', '-g', '-ffunction-sections', '-fdata-sections']
+ARM_LINK_FLAGS = ['-mcpu=cortex-m0plus', '-mthumb', '--specs=nosys.specs', '-nostartfiles',
+                  '-Wl,--gc-sections', '-Wl,--entry=Bench_main']
+BASELINE_FORMAT = 1
+
+# The number of bits after the point, and the struct code of each format.
+FORMATS = {'f32': (0, 'f'), 'q31': (31, 'i'), 'q15': (15, 'h')}
+FILTER_SIZES = (64, 256, 1024, 4096)
+MATRIX_SIZES = (4, 8, 16, 32, 64)
+FIR_TAPS = 32
+FILTER_CUTOFF = 0.1
+# The quality factors of the two sections of a 4th order Butterworth filter.
+BIQUAD_QUALITIES = (0.5412, 1.3066)
+BIQUAD_POST_SHIFT = 1
+# The range of power-of-two scales tested to match the output format of a fixed point kernel.
+SHIFT_RANGE = range(-8, 25)
+MAX_SNR = 200.0
+SNR_TOLERANCE = 1.0
+
+
+class Error(Exception):
+    """The error class for this script."""
+
+
+@dataclass
+class Kernel:
+    """A kernel of the DSP library, as named in the harness."""
+    name: str
+    format: str
+    sizes: Tuple[int, ...]
+
+    @property
+    def kind(self) -> str:
+        return self.name[:-len(self.format) - 1]
+
+
+KERNELS = [Kernel(f'{kind}_{format}', format, sizes) for (kind, format), sizes in TRANSFORM_SIZES.items()]
+KERNELS += [Kernel(f'{kind}_{format}', format, sizes)
+            for kind, sizes in (('fir', FILTER_SIZES), ('biquad', FILTER_SIZES), ('mat_mult', MATRIX_SIZES))
+            for format in ('f32', 'q31', 'q15')]
+
+
+@dataclass
+class Case:
+    """
+    The data for one kernel and size.
+
+    The input and the coefficients are already quantized to the format of the kernel, so
+    the reference only measures the error of the calculation.
+    """
+    kernel: Kernel
+    size: int
+    input: List[float]
+    coefficients: List[float] = field(default_factory=list)
+    parameter: int = 0
+    output_count: int = 0
+    samples: int = 0
+
+    @property
+    def key(self) -> str:
+        return f'{self.kernel.name}/{self.size}'
+
+
+@dataclass
+class Result:
+    """The measured values for one kernel and size."""
+    kernel: str
+    size: int
+    samples: int
+    time: Optional[float] = None
+    snr: Optional[float] = None
+    max_error: Optional[float] = None
+    shift: Optional[int] = None
+    instructions: Optional[int] = None
+    cycles: Optional[int] = None
+    estimated: List[str] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return f'{self.kernel}/{self.size}'
+
+
+@dataclass
+class Coverage:
+    """The execution counts from one run of a kernel in the coverage build."""
+    function_counts: Dict[str, int] = field(default_factory=dict)
+    function_units: Dict[str, str] = field(default_factory=dict)
+    line_counts: Dict[Tuple[str, str, int], int] = field(default_factory=dict)
+
+
+def quantize(values: List[float], format: str) -> List[float]:
+    """
+    Round values to the resolution of a fixed point format, with saturation.
+
+    :param values: The values.
+    :param format: The format, values for 'f32' are returned unchanged.
+    :return: The quantized values.
+    """
+    bits = FORMATS[format][0]
+    if not bits:
+        return list(values)
+    scale = 1 << bits
+    return [max(-scale, min(scale - 1, round(value * scale))) / scale for value in values]
+
+
+def encode(values: List[float], format: str) -> bytes:
+    """
+    Encode values in the binary format of a kernel.
+
+    :param values: The values, already quantized.
+    :param format: The format.
+    :return: The encoded values.
+    """
+    bits, code = FORMATS[format]
+    if bits:
+        values = [round(value * (1 << bits)) for value in values]
+    return struct.pack(f'<{len(values)}{code}', *values)
+
+
+def decode(data: bytes, format: str) -> List[float]:
+    """
+    Decode values from the binary format of a kernel.
+
+    :param data: The encoded values.
+    :param format: The format.
+    :return: The values.
+    """
+    bits, code = FORMATS[format]
+    values = struct.unpack(f'<{len(data) // struct.calcsize(code)}{code}', data)
+    if bits:
+        return [value / (1 << bits) for value in values]
+    return list(values)
+
+
+def _fir_coefficients() -> List[float]:
+    # A windowed sinc lowpass filter, with a gain of one.
+    center = (FIR_TAPS - 1) / 2
+    values = []
+    for index in range(FIR_TAPS):
+        x = index - center
+        sinc = 2 * FILTER_CUTOFF * (math.sin(2 * math.pi * FILTER_CUTOFF * x) / (2 * math.pi * FILTER_CUTOFF * x)
+                                    if x else 1.0)
+        window = 0.54 - 0.46 * math.cos(2 * math.pi * index / (FIR_TAPS - 1))
+        values.append(sinc * window)
+    total = sum(values)
+    return [value / total for value in values]
+
+
+def _biquad_coefficients(format: str) -> List[float]:
+    # The sections of a Butterworth lowpass filter, with the sign of the feedback used by CMSIS.
+    coefficients = []
+    omega = 2 * math.pi * FILTER_CUTOFF
+    for quality in BIQUAD_QUALITIES:
+        alpha = math.sin(omega) / (2 * quality)
+        a0 = 1 + alpha
+        b0 = (1 - math.cos(omega)) / 2 / a0
+        section = [b0, 2 * b0, b0, 2 * math.cos(omega) / a0, -(1 - alpha) / a0]
+        if format != 'f32':
+            section = quantize([value / (1 << BIQUAD_POST_SHIFT) for value in section], format)
+        if format == 'q15':
+            section.insert(1, 0.0)
+        coefficients += section
+    return coefficients
+
+
+def create_case(kernel: Kernel, size: int) -> Case:
+    """
+    Create the input data for a kernel and size.
+
+    The data only depends on the kernel and size, so the results can be compared between runs.
+
+    :param kernel: The kernel.
+    :param size: The transform length, the block size of a filter or the dimension of a matrix.
+    :return: The case.
+    """
+    generator = random.Random(f'{kernel.name}/{size}')
+
+    def noise(count: int, amplitude: float = 0.5) -> List[float]:
+        return quantize([generator.uniform(-amplitude, amplitude) for _ in range(count)], kernel.format)
+
+    kind = kernel.kind
+    if kind == 'cfft':
+        return Case(kernel, size, noise(2 * size), output_count=2 * size, samples=size)
+    if kind == 'rfft_fast':
+        return Case(kernel, size, noise(size), output_count=size, samples=size)
+    if kind == 'rfft':
+        return Case(kernel, size, noise(size), output_count=2 * size, samples=size)
+    if kind == 'dct4':
+        bits = FORMATS[kernel.format][0]
+        return Case(kernel, size, noise(size), parameter=round(math.sqrt(2 / size) * (1 << bits)),
+                    output_count=size, samples=size)
+    if kind == 'fir':
+        return Case(kernel, size, noise(size), quantize(_fir_coefficients(), kernel.format),
+                    output_count=size, samples=size)
+    if kind == 'biquad':
+        return Case(kernel, size, noise(size), _biquad_coefficients(kernel.format), parameter=BIQUAD_POST_SHIFT,
+                    output_count=size, samples=size)
+    if kind == 'mat_mult':
+        amplitude = 0.5 / math.sqrt(size)
+        return Case(kernel, size, noise(size * size, amplitude), noise(size * size, amplitude),
+                    output_count=size * size, samples=size * size)
+    raise Error(f'Unknown kernel: {kernel.name}')
+
+
+def _interleave(values) -> 'numpy.ndarray':
+    result = numpy.empty(2 * len(values))
+    result[0::2] = values.real
+    result[1::2] = values.imag
+    return result
+
+
+def _biquad_reference(case: Case, x: 'numpy.ndarray') -> 'numpy.ndarray':
+    coefficients = list(case.coefficients)
+    if case.kernel.format == 'q15':
+        del coefficients[1::6]
+    if case.kernel.format != 'f32':
+        coefficients = [value * (1 << case.parameter) for value in coefficients]
+    for stage in range(len(coefficients) // 5):
+        b0, b1, b2, a1, a2 = coefficients[stage * 5:stage * 5 + 5]
+        y = numpy.zeros(len(x))
+        x1 = x2 = y1 = y2 = 0.0
+        for index, value in enumerate(x):
+            y[index] = b0 * value + b1 * x1 + b2 * x2 + a1 * y1 + a2 * y2
+            x1, x2, y1, y2 = value, x1, y[index], y1
+        x = y
+    return x
+
+
+def reference(case: Case) -> 'numpy.ndarray':
+    """
+    Calculate the expected output of a kernel with NumPy, in double precision.
+
+    :param case: The case.
+    :return: The output, in the same layout as the output of the kernel.
+    """
+    x = numpy.array(case.input, dtype=numpy.float64)
+    size = case.size
+    kind = case.kernel.kind
+    if kind == 'cfft':
+        return _interleave(numpy.fft.fft(x[0::2] + 1j * x[1::2]))
+    if kind == 'rfft_fast':
+        spectrum = numpy.fft.rfft(x)
+        return numpy.concatenate(([spectrum[0].real, spectrum[size // 2].real],
+                                  _interleave(spectrum[1:size // 2])))
+    if kind == 'rfft':
+        return _interleave(numpy.fft.fft(x))
+    if kind == 'dct4':
+        result = numpy.empty(size)
+        positions = numpy.arange(size) + 0.5
+        # Calculated in blocks of rows, to limit the memory used for the large transforms.
+        for start in range(0, size, 256):
+            rows = numpy.cos(numpy.pi / size * numpy.outer(positions[start:start + 256], positions))
+            result[start:start + 256] = rows @ x
+        return result * math.sqrt(2 / size)
+    if kind == 'fir':
+        return numpy.convolve(x, numpy.array(case.coefficients)[::-1])[:size]
+    if kind == 'biquad':
+        return _biquad_reference(case, x)
+    if kind == 'mat_mult':
+        matrix_a = x.reshape(size, size)
+        matrix_b = numpy.array(case.coefficients).reshape(size, size)
+        return (matrix_a @ matrix_b).ravel()
+    raise Error(f'Unknown kernel: {case.kernel.name}')
+
+
+def measure_accuracy(case: Case, output: List[float], result: Result):
+    """
+    Compare the output of a kernel with the reference.
+
+    Many fixed point kernels scale the output down to prevent overflows, so the output is
+    compared using the power-of-two scale with the smallest error.
+
+    :param case: The case.
+    :param output: The output of the kernel.
+    :param result: The result to update with the SNR, the maximum error and the scale.
+    """
+    expected = reference(case)
+    actual = numpy.array(output, dtype=numpy.float64)
+    best = None
+    for shift in SHIFT_RANGE:
+        error = actual * (2.0 ** shift) - expected
+        energy = float(numpy.dot(error, error))
+        if best is None or energy < best[0]:
+            best = (energy, shift, float(numpy.max(numpy.abs(error))))
+    energy, result.shift, result.max_error = best
+    signal = float(numpy.dot(expected, expected))
+    result.snr = MAX_SNR if energy == 0 else min(MAX_SNR, 10 * math.log10(signal / energy))
+
+
+class HarnessLibrary:
+    """
+    The harness loaded as shared library.
+    """
+
+    def __init__(self, path: Path):
+        self.library = ctypes.CDLL(str(path))
+        self.library.Bench_setup.argtypes = [ctypes.c_char_p, ctypes.c_uint32, ctypes.c_int32]
+        self.library.Bench_setup.restype = ctypes.c_int
+        self.library.Bench_setInput.argtypes = [ctypes.c_char_p, ctypes.c_uint32]
+        self.library.Bench_setCoefficients.argtypes = [ctypes.c_char_p, ctypes.c_uint32]
+        self.library.Bench_output.restype = ctypes.c_void_p
+        self.library.Bench_bufferSize.restype = ctypes.c_uint32
+        self.buffer_size = self.library.Bench_bufferSize()
+
+    def setup(self, case: Case):
+        """
+        Copy the data of a case into the harness and initialize the kernel.
+
+        :param case: The case.
+        """
+        input_data = encode(case.input, case.kernel.format)
+        coefficient_data = encode(case.coefficients, case.kernel.format)
+        item_size = struct.calcsize(FORMATS[case.kernel.format][1])
+        if max(len(input_data), len(coefficient_data), case.output_count * item_size) > self.buffer_size:
+            raise Error(f'The data for {case.key} does not fit into the buffers of the harness.')
+        self.library.Bench_setInput(input_data, len(input_data))
+        self.library.Bench_setCoefficients(coefficient_data, len(coefficient_data))
+        status = self.library.Bench_setup(case.kernel.name.encode('utf-8'), case.size, case.parameter)
+        if status == -1:
+            raise Error(f'The harness has no kernel {case.kernel.name}.')
+        if status != 0:
+            raise Error(f'The kernel {case.kernel.name} does not support the size {case.size}.')
+
+    def run(self):
+        self.library.Bench_run()
+
+    def output(self, case: Case) -> List[float]:
+        """
+        Read the output of the last run.
+
+        :param case: The case.
+        :return: The output values.
+        """
+        item_size = struct.calcsize(FORMATS[case.kernel.format][1])
+        data = ctypes.string_at(self.library.Bench_output(), case.output_count * item_size)
+        return decode(data, case.kernel.format)
+
+
+def measure_time(library: HarnessLibrary, min_time: float) -> float:
+    """
+    Measure the time for one call of the current kernel.
+
+    The number of calls is doubled until the runs take the minimum time. The best of five
+    measurements is used, and the time to restore the input of in-place kernels is subtracted.
+
+    :param library: The harness with the kernel set up.
+    :param min_time: The minimum time for one measurement in seconds.
+    :return: The time for one call in nanoseconds.
+    """
+    time_function = library.library.Bench_time
+    time_function.argtypes = [ctypes.c_uint32, ctypes.c_int]
+    time_function.restype = ctypes.c_uint64
+    count = 1
+    while time_function(count, 0) < min_time * 1e9 and count < (1 << 24):
+        count *= 2
+    elapsed = min(time_function(count, 0) for _ in range(5))
+    restore = min(time_function(count, 1) for _ in range(5))
+    return max(0, elapsed - restore) / count
+
+
+def read_coverage(object_dir: Path, units: Dict[str, str]) -> Coverage:
+    """
+    Read the execution counts of the coverage build with `gcov`.
+
+    :param object_dir: The directory with the object and coverage data files.
+    :param units: The name of the source file for the stem of each object file.
+    :return: The execution counts.
+    """
+    data_files = sorted(object_dir.glob('*.gcda'))
+    command = ['gcov', '--json-format', '--stdout', '-o', str(object_dir)] + [str(path) for path in data_files]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=str(object_dir))
+    if result.returncode != 0:
+        raise Error(f'Could not read the coverage data:\n{result.stderr.decode("utf-8", errors="replace")}')
+    coverage = Coverage()
+    for line in result.stdout.decode('utf-8').splitlines():
+        if not line.startswith('{'):
+            continue
+        document = json.loads(line)
+        unit = Path(document['data_file']).stem
+        for file in document['files']:
+            file_name = Path(file['file']).name
+            for function in file['functions']:
+                name = function['name']
+                coverage.function_counts[name] = coverage.function_counts.get(name, 0) + function['execution_count']
+                if file_name == units.get(unit):
+                    coverage.function_units[name] = unit
+            for line_data in file['lines']:
+                coverage.line_counts[(unit, file_name, line_data['line_number'])] = line_data['count']
+    return coverage
+
+
+def estimate_cycles(program: ThumbProgram, coverage: Coverage, result: Result):
+    """
+    Estimate the instructions and cycles of a kernel on the Cortex-M0+.
+
+    Each instruction of the ARM build is counted as often as its source line was executed in
+    the coverage build on the host. Calls into functions without line counts, like the soft
+    float helpers of the compiler library, are estimated with one pass through the function.
+
+    :param program: The decoded ARM build of the harness.
+    :param coverage: The execution counts of the kernel.
+    :param result: The result to update with the estimate.
+    """
+    instructions = 0
+    cycles = 0
+    estimated = set()
+    for name, count in coverage.function_counts.items():
+        code = program.functions.get(name)
+        if not count or code is None:
+            continue
+        unit = coverage.function_units.get(name)
+        matched = False
+        for instruction in code:
+            location = program.lines.lookup(instruction.address)
+            if location is None:
+                continue
+            executions = coverage.line_counts.get((unit, Path(location[0]).name, location[1]))
+            if executions is None:
+                continue
+            matched = True
+            instructions += executions
+            cycles += executions * instruction.cycles
+            if not (instruction.is_call and executions):
+                continue
+            callee = program.symbols.find(instruction.target)
+            if callee is None or callee[1] != 0 or callee[0] in coverage.function_counts:
+                continue
+            instructions += executions * len(program.functions.get(callee[0], []))
+            cycles += executions * program.single_pass_cycles(callee[0])
+            estimated.add(callee[0])
+        if not matched:
+            # Functions written in assembler have no line counts.
+            instructions += count * len(code)
+            cycles += count * program.single_pass_cycles(name)
+            estimated.add(name)
+    result.instructions = instructions
+    result.cycles = cycles
+    result.estimated = sorted(estimated)
+
+
+def _object_path(object_dir: Path, source: Path) -> Path:
+    return object_dir/f'{source.parent.name}-{source.stem}.o'
+
+
+def build_harness(compiler: Path, flags: List[str], link_flags: List[str], sources: List[Path], output: Path,
+                  jobs: int, verbose: bool):
+    """
+    Compile the harness with the sources of the DSP library, if the sources or flags changed.
+
+    :param compiler: The path to the compiler.
+    :param flags: The flags to compile the sources.
+    :param link_flags: The flags to link the output.
+    :param sources: The source files.
+    :param output: The path of the linked file.
+    :param jobs: The number of parallel compile jobs.
+    :param verbose: If the commands shall be printed.
+    """
+    key = cache_key(compiler, flags + link_flags, sources)
+    key_path = output.with_name(output.name + '.key')
+    if output.is_file() and key_path.is_file() and key_path.read_text('utf-8') == key:
+        return
+    print(f'Building the benchmark harness: {output}')
+    object_dir = output.parent/'obj'
+    if object_dir.is_dir():
+        shutil.rmtree(object_dir)
+    object_dir.mkdir(parents=True)
+    object_paths = [_object_path(object_dir, source) for source in sources]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(compile_source, compiler, flags, source, object_path, verbose)
+                   for source, object_path in zip(sources, object_paths)]
+        for future in futures:
+            future.result()
+    command = [str(compiler)] + link_flags + [str(path) for path in object_paths] + ['-lm', '-o', str(output)]
+    if verbose:
+        print(' '.join(command))
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise Error(f'Could not link {output.name}:\n{result.stdout.decode("utf-8", errors="replace")}')
+    key_path.write_text(key, 'utf-8')
+
+
+def select_cases(patterns: List[str], sizes: List[int]) -> List[Case]:
+    """
+    Create the cases for the selected kernels and sizes.
+
+    :param patterns: Patterns for the kernel names, or an empty list for all kernels.
+    :param sizes: The sizes to test, or an empty list for all supported sizes.
+    :return: The cases.
+    """
+    cases = []
+    for kernel in KERNELS:
+        if patterns and not any(fnmatch.fnmatchcase(kernel.name, pattern) for pattern in patterns):
+            continue
+        cases += [create_case(kernel, size) for size in kernel.sizes if not sizes or size in sizes]
+    if not cases:
+        raise Error('No kernel matches the selected names and sizes. Known kernels: ' +
+                    ', '.join(kernel.name for kernel in KERNELS))
+    return cases
+
+
+def compare_baseline(results: List[Result], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    Compare the results with a saved baseline.
+
+    :param results: The current results.
+    :param baseline: The results of the baseline, by key.
+    :param threshold: The relative increase of the time or cycles which is a regression.
+    :return: A description for each regression.
+    """
+    regressions = []
+    for result in results:
+        old = baseline.get(result.key)
+        if old is None:
+            continue
+        if result.time is not None and old.get('time') and result.time > old['time'] * (1 + threshold):
+            regressions.append(f'{result.key}: time {old["time"]:.0f} ns -> {result.time:.0f} ns '
+                               f'(+{(result.time / old["time"] - 1) * 100:.0f}%)')
+        if result.snr is not None and old.get('snr') is not None and result.snr < old['snr'] - SNR_TOLERANCE:
+            regressions.append(f'{result.key}: SNR {old["snr"]:.1f} dB -> {result.snr:.1f} dB')
+        if result.cycles is not None and old.get('cycles') and result.cycles > old['cycles'] * (1 + threshold):
+            regressions.append(f'{result.key}: M0+ cycles {old["cycles"]} -> {result.cycles} '
+                               f'(+{(result.cycles / old["cycles"] - 1) * 100:.0f}%)')
+    return regressions
+
+
+def read_baseline(path: Path) -> Dict[str, dict]:
+    """
+    Read a saved baseline.
+
+    :param path: The path to the baseline file.
+    :return: The results by key.
+    """
+    try:
+        data = json.loads(path.read_text('utf-8'))
+    except (OSError, ValueError) as e:
+        raise Error(f'Could not read the baseline {path}: {e}')
+    if not isinstance(data, dict) or data.get('format') != BASELINE_FORMAT:
+        raise Error(f'The baseline {path} has an unknown format.')
+    return data.get('results', {})
+
+
+def write_results(path: Path, results: List[Result]):
+    """
+    Write the results as JSON, in the format of a baseline.
+
+    :param path: The path of the file.
+    :param results: The results.
+    """
+    data = {'format': BASELINE_FORMAT, 'results': {result.key: asdict(result) for result in results}}
+    temp_path = path.with_name(path.name + '.tmp')
+    temp_path.write_text(json.dumps(data, indent=1, sort_keys=True), 'utf-8')
+    temp_path.replace(path)
+
+
+def print_results(results: List[Result]):
+    """
+    Print a table with the results.
+
+    :param results: The results.
+    """
+    print(f'{"Kernel":<16} {"Size":>6} {"ns/call":>12} {"MS/s":>8} {"SNR dB":>7} {"Max error":>10} '
+          f'{"M0+ instr.":>11} {"M0+ cycles":>11} {"cyc/sample":>10}')
+    for result in results:
+        columns = [f'{result.kernel:<16} {result.size:>6}']
+        if result.time is not None:
+            columns.append(f'{result.time:>12.0f} {result.samples / result.time * 1e3 if result.time else 0:>8.1f}')
+        else:
+            columns.append(f'{"-":>12} {"-":>8}')
+        if result.snr is not None:
+            columns.append(f'{result.snr:>7.1f} {result.max_error:>10.2e}')
+        else:
+            columns.append(f'{"-":>7} {"-":>10}')
+        if result.cycles is not None:
+            columns.append(f'{result.instructions:>11} {result.cycles:>11} {result.cycles / result.samples:>10.1f}')
+        else:
+            columns.append(f'{"-":>11} {"-":>11} {"-":>10}')
+        print(' '.join(columns))
+    estimated = sorted({name for result in results for name in result.estimated})
+    if estimated:
+        print(f'Without line counts, estimated with one pass: {", ".join(estimated)}')
+
+
+def run_benchmark(args) -> int:
+    """
+    Build the harness, run all selected cases and report the results.
+
+    :param args: The parsed command line arguments.
+    :return: The exit code.
+    """
+    cases = select_cases(args.kernels, args.sizes)
+    work_dir = Path(args.work_dir).resolve()
+    host_compiler = shutil.which(args.host_compiler)
+    if host_compiler is None:
+        raise Error(f'Could not find the host compiler: {args.host_compiler}')
+    host_compiler = Path(host_compiler)
+    host_sources = [path for path in source_files() if path.suffix == '.c'] + [HARNESS_SOURCE]
+    results = [Result(case.kernel.name, case.size, case.samples) for case in cases]
+
+    if not args.no_timing or not args.no_accuracy:
+        library_path = work_dir/'host'/'libharness.so'
+        build_harness(host_compiler, HOST_FLAGS + COMMON_FLAGS, ['-shared'], host_sources, library_path,
+                      args.jobs, args.verbose)
+        library = HarnessLibrary(library_path)
+        if not args.no_accuracy and numpy is None:
+            print('NumPy is not installed, the accuracy is not measured.')
+        for case, result in zip(cases, results):
+            library.setup(case)
+            library.run()
+            if not args.no_accuracy and numpy is not None:
+                measure_accuracy(case, library.output(case), result)
+            if not args.no_timing:
+                result.time = measure_time(library, args.min_time)
+
+    if not args.no_model:
+        arm_compiler = Path(args.arm_compiler) if args.arm_compiler else find_tool(COMPILER_NAME)
+        if arm_compiler is None or not arm_compiler.is_file():
+            print('The ARM compiler was not found, the Cortex-M0+ model is not calculated.')
+        else:
+            coverage_path = work_dir/'coverage'/'libharness.so'
+            build_harness(host_compiler, COVERAGE_FLAGS + COMMON_FLAGS, ['-shared', '--coverage'], host_sources,
+                          coverage_path, args.jobs, args.verbose)
+            arm_path = work_dir/'arm'/'harness.elf'
+            arm_sources = source_files() + [HARNESS_SOURCE]
+            build_harness(arm_compiler, ARM_FLAGS + args.arm_flags.split() + COMMON_FLAGS, ARM_LINK_FLAGS,
+                          arm_sources, arm_path, args.jobs, args.verbose)
+            with ElfFile(arm_path) as elf:
+                program = ThumbProgram.from_elf(elf)
+            object_dir = coverage_path.parent/'obj'
+            units = {_object_path(object_dir, source).stem: source.name for source in host_sources}
+            coverage_library = HarnessLibrary(coverage_path)
+            for case, result in zip(cases, results):
+                coverage_library.setup(case)
+                coverage_library.library.Bench_resetCoverage()
+                for path in object_dir.glob('*.gcda'):
+                    path.unlink()
+                coverage_library.run()
+                coverage_library.library.Bench_dumpCoverage()
+                estimate_cycles(program, read_coverage(object_dir, units), result)
+
+    print_results(results)
+    if args.json:
+        write_results(Path(args.json), results)
+    if args.save_baseline:
+        write_results(Path(args.save_baseline), results)
+        print(f'Saved the baseline: {args.save_baseline}')
+    if args.baseline:
+        regressions = compare_baseline(results, read_baseline(Path(args.baseline)), args.threshold)
+        if regressions:
+            print(f'Found {len(regressions)} regressions compared to the baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print('No regressions compared to the baseline.')
+    return 0
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the kernels of the CMSIS DSP library on the host, '
+                                                 'measure their accuracy and estimate the cycles on a Cortex-M0+.')
+    parser.add_argument('--kernels', '-k',
+                        dest='kernels',
+                        type=lambda text: [name for name in text.split(',') if name],
+                        action='store',
+                        default=[],
+                        help='A comma separated list of kernel names or patterns, like "cfft_*,fir_q15".')
+    parser.add_argument('--sizes', '-s',
+                        dest='sizes',
+                        type=lambda text: [int(size) for size in text.split(',') if size],
+                        action='store',
+                        default=[],
+                        help='A comma separated list of sizes, like "256,1024".')
+    parser.add_argument('--min-time',
+                        dest='min_time',
+                        type=float,
+                        action='store',
+                        default=0.05,
+                        help='The minimum time for one timing measurement in seconds.')
+    parser.add_argument('--no-timing',
+                        dest='no_timing',
+                        action='store_true',
+                        help='Do not measure the time.')
+    parser.add_argument('--no-accuracy',
+                        dest='no_accuracy',
+                        action='store_true',
+                        help='Do not compare the output with the NumPy reference.')
+    parser.add_argument('--no-model',
+                        dest='no_model',
+                        action='store_true',
+                        help='Do not estimate the instructions and cycles on the Cortex-M0+.')
+    parser.add_argument('--host-compiler',
+                        dest='host_compiler',
+                        type=str,
+                        action='store',
+                        default='gcc',
+                        help='The C compiler for the host.')
+    parser.add_argument('--arm-compiler',
+                        dest='arm_compiler',
+                        type=str,
+                        action='store',
+                        help='The path to the ARM compiler, which is searched if not given.')
+    parser.add_argument('--arm-flags',
+                        dest='arm_flags',
+                        type=str,
+                        action='store',
+                        default='-Os',
+                        help='The optimization flags for the ARM build.')
+    parser.add_argument('--work-dir', '-w',
+                        dest='work_dir',
+                        type=str,
+                        action='store',
+                        default='dsp-benchmark',
+                        help='The directory for the builds of the harness.')
+    parser.add_argument('--baseline', '-b',
+                        dest='baseline',
+                        type=str,
+                        action='store',
+                        help='Compare the results with this baseline and fail on regressions.')
+    parser.add_argument('--save-baseline',
+                        dest='save_baseline',
+                        type=str,
+                        action='store',
+                        help='Save the results as new baseline.')
+    parser.add_argument('--threshold',
+                        dest='threshold',
+                        type=float,
+                        action='store',
+                        default=0.1,
+                        help='The relative increase of the time or cycles which is reported as regression.')
+    parser.add_argument('--json',
+                        dest='json',
+                        type=str,
+                        action='store',
+                        help='Write the results into this JSON file.')
+    parser.add_argument('--jobs', '-j',
+                        dest='jobs',
+                        type=int,
+                        action='store',
+                        default=os.cpu_count() or 4,
+                        help='The number of parallel compile jobs.')
+    parser.add_argument('--verbose', '-v',
+                        dest='verbose',
+                        action='store_true',
+                        help='Print all commands.')
+    args = parser.parse_args()
+    args.jobs = max(1, args.jobs)
+    try:
+        exit(run_benchmark(args))
+    except (Error, LibraryError, ElfError, OSError) as e:
+        exit(f'ERROR! {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from dsptables import REPLACED_SOURCES, TABLES_CACHE_DIR, TableError, parse_transforms, provide_source
+from tracing import span
+
+assert sys.version_info >= (3, 7)
+
+
+DSP_SOURCE_DIR = Path(__file__).parent/'cmsis-atmel'/'DSP_Lib'/'Source'
+DSP_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'dsp'
+DSP_LIBRARY_NAME = 'libarm_math_lto.a'
+LTO_FLAGS = ['-flto', '-ffat-lto-objects']
+
+
+class Error(Exception):
+    """The error class for this script."""
+
+
+def source_files(tables_source: Optional[Path] = None) -> List[Path]:
+    """
+    Get all source files of the DSP library.
+
+    :param tables_source: The generated source with the tables for the used transforms, or None
+        to use the tables shipped with the library.
+    :return: A sorted list with the paths of all C and assembler sources.
+    """
+    sources = sorted(list(DSP_SOURCE_DIR.glob('*/*.c')) + list(DSP_SOURCE_DIR.glob('*/*.S')))
+    if tables_source is None:
+        return sources
+    replaced = {DSP_SOURCE_DIR/name for name in REPLACED_SOURCES}
+    return [source for source in sources if source not in replaced] + [tables_source]
+
+
+def cache_key(compiler: Path, flags: List[str], sources: List[Path]) -> str:
+    """
+    Create the key for a cached library.
+
+    The key changes if the compiler, the flags or any of the sources change.
+
+    :param compiler: The path to the compiler.
+    :param flags: The flags to compile the sources.
+    :param sources: The source files.
+    :return: The key as hex string.
+    """
+    digest = hashlib.sha256()
+    for path in [compiler.resolve()] + sources:
+        stat = path.stat()
+        digest.update(f'{path}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode('utf-8'))
+    digest.update(' '.join(flags).encode('utf-8'))
+    return digest.hexdigest()[:24]
+
+
+def compile_source(compiler: Path, flags: List[str], source: Path, object_path: Path, verbose: bool):
+    """
+    Compile one source file of the library.
+
+    :param compiler: The path to the compiler.
+    :param flags: The flags to compile the source.
+    :param source: The source file.
+    :param object_path: The path of the object file.
+    :param verbose: If the command shall be printed.
+    """
+    command = [str(compiler)] + flags + ['-c', str(source), '-o', str(object_path)]
+    if verbose:
+        print(' '.join(command))
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise Error(f'Could not compile {source.name}:\n{result.stdout.decode("utf-8", errors="replace")}')
+
+
+def build_library(compiler: Path, archiver: Path, flags: List[str], library_path: Path, jobs: int, verbose: bool,
+                  sources: List[Path]):
+    """
+    Compile all sources of the DSP library in parallel and create the archive.
+
+    :param compiler: The path to the compiler.
+    :param archiver: The path to the archiver with LTO support, like `arm-none-eabi-gcc-ar`.
+    :param flags: The flags to compile the sources.
+    :param library_path: The path of the new archive.
+    :param jobs: The number of parallel compile jobs.
+    :param verbose: If the commands shall be printed.
+    :param sources: The source files.
+    """
+    if not sources:
+        raise Error(f'Found no sources for the DSP library in: {DSP_SOURCE_DIR}')
+    library_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=library_path.parent) as temp_dir:
+        object_paths = [Path(temp_dir)/f'{source.parent.name}-{source.stem}.o' for source in sources]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(compile_source, compiler, flags, source, object_path, verbose)
+                       for source, object_path in zip(sources, object_paths)]
+            for future in futures:
+                future.result()
+        temp_library = Path(temp_dir)/DSP_LIBRARY_NAME
+        command = [str(archiver), 'rcs', str(temp_library)] + [str(path) for path in object_paths]
+        if verbose:
+            print(f'{archiver} rcs {temp_library} ...')
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise Error(f'Could not create the archive:\n{result.stdout.decode("utf-8", errors="replace")}')
+        temp_library.replace(library_path)
+
+
+def provide_library(compiler: Path, archiver: Path, flags: List[str], output: Path, cache_dir: Path,
+                    jobs: int, verbose: bool, transforms: Optional[List[str]] = None):
+    """
+    Provide the LTO variant of the DSP library, building it only if there is no cached library.
+
+    If transforms are given, the common tables and the init functions of the transforms are replaced
+    by a generated source with only the tables for these transforms.
+
+    :param compiler: The path to the compiler.
+    :param archiver: The path to the archiver with LTO support.
+    :param flags: The flags to compile the sources, without the LTO flags.
+    :param output: The path where the library is copied to.
+    :param cache_dir: The directory for the cached libraries.
+    :param jobs: The number of parallel compile jobs.
+    :param verbose: If the commands shall be printed.
+    :param transforms: The names of the used transforms, like "cfft_q15_256", or None for all tables.
+    """
+    flags = flags + LTO_FLAGS
+    tables_source = None
+    if transforms:
+        tables_source = provide_source(parse_transforms(transforms), cache_dir/TABLES_CACHE_DIR.name)
+    sources = source_files(tables_source)
+    key = cache_key(compiler, flags, sources)
+    key_path = output.with_name(output.name + '.key')
+    if output.is_file() and key_path.is_file() and key_path.read_text('utf-8') == key:
+        return
+    cached_library = cache_dir/key/DSP_LIBRARY_NAME
+    if cached_library.is_file():
+        print(f'Using the cached DSP library: {cached_library}')
+    else:
+        print(f'Building the DSP library with LTO: {cached_library}')
+        with span('dsp library', 'build', sources=len(sources)):
+            build_library(compiler, archiver, flags, cached_library, jobs, verbose, sources)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(cached_library, output)
+    key_path.write_text(key, 'utf-8')
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Build the CMSIS DSP library with LTO and cache the result.')
+    parser.add_argument('--compiler', '-c',
+                        dest='compiler',
+                        type=str,
+                        action='store',
+                        required=True,
+                        help='The path to the C compiler.')
+    parser.add_argument('--archiver', '-a',
+                        dest='archiver',
+                        type=str,
+                        action='store',
+                        required=True,
+                        help='The path to the archiver with LTO support, like "arm-none-eabi-gcc-ar".')
+    parser.add_argument('--flags', '-f',
+                        dest='flags',
+                        type=str,
+                        action='store',
+                        default='',
+                        help='The flags to compile the sources.')
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        type=str,
+                        action='store',
+                        default=str(DSP_CACHE_DIR),
+                        help='The directory for the cached libraries.')
+    parser.add_argument('--jobs', '-j',
+                        dest='jobs',
+                        type=int,
+                        action='store',
+                        default=os.cpu_count() or 4,
+                        help='The number of parallel compile jobs.')
+    parser.add_argument('--transforms', '-t',
+                        dest='transforms',
+                        type=str,
+                        action='store',
+                        default='',
+                        help='A comma separated list of the used transforms, like "cfft_q15_256,rfft_fast_f32_1024". '
+                             'Only the tables for these transforms are generated and linked.')
+    parser.add_argument('--verbose', '-v',
+                        dest='verbose',
+                        action='store_true',
+                        help='Print all commands.')
+    parser.add_argument('output',
+                        help='The path of the library to create.')
+    args = parser.parse_args()
+    try:
+        provide_library(compiler=Path(args.compiler),
+                        archiver=Path(args.archiver),
+                        flags=shlex.split(args.flags),
+                        output=Path(args.output),
+                        cache_dir=Path(args.cache_dir),
+                        jobs=max(1, args.jobs),
+                        verbose=args.verbose,
+                        transforms=[name for name in args.transforms.replace(';', ',').split(',') if name.strip()])
+    except (Error, TableError, OSError) as e:
+        exit(f'ERROR! {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,672 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import hashlib
+import math
+import os
+import re
+import struct
+import argparse
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+assert sys.version_info >= (3, 7)
+
+
+DSP_SOURCE_DIR = Path(__file__).parent/'cmsis-atmel'/'DSP_Lib'/'Source'
+COMMON_TABLES_PATH = DSP_SOURCE_DIR/'CommonTables'/'arm_common_tables.c'
+TABLES_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'dsp'/'tables'
+TABLES_VERSION = 1
+
+# The sources of the library which are replaced by the generated file.
+REPLACED_SOURCES = [
+    'CommonTables/arm_common_tables.c',
+    'CommonTables/arm_const_structs.c',
+    'TransformFunctions/arm_dct4_init_f32.c',
+    'TransformFunctions/arm_dct4_init_q15.c',
+    'TransformFunctions/arm_dct4_init_q31.c',
+    'TransformFunctions/arm_rfft_fast_init_f32.c',
+    'TransformFunctions/arm_rfft_init_f32.c',
+    'TransformFunctions/arm_rfft_init_q15.c',
+    'TransformFunctions/arm_rfft_init_q31.c',
+]
+
+CFFT_SIZES = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+TRANSFORM_SIZES = {
+    ('cfft', 'f32'): CFFT_SIZES,
+    ('cfft', 'q31'): CFFT_SIZES,
+    ('cfft', 'q15'): CFFT_SIZES,
+    ('rfft_fast', 'f32'): tuple(size * 2 for size in CFFT_SIZES[:-1]),
+    ('rfft', 'q31'): tuple(size * 2 for size in CFFT_SIZES),
+    ('rfft', 'q15'): tuple(size * 2 for size in CFFT_SIZES),
+    ('dct4', 'q31'): (128, 512, 2048, 8192),
+    ('dct4', 'q15'): (128, 512, 2048, 8192),
+}
+FORMAT_BITS = {'q15': 16, 'q31': 32}
+FORMAT_TYPES = {'f32': 'float32_t', 'q15': 'q15_t', 'q31': 'q31_t'}
+
+# The real coefficients of the shipped tables are calculated for this size, smaller tables use every n-th value.
+REAL_COEFFICIENT_SIZE = 8192
+SIN_TABLE_SIZE = 512
+
+# There is no formula for the swap order of the mixed radix tables, it was chosen by hand to avoid
+# conflicts in the unrolled bit reversal loop. These tables, and the reciprocal tables, are copied.
+COPIED_TABLES = ['armBitRevIndexTable16', 'armBitRevIndexTable32', 'armBitRevIndexTable256',
+                 'armBitRevIndexTable2048', 'armRecipTableQ15', 'armRecipTableQ31']
+
+RE_TRANSFORM = re.compile(R'^(cfft|rfft_fast|rfft|dct4)_(f32|q15|q31)_(\d+)$')
+RE_TABLE = re.compile(R'const\s+(\w+)\s+(?:ALIGN4\s+)?(\w+)\s*\[[^\]]*\]\s*=\s*\{(.*?)\};', re.S)
+RE_COMMENT = re.compile(R'/\*.*?\*/|//[^\n]*', re.S)
+
+
+class TableError(Exception):
+    """
+    Exception if the tables can not be generated.
+    """
+    pass
+
+
+@dataclass(frozen=True, order=True)
+class Transform:
+    """One transform with its number format and size, as used by the firmware."""
+    kind: str
+    format: str
+    size: int
+
+    @property
+    def name(self) -> str:
+        return f'{self.kind}_{self.format}_{self.size}'
+
+    @staticmethod
+    def parse(text: str) -> 'Transform':
+        """
+        Parse the name of a transform, like `cfft_q15_256` or `rfft_fast_f32_1024`.
+
+        :param text: The name of the transform.
+        :return: The transform.
+        """
+        match = RE_TRANSFORM.match(text.strip().lower())
+        if not match:
+            raise TableError(f'Invalid transform "{text}". Use <kind>_<format>_<size>, like "cfft_q15_256".')
+        transform = Transform(match.group(1), match.group(2), int(match.group(3)))
+        sizes = TRANSFORM_SIZES.get((transform.kind, transform.format))
+        if sizes is None:
+            raise TableError(f'The transform "{transform.kind}" is not supported for {transform.format}.')
+        if transform.size not in sizes:
+            raise TableError(f'Unsupported size for "{transform.kind}_{transform.format}": {transform.size}. '
+                             f'Use one of: {", ".join(str(s) for s in sizes)}')
+        return transform
+
+
+@dataclass
+class Table:
+    """One constant table as C literals."""
+    name: str
+    c_type: str
+    values: List[str]
+    size: str = ''
+    is_static: bool = False
+    per_line: int = 8
+
+    def source(self) -> str:
+        align = 'ALIGN4 ' if self.c_type == 'q15_t' else ''
+        storage = 'static ' if self.is_static else ''
+        lines = [f'{storage}const {self.c_type} {align}{self.name}[{self.size or len(self.values)}] = {{']
+        for index in range(0, len(self.values), self.per_line):
+            lines.append('    ' + ', '.join(self.values[index:index + self.per_line]) + ',')
+        lines.append('};')
+        return '\n'.join(lines) + '\n'
+
+
+def parse_transforms(names: Iterable[str]) -> List[Transform]:
+    """
+    Parse the names of the transforms and add the transforms they depend on.
+
+    A real FFT uses a complex FFT of half the size, a DCT4 uses a real FFT of the same size.
+
+    :param names: The names of the transforms.
+    :return: A sorted list with all required transforms.
+    """
+    transforms = set()
+    for name in names:
+        if not name.strip():
+            continue
+        transform = Transform.parse(name)
+        transforms.add(transform)
+        if transform.kind == 'dct4':
+            transform = Transform('rfft', transform.format, transform.size)
+            transforms.add(transform)
+        if transform.kind in ('rfft', 'rfft_fast'):
+            transforms.add(Transform('cfft', transform.format, transform.size // 2))
+    return sorted(transforms)
+
+
+def _fixed(value: float, bits: int, rounding: str) -> str:
+    scaled = value * (1 << (bits - 1))
+    if rounding == 'round':
+        result = math.floor(scaled + 0.5)
+    elif rounding == 'trunc':
+        result = int(scaled)
+    elif rounding == 'floor':
+        result = math.floor(scaled)
+    else:
+        # The Q31 twiddle factors of the shipped tables are rounded with this small offset.
+        result = math.floor(scaled + 0.05)
+    limit = 1 << (bits - 1)
+    result = max(-limit, min(limit - 1, result)) & ((1 << bits) - 1)
+    return f'0x{result:0{bits // 4}X}'
+
+
+def _float(value: float, digits: int = 9) -> str:
+    return f'{value:.{digits}f}f'
+
+
+def cfft_twiddles(size: int, number_format: str) -> List[str]:
+    """
+    Calculate the twiddle factors of a complex FFT.
+
+    :param size: The size of the FFT.
+    :param number_format: The number format.
+    :return: The cosine and sine values, interleaved.
+    """
+    if number_format == 'f32':
+        count = size
+    else:
+        count = size * 3 // 4
+    values = []
+    for i in range(count):
+        angle = 2.0 * math.pi * i / size
+        for value in (math.cos(angle), math.sin(angle)):
+            if number_format == 'f32':
+                values.append(_float(value))
+            elif number_format == 'q31':
+                values.append(_fixed(value, 32, 'twiddle'))
+            else:
+                values.append(_fixed(value, 16, 'floor'))
+    return values
+
+
+def rfft_fast_twiddles(size: int) -> List[str]:
+    """
+    Calculate the twiddle factors for the last stage of the fast real FFT.
+
+    :param size: The size of the real FFT.
+    :return: The sine and cosine values, interleaved.
+    """
+    values = []
+    for i in range(size // 2):
+        angle = 2.0 * math.pi * i / size
+        values.append(_float(math.sin(angle)))
+        values.append(_float(math.cos(angle)))
+    return values
+
+
+def real_coefficients(size: int, number_format: str) -> Tuple[List[str], List[str]]:
+    """
+    Calculate the A and B coefficients to split the complex FFT into a real FFT.
+
+    The values are the same as in the shipped table for the largest size, so a smaller table
+    is used with a smaller twiddle modifier.
+
+    :param size: The size of the largest real FFT.
+    :param number_format: The number format.
+    :return: The A and B tables.
+    """
+    bits = FORMAT_BITS[number_format]
+    step = REAL_COEFFICIENT_SIZE // size
+    table_a = []
+    table_b = []
+    for i in range(0, REAL_COEFFICIENT_SIZE // 2, step):
+        angle = 2.0 * math.pi / REAL_COEFFICIENT_SIZE * i
+        table_a.append(_fixed(0.5 * (1.0 - math.sin(angle)), bits, 'round'))
+        table_a.append(_fixed(0.5 * (-1.0 * math.cos(angle)), bits, 'round'))
+        table_b.append(_fixed(0.5 * (1.0 + math.sin(angle)), bits, 'round'))
+        table_b.append(_fixed(0.5 * (1.0 * math.cos(angle)), bits, 'round'))
+    return table_a, table_b
+
+
+def dct4_weights(size: int, number_format: str) -> List[str]:
+    """
+    Calculate the weights of a DCT4.
+
+    :param size: The size of the DCT4.
+    :param number_format: The number format.
+    :return: The cosine and negative sine values, interleaved.
+    """
+    bits = FORMAT_BITS[number_format]
+    rounding = 'trunc' if number_format == 'q15' else 'round'
+    factor = math.pi / (2 * size)
+    values = []
+    for i in range(size):
+        values.append(_fixed(math.cos(i * factor), bits, rounding))
+        values.append(_fixed(-math.sin(i * factor), bits, rounding))
+    return values
+
+
+def dct4_cos_factors(size: int, number_format: str) -> List[str]:
+    """
+    Calculate the cosine factors of a DCT4.
+
+    :param size: The size of the DCT4.
+    :param number_format: The number format.
+    :return: The values.
+    """
+    bits = FORMAT_BITS[number_format]
+    rounding = 'trunc' if number_format == 'q15' else 'round'
+    return [_fixed(math.cos((2 * i + 1) * math.pi / (4 * size)), bits, rounding) for i in range(size)]
+
+
+def sin_table(number_format: str) -> List[str]:
+    """
+    Calculate the table for the fast sine and cosine functions.
+
+    :param number_format: The number format.
+    :return: The values for one full period, including the end point.
+    """
+    values = []
+    for i in range(SIN_TABLE_SIZE + 1):
+        value = math.sin(2.0 * math.pi * i / SIN_TABLE_SIZE)
+        if number_format == 'f32':
+            values.append(_float(value, 8))
+        else:
+            values.append(_fixed(value, FORMAT_BITS[number_format], 'round'))
+    return values
+
+
+def _reverse_digits(index: int, radices: List[int]) -> int:
+    result = 0
+    for radix in radices:
+        result = result * radix + index % radix
+        index //= radix
+    return result
+
+
+def bit_reversal_table(size: int, is_fixed: bool) -> List[str]:
+    """
+    Calculate the swaps for the bit reversal after a complex FFT.
+
+    The fixed point FFTs use a radix 4 algorithm, with a simple bit reversal. The floating point
+    FFT uses radix 8 stages, after a first radix 2 stage if required, so the digits are reversed.
+
+    :param size: The size of the FFT.
+    :param is_fixed: If the table is for a fixed point FFT.
+    :return: The byte offsets of the swapped values, in pairs.
+    """
+    stages = size.bit_length() - 1
+    if is_fixed:
+        radices = [2] * stages
+    elif stages % 3 == 1:
+        radices = [2] + [8] * (stages // 3)
+    elif stages % 3 == 0:
+        radices = [8] * (stages // 3)
+    else:
+        raise TableError(f'There is no formula for the bit reversal table of size {size}.')
+    permutation = [_reverse_digits(i, radices) for i in range(size)]
+    values = []
+    for i in range(size):
+        j = permutation[i]
+        while j < i:
+            j = permutation[j]
+        if j > i:
+            # Each value is a complex number with two 32-bit parts.
+            values.extend([str(i * 8), str(j * 8)])
+    return values
+
+
+def _bit_reversal_length(size: int, is_fixed: bool) -> str:
+    return f'ARMBITREVINDEXTABLE{"_FIXED_" if is_fixed else ""}{size:_>4}_TABLE_LENGTH'
+
+
+def _twiddle_name(size: int, number_format: str) -> str:
+    return f'twiddleCoef_{size}' if number_format == 'f32' else f'twiddleCoef_{size}_{number_format}'
+
+
+def _bit_reversal_name(size: int, number_format: str) -> str:
+    return f'armBitRevIndexTable{size}' if number_format == 'f32' else f'armBitRevIndexTable_fixed_{size}'
+
+
+def read_source_tables(path: Path) -> Dict[str, List[str]]:
+    """
+    Read the constant tables from a C source file of the library.
+
+    :param path: The path to the source file.
+    :return: A dictionary with the name and the literals of each table.
+    """
+    try:
+        text = RE_COMMENT.sub('', path.read_text('utf-8', errors='replace'))
+    except OSError as e:
+        raise TableError(f'Could not read the tables from {path}: {e}')
+    tables = {}
+    for match in RE_TABLE.finditer(text):
+        tables[match.group(2)] = [value.strip() for value in match.group(3).split(',') if value.strip()]
+    return tables
+
+
+def _copy_table(name: str, shipped: Dict[str, List[str]]) -> List[str]:
+    values = shipped.get(name)
+    if not values:
+        raise TableError(f'The table "{name}" is missing in: {COMMON_TABLES_PATH}')
+    return values
+
+
+def create_tables(transforms: List[Transform], shipped: Dict[str, List[str]]) -> List[Table]:
+    """
+    Create all tables for the transforms.
+
+    The tables for the fast sine and cosine functions and the reciprocal tables are always included,
+    because they replace the common tables of the library. The linker removes them if they are not used.
+
+    :param transforms: The transforms, including their dependencies.
+    :param shipped: The tables of the shipped common tables source, for the copied tables.
+    :return: The tables.
+    """
+    tables = [
+        Table('armRecipTableQ15', 'q15_t', _copy_table('armRecipTableQ15', shipped)),
+        Table('armRecipTableQ31', 'q31_t', _copy_table('armRecipTableQ31', shipped)),
+        Table('sinTable_f32', 'float32_t', sin_table('f32'), size='FAST_MATH_TABLE_SIZE + 1'),
+        Table('sinTable_q31', 'q31_t', sin_table('q31'), size='FAST_MATH_TABLE_SIZE + 1'),
+        Table('sinTable_q15', 'q15_t', sin_table('q15'), size='FAST_MATH_TABLE_SIZE + 1'),
+    ]
+    bit_reversal_names = set()
+    real_sizes: Dict[str, int] = {}
+    for transform in transforms:
+        size, number_format = transform.size, transform.format
+        c_type = FORMAT_TYPES[number_format]
+        if transform.kind == 'cfft':
+            tables.append(Table(_twiddle_name(size, number_format), c_type, cfft_twiddles(size, number_format)))
+            name = _bit_reversal_name(size, number_format)
+            if name not in bit_reversal_names:
+                bit_reversal_names.add(name)
+                if name in COPIED_TABLES:
+                    values = _copy_table(name, shipped)
+                else:
+                    values = bit_reversal_table(size, number_format != 'f32')
+                tables.append(Table(name, 'uint16_t', values,
+                                    size=_bit_reversal_length(size, number_format != 'f32'), per_line=16))
+        elif transform.kind == 'rfft_fast':
+            tables.append(Table(f'twiddleCoef_rfft_{size}', c_type, rfft_fast_twiddles(size)))
+        elif transform.kind == 'rfft':
+            real_sizes[number_format] = max(real_sizes.get(number_format, 0), size)
+        elif transform.kind == 'dct4':
+            suffix = number_format.upper()
+            tables.append(Table(f'Weights{suffix}_{size}', c_type, dct4_weights(size, number_format),
+                                is_static=True))
+            tables.append(Table(f'cos_factors{suffix}_{size}', c_type, dct4_cos_factors(size, number_format),
+                                is_static=True))
+    for number_format, size in sorted(real_sizes.items()):
+        table_a, table_b = real_coefficients(size, number_format)
+        suffix = number_format.upper()
+        tables.append(Table(f'realCoefA{suffix}', FORMAT_TYPES[number_format], table_a, is_static=True))
+        tables.append(Table(f'realCoefB{suffix}', FORMAT_TYPES[number_format], table_b, is_static=True))
+    return tables
+
+
+def _cfft_structs(transforms: List[Transform]) -> List[str]:
+    lines = []
+    for transform in transforms:
+        if transform.kind != 'cfft':
+            continue
+        size, number_format = transform.size, transform.format
+        lines.append(f'const arm_cfft_instance_{number_format} arm_cfft_sR_{number_format}_len{size} = {{\n'
+                     f'    {size}, {_twiddle_name(size, number_format)}, '
+                     f'{_bit_reversal_name(size, number_format)}, '
+                     f'{_bit_reversal_length(size, number_format != "f32")}\n'
+                     f'}};\n')
+    return lines
+
+
+def _rfft_fast_init(sizes: List[int]) -> str:
+    cases = []
+    for size in sorted(sizes, reverse=True):
+        half = size // 2
+        cases.append(f'    case {half}u:\n'
+                     f'        Sint->bitRevLength = {_bit_reversal_length(half, False)};\n'
+                     f'        Sint->pBitRevTable = (uint16_t *)armBitRevIndexTable{half};\n'
+                     f'        Sint->pTwiddle = (float32_t *)twiddleCoef_{half};\n'
+                     f'        S->pTwiddleRFFT = (float32_t *)twiddleCoef_rfft_{size};\n'
+                     f'        break;\n')
+    return ('arm_status arm_rfft_fast_init_f32(arm_rfft_fast_instance_f32 *S, uint16_t fftLen)\n'
+            '{\n'
+            '    arm_cfft_instance_f32 *Sint = &(S->Sint);\n'
+            '    arm_status status = ARM_MATH_SUCCESS;\n'
+            '    Sint->fftLen = fftLen / 2;\n'
+            '    S->fftLenRFFT = fftLen;\n'
+            '    switch (Sint->fftLen) {\n'
+            + ''.join(cases) +
+            '    default:\n'
+            '        status = ARM_MATH_ARGUMENT_ERROR;\n'
+            '        break;\n'
+            '    }\n'
+            '    return status;\n'
+            '}\n')
+
+
+def _rfft_init(number_format: str, sizes: List[int]) -> str:
+    suffix = number_format.upper()
+    table_size = max(sizes)
+    cases = []
+    for size in sorted(sizes, reverse=True):
+        cases.append(f'    case {size}u:\n'
+                     f'        S->twidCoefRModifier = {table_size // size}u;\n'
+                     f'        S->pCfft = &arm_cfft_sR_{number_format}_len{size // 2};\n'
+                     f'        break;\n')
+    return (f'arm_status arm_rfft_init_{number_format}(arm_rfft_instance_{number_format} *S, uint32_t fftLenReal,\n'
+            f'    uint32_t ifftFlagR, uint32_t bitReverseFlag)\n'
+            f'{{\n'
+            f'    arm_status status = ARM_MATH_SUCCESS;\n'
+            f'    S->fftLenReal = (uint16_t)fftLenReal;\n'
+            f'    S->pTwiddleAReal = ({number_format}_t *)realCoefA{suffix};\n'
+            f'    S->pTwiddleBReal = ({number_format}_t *)realCoefB{suffix};\n'
+            f'    S->ifftFlagR = (uint8_t)ifftFlagR;\n'
+            f'    S->bitReverseFlagR = (uint8_t)bitReverseFlag;\n'
+            f'    switch (S->fftLenReal) {{\n'
+            + ''.join(cases) +
+            f'    default:\n'
+            f'        status = ARM_MATH_ARGUMENT_ERROR;\n'
+            f'        break;\n'
+            f'    }}\n'
+            f'    return status;\n'
+            f'}}\n')
+
+
+def _dct4_init(number_format: str, sizes: List[int]) -> str:
+    suffix = number_format.upper()
+    cases = []
+    for size in sorted(sizes, reverse=True):
+        cases.append(f'    case {size}u:\n'
+                     f'        S->pTwiddle = ({number_format}_t *)Weights{suffix}_{size};\n'
+                     f'        S->pCosFactor = ({number_format}_t *)cos_factors{suffix}_{size};\n'
+                     f'        break;\n')
+    return (f'arm_status arm_dct4_init_{number_format}(arm_dct4_instance_{number_format} *S, '
+            f'arm_rfft_instance_{number_format} *S_RFFT,\n'
+            f'    arm_cfft_radix4_instance_{number_format} *S_CFFT, uint16_t N, uint16_t Nby2, '
+            f'{number_format}_t normalize)\n'
+            f'{{\n'
+            f'    arm_status status = ARM_MATH_SUCCESS;\n'
+            f'    S->N = N;\n'
+            f'    S->Nby2 = Nby2;\n'
+            f'    S->normalize = normalize;\n'
+            f'    S->pRfft = S_RFFT;\n'
+            f'    S->pCfft = S_CFFT;\n'
+            f'    switch (N) {{\n'
+            + ''.join(cases) +
+            f'    default:\n'
+            f'        status = ARM_MATH_ARGUMENT_ERROR;\n'
+            f'    }}\n'
+            f'    arm_rfft_init_{number_format}(S->pRfft, S->N, 0u, 1u);\n'
+            f'    return status;\n'
+            f'}}\n')
+
+
+def generate_source(transforms: List[Transform], shipped: Optional[Dict[str, List[str]]] = None) -> str:
+    """
+    Generate the C source with the tables, the constant structures and the init functions for the transforms.
+
+    :param transforms: The transforms, including their dependencies.
+    :param shipped: The tables of the shipped common tables source, or None to read them.
+    :return: The source code.
+    """
+    if shipped is None:
+        shipped = read_source_tables(COMMON_TABLES_PATH)
+    parts = ['/*\n'
+             ' * Generated by dsptables.py, do not edit.\n'
+             f' * Transforms: {", ".join(t.name for t in transforms) or "none"}\n'
+             ' */\n'
+             '#include "arm_math.h"\n'
+             '#include "arm_common_tables.h"\n'
+             '#include "arm_const_structs.h"\n']
+    parts.extend(table.source() for table in create_tables(transforms, shipped))
+    parts.extend(_cfft_structs(transforms))
+    fast_sizes = [t.size for t in transforms if t.kind == 'rfft_fast']
+    if fast_sizes:
+        parts.append(_rfft_fast_init(fast_sizes))
+    for number_format in ('q15', 'q31'):
+        sizes = [t.size for t in transforms if t.kind == 'rfft' and t.format == number_format]
+        if sizes:
+            parts.append(_rfft_init(number_format, sizes))
+        sizes = [t.size for t in transforms if t.kind == 'dct4' and t.format == number_format]
+        if sizes:
+            parts.append(_dct4_init(number_format, sizes))
+    return '\n'.join(parts)
+
+
+def cache_key(transforms: List[Transform]) -> str:
+    """
+    Create the key for a generated source.
+
+    :param transforms: The transforms, including their dependencies.
+    :return: The key as hex string.
+    """
+    digest = hashlib.sha256()
+    stat = COMMON_TABLES_PATH.stat()
+    digest.update(f'{TABLES_VERSION}|{COMMON_TABLES_PATH}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode('utf-8'))
+    digest.update(' '.join(t.name for t in transforms).encode('utf-8'))
+    return digest.hexdigest()[:24]
+
+
+def provide_source(transforms: List[Transform], cache_dir: Path) -> Path:
+    """
+    Provide the generated source for the transforms, generating it only if it is not cached.
+
+    The cached file is never rewritten, so its modification time stays the same for the library cache.
+
+    :param transforms: The transforms, including their dependencies.
+    :param cache_dir: The directory for the generated sources.
+    :return: The path to the source file.
+    """
+    path = cache_dir/f'arm_tables_{cache_key(transforms)}.c'
+    if path.is_file():
+        return path
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    temp_path.write_text(generate_source(transforms), 'utf-8')
+    temp_path.replace(path)
+    return path
+
+
+def _literal_bits(text: str, c_type: str) -> int:
+    text = text.strip()
+    if c_type == 'float32_t':
+        return struct.unpack('<I', struct.pack('<f', float(text.rstrip('fF'))))[0]
+    bits = 16 if c_type in ('q15_t', 'uint16_t') else 32
+    return int(text.rstrip('uUlL'), 0) & ((1 << bits) - 1)
+
+
+def verify_tables(transforms: List[Transform]) -> List[str]:
+    """
+    Compare the generated tables with the tables shipped with the library.
+
+    The tables for smaller real FFTs are compared with every n-th value of the shipped table.
+
+    :param transforms: The transforms to verify.
+    :return: A list with the differences, empty if all tables are identical.
+    """
+    shipped = {}
+    for source in REPLACED_SOURCES:
+        shipped.update(read_source_tables(DSP_SOURCE_DIR/source))
+    differences = []
+    for table in create_tables(transforms, shipped):
+        expected = shipped.get(table.name)
+        if expected is None:
+            differences.append(f'{table.name}: not found in the library sources')
+            continue
+        if table.name.startswith('realCoef'):
+            step = len(expected) // len(table.values)
+            expected = [value for index in range(0, len(expected), step * 2)
+                        for value in expected[index:index + 2]]
+        if len(expected) != len(table.values):
+            differences.append(f'{table.name}: {len(table.values)} values, expected {len(expected)}')
+            continue
+        mismatches = [index for index, (a, b) in enumerate(zip(table.values, expected))
+                      if _literal_bits(a, table.c_type) != _literal_bits(b, table.c_type)]
+        if mismatches:
+            differences.append(f'{table.name}: {len(mismatches)} different values, first at index {mismatches[0]}')
+    return differences
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Generate the CMSIS DSP tables for the used transforms.')
+    parser.add_argument('transforms',
+                        nargs='*',
+                        help='The transforms, like "cfft_q15_256", "rfft_fast_f32_1024" or "dct4_q31_512".')
+    parser.add_argument('--output', '-o',
+                        dest='output',
+                        type=str,
+                        action='store',
+                        help='Write the source to this path, instead of the cache.')
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        type=str,
+                        action='store',
+                        default=str(TABLES_CACHE_DIR),
+                        help='The directory for the generated sources.')
+    parser.add_argument('--verify',
+                        dest='verify',
+                        action='store_true',
+                        help='Compare the generated tables with the tables shipped with the library. '
+                             'Without transforms, all supported transforms are compared.')
+    args = parser.parse_args()
+    try:
+        transforms = parse_transforms(args.transforms)
+        if args.verify:
+            if not transforms:
+                transforms = parse_transforms(f'{kind}_{number_format}_{size}'
+                                              for (kind, number_format), sizes in TRANSFORM_SIZES.items()
+                                              for size in sizes)
+            differences = verify_tables(transforms)
+            for difference in differences:
+                print(difference)
+            if differences:
+                exit(1)
+            print(f'All tables for {len(transforms)} transforms are identical to the shipped tables.')
+        elif args.output:
+            Path(args.output).write_text(generate_source(transforms), 'utf-8')
+        else:
+            print(provide_source(transforms, Path(args.cache_dir)))
+    except (TableError, OSError) as e:
+        exit(f'ERROR! {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import mmap
+import struct
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+assert sys.version_info >= (3, 7)
+
+
+ELF_MAGIC = b'\x7fELF'
+ELF_CLASS_32 = 1
+ELF_DATA_LSB = 1
+ELF_DATA_MSB = 2
+
+SHT_NULL = 0
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+PT_LOAD = 1
+
+NT_GNU_BUILD_ID = 3
+BUILD_ID_SECTION = '.note.gnu.build-id'
+
+STT_OBJECT = 1
+STT_FUNC = 2
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+SHN_UNDEF = 0
+
+
+class ElfError(Exception):
+    """
+    Exception if a file is no valid ELF32 file.
+    """
+    pass
+
+
+@dataclass
+class Section:
+    """A section from the section header table."""
+    index: int
+    name: str
+    type: int
+    flags: int
+    address: int
+    offset: int
+    size: int
+    link: int
+    info: int
+    alignment: int
+    entry_size: int
+
+    @property
+    def is_alloc(self) -> bool:
+        return (self.flags & SHF_ALLOC) != 0
+
+    @property
+    def is_code(self) -> bool:
+        return (self.flags & SHF_EXECINSTR) != 0
+
+    @property
+    def is_writable(self) -> bool:
+        return (self.flags & SHF_WRITE) != 0
+
+    @property
+    def has_contents(self) -> bool:
+        return self.type != SHT_NOBITS
+
+    @property
+    def kind(self) -> str:
+        """
+        The category of the section, using the same rules as the GNU size format.
+
+        :return: 'text', 'data', 'bss' or an empty string for sections which are not allocated.
+        """
+        if not self.is_alloc:
+            return ''
+        if self.is_code:
+            return 'text'
+        if self.has_contents:
+            return 'data'
+        return 'bss'
+
+
+@dataclass
+class Segment:
+    """A segment from the program header table."""
+    type: int
+    offset: int
+    virtual_address: int
+    physical_address: int
+    file_size: int
+    memory_size: int
+    flags: int
+    alignment: int
+
+    @property
+    def is_load(self) -> bool:
+        return self.type == PT_LOAD
+
+
+@dataclass
+class Symbol:
+    """A symbol from the symbol table."""
+    name: str
+    value: int
+    size: int
+    type: int
+    binding: int
+    section_index: int
+
+    @property
+    def is_function(self) -> bool:
+        return self.type == STT_FUNC
+
+    @property
+    def is_object(self) -> bool:
+        return self.type == STT_OBJECT
+
+    @property
+    def is_defined(self) -> bool:
+        return self.section_index != SHN_UNDEF
+
+    @property
+    def address(self) -> int:
+        """
+        The address of the symbol, without the thumb bit for functions.
+        """
+        if self.is_function:
+            return self.value & ~1
+        return self.value
+
+
+class ElfFile:
+    """
+    A minimal reader for ELF32 files, using a memory map of the file.
+
+    Only the headers which are actually accessed are decoded, so opening a large
+    firmware file is cheap. Use the object as context manager to release the map.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ElfError(f'The file is empty: {self.path}')
+        self._sections: Optional[List[Section]] = None
+        self._segments: Optional[List[Segment]] = None
+        self._symbols: Optional[List[Symbol]] = None
+        try:
+            self._read_header()
+        except (ElfError, struct.error) as e:
+            self.close()
+            raise ElfError(f'Could not read the ELF header of {self.path}: {e}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Release the memory map and close the file.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_header(self):
+        if self._map[0:4] != ELF_MAGIC:
+            raise ElfError('Missing ELF magic.')
+        if self._map[4] != ELF_CLASS_32:
+            raise ElfError('Only ELF32 files are supported.')
+        if self._map[5] == ELF_DATA_LSB:
+            self._endian = '<'
+        elif self._map[5] == ELF_DATA_MSB:
+            self._endian = '>'
+        else:
+            raise ElfError('Unknown data encoding.')
+        (self.type, self.machine, _, self.entry, self._ph_offset, self._sh_offset, self.flags, _,
+         self._ph_entry_size, self._ph_count, self._sh_entry_size, self._sh_count,
+         self._sh_string_index) = struct.unpack_from(self._endian + 'HHIIIIIHHHHHH', self._map, 16)
+
+    def unpack_from(self, fmt: str, offset: int) -> Tuple:
+        """
+        Unpack values from the file, using the byte order of the file.
+
+        :param fmt: The struct format, without byte order prefix.
+        :param offset: The offset in the file.
+        :return: The unpacked values.
+        """
+        return struct.unpack_from(self._endian + fmt, self._map, offset)
+
+    @property
+    def sections(self) -> List[Section]:
+        """
+        All sections of the file, in the order of the section header table.
+        """
+        if self._sections is None:
+            self._sections = self._read_sections()
+        return self._sections
+
+    @property
+    def segments(self) -> List[Segment]:
+        """
+        All segments of the file, in the order of the program header table.
+        """
+        if self._segments is None:
+            self._segments = self._read_segments()
+        return self._segments
+
+    @property
+    def symbols(self) -> List[Symbol]:
+        """
+        All symbols from the symbol table, in the order of the table.
+        """
+        if self._symbols is None:
+            self._symbols = self._read_symbols()
+        return self._symbols
+
+    def _read_symbols(self) -> List[Symbol]:
+        symbol_table = next((s for s in self.sections if s.type == SHT_SYMTAB), None)
+        if symbol_table is None or symbol_table.link >= len(self.sections):
+            return []
+        names_offset = self.sections[symbol_table.link].offset
+        entry_size = symbol_table.entry_size or 16
+        symbols = []
+        for offset in range(symbol_table.offset, symbol_table.offset + symbol_table.size, entry_size):
+            name, value, size, info, _, section_index = self.unpack_from('IIIBBH', offset)
+            symbols.append(Symbol(name=self.read_string(names_offset + name) if name else '',
+                                  value=value,
+                                  size=size,
+                                  type=info & 0xf,
+                                  binding=info >> 4,
+                                  section_index=section_index))
+        return symbols
+
+    def _read_sections(self) -> List[Section]:
+        if self._sh_offset == 0 or self._sh_count == 0:
+            return []
+        headers = []
+        for index in range(self._sh_count):
+            offset = self._sh_offset + index * self._sh_entry_size
+            headers.append((index,) + self.unpack_from('IIIIIIIIII', offset))
+        names_offset = 0
+        if self._sh_string_index < len(headers):
+            names_offset = headers[self._sh_string_index][5]
+        sections = []
+        for index, name, sh_type, flags, address, offset, size, link, info, alignment, entry_size in headers:
+            sections.append(Section(index=index,
+                                    name=self.read_string(names_offset + name) if names_offset else '',
+                                    type=sh_type,
+                                    flags=flags,
+                                    address=address,
+                                    offset=offset,
+                                    size=size,
+                                    link=link,
+                                    info=info,
+                                    alignment=alignment,
+                                    entry_size=entry_size))
+        return sections
+
+    def _read_segments(self) -> List[Segment]:
+        if self._ph_offset == 0 or self._ph_count == 0:
+            return []
+        segments = []
+        for index in range(self._ph_count):
+            offset = self._ph_offset + index * self._ph_entry_size
+            segments.append(Segment(*self.unpack_from('IIIIIIII', offset)))
+        return segments
+
+    def read_string(self, offset: int) -> str:
+        """
+        Read a zero terminated string from the file.
+
+        :param offset: The offset in the file.
+        :return: The decoded string.
+        """
+        end = self._map.find(b'\0', offset)
+        if end < 0:
+            end = len(self._map)
+        return self._map[offset:end].decode('utf-8', errors='replace')
+
+    def section(self, name: str) -> Optional[Section]:
+        """
+        Get the first section with the given name.
+
+        :param name: The name of the section.
+        :return: The section or None if there is no section with this name.
+        """
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def section_data(self, section: Section) -> bytes:
+        """
+        Read the contents of a section.
+
+        :param section: The section.
+        :return: The contents, empty for sections without contents.
+        """
+        if not section.has_contents:
+            return b''
+        return self._map[section.offset:section.offset + section.size]
+
+    def segment_data(self, segment: Segment) -> bytes:
+        """
+        Read the file contents of a segment.
+
+        :param segment: The segment.
+        :return: The contents of the segment in the file.
+        """
+        return self._map[segment.offset:segment.offset + segment.file_size]
+
+    def load_address(self, section: Section) -> int:
+        """
+        Get the load address (LMA) of a section.
+
+        Like the GNU binutils, the address is calculated from the load segment which contains the section.
+
+        :param section: The section.
+        :return: The load address of the section.
+        """
+        for segment in self.segments:
+            if not segment.is_load:
+                continue
+            if (segment.offset <= section.offset and
+                    section.offset + section.size <= segment.offset + segment.file_size and
+                    segment.virtual_address <= section.address < segment.virtual_address + max(segment.memory_size, 1)):
+                return segment.physical_address + section.address - segment.virtual_address
+        return section.address
+
+    def is_copied(self, section: Section) -> bool:
+        """
+        Test if a section is loaded into the flash, but copied to a different address at runtime.
+
+        :param section: The section.
+        :return: True if the load address of the section differs from its address.
+        """
+        return section.is_alloc and section.has_contents and self.load_address(section) != section.address
+
+    def ram_code_size(self) -> int:
+        """
+        Get the size of the code which is copied from the flash into the RAM at reset.
+
+        This code, like the functions in the `.ramfunc` section, is counted as text by the GNU size
+        format, but also uses the RAM.
+
+        :return: The size of the code in the RAM.
+        """
+        return sum(section.size for section in self.sections if section.is_code and self.is_copied(section))
+
+    def sizes(self) -> Tuple[int, int, int]:
+        """
+        Calculate the text, data and bss size of the file.
+
+        The values are identical to the ones reported by `arm-none-eabi-size --format=GNU`.
+
+        :return: A tuple with the text, data and bss size.
+        """
+        totals = {'text': 0, 'data': 0, 'bss': 0}
+        for section in self.sections:
+            kind = section.kind
+            if kind:
+                totals[kind] += section.size
+        return totals['text'], totals['data'], totals['bss']
+
+    def build_id(self) -> Optional[bytes]:
+        """
+        Read the GNU build ID, created by the linker with `--build-id`.
+
+        :return: The build ID, or None if the file has no build ID.
+        """
+        section = self.section(BUILD_ID_SECTION)
+        if section is None or not section.has_contents:
+            return None
+        offset = section.offset
+        end = section.offset + section.size
+        while offset + 12 <= end:
+            name_size, description_size, note_type = self.unpack_from('III', offset)
+            name_offset = offset + 12
+            description_offset = name_offset + ((name_size + 3) & ~3)
+            if note_type == NT_GNU_BUILD_ID and self._map[name_offset:name_offset + name_size] == b'GNU\0':
+                return bytes(self._map[description_offset:description_offset + description_size])
+            offset = description_offset + ((description_size + 3) & ~3)
+        return None
@@ -0,0 +1,170 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import hashlib
+import os
+import struct
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Union
+
+from elffile import ElfFile
+
+assert sys.version_info >= (3, 7)
+
+
+GAP_FILL = 0x00  # The value used by objcopy to fill gaps between sections.
+HEX_RECORD_SIZE = 16
+UF2_MAGIC_START0 = 0x0a324655
+UF2_MAGIC_START1 = 0x9e5d5157
+UF2_MAGIC_END = 0x0ab16f30
+UF2_FLAG_FAMILY_ID = 0x00002000
+UF2_PAYLOAD_SIZE = 256
+UF2_FAMILY_IDS = {
+    'samd21': 0x68ed2b88,
+    'samd51': 0x55114460,
+    'saml21': 0x1851780a,
+}
+
+
+class ImageError(Exception):
+    """
+    Exception if no image can be created from the firmware.
+    """
+    pass
+
+
+@dataclass
+class LoadChunk:
+    """The contents of one section, at its load address."""
+    name: str
+    address: int
+    data: bytes
+
+
+@dataclass
+class FirmwareImage:
+    """The binary image of a firmware, as written to the flash memory."""
+    address: int
+    data: bytes
+    chunks: List[LoadChunk]
+    entry: int
+
+    @property
+    def hash(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+
+def create_image(elf: ElfFile) -> FirmwareImage:
+    """
+    Create the binary image of the firmware.
+
+    The image is identical to the output of `objcopy -O binary`: All allocated sections with contents
+    are placed at their load address, starting at the lowest address, and gaps are filled with zeros.
+
+    :param elf: The firmware.
+    :return: The image.
+    """
+    chunks = []
+    for section in elf.sections:
+        if section.is_alloc and section.has_contents and section.size > 0:
+            chunks.append(LoadChunk(name=section.name,
+                                    address=elf.load_address(section),
+                                    data=elf.section_data(section)))
+    if not chunks:
+        raise ImageError('The firmware has no sections with contents.')
+    chunks.sort(key=lambda c: c.address)
+    start = chunks[0].address
+    end = max(chunk.address + len(chunk.data) for chunk in chunks)
+    data = bytearray([GAP_FILL]) * (end - start)
+    for chunk in chunks:
+        offset = chunk.address - start
+        data[offset:offset + len(chunk.data)] = chunk.data
+    return FirmwareImage(address=start, data=bytes(data), chunks=chunks, entry=elf.entry)
+
+
+def _write_atomic(path: Union[str, Path], data: bytes):
+    path = Path(path)
+    temp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    temp_path.write_bytes(data)
+    temp_path.replace(path)
+
+
+def write_binary(path: Union[str, Path], image: FirmwareImage):
+    """
+    Write the image as raw binary file.
+
+    :param path: The path to the file.
+    :param image: The image.
+    """
+    _write_atomic(path, image.data)
+
+
+def _hex_record(record_type: int, address: int, data: bytes) -> str:
+    record = bytes([len(data), (address >> 8) & 0xff, address & 0xff, record_type]) + data
+    checksum = (-sum(record)) & 0xff
+    return f':{record.hex().upper()}{checksum:02X}\n'
+
+
+def write_intel_hex(path: Union[str, Path], image: FirmwareImage):
+    """
+    Write the image as Intel HEX file.
+
+    Only the sections are written, the gaps between them are left out.
+
+    :param path: The path to the file.
+    :param image: The image.
+    """
+    lines = []
+    upper_address = 0
+    for chunk in image.chunks:
+        offset = 0
+        while offset < len(chunk.data):
+            address = chunk.address + offset
+            # A record must not cross a 64 KiB boundary.
+            size = min(HEX_RECORD_SIZE, len(chunk.data) - offset, 0x10000 - (address & 0xffff))
+            if (address >> 16) != upper_address:
+                upper_address = address >> 16
+                lines.append(_hex_record(0x04, 0, struct.pack('>H', upper_address)))
+            lines.append(_hex_record(0x00, address & 0xffff, chunk.data[offset:offset + size]))
+            offset += size
+    if image.entry:
+        lines.append(_hex_record(0x05, 0, struct.pack('>I', image.entry)))
+    lines.append(_hex_record(0x01, 0, b''))
+    _write_atomic(path, ''.join(lines).encode('ascii'))
+
+
+def write_uf2(path: Union[str, Path], image: FirmwareImage, family_id: Optional[int]):
+    """
+    Write the image as UF2 file, for boot loaders which emulate a USB drive.
+
+    :param path: The path to the file.
+    :param image: The image.
+    :param family_id: The UF2 family ID of the MCU, or None.
+    """
+    flags = UF2_FLAG_FAMILY_ID if family_id is not None else 0
+    block_count = (len(image.data) + UF2_PAYLOAD_SIZE - 1) // UF2_PAYLOAD_SIZE
+    blocks = []
+    for block_index in range(block_count):
+        offset = block_index * UF2_PAYLOAD_SIZE
+        payload = image.data[offset:offset + UF2_PAYLOAD_SIZE]
+        header = struct.pack('<8I', UF2_MAGIC_START0, UF2_MAGIC_START1, flags, image.address + offset,
+                             UF2_PAYLOAD_SIZE, block_index, block_count, family_id or 0)
+        blocks.append(header + payload.ljust(476, b'\0') + struct.pack('<I', UF2_MAGIC_END))
+    _write_atomic(path, b''.join(blocks))
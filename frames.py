@@ -0,0 +1,90 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import struct
+import sys
+from dataclasses import dataclass
+from typing import Iterable, List
+
+assert sys.version_info >= (3, 7)
+
+
+FRAME_SYNC = 0xa5
+FRAME_HEADER = struct.Struct('<BBH')  # The sync byte, the frame type and the size of the payload.
+FRAME_MAX_PAYLOAD = 4096
+FRAME_TYPE_PROFILER = 0x50
+FRAME_TYPE_LOG = 0x4c
+FRAME_TYPE_CRASH_DUMP = 0x43
+
+
+@dataclass
+class Frame:
+    """A frame sent by the firmware over the serial interface."""
+    type: int
+    payload: bytes
+
+
+class FrameDecoder:
+    """
+    Split the data received from the firmware into frames.
+
+    The decoder works incrementally on the received chunks. Bytes which do not belong to a
+    frame of a known type are skipped, so the decoder synchronizes again after lost data.
+    """
+
+    def __init__(self, frame_types: Iterable[int]):
+        self.frame_types = set(frame_types)
+        self.skipped = 0
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Frame]:
+        """
+        Add received data and decode all complete frames.
+
+        :param data: The received data.
+        :return: The decoded frames.
+        """
+        buffer = self._buffer
+        buffer.extend(data)
+        frames = []
+        position = 0
+        end = len(buffer)
+        while position < end:
+            sync_position = buffer.find(FRAME_SYNC, position)
+            if sync_position < 0:
+                self.skipped += end - position
+                position = end
+                break
+            self.skipped += sync_position - position
+            position = sync_position
+            if end - position < FRAME_HEADER.size:
+                break
+            _, frame_type, size = FRAME_HEADER.unpack_from(buffer, position)
+            if frame_type not in self.frame_types or size > FRAME_MAX_PAYLOAD:
+                # This was no frame, search for the next sync byte.
+                self.skipped += 1
+                position += 1
+                continue
+            frame_end = position + FRAME_HEADER.size + size
+            if frame_end > end:
+                break
+            frames.append(Frame(type=frame_type, payload=bytes(buffer[position + FRAME_HEADER.size:frame_end])))
+            position = frame_end
+        del buffer[:position]
+        return frames
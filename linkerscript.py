@@ -0,0 +1,458 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import hashlib
+import json
+import os
+import argparse
+import sys
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import List
+
+from tracing import span
+
+assert sys.version_info >= (3, 7)
+
+
+SCRIPT_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'ld'
+
+
+class Error(Exception):
+    """The error class for this script."""
+
+
+@dataclass
+class LinkerLayout:
+    """The memory layout of a firmware."""
+    flash_origin: int
+    flash_length: int
+    ram_origin: int
+    ram_length: int
+    lp_ram_origin: int = 0
+    lp_ram_length: int = 0
+    ram_code: bool = True
+    noinit_size: int = 0
+
+    def validate(self):
+        """
+        Check if the layout is valid.
+        """
+        if self.flash_length <= 0:
+            raise Error('The flash region is empty.')
+        if self.ram_length <= 0:
+            raise Error('The RAM region is empty.')
+        if self.noinit_size < 0 or self.noinit_size % 4 != 0:
+            raise Error('The size of the noinit region has to be a multiple of 4.')
+        if self.noinit_size >= self.ram_length:
+            raise Error('The noinit region does not fit into the RAM.')
+
+    @property
+    def key(self) -> str:
+        """The key of the generated script, which changes if the layout or this generator changes."""
+        digest = hashlib.sha256(Path(__file__).read_bytes())
+        digest.update(json.dumps(asdict(self), sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()[:24]
+
+
+def _memory_regions(layout: LinkerLayout) -> List[str]:
+    ram_length = layout.ram_length - layout.noinit_size
+    lines = [f'  FLASH (rx) : ORIGIN = {layout.flash_origin:#010x}, LENGTH = {layout.flash_length:#010x}',
+             f'  RAM (rwx) : ORIGIN = {layout.ram_origin:#010x}, LENGTH = {ram_length:#010x}']
+    if layout.noinit_size:
+        lines.append(f'  NOINIT (rw) : ORIGIN = {layout.ram_origin + ram_length:#010x}, '
+                     f'LENGTH = {layout.noinit_size:#010x}')
+    if layout.lp_ram_length:
+        lines.append(f'  LPRAM (rw) : ORIGIN = {layout.lp_ram_origin:#010x}, LENGTH = {layout.lp_ram_length:#010x}')
+    return lines
+
+
+def generate_script(layout: LinkerLayout) -> str:
+    """
+    Generate the linker script for a memory layout.
+
+    :param layout: The memory layout.
+    :return: The contents of the linker script.
+    """
+    layout.validate()
+    text_ram_code = ''
+    if not layout.ram_code:
+        text_ram_code = '\n\t\t/* RAM code is disabled, the functions are executed from the flash. */\n' \
+                        '\t\t*(.ramfunc .ramfunc.*)\n'
+    copy_table = ''
+    ram_code_section = ''
+    data_load_address = '__etext'
+    if layout.ram_code:
+        copy_table = ('\t\tLONG (LOADADDR(.ramfunc))\n'
+                      '\t\tLONG (__ramfunc_start__)\n'
+                      '\t\tLONG (__ramfunc_end__ - __ramfunc_start__)\n')
+        ram_code_section = '''
+	/* Functions and tables executed from RAM, without flash wait states.
+	 * They are marked with HAL_RAM_FUNCTION and HAL_RAM_TABLE from hal-core/RamCode.h */
+	.ramfunc : AT (__etext)
+	{
+		. = ALIGN(4);
+		__ramfunc_start__ = .;
+		*(.ramfunc .ramfunc.*)
+		. = ALIGN(4);
+		__ramfunc_end__ = .;
+	} > RAM
+'''
+        data_load_address = '__etext + SIZEOF(.ramfunc)'
+    noinit_region = 'NOINIT' if layout.noinit_size else 'RAM'
+    lp_ram_region = 'LPRAM' if layout.lp_ram_length else 'RAM'
+    memory = '\n'.join(_memory_regions(layout))
+    return f'''/*
+ * Do not modify this file! It was generated by the "linkerscript.py" script.
+ *
+ * Based on the linker scripts of the Arduino SAMD core,
+ * Copyright (c) 2014-2015 Arduino LLC, licensed under the LGPL 2.1 or later.
+ */
+
+MEMORY
+{{
+{memory}
+}}
+
+/* Linker script to place sections and symbol values.
+ * It references following symbols, which must be defined in code:
+ *   Reset_Handler : Entry of reset handler
+ *
+ * It defines following symbols, which code can use without definition:
+ *   __exidx_start
+ *   __exidx_end
+ *   __build_id_start__
+ *   __build_id_end__
+ *   __copy_table_start__
+ *   __copy_table_end__
+ *   __zero_table_start__
+ *   __zero_table_end__
+ *   __etext
+ *   __data_start__
+ *   __preinit_array_start
+ *   __preinit_array_end
+ *   __init_array_start
+ *   __init_array_end
+ *   __fini_array_start
+ *   __fini_array_end
+ *   __data_end__
+ *   __bss_start__
+ *   __bss_end__
+ *   __noinit_start__
+ *   __noinit_end__
+ *   __lpram_start__
+ *   __lpram_end__
+ *   __end__
+ *   end
+ *   __HeapLimit
+ *   __StackLimit
+ *   __StackTop
+ *   __stack
+ *   __ram_end__
+ */
+ENTRY(Reset_Handler)
+
+SECTIONS
+{{
+	.text :
+	{{
+		__text_start__ = .;
+
+		KEEP(*(.isr_vector))
+		*(.text*)
+{text_ram_code}
+		KEEP(*(.init))
+		KEEP(*(.fini))
+
+		/* .ctors */
+		*crtbegin.o(.ctors)
+		*crtbegin?.o(.ctors)
+		*(EXCLUDE_FILE(*crtend?.o *crtend.o) .ctors)
+		*(SORT(.ctors.*))
+		*(.ctors)
+
+		/* .dtors */
+		*crtbegin.o(.dtors)
+		*crtbegin?.o(.dtors)
+		*(EXCLUDE_FILE(*crtend?.o *crtend.o) .dtors)
+		*(SORT(.dtors.*))
+		*(.dtors)
+
+		*(.rodata*)
+
+		KEEP(*(.eh_frame*))
+	}} > FLASH
+
+	.ARM.extab :
+	{{
+		*(.ARM.extab* .gnu.linkonce.armextab.*)
+	}} > FLASH
+
+	__exidx_start = .;
+	.ARM.exidx :
+	{{
+		*(.ARM.exidx* .gnu.linkonce.armexidx.*)
+	}} > FLASH
+	__exidx_end = .;
+
+	/* The build ID, if the firmware is linked with --build-id.
+	 * It is used to find the matching firmware for a crash dump. */
+	.note.gnu.build-id :
+	{{
+		__build_id_start__ = .;
+		KEEP(*(.note.gnu.build-id))
+		__build_id_end__ = .;
+	}} > FLASH
+
+	/* The sections copied from ROM to RAM by the reset handler.
+	 * Each entry is the source, the destination and the size in bytes. */
+	.copy.table :
+	{{
+		. = ALIGN(4);
+		__copy_table_start__ = .;
+{copy_table}		LONG (LOADADDR(.data))
+		LONG (__data_start__)
+		LONG (__data_end__ - __data_start__)
+		__copy_table_end__ = .;
+	}} > FLASH
+
+	/* The sections cleared by the reset handler.
+	 * Each entry is the start and the size in bytes. */
+	.zero.table :
+	{{
+		. = ALIGN(4);
+		__zero_table_start__ = .;
+		LONG (__bss_start__)
+		LONG (__bss_end__ - __bss_start__)
+		LONG (__lpram_start__)
+		LONG (__lpram_end__ - __lpram_start__)
+		__zero_table_end__ = .;
+	}} > FLASH
+
+	__etext = .;
+{ram_code_section}
+	.data : AT ({data_load_address})
+	{{
+		__data_start__ = .;
+		*(vtable)
+		*(.data*)
+
+		. = ALIGN(4);
+		/* preinit data */
+		PROVIDE_HIDDEN (__preinit_array_start = .);
+		KEEP(*(.preinit_array))
+		PROVIDE_HIDDEN (__preinit_array_end = .);
+
+		. = ALIGN(4);
+		/* init data */
+		PROVIDE_HIDDEN (__init_array_start = .);
+		KEEP(*(SORT(.init_array.*)))
+		KEEP(*(.init_array))
+		PROVIDE_HIDDEN (__init_array_end = .);
+
+
+		. = ALIGN(4);
+		/* finit data */
+		PROVIDE_HIDDEN (__fini_array_start = .);
+		KEEP(*(SORT(.fini_array.*)))
+		KEEP(*(.fini_array))
+		PROVIDE_HIDDEN (__fini_array_end = .);
+
+		KEEP(*(.jcr*))
+		. = ALIGN(16);
+		/* All data end */
+		__data_end__ = .;
+
+	}} > RAM
+
+	.bss :
+	{{
+		. = ALIGN(4);
+		__bss_start__ = .;
+		*(.bss*)
+		*(COMMON)
+		. = ALIGN(4);
+		__bss_end__ = .;
+	}} > RAM
+
+	/* Variables which are neither initialized nor cleared at reset, marked with HAL_NO_INIT.
+	 * In a separate NOINIT region, their address does not change between builds. */
+	.noinit (NOLOAD) :
+	{{
+		. = ALIGN(4);
+		__noinit_start__ = .;
+		KEEP(*(.noinit .noinit.*))
+		. = ALIGN(4);
+		__noinit_end__ = .;
+	}} > {noinit_region}
+
+	/* Variables in the low power SRAM, cleared at reset.
+	 * If the MCU has no low power SRAM, they are placed in the RAM.
+	 * This SRAM is not faster than the main RAM, it only stays powered in the low power modes. */
+	.lpram (NOLOAD) :
+	{{
+		. = ALIGN(4);
+		__lpram_start__ = .;
+		*(.lpram .lpram.*)
+		. = ALIGN(4);
+		__lpram_end__ = .;
+	}} > {lp_ram_region}
+	.heap (COPY):
+	{{
+		__end__ = .;
+		PROVIDE(end = .);
+		*(.heap*)
+		__HeapLimit = .;
+	}} > RAM
+
+	/* .stack_dummy section doesn't contains any symbols. It is only
+	 * used for linker to calculate size of stack sections, and assign
+	 * values to stack symbols later */
+	.stack_dummy (COPY):
+	{{
+		*(.stack*)
+	}} > RAM
+
+	/* Set stack top to end of RAM, and stack limit move down by
+	 * size of stack_dummy section */
+	__StackTop = ORIGIN(RAM) + LENGTH(RAM);
+	__StackLimit = __StackTop - SIZEOF(.stack_dummy);
+	PROVIDE(__stack = __StackTop);
+
+	__ram_end__ = ORIGIN(RAM) + LENGTH(RAM) - 1;
+
+	/* Check if data + heap + stack exceeds RAM limit */
+	ASSERT(__StackLimit >= __HeapLimit, "region RAM overflowed with stack")
+
+	/* The format strings of the deferred log. The section is not loaded,
+	 * the offset of each string is used as its identifier. */
+	.hal_log 0 (INFO) :
+	{{
+		KEEP(*(.hal_log .hal_log.*))
+	}}
+}}
+'''
+
+
+def provide_script(layout: LinkerLayout, cache_dir: Path) -> Path:
+    """
+    Provide the linker script for a memory layout, generating it only if there is no cached script.
+
+    :param layout: The memory layout.
+    :param cache_dir: The directory for the generated scripts.
+    :return: The path to the linker script.
+    """
+    path = cache_dir/f'{layout.key}.ld'
+    if path.is_file():
+        return path
+    contents = generate_script(layout)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    temp_path.write_text(contents, 'utf-8')
+    temp_path.replace(path)
+    return path
+
+
+def auto_int(argument: str) -> int:
+    """
+    Convert any int string into an int.
+
+    :param argument: The string with the integer.
+    :return: The converted integer.
+    """
+    return int(argument, 0)
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Generate the linker script for a memory layout and print '
+                                                 'the path to the cached script.')
+    parser.add_argument('--flash-size',
+                        dest='flash_size',
+                        type=auto_int,
+                        action='store',
+                        required=True,
+                        help='The total size of the flash memory.')
+    parser.add_argument('--flash-start',
+                        dest='flash_start',
+                        type=auto_int,
+                        action='store',
+                        default=0,
+                        help='The start of the firmware in the flash memory, after the boot loader.')
+    parser.add_argument('--ram-start',
+                        dest='ram_start',
+                        type=auto_int,
+                        action='store',
+                        default=0x20000000,
+                        help='The start address of the RAM.')
+    parser.add_argument('--ram-size',
+                        dest='ram_size',
+                        type=auto_int,
+                        action='store',
+                        required=True,
+                        help='The size of the RAM.')
+    parser.add_argument('--lp-ram-start',
+                        dest='lp_ram_start',
+                        type=auto_int,
+                        action='store',
+                        default=0,
+                        help='The start address of the low power SRAM, if the MCU has one.')
+    parser.add_argument('--lp-ram-size',
+                        dest='lp_ram_size',
+                        type=auto_int,
+                        action='store',
+                        default=0,
+                        help='The size of the low power SRAM, or zero if the MCU has none.')
+    parser.add_argument('--no-ram-code',
+                        dest='ram_code',
+                        action='store_false',
+                        help='Execute the functions marked for the RAM from the flash memory.')
+    parser.add_argument('--noinit-size',
+                        dest='noinit_size',
+                        type=auto_int,
+                        action='store',
+                        default=0,
+                        help='The size of a region at the end of the RAM for variables which keep their '
+                             'value across resets. With zero, these variables are placed after the bss section.')
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        type=str,
+                        action='store',
+                        default=str(SCRIPT_CACHE_DIR),
+                        help='The directory for the generated scripts.')
+    args = parser.parse_args()
+    layout = LinkerLayout(flash_origin=args.flash_start,
+                          flash_length=args.flash_size - args.flash_start,
+                          ram_origin=args.ram_start,
+                          ram_length=args.ram_size,
+                          lp_ram_origin=args.lp_ram_start,
+                          lp_ram_length=args.lp_ram_size,
+                          ram_code=args.ram_code,
+                          noinit_size=args.noinit_size)
+    try:
+        with span('linker script', 'configure'):
+            print(provide_script(layout, Path(args.cache_dir)))
+    except (Error, OSError) as e:
+        exit(f'ERROR! {e}')
+
+
+if __name__ == '__main__':
+    main()
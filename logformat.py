@@ -0,0 +1,274 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from elffile import ElfFile, ElfError
+from frames import Frame
+
+assert sys.version_info >= (3, 7)
+
+
+LOG_SECTION = '.hal_log'
+LOG_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'log'
+LOG_DROPPED_ID = 0xffff
+CACHE_FORMAT = 1
+FORMAT_ID = struct.Struct('<H')
+ARGUMENT = struct.Struct('<I')
+FLOAT = struct.Struct('<f')
+
+RE_CONVERSION = re.compile(R'%([-+ #0]*)(\d*)(\.\d+)?(hh|h|ll|l|j|z|t|L)?([diouxXeEfFgGcsp%])')
+
+
+class LogFormatError(Exception):
+    """
+    Exception if the format strings can not be read from the firmware.
+    """
+    pass
+
+
+def read_formats(elf: ElfFile) -> Dict[int, str]:
+    """
+    Read all format strings from the log section of the firmware.
+
+    The section is not loaded and starts at address zero, so the address of each string is its ID.
+
+    :param elf: The firmware.
+    :return: A dictionary with the ID and the format string.
+    """
+    section = elf.section(LOG_SECTION)
+    if section is None:
+        return {}
+    if section.address + section.size > LOG_DROPPED_ID:
+        raise LogFormatError(f'The "{LOG_SECTION}" section is too large for 16-bit IDs.')
+    data = elf.section_data(section)
+    formats = {}
+    offset = 0
+    while offset < len(data):
+        # The strings are aligned, so zero bytes between them are skipped.
+        if data[offset] == 0:
+            offset += 1
+            continue
+        end = data.find(b'\0', offset)
+        if end < 0:
+            end = len(data)
+        formats[section.address + offset] = data[offset:end].decode('utf-8', errors='replace')
+        offset = end + 1
+    return formats
+
+
+def firmware_hash(path: Union[str, Path]) -> str:
+    """
+    Calculate the hash of the firmware file, used as key for the cache.
+
+    :param path: The path to the firmware ELF file.
+    :return: The hash as hex string.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _compile_format(text: str) -> Tuple[str, List[str]]:
+    """
+    Convert a C format string into a Python format string.
+
+    :param text: The C format string.
+    :return: The Python format string and the kind of each argument: 'i', 'u', 'f' or 's'.
+    """
+    kinds = []
+
+    def replace(match) -> str:
+        flags, width, precision, _, conversion = match.groups()
+        if conversion == '%':
+            return '%%'
+        if conversion == 'p':
+            kinds.append('u')
+            return '0x%08x'
+        if conversion in 'di':
+            kinds.append('i')
+        elif conversion in 'ouxXc':
+            kinds.append('u')
+            if conversion == 'u':
+                conversion = 'd'
+        elif conversion == 's':
+            kinds.append('s')
+        else:
+            kinds.append('f')
+        return f'%{flags}{width}{precision or ""}{conversion}'
+
+    return RE_CONVERSION.sub(replace, text), kinds
+
+
+class LogTable:
+    """
+    The format strings of a firmware, to expand the log records.
+    """
+
+    def __init__(self, formats: Dict[int, str], read_string: Callable[[int], Optional[str]] = lambda a: None):
+        self.formats = formats
+        self._read_string = read_string
+        self._compiled: Dict[int, Tuple[str, List[str]]] = {}
+        self._strings: Dict[int, str] = {}
+
+    @staticmethod
+    def load(path: Union[str, Path], cache_dir: Optional[Path] = LOG_CACHE_DIR) -> 'LogTable':
+        """
+        Load the format strings of a firmware, from the cache if possible.
+
+        :param path: The path to the firmware ELF file.
+        :param cache_dir: The directory for the cached tables, or None to disable the cache.
+        :return: The table.
+        """
+        path = Path(path)
+        cache_path = cache_dir/f'{firmware_hash(path)}.json' if cache_dir else None
+        formats = None
+        if cache_path:
+            try:
+                data = json.loads(cache_path.read_text('utf-8'))
+                if data.get('format') == CACHE_FORMAT:
+                    formats = {int(key): value for key, value in data['formats'].items()}
+            except (OSError, ValueError, KeyError, AttributeError):
+                formats = None
+        if formats is None:
+            try:
+                with ElfFile(path) as elf:
+                    formats = read_formats(elf)
+            except ElfError as e:
+                raise LogFormatError(f'Could not read the firmware: {e}')
+            if cache_path:
+                try:
+                    cache_dir.mkdir(parents=True, exist_ok=True)
+                    temp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+                    temp_path.write_text(json.dumps({'format': CACHE_FORMAT, 'formats': formats},
+                                                    separators=(',', ':')), 'utf-8')
+                    temp_path.replace(cache_path)
+                except OSError:
+                    pass
+        return LogTable(formats, _FirmwareStrings(path))
+
+    def _string(self, address: int) -> str:
+        text = self._strings.get(address)
+        if text is None:
+            text = self._read_string(address)
+            if text is None:
+                text = f'<{address:#010x}>'
+            self._strings[address] = text
+        return text
+
+    def expand(self, format_id: int, arguments: List[int]) -> str:
+        """
+        Expand one log record.
+
+        :param format_id: The ID of the format string.
+        :param arguments: The raw 32-bit arguments.
+        :return: The formatted text.
+        """
+        compiled = self._compiled.get(format_id)
+        if compiled is None:
+            text = self.formats.get(format_id)
+            if text is None:
+                values = ' '.join(f'{value:#010x}' for value in arguments)
+                return f'<unknown format {format_id:#06x}> {values}'.rstrip()
+            compiled = _compile_format(text)
+            self._compiled[format_id] = compiled
+        python_format, kinds = compiled
+        values = []
+        for kind, value in zip(kinds, arguments):
+            if kind == 'i':
+                value = value - 0x100000000 if value & 0x80000000 else value
+            elif kind == 'f':
+                value = FLOAT.unpack(ARGUMENT.pack(value))[0]
+            elif kind == 's':
+                value = self._string(value)
+            values.append(value)
+        # Missing arguments are shown as zero, instead of failing the whole record.
+        values.extend([0] * (len(kinds) - len(values)))
+        try:
+            return python_format % tuple(values)
+        except (TypeError, ValueError, OverflowError):
+            return f'{self.formats[format_id]} {arguments}'
+
+
+class _FirmwareStrings:
+    """
+    Read string arguments from the firmware, opening the file on first use.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._ranges: Optional[List[Tuple[int, int, bytes]]] = None
+
+    def __call__(self, address: int) -> Optional[str]:
+        if self._ranges is None:
+            self._ranges = []
+            try:
+                with ElfFile(self.path) as elf:
+                    for section in elf.sections:
+                        if section.is_alloc and section.has_contents and not section.is_writable:
+                            self._ranges.append((section.address, section.address + section.size,
+                                                 bytes(elf.section_data(section))))
+            except (ElfError, OSError):
+                pass
+        for start, end, data in self._ranges:
+            if start <= address < end:
+                offset = address - start
+                string_end = data.find(b'\0', offset)
+                if string_end < 0:
+                    string_end = len(data)
+                return data[offset:string_end].decode('utf-8', errors='replace')
+        return None
+
+
+class LogDecoder:
+    """
+    Expand the log frames received from the firmware into lines of text.
+    """
+
+    def __init__(self, table: LogTable):
+        self.table = table
+        self.record_count = 0
+        self.dropped_count = 0
+
+    def add_frame(self, frame: Frame) -> Optional[str]:
+        """
+        Expand one log frame.
+
+        :param frame: A frame with a log record.
+        :return: The text of the record, or None for an invalid frame.
+        """
+        payload = frame.payload
+        if len(payload) < FORMAT_ID.size or (len(payload) - FORMAT_ID.size) % ARGUMENT.size:
+            return None
+        format_id = FORMAT_ID.unpack_from(payload)[0]
+        arguments = [value for value, in ARGUMENT.iter_unpack(payload[FORMAT_ID.size:])]
+        if format_id == LOG_DROPPED_ID:
+            dropped = arguments[0] if arguments else 0
+            self.dropped_count += dropped
+            return f'[{dropped} log records dropped]'
+        self.record_count += 1
+        return self.table.expand(format_id, arguments)
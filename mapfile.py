@@ -0,0 +1,376 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import json
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+assert sys.version_info >= (3, 7)
+
+
+NON_ALLOC_PREFIXES = ('.debug', '.comment', '.ARM.attributes', '.stab', '.gnu.attributes')
+FILL_NAME = '*fill*'
+DATA_STATEMENTS = ('BYTE', 'SHORT', 'LONG', 'QUAD', 'SQUAD')
+DATA_STATEMENT_NAME = '*data*'
+LINKER_OBJECT_NAME = '*linker*'
+
+
+class MapFileError(Exception):
+    """
+    Exception if a map file can not be read.
+    """
+    pass
+
+
+@dataclass
+class MemoryRegion:
+    """A memory region from the memory configuration of the map file."""
+    name: str
+    origin: int
+    length: int
+    attributes: str
+
+    def contains(self, address: int) -> bool:
+        return self.origin <= address < self.origin + self.length
+
+    @property
+    def is_writable(self) -> bool:
+        return 'w' in self.attributes.lower()
+
+
+@dataclass
+class MapEntry:
+    """The footprint of one symbol, or of an input section without global symbols."""
+    name: str
+    object: str
+    section: str
+    flash: int
+    ram: int
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.name, self.object
+
+    @property
+    def archive(self) -> str:
+        """
+        The archive of the object, or the object itself if it is not an archive member.
+        """
+        if self.object.endswith(')') and '(' in self.object:
+            return self.object[:self.object.index('(')]
+        return self.object
+
+
+@dataclass
+class _OutputSection:
+    name: str
+    in_flash: bool
+    in_ram: bool
+
+
+def short_object_name(object_path: str) -> str:
+    """
+    Shorten the path to an object for display.
+
+    :param object_path: The object path as written in the map file.
+    :return: The file name of the object, including the archive member if any.
+    """
+    if not object_path:
+        return LINKER_OBJECT_NAME
+    if object_path.endswith(')') and '(' in object_path:
+        archive, member = object_path[:-1].split('(', 1)
+        return f'{Path(archive).name}({member})'
+    return Path(object_path).name
+
+
+class Footprint:
+    """
+    The footprint of a firmware, broken down by symbols and objects.
+    """
+
+    def __init__(self, entries: List[MapEntry]):
+        self.entries = entries
+
+    def by_symbol(self) -> List[MapEntry]:
+        """
+        All entries, sorted by size, the largest first.
+        """
+        return sorted(self.entries, key=lambda e: (-(e.flash + e.ram), e.name))
+
+    def _group(self, key) -> List[Tuple[str, int, int]]:
+        groups: Dict[str, List[int]] = {}
+        for entry in self.entries:
+            sizes = groups.setdefault(key(entry), [0, 0])
+            sizes[0] += entry.flash
+            sizes[1] += entry.ram
+        result = [(name, sizes[0], sizes[1]) for name, sizes in groups.items()]
+        result.sort(key=lambda g: (-(g[1] + g[2]), g[0]))
+        return result
+
+    def by_object(self) -> List[Tuple[str, int, int]]:
+        """
+        The flash and RAM size of each input object, the largest first.
+        """
+        return self._group(lambda e: e.object)
+
+    def by_archive(self) -> List[Tuple[str, int, int]]:
+        """
+        The flash and RAM size of each archive, the largest first.
+        """
+        return self._group(lambda e: e.archive)
+
+    def diff(self, previous: 'Footprint') -> List[Tuple[MapEntry, int, int]]:
+        """
+        Compare this footprint with a previous one.
+
+        :param previous: The footprint of the previous build.
+        :return: A list with the entry, flash delta and RAM delta of every changed symbol,
+            sorted by the absolute size of the change.
+        """
+        old_sizes = {}
+        for entry in previous.entries:
+            sizes = old_sizes.setdefault(entry.key, [0, 0, entry])
+            sizes[0] += entry.flash
+            sizes[1] += entry.ram
+        new_sizes = {}
+        for entry in self.entries:
+            sizes = new_sizes.setdefault(entry.key, [0, 0, entry])
+            sizes[0] += entry.flash
+            sizes[1] += entry.ram
+        changes = []
+        for key, (flash, ram, entry) in new_sizes.items():
+            old_flash, old_ram, _ = old_sizes.get(key, (0, 0, None))
+            if flash != old_flash or ram != old_ram:
+                changes.append((entry, flash - old_flash, ram - old_ram))
+        for key, (old_flash, old_ram, entry) in old_sizes.items():
+            if key not in new_sizes:
+                changes.append((entry, -old_flash, -old_ram))
+        changes.sort(key=lambda c: (-(abs(c[1]) + abs(c[2])), c[0].name))
+        return changes
+
+    def save(self, path: Union[str, Path]):
+        """
+        Save the footprint in a compact JSON file.
+
+        :param path: The path to the file.
+        """
+        data = [[e.name, e.object, e.section, e.flash, e.ram] for e in self.entries]
+        Path(path).write_text(json.dumps(data, separators=(',', ':')), 'utf-8')
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> Optional['Footprint']:
+        """
+        Load a footprint saved with `save()`.
+
+        :param path: The path to the file.
+        :return: The footprint, or None if there is no readable file.
+        """
+        try:
+            data = json.loads(Path(path).read_text('utf-8'))
+            return Footprint([MapEntry(*values) for values in data])
+        except (OSError, ValueError, TypeError):
+            return None
+
+
+def _is_hex(text: str) -> bool:
+    return text.startswith('0x')
+
+
+def _read_memory_regions(lines: Iterable[str]) -> List[MemoryRegion]:
+    regions = []
+    for line in lines:
+        if line.startswith('Linker script and memory map'):
+            break
+        parts = line.split()
+        if len(parts) >= 3 and _is_hex(parts[1]) and _is_hex(parts[2]) and parts[0] != '*default*':
+            regions.append(MemoryRegion(name=parts[0], origin=int(parts[1], 16), length=int(parts[2], 16),
+                                        attributes=parts[3] if len(parts) > 3 else ''))
+    return regions
+
+
+class _Parser:
+    def __init__(self, regions: List[MemoryRegion], alloc_sections: Optional[Dict[str, Tuple[bool, bool]]]):
+        self.regions = regions
+        self.alloc_sections = alloc_sections
+        self.entries: List[MapEntry] = []
+        self.output: Optional[_OutputSection] = None
+        self.input_name = ''
+        self.input_object = ''
+        self.input_address = 0
+        self.input_size = 0
+        self.symbols: List[Tuple[int, str]] = []
+
+    def region_for(self, address: int) -> Optional[MemoryRegion]:
+        for region in self.regions:
+            if region.contains(address):
+                return region
+        return None
+
+    def start_output(self, name: str, parts: List[str]):
+        self.finish_input()
+        self.output = None
+        if not parts or not _is_hex(parts[0]):
+            return
+        address = int(parts[0], 16)
+        if self.alloc_sections is not None:
+            if name not in self.alloc_sections:
+                return
+            in_flash, in_ram = self.alloc_sections[name]
+        else:
+            if name.startswith(NON_ALLOC_PREFIXES):
+                return
+            region = self.region_for(address)
+            if region is None:
+                return
+            in_ram = region.is_writable
+            in_flash = not in_ram
+            if 'load' in parts and _is_hex(parts[-1]):
+                load_region = self.region_for(int(parts[-1], 16))
+                in_flash = load_region is not None and not load_region.is_writable
+        self.output = _OutputSection(name=name, in_flash=in_flash, in_ram=in_ram)
+
+    def start_input(self, name: str, parts: List[str]):
+        self.finish_input()
+        if self.output is None or len(parts) < 2 or not _is_hex(parts[0]) or not _is_hex(parts[1]):
+            return
+        self.input_name = name
+        self.input_address = int(parts[0], 16)
+        self.input_size = int(parts[1], 16)
+        self.input_object = ' '.join(parts[2:])
+
+    def add_symbol(self, address: int, name: str):
+        if self.input_size:
+            self.symbols.append((address, name))
+
+    def add_entry(self, name: str, size: int):
+        output = self.output
+        self.entries.append(MapEntry(name=name,
+                                     object=self.input_object,
+                                     section=output.name,
+                                     flash=size if output.in_flash else 0,
+                                     ram=size if output.in_ram else 0))
+
+    def finish_input(self):
+        if not self.input_size:
+            return
+        end = self.input_address + self.input_size
+        if self.input_name == FILL_NAME:
+            self.add_entry(FILL_NAME, self.input_size)
+        elif not self.symbols:
+            self.add_entry(self.input_name, self.input_size)
+        else:
+            self.symbols.sort()
+            first_address = self.symbols[0][0]
+            if first_address > self.input_address:
+                self.add_entry(self.input_name, first_address - self.input_address)
+            for index, (address, name) in enumerate(self.symbols):
+                if index + 1 < len(self.symbols):
+                    next_address = self.symbols[index + 1][0]
+                else:
+                    next_address = end
+                self.add_entry(name, next_address - address)
+        self.input_size = 0
+        self.symbols = []
+
+    def parse(self, lines: Iterable[str]):
+        pending_output = ''
+        pending_input = ''
+        for line in lines:
+            if not line.strip():
+                continue
+            first = line[0]
+            if first == 'C' and line.startswith('Cross Reference Table'):
+                break
+            parts = line.split()
+            if first != ' ':
+                # An output section, or a linker statement like LOAD or OUTPUT.
+                pending_input = ''
+                if first != '.':
+                    self.finish_input()
+                    self.output = None
+                    pending_output = ''
+                elif len(parts) == 1:
+                    pending_output = parts[0]
+                    self.finish_input()
+                    self.output = None
+                else:
+                    pending_output = ''
+                    self.start_output(parts[0], parts[1:])
+                continue
+            if pending_output:
+                self.start_output(pending_output, parts)
+                pending_output = ''
+                continue
+            if line[1] != ' ':
+                # An input section, fill or an input section description.
+                if len(parts) == 1 and not parts[0].startswith(('*', 'KEEP(', 'SORT')):
+                    pending_input = parts[0]
+                    self.finish_input()
+                elif len(parts) >= 3 and _is_hex(parts[1]):
+                    pending_input = ''
+                    self.start_input(parts[0], parts[1:])
+                else:
+                    pending_input = ''
+                    self.finish_input()
+                continue
+            if pending_input:
+                self.start_input(pending_input, parts)
+                pending_input = ''
+                continue
+            # A symbol, an assignment or a data statement inside the current output section.
+            if len(parts) >= 3 and _is_hex(parts[0]) and _is_hex(parts[1]) and parts[2] in DATA_STATEMENTS:
+                self.finish_input()
+                if self.output is not None:
+                    self.input_object = ''
+                    self.add_entry(DATA_STATEMENT_NAME, int(parts[1], 16))
+            elif len(parts) >= 2 and _is_hex(parts[0]) and not _is_hex(parts[1]):
+                rest = line.split(None, 1)[1].strip()
+                if ' = ' in rest or rest.startswith(('PROVIDE', '. =', 'ASSERT')):
+                    continue
+                self.add_symbol(int(parts[0], 16), rest)
+        self.finish_input()
+
+
+def read_map_file(path: Union[str, Path],
+                  alloc_sections: Optional[Dict[str, Tuple[bool, bool]]] = None) -> Footprint:
+    """
+    Read the footprint from a map file written by the GNU linker.
+
+    The file is processed line by line. The cross reference table at the end of the
+    file is not read at all.
+
+    :param path: The path to the map file.
+    :param alloc_sections: An optional dictionary with all allocated output sections of the firmware,
+        mapping the section name to a tuple of two flags, whether the section uses flash and RAM.
+        If not set, the memory configuration from the map file is used.
+    :return: The footprint of the firmware.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace', buffering=1 << 20) as file:
+            lines = iter(file)
+            for line in lines:
+                if line.startswith('Memory Configuration'):
+                    break
+            regions = _read_memory_regions(lines)
+            parser = _Parser(regions, alloc_sections)
+            parser.parse(lines)
+    except OSError as e:
+        raise MapFileError(f'Could not read the map file: {e}')
+    return Footprint(parser.entries)
@@ -0,0 +1,248 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import fnmatch
+import json
+import os
+import re
+import sys
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+assert sys.version_info >= (3, 7)
+
+
+CMSIS_DIR = Path(__file__).parent/'cmsis'
+INDEX_CACHE_FILE = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'mcu-index.json'
+INDEX_FORMAT = 2
+
+RAM_DEFINES = ['HMCRAMC0', 'HSRAM', 'HRAMC0']
+LP_RAM_DEFINE = 'LPRAM'
+CPU_DEFINES = {
+    '__CM0PLUS_REV': 'cortex-m0plus',
+    '__CM0_REV': 'cortex-m0',
+}
+
+RE_DEFINE = re.compile(R'^\s*#define\s+(\w+)\s+(.*?)\s*(?:/\*.*)?$', re.MULTILINE)
+RE_NUMBER = re.compile(R'\b(0x[0-9a-fA-F]+|\d+)[uUlL]*\b')
+
+
+class McuDatabaseError(Exception):
+    """
+    Exception if the MCU database can not be created or a variant is unknown.
+    """
+    pass
+
+
+@dataclass
+class Variant:
+    """The memory map and core of one MCU variant."""
+    name: str
+    family: str
+    include_dir: str
+    cpu: str
+    flash_address: int
+    flash_size: int
+    flash_page_size: int
+    ram_address: int
+    ram_size: int
+    lp_ram_address: int = 0
+    lp_ram_size: int = 0
+
+
+@dataclass
+class Board:
+    """A board with a known MCU variant and boot loader."""
+    name: str
+    platform: str
+    variant: str
+    bootloader_size: int
+
+
+BOARDS = {
+    'feather-m0': Board(name='feather-m0', platform='feather-m0', variant='SAMD21G18A', bootloader_size=0x2000),
+}
+
+
+def _number(text: str) -> Optional[int]:
+    match = RE_NUMBER.search(text)
+    if not match:
+        return None
+    return int(match.group(1), 0)
+
+
+def read_variant(header: Path) -> Optional[Variant]:
+    """
+    Read the memory map and core type from the header of a variant.
+
+    :param header: The path to the header file, like `cmsis/samd21/include/samd21g18a.h`.
+    :return: The variant, or None if the header does not describe a variant with flash memory.
+    """
+    defines = {}
+    for name, value in RE_DEFINE.findall(header.read_text('utf-8', errors='replace')):
+        defines.setdefault(name, value)
+    if 'FLASH_SIZE' not in defines:
+        return None
+    cpu = ''
+    for define, cpu_name in CPU_DEFINES.items():
+        if define in defines:
+            cpu = cpu_name
+            break
+    ram_name = next((name for name in RAM_DEFINES if f'{name}_SIZE' in defines), None)
+    if not cpu or not ram_name:
+        return None
+    values = {}
+    for key, define in [('flash_address', 'FLASH_ADDR'), ('flash_size', 'FLASH_SIZE'),
+                        ('flash_page_size', 'FLASH_PAGE_SIZE'), ('ram_address', f'{ram_name}_ADDR'),
+                        ('ram_size', f'{ram_name}_SIZE')]:
+        value = _number(defines.get(define, ''))
+        if value is None:
+            return None
+        values[key] = value
+    # Some variants have a second, low power SRAM.
+    lp_ram_address = _number(defines.get(f'{LP_RAM_DEFINE}_ADDR', ''))
+    lp_ram_size = _number(defines.get(f'{LP_RAM_DEFINE}_SIZE', ''))
+    if lp_ram_address is not None and lp_ram_size:
+        values['lp_ram_address'] = lp_ram_address
+        values['lp_ram_size'] = lp_ram_size
+    return Variant(name=header.stem.upper(),
+                   family=header.parent.parent.name,
+                   include_dir=header.parent.name,
+                   cpu=cpu,
+                   **values)
+
+
+def variant_headers(cmsis_dir: Path) -> List[Path]:
+    """
+    List all candidate variant headers in the CMSIS directory.
+
+    :param cmsis_dir: The CMSIS directory with one subdirectory for each family.
+    :return: A sorted list of header paths.
+    """
+    headers = []
+    for header in cmsis_dir.glob('*/include*/*.h'):
+        if header.stem.startswith(header.parent.parent.name) and header.stem != header.parent.parent.name:
+            headers.append(header)
+    return sorted(headers)
+
+
+def _signature(headers: List[Path]) -> List[List]:
+    signature = []
+    for header in headers:
+        stat = header.stat()
+        signature.append([str(header), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def build_index(cmsis_dir: Path = CMSIS_DIR) -> Dict[str, Variant]:
+    """
+    Create the index of all variants by reading the headers.
+
+    :param cmsis_dir: The CMSIS directory.
+    :return: A dictionary with the upper case variant name as key.
+    """
+    index = {}
+    for header in variant_headers(cmsis_dir):
+        variant = read_variant(header)
+        if variant:
+            index[variant.name] = variant
+    return index
+
+
+def load_index(cmsis_dir: Path = CMSIS_DIR, cache_file: Optional[Path] = INDEX_CACHE_FILE) -> Dict[str, Variant]:
+    """
+    Load the index of all variants.
+
+    The index is cached. The headers are only read again if a header was added, removed or modified.
+
+    :param cmsis_dir: The CMSIS directory.
+    :param cache_file: The path to the cache file, or None to disable the cache.
+    :return: A dictionary with the upper case variant name as key.
+    """
+    cmsis_dir = cmsis_dir.resolve()
+    signature = _signature(variant_headers(cmsis_dir))
+    if cache_file:
+        try:
+            data = json.loads(cache_file.read_text('utf-8'))
+            if data.get('format') == INDEX_FORMAT and data.get('signature') == signature:
+                return {name: Variant(**values) for name, values in data['variants'].items()}
+        except (OSError, ValueError, TypeError, KeyError):
+            pass
+    index = build_index(cmsis_dir)
+    if not index:
+        raise McuDatabaseError(f'Found no MCU variants in: {cmsis_dir}')
+    if cache_file:
+        data = {'format': INDEX_FORMAT,
+                'signature': signature,
+                'variants': {name: asdict(variant) for name, variant in index.items()}}
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+            temp_path.write_text(json.dumps(data, separators=(',', ':')), 'utf-8')
+            temp_path.replace(cache_file)
+        except OSError:
+            pass
+    return index
+
+
+def find_variants(index: Dict[str, Variant], patterns: List[str]) -> List[Variant]:
+    """
+    Find variants by name or by shell pattern.
+
+    A pattern can also be the name of a family, like `samd21`, to select all variants of this family.
+
+    :param index: The index of all variants.
+    :param patterns: A list of names or patterns, like `SAMD21G18A` or `samd21*`.
+    :return: The matching variants, sorted by name.
+    """
+    result = {}
+    for pattern in patterns:
+        pattern = pattern.upper()
+        matches = [v for v in index.values() if fnmatch.fnmatchcase(v.name, pattern) or v.family.upper() == pattern]
+        if not matches:
+            raise McuDatabaseError(f'Unknown MCU variant: {pattern}')
+        for variant in matches:
+            result[variant.name] = variant
+    return [result[name] for name in sorted(result)]
+
+
+def find_families(patterns: List[str], cmsis_dir: Path = CMSIS_DIR) -> List[str]:
+    """
+    Find the families in the CMSIS directory matching names or shell patterns.
+
+    Unlike `find_variants`, this also finds families without any variant in the index, like `samb11`.
+
+    :param patterns: A list of names or patterns, like `samd21` or `sam*`.
+    :param cmsis_dir: The CMSIS directory.
+    :return: The matching family names, sorted.
+    """
+    families = sorted(path.name for path in cmsis_dir.iterdir() if path.is_dir())
+    return [family for family in families
+            if any(fnmatch.fnmatchcase(family.upper(), pattern.upper()) for pattern in patterns)]
+
+
+def print_variants(variants: List[Variant]):
+    """
+    Print a table with the variants.
+
+    :param variants: The variants to print.
+    """
+    print('Variant          Family  CPU             Flash       RAM')
+    for v in variants:
+        print(f'{v.name:<16} {v.family:<7} {v.cpu:<15} {v.flash_size // 1024:>5} kB  {v.ram_size // 1024:>5} kB')
@@ -0,0 +1,72 @@
+#pragma once
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+
+#include <stdbool.h>
+
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+
+/// Check if the main clock is locked to the XOSC32K crystal.
+///
+/// With a fast boot clock, selected with `-DHAL_BOOT_CLOCK=dfll` or `-DHAL_BOOT_CLOCK=osc8m`,
+/// `main()` is called before the crystal is ready. The DFLL48M is locked to the crystal in the
+/// `SYSCTRL` exception, then the main clock runs at exactly 48MHz. Without a fast boot clock,
+/// the clock is always locked.
+///
+/// Until the lock, the generator 0 and the CPU do not run at `F_CPU`:
+///
+/// - `dfll`: The frequency is close to 48MHz, but not exact.
+/// - `osc8m`: The frequency is 8MHz, six times slower than `F_CPU`. At the lock, the source of
+///   the generator 0 is switched to the DFLL48M, also for all peripherals which already use it.
+///
+/// So baud rates, timers and delays based on `F_CPU` or the generator 0 are wrong until the lock.
+/// Call `BootClock_waitForLock()` before configuring them, or configure them again in
+/// `BootClock_onLock()`. Only the SysTick exception is adjusted, it stays at 1kHz.
+///
+/// @return `true` if the main clock is locked, `false` while it is still starting.
+///
+bool BootClock_isLocked(void);
+
+/// Wait until the main clock is locked to the XOSC32K crystal.
+///
+/// Call this function before using the USB, the generator 0 or 1, or for exact timings.
+/// The interrupts have to be enabled.
+///
+void BootClock_waitForLock(void);
+
+/// Called from the `SYSCTRL` exception, right after the main clock is locked.
+///
+/// Implement this function in the firmware, to configure peripherals for the final clock.
+/// It is only called with a fast boot clock. The default implementation does nothing.
+///
+/// With a fast boot clock, the `SYSCTRL` exception is handled by the toolchain. A
+/// `SYSCTRL_Handler` of the firmware is still called, for all interrupts it enabled itself.
+///
+void BootClock_onLock(void);
+
+
+#ifdef __cplusplus
+}
+#endif
+
@@ -0,0 +1,74 @@
+#pragma once
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+#include <stdbool.h>
+#include <stdint.h>
+
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+
+/// The reload value of the SysTick timer while the boot time is measured.
+///
+#define BOOT_TIME_SYSTICK_RELOAD 0x00ffffffu
+
+
+/// The SysTick ticks measured from the first instruction of the reset handler.
+///
+/// The ticks are CPU cycles. Until `SystemInit()` switches to the boot clock,
+/// the CPU runs at 1MHz from the OSC8M oscillator, afterwards at the frequency of the boot clock.
+/// Only available if the firmware is built with `-DHAL_BOOT_TIME=ON`.
+///
+typedef struct {
+    uint32_t memoryInitTicks; ///< The ticks until all sections of the copy and zero table are initialized.
+    uint32_t clockSwitchTicks; ///< The ticks until `SystemInit()` switched from the reset clock to the boot clock.
+    uint32_t systemInitTicks; ///< The ticks until `SystemInit()` configured the clocks, right before `main()`.
+    uint32_t bootClockFrequency; ///< The nominal frequency of the boot clock in Hz.
+    bool overflow; ///< If the timer overflowed and the values are not valid.
+} BootTime;
+
+
+/// The measured boot time.
+///
+extern BootTime gBootTime;
+
+
+/// Get the time from the reset until `main()`.
+///
+/// The open loop DFLL48M of the `dfll` boot clock is not exact, so the time is an estimate for this clock.
+///
+/// @return The time in microseconds, or zero if the timer overflowed.
+///
+static inline uint32_t BootTime_mainMicroseconds(void)
+{
+    if (gBootTime.overflow || gBootTime.bootClockFrequency < 1000000u) {
+        return 0;
+    }
+    const uint32_t bootClockTicks = gBootTime.systemInitTicks - gBootTime.clockSwitchTicks;
+    return gBootTime.clockSwitchTicks + bootClockTicks / (gBootTime.bootClockFrequency / 1000000u);
+}
+
+
+#ifdef __cplusplus
+}
+#endif
+
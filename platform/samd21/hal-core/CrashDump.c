@@ -0,0 +1,179 @@
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+#ifdef HAL_CRASH_DUMP
+
+
+#include "CrashDump.h"
+
+#include "Chip.hpp"
+#include "RamCode.h"
+
+
+/// The crash dump, which keeps its value across the reset.
+///
+HAL_NO_INIT static CrashDump gCrashDump;
+
+/// The build ID note, placed in the flash by the linker script.
+///
+extern const uint8_t __build_id_start__[];
+extern const uint8_t __build_id_end__[];
+
+
+/// Calculate the checksum of the crash dump.
+///
+static uint32_t calculateChecksum(const CrashDump *dump)
+{
+    const uint32_t *words = (const uint32_t*)dump;
+    uint32_t sum = 0;
+    for (uint32_t i = 2; i < sizeof(CrashDump) / sizeof(uint32_t); ++i) {
+        sum += words[i];
+    }
+    return ~sum;
+}
+
+
+/// Save the crash dump and reset the chip.
+///
+/// @param frame The exception frame with r0-r3, r12, lr, pc and xPSR.
+/// @param excReturn The EXC_RETURN value of the exception.
+/// @param saved The registers r8-r11 and r4-r7, pushed by the handler.
+///
+__attribute__((used, noreturn))
+void CrashDump_save(const uint32_t *frame, uint32_t excReturn, const uint32_t *saved)
+{
+    CrashDump * const dump = &gCrashDump;
+    dump->magic = 0;
+    // The note starts with the name size, description size, type and the name "GNU".
+    const uint32_t noteSize = (uint32_t)(__build_id_end__ - __build_id_start__);
+    for (uint32_t i = 0; i < HAL_CRASH_DUMP_BUILD_ID_SIZE; ++i) {
+        dump->buildId[i] = (16u + i < noteSize) ? __build_id_start__[16u + i] : 0;
+    }
+    for (uint32_t i = 0; i < 4; ++i) {
+        dump->registers[4 + i] = saved[4 + i];
+        dump->registers[8 + i] = saved[i];
+    }
+    const uint32_t frameAddress = (uint32_t)(uintptr_t)frame;
+    const bool isFrameValid = (frameAddress & 3u) == 0 && frameAddress >= HMCRAMC0_ADDR &&
+        frameAddress + 32u <= HMCRAMC0_ADDR + HMCRAMC0_SIZE;
+    if (isFrameValid) {
+        for (uint32_t i = 0; i < 4; ++i) {
+            dump->registers[i] = frame[i];
+        }
+        dump->registers[12] = frame[4];
+        dump->registers[14] = frame[5];
+        dump->registers[15] = frame[6];
+        dump->xpsr = frame[7];
+        // The stack was aligned to 8 bytes on exception entry, if bit 9 of the stacked xPSR is set.
+        uint32_t stackPointer = frameAddress + 32u + ((frame[7] & (1u << 9)) != 0 ? 4u : 0u);
+        dump->registers[13] = stackPointer;
+        uint32_t count = (HMCRAMC0_ADDR + HMCRAMC0_SIZE - stackPointer) / 4u;
+        if (count > HAL_CRASH_DUMP_STACK_WORDS) {
+            count = HAL_CRASH_DUMP_STACK_WORDS;
+        }
+        const uint32_t *stack = (const uint32_t*)(uintptr_t)stackPointer;
+        for (uint32_t i = 0; i < count; ++i) {
+            dump->stack[i] = stack[i];
+        }
+        dump->stackSize = count;
+    } else {
+        // The stack pointer is corrupt, only the pushed registers are known.
+        for (uint32_t i = 0; i < 4; ++i) {
+            dump->registers[i] = 0;
+        }
+        dump->registers[12] = 0;
+        dump->registers[13] = frameAddress;
+        dump->registers[14] = 0;
+        dump->registers[15] = 0;
+        dump->xpsr = 0;
+        dump->stackSize = 0;
+    }
+    for (uint32_t i = dump->stackSize; i < HAL_CRASH_DUMP_STACK_WORDS; ++i) {
+        dump->stack[i] = 0;
+    }
+    dump->excReturn = excReturn;
+    dump->checksum = calculateChecksum(dump);
+    dump->magic = HAL_CRASH_DUMP_MAGIC;
+    NVIC_SystemReset();
+}
+
+
+/// The HardFault handler used if crash dumps are enabled.
+///
+/// It replaces the weak default handler. The exception frame is on the process or main stack,
+/// depending on bit 2 of the EXC_RETURN value in LR. The registers r4-r11 are pushed on the
+/// current stack, to pass them to `CrashDump_save()`.
+///
+__attribute__((naked))
+void HardFault_Handler(void)
+{
+    __asm volatile (
+        "movs r0, #4\n"
+        "mov r1, lr\n"
+        "tst r0, r1\n"
+        "beq 1f\n"
+        "mrs r0, psp\n"
+        "b 2f\n"
+        "1:\n"
+        "mrs r0, msp\n"
+        "2:\n"
+        "push {r4-r7}\n"
+        "mov r4, r8\n"
+        "mov r5, r9\n"
+        "mov r6, r10\n"
+        "mov r7, r11\n"
+        "push {r4-r7}\n"
+        "mov r2, sp\n"
+        "bl CrashDump_save\n"
+    );
+}
+
+
+bool CrashDump_isAvailable(void)
+{
+    return gCrashDump.magic == HAL_CRASH_DUMP_MAGIC && gCrashDump.checksum == calculateChecksum(&gCrashDump);
+}
+
+
+uint32_t CrashDump_writeFrame(uint8_t *buffer, uint32_t size)
+{
+    if (!CrashDump_isAvailable() || size < HAL_FRAME_HEADER_SIZE + sizeof(CrashDump)) {
+        return 0;
+    }
+    const uint32_t payloadSize = sizeof(CrashDump);
+    buffer[0] = HAL_FRAME_SYNC;
+    buffer[1] = HAL_FRAME_TYPE_CRASH_DUMP;
+    buffer[2] = (uint8_t)payloadSize;
+    buffer[3] = (uint8_t)(payloadSize >> 8);
+    const uint8_t *data = (const uint8_t*)&gCrashDump;
+    for (uint32_t i = 0; i < payloadSize; ++i) {
+        buffer[HAL_FRAME_HEADER_SIZE + i] = data[i];
+    }
+    return HAL_FRAME_HEADER_SIZE + payloadSize;
+}
+
+
+void CrashDump_clear(void)
+{
+    gCrashDump.magic = 0;
+}
+
+
+#endif
+
@@ -0,0 +1,90 @@
+#pragma once
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+#include "Frame.h"
+
+#include <stdbool.h>
+#include <stdint.h>
+
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+
+/// The number of stack words saved in a crash dump.
+///
+#ifndef HAL_CRASH_DUMP_STACK_WORDS
+#define HAL_CRASH_DUMP_STACK_WORDS 64
+#endif
+
+/// The magic value of a valid crash dump, which also identifies the layout of the structure.
+///
+#define HAL_CRASH_DUMP_MAGIC 0x31504443u
+
+/// The size of the build ID in a crash dump.
+///
+#define HAL_CRASH_DUMP_BUILD_ID_SIZE 20
+
+/// The registers and the stack saved by the HardFault handler.
+///
+/// The dump is placed in the `.noinit` section and survives the reset after the fault.
+///
+typedef struct {
+    uint32_t magic; ///< The magic value `HAL_CRASH_DUMP_MAGIC`.
+    uint32_t checksum; ///< The complement of the sum of all following words.
+    uint8_t buildId[HAL_CRASH_DUMP_BUILD_ID_SIZE]; ///< The start of the GNU build ID of the firmware.
+    uint32_t registers[16]; ///< The registers r0-r12, sp, lr and pc at the fault.
+    uint32_t xpsr; ///< The program status register at the fault.
+    uint32_t excReturn; ///< The EXC_RETURN value of the HardFault exception.
+    uint32_t stackSize; ///< The number of valid words in `stack`.
+    uint32_t stack[HAL_CRASH_DUMP_STACK_WORDS]; ///< The stack, starting at the stack pointer of the fault.
+} CrashDump;
+
+
+/// Check if there is a crash dump from the last reset.
+///
+/// The firmware saves a crash dump in the HardFault exception and resets the chip, only if
+/// it is built with `-DHAL_CRASH_DUMP=ON`. After a power loss, there is no valid dump.
+///
+/// @return True if there is a valid crash dump.
+///
+bool CrashDump_isAvailable(void);
+
+/// Write the crash dump into a frame, to send it to the host.
+///
+/// Call this function after the start, once the serial interface is ready, and send the frame.
+/// Use `crashdump.py` on the host to read the frame and to symbolize the dump.
+///
+/// @param buffer The buffer for the frame.
+/// @param size The size of the buffer, at least `HAL_FRAME_HEADER_SIZE + sizeof(CrashDump)` bytes.
+/// @return The size of the frame, or zero if there is no crash dump.
+///
+uint32_t CrashDump_writeFrame(uint8_t *buffer, uint32_t size);
+
+/// Clear the crash dump, after it was sent to the host.
+///
+void CrashDump_clear(void);
+
+
+#ifdef __cplusplus
+}
+#endif
+
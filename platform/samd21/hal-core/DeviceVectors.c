@@ -22,6 +22,14 @@
 #include "Segments.h"
 
 
+#ifdef HAL_PROFILER
+void Profiler_SysTick_Handler(void);
+#endif
+#if defined(HAL_BOOT_CLOCK_DFLL) || defined(HAL_BOOT_CLOCK_OSC8M)
+void BootClock_SYSCTRL_Handler(void);
+#endif
+
+
 /// The device vectors.
 ///
 __attribute__((section(".isr_vector"),used))
@@ -41,9 +49,17 @@ const DeviceVectors exception_table = {
     (void *) (0UL),
     (void *) (0UL),
     (void *) PendSV_Handler,
+#ifdef HAL_PROFILER
+    (void *) Profiler_SysTick_Handler, // Samples the interrupted code and calls SysTick_Handler.
+#else
     (void *) SysTick_Handler,
+#endif
     (void *) PM_Handler,
+#if defined(HAL_BOOT_CLOCK_DFLL) || defined(HAL_BOOT_CLOCK_OSC8M)
+    (void *) BootClock_SYSCTRL_Handler, // Finishes the clock configuration and calls SYSCTRL_Handler.
+#else
     (void *) SYSCTRL_Handler,
+#endif
     (void *) WDT_Handler,
     (void *) RTC_Handler,
     (void *) EIC_Handler,
@@ -0,0 +1,49 @@
+#pragma once
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+// The frames sent by the firmware to the host over the serial interface.
+// Each frame starts with a header: the sync byte, the frame type and the size of the
+// payload as 16-bit little endian value. See `frames.py` for the decoder on the host.
+
+
+/// The first byte of each frame sent to the host.
+///
+#define HAL_FRAME_SYNC 0xa5u
+
+/// The type of a frame with profiler samples.
+///
+#define HAL_FRAME_TYPE_PROFILER 0x50u
+
+/// The type of a frame with a log record.
+///
+#define HAL_FRAME_TYPE_LOG 0x4cu
+
+/// The type of a frame with a crash dump.
+///
+#define HAL_FRAME_TYPE_CRASH_DUMP 0x43u
+
+/// The size of the frame header.
+///
+#define HAL_FRAME_HEADER_SIZE 4u
+
+/// The maximum size of the payload, larger frames are dropped by `frames.py`.
+///
+#define HAL_FRAME_MAX_PAYLOAD 4096u
+
@@ -0,0 +1,122 @@
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+#include "Chip.hpp"
+#include "Log.h"
+
+#include <stdarg.h>
+
+
+_Static_assert((HAL_LOG_BUFFER_SIZE & (HAL_LOG_BUFFER_SIZE - 1)) == 0, "HAL_LOG_BUFFER_SIZE must be a power of two.");
+
+
+/// The ring buffer with the frames.
+///
+static uint8_t gBuffer[HAL_LOG_BUFFER_SIZE];
+
+/// The number of bytes written into the ring buffer.
+///
+static volatile uint32_t gWriteCount = 0;
+
+/// The number of bytes read from the ring buffer.
+///
+static volatile uint32_t gReadCount = 0;
+
+/// The number of records dropped since the last record was written.
+///
+static volatile uint32_t gDroppedCount = 0;
+
+
+/// Write the frame of one record into the ring buffer.
+///
+/// The caller has to disable the interrupts and check the free space.
+///
+/// @return The new write count.
+///
+static uint32_t writeRecord(uint32_t writeCount, uint16_t formatId, const uint32_t *values, uint32_t valueCount)
+{
+    const uint32_t payloadSize = 2u + valueCount * 4u;
+    uint8_t header[HAL_FRAME_HEADER_SIZE + 2u];
+    header[0] = HAL_FRAME_SYNC;
+    header[1] = HAL_FRAME_TYPE_LOG;
+    header[2] = (uint8_t)payloadSize;
+    header[3] = (uint8_t)(payloadSize >> 8);
+    header[4] = (uint8_t)formatId;
+    header[5] = (uint8_t)(formatId >> 8);
+    for (uint32_t i = 0; i < sizeof(header); ++i) {
+        gBuffer[(writeCount++) & (HAL_LOG_BUFFER_SIZE - 1)] = header[i];
+    }
+    for (uint32_t index = 0; index < valueCount; ++index) {
+        const uint32_t value = values[index];
+        for (uint32_t i = 0; i < 4; ++i) {
+            gBuffer[(writeCount++) & (HAL_LOG_BUFFER_SIZE - 1)] = (uint8_t)(value >> (i * 8));
+        }
+    }
+    return writeCount;
+}
+
+
+void Log_write(const char *format, uint32_t argumentCount, ...)
+{
+    if (argumentCount > HAL_LOG_MAX_ARGUMENTS) {
+        argumentCount = HAL_LOG_MAX_ARGUMENTS;
+    }
+    uint32_t values[HAL_LOG_MAX_ARGUMENTS];
+    va_list arguments;
+    va_start(arguments, argumentCount);
+    for (uint32_t index = 0; index < argumentCount; ++index) {
+        values[index] = va_arg(arguments, uint32_t);
+    }
+    va_end(arguments);
+    const uint32_t recordSize = HAL_FRAME_HEADER_SIZE + 2u + argumentCount * 4u;
+    const uint32_t droppedRecordSize = HAL_FRAME_HEADER_SIZE + 2u + 4u;
+    const uint32_t primask = __get_PRIMASK();
+    __disable_irq();
+    uint32_t writeCount = gWriteCount;
+    const uint32_t freeSize = HAL_LOG_BUFFER_SIZE - (writeCount - gReadCount);
+    const uint32_t droppedCount = gDroppedCount;
+    if (recordSize + (droppedCount != 0 ? droppedRecordSize : 0u) > freeSize) {
+        gDroppedCount = droppedCount + 1;
+    } else {
+        if (droppedCount != 0) {
+            writeCount = writeRecord(writeCount, HAL_LOG_DROPPED_ID, &droppedCount, 1);
+            gDroppedCount = 0;
+        }
+        writeCount = writeRecord(writeCount, (uint16_t)(uintptr_t)format, values, argumentCount);
+        gWriteCount = writeCount;
+    }
+    __set_PRIMASK(primask);
+}
+
+
+uint32_t Log_read(uint8_t *buffer, uint32_t size)
+{
+    const uint32_t readCount = gReadCount;
+    uint32_t count = gWriteCount - readCount;
+    if (count > size) {
+        count = size;
+    }
+    for (uint32_t i = 0; i < count; ++i) {
+        buffer[i] = gBuffer[(readCount + i) & (HAL_LOG_BUFFER_SIZE - 1)];
+    }
+    // Release the space only after the data was copied.
+    gReadCount = readCount + count;
+    return count;
+}
+
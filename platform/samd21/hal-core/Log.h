@@ -0,0 +1,108 @@
+#pragma once
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+#include "Frame.h"
+
+#include <stdint.h>
+
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+
+/// The size of the ring buffer for the log records, a power of two.
+///
+#ifndef HAL_LOG_BUFFER_SIZE
+#define HAL_LOG_BUFFER_SIZE 512
+#endif
+
+/// The format ID of the record written after records were dropped.
+///
+#define HAL_LOG_DROPPED_ID 0xffffu
+
+/// The maximum number of arguments for one log record.
+///
+#define HAL_LOG_MAX_ARGUMENTS 8
+
+
+/// Write a log record with deferred formatting.
+///
+/// The format string is placed in the `.hal_log` section, which is not loaded into the flash.
+/// The record contains only the address of the format string in this section, as 16-bit ID,
+/// and the raw arguments. The host expands the records using the format strings from the
+/// firmware ELF file, with `upload.py --monitor`.
+///
+/// All arguments must be 32-bit integers or pointers, use `Log_float()` for float values.
+/// Use `%s` only for string constants, which the host reads from the firmware file.
+///
+/// ```
+/// HAL_LOG("ADC channel %u: %d mV, gain %f", channel, value, Log_float(gain));
+/// ```
+///
+#define HAL_LOG(format, ...) \
+    do { \
+        static const char halLogFormat[] __attribute__((section(".hal_log"), used)) = format; \
+        Log_write(halLogFormat, HAL_LOG_COUNT(__VA_ARGS__), ##__VA_ARGS__); \
+    } while (0)
+
+// Count the arguments of the macro.
+#define HAL_LOG_COUNT(...) HAL_LOG_COUNT_(0, ##__VA_ARGS__, 8, 7, 6, 5, 4, 3, 2, 1, 0)
+#define HAL_LOG_COUNT_(_0, _1, _2, _3, _4, _5, _6, _7, _8, count, ...) count
+
+
+/// Write a log record, use the `HAL_LOG` macro instead.
+///
+/// It is safe to call this function from interrupts. If the ring buffer is full, the record is
+/// dropped, and the number of dropped records is sent with the next record.
+///
+/// @param format The format string in the `.hal_log` section.
+/// @param argumentCount The number of 32-bit arguments.
+///
+void Log_write(const char *format, uint32_t argumentCount, ...);
+
+/// Convert a float value into a log argument.
+///
+/// @param value The float value.
+/// @return The bits of the value.
+///
+static inline uint32_t Log_float(float value)
+{
+    union { float f; uint32_t u; } converter;
+    converter.f = value;
+    return converter.u;
+}
+
+/// Read the frames of the log records, to send them to the host.
+///
+/// Call this function regularly from the main loop and send the data using the serial
+/// interface. Frames can be split between two calls.
+///
+/// @param buffer The buffer for the data.
+/// @param size The size of the buffer.
+/// @return The number of bytes written to the buffer.
+///
+uint32_t Log_read(uint8_t *buffer, uint32_t size);
+
+
+#ifdef __cplusplus
+}
+#endif
+
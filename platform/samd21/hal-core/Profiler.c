@@ -0,0 +1,133 @@
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+#ifdef HAL_PROFILER
+
+
+#include "Profiler.h"
+
+
+_Static_assert((HAL_PROFILER_SAMPLES & (HAL_PROFILER_SAMPLES - 1)) == 0, "HAL_PROFILER_SAMPLES must be a power of two.");
+_Static_assert(HAL_PROFILER_FRAME_SAMPLES * sizeof(ProfilerSample) + 4u <= HAL_FRAME_MAX_PAYLOAD,
+    "The samples of one frame must fit into the maximum payload.");
+
+
+/// The ring buffer with the samples.
+///
+static ProfilerSample gSamples[HAL_PROFILER_SAMPLES];
+
+/// The number of samples written by the SysTick exception.
+///
+static volatile uint32_t gWriteCount = 0;
+
+/// The number of samples read by `Profiler_writeFrame()`.
+///
+static volatile uint32_t gReadCount = 0;
+
+/// The number of samples dropped, because the ring buffer was full.
+///
+static volatile uint32_t gDroppedCount = 0;
+
+
+/// Record one sample from the exception frame of the interrupted code.
+///
+/// @param frame The exception frame with r0-r3, r12, lr, pc and xPSR.
+///
+__attribute__((used))
+void Profiler_recordSample(const uint32_t *frame)
+{
+    const uint32_t writeCount = gWriteCount;
+    if (writeCount - gReadCount >= HAL_PROFILER_SAMPLES) {
+        gDroppedCount = gDroppedCount + 1;
+        return;
+    }
+    ProfilerSample * const sample = &gSamples[writeCount & (HAL_PROFILER_SAMPLES - 1)];
+    sample->pc = frame[6];
+    sample->lr = frame[5];
+    gWriteCount = writeCount + 1;
+}
+
+
+/// The SysTick handler used if the profiler is enabled.
+///
+/// It records the sample and calls the SysTick handler of the firmware. The exception frame
+/// is on the process or main stack, depending on bit 2 of the EXC_RETURN value in LR.
+///
+__attribute__((naked))
+void Profiler_SysTick_Handler(void)
+{
+    __asm volatile (
+        "movs r0, #4\n"
+        "mov r1, lr\n"
+        "tst r0, r1\n"
+        "beq 1f\n"
+        "mrs r0, psp\n"
+        "b 2f\n"
+        "1:\n"
+        "mrs r0, msp\n"
+        "2:\n"
+        "push {r4, lr}\n"
+        "bl Profiler_recordSample\n"
+        "bl SysTick_Handler\n"
+        "pop {r4, pc}\n"
+    );
+}
+
+
+uint32_t Profiler_writeFrame(uint8_t *buffer, uint32_t size)
+{
+    const uint32_t readCount = gReadCount;
+    uint32_t count = gWriteCount - readCount;
+    if (count == 0 || size < HAL_FRAME_HEADER_SIZE + 4u + sizeof(ProfilerSample)) {
+        return 0;
+    }
+    uint32_t maximumCount = (size - HAL_FRAME_HEADER_SIZE - 4u) / sizeof(ProfilerSample);
+    if (maximumCount > HAL_PROFILER_FRAME_SAMPLES) {
+        maximumCount = HAL_PROFILER_FRAME_SAMPLES;
+    }
+    if (count > maximumCount) {
+        count = maximumCount;
+    }
+    const uint32_t payloadSize = 4u + count * sizeof(ProfilerSample);
+    buffer[0] = HAL_FRAME_SYNC;
+    buffer[1] = HAL_FRAME_TYPE_PROFILER;
+    buffer[2] = (uint8_t)payloadSize;
+    buffer[3] = (uint8_t)(payloadSize >> 8);
+    uint8_t *data = buffer + HAL_FRAME_HEADER_SIZE;
+    const uint32_t droppedCount = gDroppedCount;
+    for (uint32_t i = 0; i < 4; ++i) {
+        *data++ = (uint8_t)(droppedCount >> (i * 8));
+    }
+    for (uint32_t index = 0; index < count; ++index) {
+        const ProfilerSample * const sample = &gSamples[(readCount + index) & (HAL_PROFILER_SAMPLES - 1)];
+        for (uint32_t i = 0; i < 4; ++i) {
+            *data++ = (uint8_t)(sample->pc >> (i * 8));
+        }
+        for (uint32_t i = 0; i < 4; ++i) {
+            *data++ = (uint8_t)(sample->lr >> (i * 8));
+        }
+    }
+    // Release the samples only after they were copied.
+    gReadCount = readCount + count;
+    return HAL_FRAME_HEADER_SIZE + payloadSize;
+}
+
+
+#endif
+
@@ -0,0 +1,70 @@
+#pragma once
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+#include "Frame.h"
+
+#include <stdint.h>
+
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+
+/// The number of samples in the ring buffer of the profiler, a power of two.
+///
+#ifndef HAL_PROFILER_SAMPLES
+#define HAL_PROFILER_SAMPLES 64
+#endif
+
+/// The maximum number of samples in one frame.
+///
+#define HAL_PROFILER_FRAME_SAMPLES ((HAL_FRAME_MAX_PAYLOAD - 4u) / 8u)
+
+/// One sample of the profiler.
+///
+typedef struct {
+    uint32_t pc; ///< The interrupted program counter.
+    uint32_t lr; ///< The link register of the interrupted code, usually pointing into the caller.
+} ProfilerSample;
+
+
+/// Write the recorded samples into a frame, to send it to the host.
+///
+/// The profiler samples the interrupted code in the SysTick exception, only if the firmware
+/// is built with `-DHAL_PROFILER=ON`. Call this function regularly from the main loop and
+/// send the frame using the serial interface. Use `profiler.py` on the host to read the frames.
+///
+/// The payload of the frame contains the number of dropped samples since the start as 32-bit
+/// value, followed by the samples. All values are little endian.
+/// A frame holds at most `HAL_PROFILER_FRAME_SAMPLES` samples, to stay within the maximum payload
+/// accepted by the host. Call this function again until it returns zero, to send all samples.
+///
+/// @param buffer The buffer for the frame.
+/// @param size The size of the buffer, at least `HAL_FRAME_HEADER_SIZE + 12` bytes.
+/// @return The size of the frame, or zero if there are no new samples.
+///
+uint32_t Profiler_writeFrame(uint8_t *buffer, uint32_t size);
+
+
+#ifdef __cplusplus
+}
+#endif
+
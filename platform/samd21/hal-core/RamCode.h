@@ -0,0 +1,55 @@
+#pragma once
+//
+// (c)2019 by Lucky Resistor. See LICENSE for details.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License along
+// with this program; if not, write to the Free Software Foundation, Inc.,
+// 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+//
+
+
+/// Place a function in the RAM, to execute it without flash wait states.
+///
+/// The function is copied from the flash into the RAM at reset. It is never inlined into
+/// code in the flash, and calls to it use a long call, because the RAM is out of the
+/// range of a direct branch from the flash. Use the macro for the declaration and the
+/// definition of the function:
+///
+/// ```
+/// HAL_RAM_FUNCTION void processSamples(const int16_t *samples, uint32_t count);
+/// ```
+///
+#define HAL_RAM_FUNCTION __attribute__((section(".ramfunc"), noinline, long_call))
+
+/// Place a constant table in the RAM, next to the functions using it.
+///
+/// Reading a table from the RAM avoids the flash wait states for each access.
+///
+/// ```
+/// HAL_RAM_TABLE const uint16_t cSineTable[256] = {...};
+/// ```
+///
+#define HAL_RAM_TABLE __attribute__((section(".ramfunc.table")))
+
+/// Place a variable in the `.noinit` section, which is neither initialized nor cleared at reset.
+///
+/// The variable keeps its value across resets, as long as the device is powered. If the
+/// firmware is built with `-DHAL_NOINIT_SIZE=<size>`, these variables are placed in a region
+/// at the end of the RAM, so their address does not change between builds.
+///
+/// ```
+/// HAL_NO_INIT uint32_t gResetCount;
+/// ```
+///
+#define HAL_NO_INIT __attribute__((section(".noinit")))
+
@@ -20,35 +20,103 @@
 #include "Chip.hpp"
 #include "CoreFunctions.h"
 #include "Segments.h"
+#ifdef HAL_BOOT_TIME
+#include "BootTime.h"
+#endif
 
 #include <stdint.h>
 
 
+// Prevent GCC from replacing the loops with calls to `memcpy` and `memset`,
+// which are not ready to use before the sections are initialized.
+#define RESET_CODE __attribute__((optimize("no-tree-loop-distribute-patterns")))
+
+
+#ifdef HAL_BOOT_TIME
+BootTime gBootTime;
+#endif
+
+
+/// Copy a section word by word, four words in each iteration.
+///
+/// @param source The source address, aligned to 4 bytes.
+/// @param destination The destination address, aligned to 4 bytes.
+/// @param size The size in bytes, a multiple of 4.
+///
+RESET_CODE __attribute__((always_inline))
+static inline void copyWords(const uint32_t *source, uint32_t *destination, uint32_t size)
+{
+    uint32_t * const end = destination + (size >> 2);
+    uint32_t * const blockEnd = destination + ((size >> 4) << 2);
+    while (destination < blockEnd) {
+        // Loading all four words first allows the compiler to use `ldm` and `stm`.
+        const uint32_t a = source[0];
+        const uint32_t b = source[1];
+        const uint32_t c = source[2];
+        const uint32_t d = source[3];
+        destination[0] = a;
+        destination[1] = b;
+        destination[2] = c;
+        destination[3] = d;
+        source += 4;
+        destination += 4;
+    }
+    while (destination < end) {
+        *destination++ = *source++;
+    }
+}
+
+
+/// Clear a section word by word, four words in each iteration.
+///
+/// @param destination The start address, aligned to 4 bytes.
+/// @param size The size in bytes, a multiple of 4.
+///
+RESET_CODE __attribute__((always_inline))
+static inline void zeroWords(uint32_t *destination, uint32_t size)
+{
+    uint32_t * const end = destination + (size >> 2);
+    uint32_t * const blockEnd = destination + ((size >> 4) << 2);
+    while (destination < blockEnd) {
+        destination[0] = 0;
+        destination[1] = 0;
+        destination[2] = 0;
+        destination[3] = 0;
+        destination += 4;
+    }
+    while (destination < end) {
+        *destination++ = 0;
+    }
+}
+
+
+RESET_CODE
 void Reset_Handler(void)
 {
-/*    PORT->Group[0].DIRSET.reg = (1u << 17);
-    while (1) {
-        PORT->Group[0].OUTCLR.reg = (1u << 17);
-        for (uint32_t i = 0; i < 10000; ++i) {
-            __NOP();
+#ifdef HAL_BOOT_TIME
+    // Let the SysTick timer count the CPU cycles, until `SystemInit()` configures it.
+    SysTick->LOAD = BOOT_TIME_SYSTICK_RELOAD;
+    SysTick->VAL = 0;
+    SysTick->CTRL = SysTick_CTRL_CLKSOURCE_Msk|SysTick_CTRL_ENABLE_Msk;
+#endif
+
+    // Copy all sections with initialized data from the flash into the RAM.
+    for (const CopyTableEntry *entry = __copy_table_start__; entry < __copy_table_end__; ++entry) {
+        if (entry->source != entry->destination) {
+            copyWords(entry->source, entry->destination, entry->size);
         }
     }
-*/
-    // First initialize all data from the data section.
-    uint32_t *pSrc = &__etext;
-    uint32_t *pDest = &__data_start__;
-    // If there is data to copy, copy it.
-    if ((&__data_start__ != &__data_end__) && (pSrc != pDest)) {
-        for (; pDest < &__data_end__; pDest++, pSrc++)
-            *pDest = *pSrc;
-    }
 
-    // Zero the static variable section.
-    if ((&__data_start__ != &__data_end__) && (pSrc != pDest)) {
-        for (pDest = &__bss_start__; pDest < &__bss_end__; pDest++)
-            *pDest = 0;
+    // Clear all sections with uninitialized variables.
+    for (const ZeroTableEntry *entry = __zero_table_start__; entry < __zero_table_end__; ++entry) {
+        zeroWords(entry->destination, entry->size);
     }
 
+#ifdef HAL_BOOT_TIME
+    gBootTime.memoryInitTicks = BOOT_TIME_SYSTICK_RELOAD - SysTick->VAL;
+    gBootTime.overflow = (SysTick->CTRL & SysTick_CTRL_COUNTFLAG_Msk) != 0;
+#endif
+
     // Call the initialization of the CMSYS library.
     SystemInit();
 
@@ -30,3 +30,25 @@ extern uint32_t __bss_end__;
 extern uint32_t __StackTop;
 extern uint32_t __text_start__;
 
+
+/// An entry of the copy table, with a section to copy from the flash into the RAM.
+///
+typedef struct {
+    const uint32_t *source; ///< The start of the section in the flash.
+    uint32_t *destination; ///< The start of the section in the RAM.
+    uint32_t size; ///< The size of the section in bytes.
+} CopyTableEntry;
+
+/// An entry of the zero table, with a section to clear in the RAM.
+///
+typedef struct {
+    uint32_t *destination; ///< The start of the section in the RAM.
+    uint32_t size; ///< The size of the section in bytes.
+} ZeroTableEntry;
+
+// The tables created by the linker script.
+extern const CopyTableEntry __copy_table_start__[];
+extern const CopyTableEntry __copy_table_end__[];
+extern const ZeroTableEntry __zero_table_start__[];
+extern const ZeroTableEntry __zero_table_end__[];
+
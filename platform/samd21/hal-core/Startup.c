@@ -18,10 +18,19 @@
 
 
 #include "Chip.hpp"
+#include "BootClock.h"
+#ifdef HAL_BOOT_TIME
+#include "BootTime.h"
+#endif
 
 #include <stdbool.h>
 
 
+#if defined(HAL_BOOT_CLOCK_DFLL) || defined(HAL_BOOT_CLOCK_OSC8M)
+#define HAL_FAST_BOOT
+#endif
+
+
 const uint8_t cClockMain = 0;
 const uint8_t cClockXOSC32K = 1u;
 const uint8_t cClockOSC32K = 1u;
@@ -31,6 +40,180 @@ const uint8_t cClockMuxDFFL48M = 0u;
 const uint32_t cCpuSpeed = 48000000u;
 const uint32_t cMainOscillatorSpeed = 32768u;
 
+#ifdef HAL_BOOT_CLOCK_OSC8M
+const uint32_t cBootClockSpeed = 8000000u;
+#else
+const uint32_t cBootClockSpeed = 48000000u;
+#endif
+
+#ifdef HAL_FAST_BOOT
+// Smaller steps than the maximum for the closed loop, to limit the overshoot while the CPU is running.
+const uint32_t cDfllCoarseStep = 0x1fu/4u;
+const uint32_t cDfllFineStep = 0xffu/4u;
+// The fine value in the middle of the range, for the open loop.
+const uint32_t cDfllFineDefault = 0x200u;
+
+/// If the DFLL48M is locked to the crystal.
+///
+static volatile bool gBootClockLocked = false;
+#endif
+
+
+/// Use the XOSC32K crystal as source for the generator 1, which is the reference of the DFLL48M.
+///
+static void connectCrystalToDfll()
+{
+    GCLK->GENDIV.reg = GCLK_GENDIV_ID(cClockXOSC32K);
+    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+    GCLK->GENCTRL.reg = GCLK_GENCTRL_ID(cClockOSC32K)|GCLK_GENCTRL_SRC_XOSC32K|GCLK_GENCTRL_GENEN;
+    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+    GCLK->CLKCTRL.reg = GCLK_CLKCTRL_ID(cClockMuxDFFL48M)|GCLK_CLKCTRL_GEN_GCLK1|GCLK_CLKCTRL_CLKEN;
+    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+}
+
+
+/// Use the DFLL48M as source for the main clock.
+///
+static void switchMainClockToDfll()
+{
+    GCLK->GENDIV.reg = GCLK_GENDIV_ID(cClockMain);
+    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+    GCLK->GENCTRL.reg = GCLK_GENCTRL_ID(cClockMain)|GCLK_GENCTRL_SRC_DFLL48M|GCLK_GENCTRL_IDC|GCLK_GENCTRL_GENEN;
+    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+}
+
+
+#ifdef HAL_BOOT_TIME
+/// Record the ticks at the switch from the reset clock to the boot clock.
+///
+static inline void recordClockSwitch()
+{
+    gBootTime.clockSwitchTicks = BOOT_TIME_SYSTICK_RELOAD - SysTick->VAL;
+    gBootTime.bootClockFrequency = cBootClockSpeed;
+}
+#endif
+
+
+#ifdef HAL_BOOT_CLOCK_DFLL
+/// Start the DFLL48M in open loop mode, with the calibration values from the factory.
+///
+static void startDfllOpenLoop()
+{
+    SYSCTRL->DFLLCTRL.reg = SYSCTRL_DFLLCTRL_ENABLE; // bug fix
+    while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
+    uint32_t coarse = ((*(uint32_t*)FUSES_DFLL48M_COARSE_CAL_ADDR)&FUSES_DFLL48M_COARSE_CAL_Msk)
+        >> FUSES_DFLL48M_COARSE_CAL_Pos;
+    if (coarse == 0x3fu) {
+        // Not calibrated, use the middle of the range.
+        coarse = 0x1fu;
+    }
+    SYSCTRL->DFLLVAL.reg = SYSCTRL_DFLLVAL_COARSE(coarse)|SYSCTRL_DFLLVAL_FINE(cDfllFineDefault);
+    while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
+}
+#endif
+
+
+#ifdef HAL_FAST_BOOT
+
+/// Switch the DFLL48M into closed loop mode, after the crystal is ready.
+///
+/// The lock is reported by the lock interrupts. This function does not wait for the lock.
+///
+static void startDfllClosedLoop()
+{
+    connectCrystalToDfll();
+#ifdef HAL_BOOT_CLOCK_OSC8M
+    // The DFLL48M is not running yet.
+    SYSCTRL->DFLLCTRL.reg = SYSCTRL_DFLLCTRL_ENABLE; // bug fix
+    while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
+#endif
+    SYSCTRL->DFLLMUL.reg = SYSCTRL_DFLLMUL_CSTEP(cDfllCoarseStep)|SYSCTRL_DFLLMUL_FSTEP(cDfllFineStep)|
+                           SYSCTRL_DFLLMUL_MUL((cCpuSpeed+cMainOscillatorSpeed/2)/cMainOscillatorSpeed);
+    while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
+    // No `WAITLOCK` here, the output of the DFLL48M must not stop while it may clock the CPU.
+    SYSCTRL->DFLLCTRL.reg |= SYSCTRL_DFLLCTRL_MODE|SYSCTRL_DFLLCTRL_QLDIS;
+    while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
+    SYSCTRL->DFLLCTRL.reg |= SYSCTRL_DFLLCTRL_ENABLE;
+    while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
+}
+
+
+/// The interrupts of the `SYSCTRL` used for the clock configuration.
+///
+const uint32_t cBootClockInterrupts = SYSCTRL_INTFLAG_XOSC32KRDY|SYSCTRL_INTFLAG_DFLLLCKC|SYSCTRL_INTFLAG_DFLLLCKF;
+
+
+/// The default of the function called after the lock, which does nothing.
+///
+__attribute__((weak))
+void BootClock_onLock()
+{
+}
+
+
+/// The `SYSCTRL` handler used with a fast boot clock.
+///
+/// It finishes the clock configuration in the background: first the crystal gets ready, then the
+/// DFLL48M is switched into closed loop mode. After the coarse and fine lock, the main clock is
+/// switched to the DFLL48M if it runs from the OSC8M, and `BootClock_onLock()` is called.
+/// All other enabled interrupts are passed to the `SYSCTRL_Handler` of the firmware.
+///
+void BootClock_SYSCTRL_Handler()
+{
+    const uint32_t flags = SYSCTRL->INTFLAG.reg;
+    const uint32_t ownInterrupts = gBootClockLocked ? 0u : cBootClockInterrupts;
+    if ((flags&ownInterrupts&SYSCTRL_INTFLAG_XOSC32KRDY) != 0) {
+        SYSCTRL->INTENCLR.reg = SYSCTRL_INTENCLR_XOSC32KRDY;
+        SYSCTRL->INTFLAG.reg = SYSCTRL_INTFLAG_XOSC32KRDY|SYSCTRL_INTFLAG_DFLLLCKC|SYSCTRL_INTFLAG_DFLLLCKF;
+        startDfllClosedLoop();
+        SYSCTRL->INTENSET.reg = SYSCTRL_INTENSET_DFLLLCKC|SYSCTRL_INTENSET_DFLLLCKF;
+    }
+    if ((flags&ownInterrupts&(SYSCTRL_INTFLAG_DFLLLCKC|SYSCTRL_INTFLAG_DFLLLCKF)) != 0) {
+        SYSCTRL->INTFLAG.reg = SYSCTRL_INTFLAG_DFLLLCKC|SYSCTRL_INTFLAG_DFLLLCKF;
+        const uint32_t locked = SYSCTRL_PCLKSR_DFLLLCKC|SYSCTRL_PCLKSR_DFLLLCKF;
+        if ((SYSCTRL->PCLKSR.reg&locked) == locked) {
+            SYSCTRL->INTENCLR.reg = SYSCTRL_INTENCLR_DFLLLCKC|SYSCTRL_INTENCLR_DFLLLCKF;
+#ifdef HAL_BOOT_CLOCK_OSC8M
+            switchMainClockToDfll();
+            // Keep the SysTick exception at 1kHz.
+            SysTick->LOAD = cCpuSpeed/1000 - 1;
+            SysTick->VAL = 0;
+#endif
+            gBootClockLocked = true;
+            BootClock_onLock();
+        }
+    }
+    if ((flags&SYSCTRL->INTENSET.reg&~ownInterrupts) != 0) {
+        SYSCTRL_Handler();
+    }
+}
+
+
+bool BootClock_isLocked()
+{
+    return gBootClockLocked;
+}
+
+
+void BootClock_waitForLock()
+{
+    while (!gBootClockLocked) {}
+}
+
+#else
+
+bool BootClock_isLocked()
+{
+    return true;
+}
+
+
+void BootClock_waitForLock()
+{
+}
+
+#endif
+
 
 /// Our own implementation of the SystemInit function.
 ///
@@ -40,6 +223,30 @@ void SystemInit()
     NVMCTRL->CTRLB.bit.RWS = NVMCTRL_CTRLB_RWS_HALF_Val;
     // Enable the clock.
     PM->APBAMASK.reg |= PM_APBAMASK_GCLK;
+#ifdef HAL_FAST_BOOT
+    // Enable the external clock XOSC32K, but do not wait until it stabilized.
+    SYSCTRL->XOSC32K.reg = SYSCTRL_XOSC32K_STARTUP(0x6u)|SYSCTRL_XOSC32K_XTALEN|SYSCTRL_XOSC32K_EN32K;
+    SYSCTRL->XOSC32K.bit.ENABLE = 1;
+
+    // Do a software reset of the clock module.
+    GCLK->CTRL.reg = GCLK_CTRL_SWRST;
+    while ((GCLK->CTRL.reg&GCLK_CTRL_SWRST) && (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY)) {}
+
+#ifdef HAL_BOOT_CLOCK_DFLL
+    // Run the CPU from the DFLL48M in open loop mode, until it is locked to the crystal.
+    startDfllOpenLoop();
+#ifdef HAL_BOOT_TIME
+    recordClockSwitch();
+#endif
+    switchMainClockToDfll();
+#else
+    // Run the CPU from the OSC8M without prescaler, until the DFLL48M is locked to the crystal.
+#ifdef HAL_BOOT_TIME
+    recordClockSwitch();
+#endif
+    SYSCTRL->OSC8M.bit.PRESC = SYSCTRL_OSC8M_PRESC_0_Val;
+#endif
+#else
     // Enable the external clock XOSC32K, wait until it stabilized.
     SYSCTRL->XOSC32K.reg = SYSCTRL_XOSC32K_STARTUP(0x6u)|SYSCTRL_XOSC32K_XTALEN|SYSCTRL_XOSC32K_EN32K;
     SYSCTRL->XOSC32K.bit.ENABLE = 1;
@@ -49,15 +256,10 @@ void SystemInit()
     GCLK->CTRL.reg = GCLK_CTRL_SWRST;
     while ((GCLK->CTRL.reg&GCLK_CTRL_SWRST) && (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY)) {}
 
-    // Use XOSC32K as source of clock generator 1
-    GCLK->GENDIV.reg = GCLK_GENDIV_ID(cClockXOSC32K);
-    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
-    GCLK->GENCTRL.reg = GCLK_GENCTRL_ID(cClockOSC32K)|GCLK_GENCTRL_SRC_XOSC32K|GCLK_GENCTRL_GENEN;
-    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+    // Use XOSC32K as source of clock generator 1 and for the multiplexer DFLL48M.
+    connectCrystalToDfll();
 
-    // Use generator 1 as source for the multiplexer DFLL48M and enable it.
-    GCLK->CLKCTRL.reg = GCLK_CLKCTRL_ID(cClockMuxDFFL48M)|GCLK_CLKCTRL_GEN_GCLK1|GCLK_CLKCTRL_CLKEN;
-    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+    // Enable the DFLL48M and wait for the lock.
     SYSCTRL->DFLLCTRL.reg = SYSCTRL_DFLLCTRL_ENABLE; // bug fix
     while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
     SYSCTRL->DFLLMUL.reg = SYSCTRL_DFLLMUL_CSTEP(0x1fu)|SYSCTRL_DFLLMUL_FSTEP(0x1ffu)|
@@ -70,10 +272,11 @@ void SystemInit()
     while ((SYSCTRL->PCLKSR.reg&SYSCTRL_PCLKSR_DFLLRDY) == 0) {}
 
     // Now set the main clock to the initialized DFLL48M
-    GCLK->GENDIV.reg = GCLK_GENDIV_ID(cClockMain);
-    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
-    GCLK->GENCTRL.reg = GCLK_GENCTRL_ID(cClockMain)|GCLK_GENCTRL_SRC_DFLL48M|GCLK_GENCTRL_IDC|GCLK_GENCTRL_GENEN;
-    while (GCLK->STATUS.reg&GCLK_STATUS_SYNCBUSY) {}
+#ifdef HAL_BOOT_TIME
+    recordClockSwitch();
+#endif
+    switchMainClockToDfll();
+#endif
 
     // Setup OSC8M
     SYSCTRL->OSC8M.bit.PRESC = SYSCTRL_OSC8M_PRESC_0_Val;
@@ -91,11 +294,26 @@ void SystemInit()
     // Disable automatic NVM writes (for compatibility).
     NVMCTRL->CTRLB.bit.MANW = 1;
 
+#ifdef HAL_BOOT_TIME
+    // Record the boot time, before the SysTick timer is configured for the firmware.
+    gBootTime.systemInitTicks = BOOT_TIME_SYSTICK_RELOAD - SysTick->VAL;
+    if ((SysTick->CTRL & SysTick_CTRL_COUNTFLAG_Msk) != 0) {
+        gBootTime.overflow = true;
+    }
+#endif
+
     // Enable SysTick at 1kHz/1ms
-    if (SysTick_Config(cCpuSpeed/1000)) {
+    if (SysTick_Config(cBootClockSpeed/1000)) {
         while (true) {};
     }
     // Lower the priority of the SysTick IRQ down to second lowest (compatibility).
     NVIC_SetPriority(SysTick_IRQn, (1u << __NVIC_PRIO_BITS) - 2);
+
+#ifdef HAL_FAST_BOOT
+    // Finish the clock configuration in the background, as soon as the crystal is ready.
+    // This is enabled last, because the handler adjusts the SysTick timer.
+    SYSCTRL->INTENSET.reg = SYSCTRL_INTENSET_XOSC32KRDY;
+    NVIC_EnableIRQ(SYSCTRL_IRQn);
+#endif
 }
 
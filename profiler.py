@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import struct
+import time
+import argparse
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Dict, IO, Optional
+
+from elffile import ElfFile, ElfError
+from frames import FRAME_TYPE_PROFILER, Frame, FrameDecoder
+from samba import SambaError, SerialPort
+from symbolindex import SymbolIndex
+from upload import PortNotFound, find_port
+
+assert sys.version_info >= (3, 7)
+
+
+DROPPED_COUNT = struct.Struct('<I')
+SAMPLE = struct.Struct('<II')  # The interrupted PC and LR.
+UNKNOWN_FUNCTION = '[unknown]'
+EXC_RETURN_MASK = 0xfffffff0
+
+
+class Error(Exception):
+    """The error class for this script."""
+
+
+class ProfileCollector:
+    """
+    Collect the samples from the profiler frames and map them to functions.
+    """
+
+    def __init__(self, index: SymbolIndex):
+        self.index = index
+        self.functions: Counter = Counter()
+        self.stacks: Counter = Counter()
+        self.sample_count = 0
+        self.dropped_count = 0
+        self._last_dropped: Optional[int] = None
+        self._names: Dict[int, str] = {}
+
+    def _function_name(self, address: int) -> str:
+        name = self._names.get(address)
+        if name is None:
+            name = self.index.lookup(address) or UNKNOWN_FUNCTION
+            self._names[address] = name
+        return name
+
+    def add_frame(self, frame: Frame):
+        """
+        Add the samples of one frame.
+
+        :param frame: A frame with profiler samples.
+        """
+        payload = frame.payload
+        if len(payload) < DROPPED_COUNT.size:
+            return
+        dropped = DROPPED_COUNT.unpack_from(payload)[0]
+        if self._last_dropped is not None and dropped >= self._last_dropped:
+            self.dropped_count += dropped - self._last_dropped
+        self._last_dropped = dropped
+        end = len(payload) - (len(payload) - DROPPED_COUNT.size) % SAMPLE.size
+        for pc, lr in SAMPLE.iter_unpack(payload[DROPPED_COUNT.size:end]):
+            function = self._function_name(pc)
+            self.functions[function] += 1
+            caller = None
+            if (lr & EXC_RETURN_MASK) != EXC_RETURN_MASK and lr > 1:
+                # The link register points after the call instruction.
+                caller = self._function_name((lr & ~1) - 2)
+            if caller is None or caller == function:
+                self.stacks[function] += 1
+            else:
+                self.stacks[f'{caller};{function}'] += 1
+            self.sample_count += 1
+
+
+def collect_from_port(port: str, duration: float, collector: ProfileCollector, record: Optional[IO]):
+    """
+    Collect samples from the serial port of the board.
+
+    :param port: The path to the port.
+    :param duration: The time in seconds to collect samples, or zero to collect until interrupted.
+    :param collector: The collector for the samples.
+    :param record: A file to record the received data, or None.
+    """
+    decoder = FrameDecoder([FRAME_TYPE_PROFILER])
+    end_time = time.monotonic() + duration if duration > 0 else None
+    try:
+        with SerialPort(port) as serial_port:
+            while end_time is None or time.monotonic() < end_time:
+                data = serial_port.read_available(timeout=0.1)
+                if not data:
+                    continue
+                if record:
+                    record.write(data)
+                for frame in decoder.feed(data):
+                    collector.add_frame(frame)
+    except KeyboardInterrupt:
+        pass
+    except SambaError as e:
+        raise Error(str(e))
+
+
+def collect_from_file(path: Path, collector: ProfileCollector):
+    """
+    Collect samples from a file recorded with `--record`.
+
+    :param path: The path to the recorded data.
+    :param collector: The collector for the samples.
+    """
+    decoder = FrameDecoder([FRAME_TYPE_PROFILER])
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(65536)
+            if not data:
+                break
+            for frame in decoder.feed(data):
+                collector.add_frame(frame)
+
+
+def print_flat_profile(collector: ProfileCollector, top: int):
+    """
+    Print the functions with the most samples.
+
+    :param collector: The collector with the samples.
+    :param top: The number of functions to print.
+    """
+    total = collector.sample_count
+    print(f'{total} samples, {collector.dropped_count} dropped.')
+    if not total:
+        return
+    print(f'{"Samples":>8} {"Percent":>8}  Function')
+    for name, count in collector.functions.most_common(top):
+        print(f'{count:>8} {count * 100.0 / total:>7.2f}%  {name}')
+
+
+def write_folded(collector: ProfileCollector, path: Path):
+    """
+    Write the samples in the folded stack format, as used by `flamegraph.pl`.
+
+    Only the interrupted function and its caller are known, so each stack has at most two levels.
+
+    :param collector: The collector with the samples.
+    :param path: The path of the output file.
+    """
+    lines = [f'{stack} {count}\n' for stack, count in sorted(collector.stacks.items())]
+    path.write_text(''.join(lines), 'utf-8')
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Collect the samples of the profiler from a board and print '
+                                                 'the functions where the firmware spends its time.')
+    parser.add_argument('firmware',
+                        help='The firmware ELF file, to map the samples to functions.')
+    parser.add_argument('--port', '-p',
+                        dest='port',
+                        type=str,
+                        action='store',
+                        default='/dev/cu.usbmodem*',
+                        help='The serial port of the board. Can contain wildcards to select the first '
+                             'matching device.')
+    parser.add_argument('--duration', '-d',
+                        dest='duration',
+                        type=float,
+                        action='store',
+                        default=10.0,
+                        help='The time in seconds to collect samples. Use 0 to collect until Ctrl+C is pressed.')
+    parser.add_argument('--input', '-i',
+                        dest='input',
+                        type=str,
+                        action='store',
+                        help='Read the samples from a file recorded with --record, instead of the port.')
+    parser.add_argument('--record', '-r',
+                        dest='record',
+                        type=str,
+                        action='store',
+                        help='Record the data received from the board into this file.')
+    parser.add_argument('--top', '-n',
+                        dest='top',
+                        type=int,
+                        action='store',
+                        default=30,
+                        help='The number of functions to print.')
+    parser.add_argument('--folded',
+                        dest='folded',
+                        type=str,
+                        action='store',
+                        help='Write the samples in the folded stack format to this file.')
+    args = parser.parse_args()
+    try:
+        with ElfFile(args.firmware) as elf:
+            index = SymbolIndex.from_elf(elf)
+    except (ElfError, OSError) as e:
+        exit(f'Could not read the firmware: {e}')
+    collector = ProfileCollector(index)
+    try:
+        if args.input:
+            collect_from_file(Path(args.input), collector)
+        else:
+            port = find_port(args.port)
+            print(f'Collecting samples from {port}...')
+            if args.record:
+                with open(args.record, 'wb') as record:
+                    collect_from_port(port, args.duration, collector, record)
+            else:
+                collect_from_port(port, args.duration, collector, None)
+    except (Error, PortNotFound, OSError) as e:
+        exit(f'ERROR! {e}')
+    print_flat_profile(collector, args.top)
+    if args.folded:
+        write_folded(collector, Path(args.folded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import shutil
+import subprocess
+import time
+import argparse
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+from configure import OPTIMIZATION_PROFILES
+from elffile import ElfFile, ElfError
+from mapfile import MapFileError, read_map_file
+
+assert sys.version_info >= (3, 7)
+
+
+TOOLCHAIN_FILE = Path(__file__).parent/'toolchain.cmake'
+FIRMWARE_NAME = 'firmware'
+
+
+class Error(Exception):
+    """The error class for this script."""
+
+
+@dataclass
+class ProfileResult:
+    """The result of building the firmware with one profile."""
+    profile: str
+    build_time: float = 0.0
+    flash: int = 0
+    ram: int = 0
+    functions: Dict[str, int] = field(default_factory=dict)
+    error: str = ''
+
+
+def run_command(command: List[str], cwd: Path, log_path: Path):
+    """
+    Run a command and append its output to a log file.
+
+    :param command: The command to run.
+    :param cwd: The working directory.
+    :param log_path: The path to the log file.
+    """
+    with open(log_path, 'a', encoding='utf-8') as log:
+        log.write(f'$ {" ".join(command)}\n')
+        log.flush()
+        result = subprocess.run(command, cwd=str(cwd), stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise Error(f'Command failed, see: {log_path}')
+
+
+def find_firmware(build_dir: Path) -> Path:
+    """
+    Find the linked firmware in the build directory.
+
+    :param build_dir: The build directory.
+    :return: The path to the firmware ELF file.
+    """
+    for path in sorted(build_dir.rglob(FIRMWARE_NAME)):
+        if path.is_file() and (path.parent/'firmware.map').is_file():
+            return path
+    raise Error(f'Could not find the firmware in: {build_dir}')
+
+
+def function_sizes(map_path: Path) -> Dict[str, int]:
+    """
+    Get the flash size of every function and constant from the map file.
+
+    The sizes are summed up by name, because with link time optimization the symbols
+    are moved into objects with random names.
+
+    :param map_path: The path to the map file.
+    :return: A dictionary with the symbol name and the flash size.
+    """
+    sizes: Dict[str, int] = {}
+    for entry in read_map_file(map_path).entries:
+        if entry.flash:
+            sizes[entry.name] = sizes.get(entry.name, 0) + entry.flash
+    return sizes
+
+
+def build_profile(profile: str, source_dir: Path, work_dir: Path, toolchain: Path, target: str,
+                  jobs: int, extra_args: List[str]) -> ProfileResult:
+    """
+    Build the firmware in a clean build directory using one profile.
+
+    :param profile: The name of the profile.
+    :param source_dir: The source directory of the project.
+    :param work_dir: The directory for all build directories.
+    :param toolchain: The path to the toolchain file.
+    :param target: The target to build.
+    :param jobs: The number of parallel build jobs.
+    :param extra_args: Additional arguments for cmake.
+    :return: The result for this profile.
+    """
+    result = ProfileResult(profile=profile)
+    build_dir = work_dir/profile
+    log_path = work_dir/f'{profile}.log'
+    if build_dir.exists():
+        shutil.rmtree(build_dir)
+    build_dir.mkdir(parents=True)
+    if log_path.exists():
+        log_path.unlink()
+    try:
+        run_command(['cmake', f'-DCMAKE_TOOLCHAIN_FILE={toolchain}', f'-DHAL_OPTIMIZATION_PROFILE={profile}']
+                    + extra_args + [str(source_dir)], build_dir, log_path)
+        start_time = time.monotonic()
+        run_command(['cmake', '--build', '.', '--target', target, '--', f'-j{jobs}'], build_dir, log_path)
+        result.build_time = time.monotonic() - start_time
+        firmware = find_firmware(build_dir)
+        with ElfFile(firmware) as elf_file:
+            text, data, bss = elf_file.sizes()
+        result.flash = text + data
+        result.ram = data + bss
+        result.functions = function_sizes(firmware.parent/'firmware.map')
+    except (Error, ElfError, MapFileError, OSError) as e:
+        result.error = str(e)
+    return result
+
+
+def _delta(value: int, reference: int) -> str:
+    if value == reference:
+        return ''
+    return f'{value - reference:+d}'
+
+
+def print_results(results: List[ProfileResult], top: int):
+    """
+    Print the results of all profiles side by side.
+
+    :param results: The results, the first one is used as reference for the deltas.
+    :param top: The number of functions with the largest differences to print.
+    """
+    reference = next((r for r in results if not r.error), None)
+    print()
+    print(f'{"Profile":<12} {"Build time":>10} {"Flash":>8} {"Delta":>8} {"RAM":>8} {"Delta":>8}')
+    print('-' * 59)
+    for result in results:
+        if result.error:
+            print(f'{result.profile:<12} FAILED: {result.error}')
+            continue
+        print(f'{result.profile:<12} {result.build_time:>9.1f}s {result.flash:>8} '
+              f'{_delta(result.flash, reference.flash):>8} {result.ram:>8} {_delta(result.ram, reference.ram):>8}')
+    succeeded = [r for r in results if not r.error]
+    if len(succeeded) < 2 or top <= 0:
+        return
+    names = set()
+    for result in succeeded:
+        names.update(result.functions)
+
+    def spread(name: str) -> int:
+        sizes = [r.functions.get(name, 0) for r in succeeded]
+        return max(sizes) - min(sizes)
+
+    changed = sorted((n for n in names if spread(n)), key=lambda n: (-spread(n), n))[:top]
+    if not changed:
+        return
+    print()
+    print(f'Functions with the largest size differences (relative to "{reference.profile}"):')
+    header = f'{"Function":<40}' + ''.join(f' {r.profile:>10}' for r in succeeded)
+    print(header)
+    print('-' * len(header))
+    for name in changed:
+        reference_size = reference.functions.get(name, 0)
+        columns = [f' {reference_size:>10}']
+        for result in succeeded[1:]:
+            size = result.functions.get(name, 0)
+            columns.append(f' {_delta(size, reference_size) or "=":>10}')
+        print(f'{name[:40]:<40}' + ''.join(columns))
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Build a firmware with each optimization profile and compare '
+                                                 'the build time and the size.')
+    parser.add_argument('source_dir',
+                        help='The source directory of the project.')
+    parser.add_argument('--profiles', '-p',
+                        dest='profiles',
+                        nargs='+',
+                        choices=OPTIMIZATION_PROFILES,
+                        default=OPTIMIZATION_PROFILES,
+                        help='The profiles to compare. The first profile is used as reference.')
+    parser.add_argument('--work-dir', '-w',
+                        dest='work_dir',
+                        type=str,
+                        action='store',
+                        default='profile-benchmark',
+                        help='The directory for the build directories and logs.')
+    parser.add_argument('--toolchain',
+                        dest='toolchain',
+                        type=str,
+                        action='store',
+                        default=str(TOOLCHAIN_FILE),
+                        help='The path to the toolchain file.')
+    parser.add_argument('--target',
+                        dest='target',
+                        type=str,
+                        action='store',
+                        default=FIRMWARE_NAME,
+                        help='The target to build.')
+    parser.add_argument('--jobs', '-j',
+                        dest='jobs',
+                        type=int,
+                        action='store',
+                        default=os.cpu_count() or 4,
+                        help='The number of parallel build jobs.')
+    parser.add_argument('--top', '-n',
+                        dest='top',
+                        type=int,
+                        action='store',
+                        default=20,
+                        help='The number of functions with the largest differences to display.')
+    parser.add_argument('--cmake-arg', '-D',
+                        dest='cmake_args',
+                        action='append',
+                        default=[],
+                        help='An additional variable for cmake, like "-D HAL_DSP_LIBRARY=lto".')
+    args = parser.parse_args()
+    source_dir = Path(args.source_dir).resolve()
+    work_dir = Path(args.work_dir).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    extra_args = [f'-D{arg}' for arg in args.cmake_args]
+    results = []
+    for profile in args.profiles:
+        print(f'Building with profile "{profile}"...')
+        results.append(build_profile(profile, source_dir, work_dir, Path(args.toolchain).resolve(),
+                                     args.target, args.jobs, extra_args))
+    print_results(results, args.top)
+    if any(r.error for r in results):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
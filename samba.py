@@ -0,0 +1,310 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import select
+import sys
+import termios
+import time
+from typing import Callable, Optional
+
+assert sys.version_info >= (3, 7)
+
+
+NVMCTRL_CTRLA = 0x41004000
+NVMCTRL_INTFLAG = 0x41004014
+NVMCTRL_ADDR = 0x4100401c
+NVMCTRL_CMD_ER = 0xa502  # Erase row, with the command execution key.
+NVMCTRL_INTFLAG_READY = 0x01
+SCB_AIRCR = 0xe000ed0c
+SCB_AIRCR_SYSRESETREQ = 0x05fa0004
+
+DEFAULT_BUFFER_ADDRESS = 0x20005000
+DEFAULT_BUFFER_SIZE = 0x1000
+DEFAULT_TIMEOUT = 5.0
+
+
+class SambaError(Exception):
+    """
+    Exception if the communication with the boot loader fails.
+    """
+    pass
+
+
+def crc16(data: bytes, crc: int = 0) -> int:
+    """
+    Calculate the CRC16-CCITT checksum, as used by the SAM-BA boot loader.
+
+    :param data: The data.
+    :param crc: The initial value.
+    :return: The checksum.
+    """
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xff00) ^ table[((crc >> 8) ^ byte) & 0xff]
+    return crc
+
+
+def _create_crc16_table():
+    table = []
+    for index in range(256):
+        crc = index << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xffff)
+    return table
+
+
+_CRC16_TABLE = _create_crc16_table()
+
+
+class SerialPort:
+    """
+    A minimal raw serial port, using termios only.
+    """
+
+    def __init__(self, port: str, timeout: float = DEFAULT_TIMEOUT):
+        self.port = port
+        self.timeout = timeout
+        try:
+            self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        except OSError as e:
+            raise SambaError(f'Could not open the port {port}: {e}')
+        try:
+            iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(self.fd)
+            cflag |= (termios.CLOCAL | termios.CREAD | termios.CS8)
+            cflag &= ~(termios.CSIZE | termios.CSTOPB | termios.PARENB)
+            cflag |= termios.CS8
+            lflag &= ~(termios.ICANON | termios.ECHO | termios.ECHOE |
+                       termios.ECHOK | termios.ECHONL | termios.ISIG | termios.IEXTEN)
+            oflag &= ~(termios.OPOST | termios.ONLCR | termios.OCRNL)
+            iflag &= ~(termios.INLCR | termios.IGNCR | termios.ICRNL | termios.IGNBRK | termios.INPCK |
+                       termios.ISTRIP | termios.IXON | termios.IXOFF)
+            speed = termios.B115200
+            termios.tcsetattr(self.fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+        except termios.error as e:
+            os.close(self.fd)
+            raise SambaError(f'The path {port} is no serial line: {e}')
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data: bytes):
+        """
+        Write all data to the port.
+
+        :param data: The data to write.
+        """
+        view = memoryview(data)
+        deadline = time.monotonic() + self.timeout
+        while view:
+            try:
+                written = os.write(self.fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise SambaError('Timeout while writing to the boot loader.')
+                select.select([], [self.fd], [], self.timeout)
+            except OSError as e:
+                raise SambaError(f'Could not write to the boot loader: {e}')
+
+    def read(self, size: int) -> bytes:
+        """
+        Read an exact number of bytes from the port.
+
+        :param size: The number of bytes to read.
+        :return: The read bytes.
+        """
+        result = bytearray()
+        deadline = time.monotonic() + self.timeout
+        while len(result) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SambaError('Timeout while waiting for the boot loader.')
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                continue
+            try:
+                result.extend(os.read(self.fd, size - len(result)))
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                raise SambaError(f'Could not read from the boot loader: {e}')
+        return bytes(result)
+
+    def read_available(self, timeout: float, size: int = 65536) -> bytes:
+        """
+        Read all bytes which are available, waiting at most for the timeout if there are none.
+
+        :param timeout: The maximum time to wait for data in seconds.
+        :param size: The maximum number of bytes to read.
+        :return: The read bytes, which is empty after a timeout.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return b''
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            return b''
+        except OSError as e:
+            raise SambaError(f'Could not read from the port: {e}')
+
+    def read_until(self, terminator: bytes) -> bytes:
+        """
+        Read from the port until the terminator was received.
+
+        :param terminator: The terminating bytes.
+        :return: The read bytes, including the terminator.
+        """
+        result = bytearray()
+        while not result.endswith(terminator):
+            result.extend(self.read(1))
+        return bytes(result)
+
+
+class SambaClient:
+    """
+    A client for the SAM-BA boot loader, including the Arduino extensions to write and checksum buffers.
+    """
+
+    def __init__(self, port: SerialPort, buffer_address: int = DEFAULT_BUFFER_ADDRESS,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.port = port
+        self.buffer_address = buffer_address
+        self.buffer_size = buffer_size
+        self.port.write(b'N#')
+        self.port.read_until(b'\n\r')
+
+    def version(self) -> str:
+        """
+        Get the version of the boot loader.
+        """
+        self.port.write(b'V#')
+        return self.port.read_until(b'\n\r')[:-2].decode('ascii', errors='replace')
+
+    def write_word(self, address: int, value: int):
+        self.port.write(f'W{address:08X},{value:08X}#'.encode('ascii'))
+
+    def read_word(self, address: int) -> int:
+        self.port.write(f'w{address:08X},4#'.encode('ascii'))
+        return int.from_bytes(self.port.read(4), 'little')
+
+    def read(self, address: int, size: int) -> bytes:
+        self.port.write(f'R{address:08X},{size:08X}#'.encode('ascii'))
+        return self.port.read(size)
+
+    def erase(self, address: int):
+        """
+        Erase the flash memory from the given address to the end.
+
+        :param address: The first address to erase.
+        """
+        self.port.write(f'X{address:08X}#'.encode('ascii'))
+        self._expect(b'X\n\r')
+
+    def erase_row(self, address: int):
+        """
+        Erase one row of the flash memory, using the NVM controller.
+
+        :param address: The address of the row.
+        """
+        self.write_word(NVMCTRL_ADDR, address >> 1)
+        self.write_word(NVMCTRL_CTRLA, NVMCTRL_CMD_ER)
+        deadline = time.monotonic() + DEFAULT_TIMEOUT
+        while (self.read_word(NVMCTRL_INTFLAG) & NVMCTRL_INTFLAG_READY) == 0:
+            if time.monotonic() > deadline:
+                raise SambaError('Timeout while erasing a flash row.')
+
+    def checksum(self, address: int, size: int) -> int:
+        """
+        Let the boot loader calculate the CRC16 of a memory range.
+
+        :param address: The start address.
+        :param size: The size of the range.
+        :return: The checksum.
+        """
+        self.port.write(f'Z{address:08X},{size:08X}#'.encode('ascii'))
+        response = self.port.read_until(b'#\n\r')
+        if not response.startswith(b'Z'):
+            raise SambaError(f'Unexpected checksum response: {response!r}')
+        return int(response[1:-3], 16)
+
+    def reset(self):
+        """
+        Reset the MCU to start the firmware.
+        """
+        self.write_word(SCB_AIRCR, SCB_AIRCR_SYSRESETREQ)
+
+    def _expect(self, response: bytes):
+        received = self.port.read(len(response))
+        if received != response:
+            raise SambaError(f'Unexpected response from the boot loader: {received!r}')
+
+    def write(self, address: int, data: bytes, progress: Optional[Callable[[int], None]] = None):
+        """
+        Write data into the erased flash memory.
+
+        The data is sent in large blocks, alternating between two buffers in the SRAM. The next
+        block is sent while the boot loader still writes the previous block into the flash memory.
+
+        :param address: The start address in the flash memory.
+        :param data: The data to write.
+        :param progress: An optional function called with the number of written bytes.
+        """
+        pending = 0
+        written = 0
+        buffers = [self.buffer_address, self.buffer_address + self.buffer_size]
+        for index, offset in enumerate(range(0, len(data), self.buffer_size)):
+            block = data[offset:offset + self.buffer_size]
+            if len(block) % 4:
+                block += b'\xff' * (4 - len(block) % 4)
+            buffer_address = buffers[index % 2]
+            self.port.write(f'S{buffer_address:08X},{len(block):08X}#'.encode('ascii') + block)
+            if pending:
+                self._expect(b'Y\n\r')
+                written += pending
+                if progress:
+                    progress(written)
+            self.port.write(f'Y{buffer_address:08X},0#'.encode('ascii'))
+            self._expect(b'Y\n\r')
+            self.port.write(f'Y{address + offset:08X},{len(block):08X}#'.encode('ascii'))
+            pending = min(len(block), len(data) - offset)
+        if pending:
+            self._expect(b'Y\n\r')
+            written += pending
+            if progress:
+                progress(written)
+
+    def verify(self, address: int, data: bytes) -> bool:
+        """
+        Verify the flash memory using the checksum of the boot loader.
+
+        :param address: The start address in the flash memory.
+        :param data: The expected data.
+        :return: True if the checksum matches.
+        """
+        return self.checksum(address, len(data)) == crc16(data)
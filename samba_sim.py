@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import pty
+import select
+import termios
+import threading
+import time
+import argparse
+import sys
+from pathlib import Path
+from typing import Optional
+
+from samba import crc16, NVMCTRL_ADDR, NVMCTRL_CTRLA, NVMCTRL_CMD_ER, NVMCTRL_INTFLAG, NVMCTRL_INTFLAG_READY, \
+    SCB_AIRCR, SCB_AIRCR_SYSRESETREQ
+
+assert sys.version_info >= (3, 7)
+
+
+VERSION = 'v2.0 [Arduino:XYZ] (simulated)'
+PAGE_SIZE = 64
+ROW_SIZE = 256
+
+
+class SimulatedBoard:
+    """
+    A simulated board with a SAM-BA boot loader, connected through a pseudo terminal.
+
+    The board is reachable through a symbolic link to the pseudo terminal. Like a real board,
+    it starts with the firmware running, and enters the boot loader if the port is opened and
+    closed at 1200 baud. Each time the board resets, the link is removed and created again
+    for a new pseudo terminal, to simulate the USB re-enumeration.
+    """
+
+    def __init__(self, link_path: Path, flash_size: int = 0x40000,
+                 enumeration_delay: float = 0.3, page_write_time: float = 0.0, start_in_bootloader: bool = False):
+        self.link_path = link_path
+        self.flash = bytearray(b'\xff' * flash_size)
+        self.enumeration_delay = enumeration_delay
+        self.page_write_time = page_write_time
+        self.in_bootloader = start_in_bootloader
+        self.sram = {}
+        self.registers = {}
+        self.source_address = 0
+        self.master_fd: Optional[int] = None
+        self.reset_count = 0
+        self._buffer = bytearray()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Run the simulation in a background thread.
+        """
+        self._create_device()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the simulation and remove the device.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._remove_device()
+
+    def run(self):
+        """
+        Run the simulation until interrupted.
+        """
+        self._create_device()
+        try:
+            self._run()
+        finally:
+            self._remove_device()
+
+    def _create_device(self):
+        master_fd, slave_fd = pty.openpty()
+        slave_name = os.ttyname(slave_fd)
+        os.close(slave_fd)
+        self.master_fd = master_fd
+        self._buffer = bytearray()
+        self.link_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.link_path.is_symlink():
+            self.link_path.unlink()
+        self.link_path.symlink_to(slave_name)
+
+    def _remove_device(self):
+        if self.link_path.is_symlink():
+            self.link_path.unlink()
+        if self.master_fd is not None:
+            os.close(self.master_fd)
+            self.master_fd = None
+
+    def _reenumerate(self, bootloader: bool):
+        self._remove_device()
+        time.sleep(self.enumeration_delay)
+        self.in_bootloader = bootloader
+        self.reset_count += 1
+        self._create_device()
+
+    def _run(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self.master_fd], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master_fd, 65536)
+            except OSError:
+                # No process has the port open.
+                if not self.in_bootloader and termios.tcgetattr(self.master_fd)[4] == termios.B1200:
+                    self._reenumerate(bootloader=True)
+                else:
+                    time.sleep(0.01)
+                continue
+            if self.in_bootloader:
+                self._buffer.extend(data)
+                self._process()
+
+    def _send(self, data: bytes):
+        os.write(self.master_fd, data)
+
+    def _process(self):
+        while True:
+            end = self._buffer.find(b'#')
+            if end < 0:
+                return
+            command = chr(self._buffer[0])
+            arguments = [int(a, 16) if a else 0 for a in self._buffer[1:end].decode('ascii').split(',')]
+            if command == 'S':
+                address, size = arguments
+                if len(self._buffer) < end + 1 + size:
+                    return
+                self._write_sram(address, bytes(self._buffer[end + 1:end + 1 + size]))
+                del self._buffer[:end + 1 + size]
+                continue
+            del self._buffer[:end + 1]
+            if self._execute(command, arguments):
+                return
+
+    def _write_sram(self, address: int, data: bytes):
+        for offset in range(0, len(data), 4):
+            self.sram[address + offset] = data[offset:offset + 4]
+
+    def _read_memory(self, address: int, size: int) -> bytes:
+        if address + size <= len(self.flash):
+            return bytes(self.flash[address:address + size])
+        result = bytearray()
+        for offset in range(0, size, 4):
+            result.extend(self.sram.get(address + offset, b'\0\0\0\0'))
+        return bytes(result[:size])
+
+    def _write_flash(self, address: int, data: bytes):
+        # Like real flash memory, writing can only clear bits.
+        for offset, byte in enumerate(data):
+            self.flash[address + offset] &= byte
+        if self.page_write_time:
+            time.sleep(self.page_write_time * ((len(data) + PAGE_SIZE - 1) // PAGE_SIZE))
+
+    def _execute(self, command: str, arguments) -> bool:
+        if command == 'N':
+            self._send(b'\n\r')
+        elif command == 'V':
+            self._send(VERSION.encode('ascii') + b'\n\r')
+        elif command == 'W':
+            address, value = arguments
+            self.registers[address] = value
+            if address == NVMCTRL_CTRLA and value == NVMCTRL_CMD_ER:
+                row_address = (self.registers.get(NVMCTRL_ADDR, 0) << 1) & ~(ROW_SIZE - 1)
+                self.flash[row_address:row_address + ROW_SIZE] = b'\xff' * ROW_SIZE
+            elif address == SCB_AIRCR and value == SCB_AIRCR_SYSRESETREQ:
+                self._reenumerate(bootloader=False)
+                return True
+        elif command == 'w':
+            address = arguments[0]
+            if address == NVMCTRL_INTFLAG:
+                value = NVMCTRL_INTFLAG_READY
+            elif address in self.registers:
+                value = self.registers[address]
+            else:
+                value = int.from_bytes(self._read_memory(address, 4), 'little')
+            self._send(value.to_bytes(4, 'little'))
+        elif command == 'R':
+            address, size = arguments
+            self._send(self._read_memory(address, size))
+        elif command == 'X':
+            address = arguments[0]
+            self.flash[address:] = b'\xff' * (len(self.flash) - address)
+            self._send(b'X\n\r')
+        elif command == 'Y':
+            address, size = arguments
+            if size == 0:
+                self.source_address = address
+            else:
+                self._write_flash(address, self._read_memory(self.source_address, size))
+            self._send(b'Y\n\r')
+        elif command == 'Z':
+            address, size = arguments
+            self._send(f'Z{crc16(self._read_memory(address, size)):08X}#\n\r'.encode('ascii'))
+        elif command == 'G':
+            self._reenumerate(bootloader=False)
+            return True
+        return False
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Simulate a board with a SAM-BA boot loader on a pseudo terminal.')
+    parser.add_argument('--device', '-d',
+                        dest='device',
+                        type=str,
+                        action='store',
+                        default='/tmp/hal-samba-sim/ttyACM0',
+                        help='The path of the symbolic link to the simulated device.')
+    parser.add_argument('--bootloader',
+                        dest='bootloader',
+                        action='store_true',
+                        help='Start the board in boot loader mode.')
+    parser.add_argument('--enumeration-delay',
+                        dest='enumeration_delay',
+                        type=float,
+                        action='store',
+                        default=0.3,
+                        help='The time in seconds the device disappears after a reset.')
+    parser.add_argument('--page-write-time',
+                        dest='page_write_time',
+                        type=float,
+                        action='store',
+                        default=0.0,
+                        help='The simulated time in seconds to write one flash page.')
+    args = parser.parse_args()
+    board = SimulatedBoard(link_path=Path(args.device),
+                           enumeration_delay=args.enumeration_delay,
+                           page_write_time=args.page_write_time,
+                           start_in_bootloader=args.bootloader)
+    print(f'Simulated board at: {args.device}')
+    try:
+        board.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -22,9 +22,19 @@ import re
 import subprocess
 import argparse
 import sys
+import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import List, Optional
+
+from elffile import ElfFile, ElfError
+from firmwareimage import UF2_FAMILY_IDS, ImageError, create_image, write_binary, write_intel_hex, write_uf2
+from mapfile import Footprint, MapFileError, read_map_file, short_object_name
+from sizebatch import (SIZE_CACHE_PATH, BatchError, MemoryLayout, analyze_batch, find_firmware, print_reports,
+                       write_csv, write_json)
+from sizehistory import HistoryRecord, SizeHistory, create_record
+from stackusage import EXCEPTION_FRAME_SIZE, CallGraph, StackUsageError, vector_entries
+from tracing import span
 
 assert sys.version_info >= (3, 7)
 
@@ -38,6 +48,18 @@ class BarEntry:
     text: str
 
 
+@dataclass
+class Budget:
+    """A size budget, either in bytes or as percentage of the available memory."""
+    value: float
+    is_percentage: bool
+
+    def limit(self, available: int) -> int:
+        if self.is_percentage:
+            return int(available * self.value / 100.0)
+        return int(self.value)
+
+
 def format_bytes(num):
     """
     Human friendly format of byte values.
@@ -81,7 +103,7 @@ def print_bar(bar_entries: List[BarEntry]):
 
 
 def print_results(text_size: int, initialized_size: int, uninitialized_size: int,
-                  flash_size: int, flash_start: int, ram_size: int):
+                  flash_size: int, flash_start: int, ram_size: int, ram_code_size: int = 0):
     """
     Print the results of the size command.
 
@@ -91,6 +113,7 @@ def print_results(text_size: int, initialized_size: int, uninitialized_size: int
     :param flash_size: The total size of the flash rom.
     :param flash_start: The start of the firmware in the flash memory.
     :param ram_size: The size of the RAM in the platform.
+    :param ram_code_size: The size of the code copied into the RAM, which is part of the text segment.
     """
     if flash_start > 0:
         print(f'Flash {format_bytes(flash_size)}: {format_bytes(flash_start)} boot / '
@@ -108,18 +131,41 @@ def print_results(text_size: int, initialized_size: int, uninitialized_size: int
             BarEntry(percentage=initialized_size/flash_size, text='I')
         ]
     print_bar(bar_entries)
+    ram_code_text = f' / {format_bytes(ram_code_size)} code' if ram_code_size else ''
     print(f'RAM {format_bytes(ram_size)}: {format_bytes(uninitialized_size)} uninitialized variables / '
-          f'{format_bytes(initialized_size)} initialized variables')
+          f'{format_bytes(initialized_size)} initialized variables{ram_code_text}')
     bar_entries = [
         BarEntry(percentage=uninitialized_size/ram_size, text='V'),
         BarEntry(percentage=initialized_size/ram_size, text='I')
     ]
+    if ram_code_size:
+        bar_entries.append(BarEntry(percentage=ram_code_size/ram_size, text='C'))
     print_bar(bar_entries)
 
 
-def retrieve_size(size_tool: str, firmware: str):
+def open_firmware(firmware: str) -> ElfFile:
+    """
+    Open the firmware, which is then read only once for all reports and outputs.
+
+    The sizes read from the section headers of the firmware are identical to the
+    sizes reported by `arm-none-eabi-size --format=GNU`.
+
+    :param firmware: The absolute path to the firmware.
+    :return: The opened firmware.
+    """
+    if not Path(firmware).is_file():
+        exit(f'Firmware not found at path: {firmware}')
+    try:
+        elf = ElfFile(firmware)
+        elf.sections
+        return elf
+    except ElfError as e:
+        exit(f'Could not read the firmware: {e}')
+
+
+def retrieve_size_with_tool(size_tool: str, firmware: str):
     """
-    Retrieve the size of the firmware.
+    Retrieve the size of the firmware using an external size tool.
 
     :param size_tool: The absolute path to the size tool.
     :param firmware: The absolute path to the firmware.
@@ -143,6 +189,283 @@ def retrieve_size(size_tool: str, firmware: str):
     return int(match.group(1), 16), int(match.group(2), 16), int(match.group(3), 16)
 
 
+def print_sections(elf: ElfFile):
+    """
+    Print a list of all allocated sections of the firmware.
+
+    :param elf: The firmware.
+    """
+    sections = [section for section in elf.sections if section.is_alloc]
+    name_width = max([len(section.name) for section in sections] + [7])
+    print(f'{"Section".ljust(name_width)}  {"Address":>10}  {"Size":>10}  Kind')
+    for section in sections:
+        kind = section.kind
+        if section.is_code and elf.is_copied(section):
+            kind += ' (RAM)'
+        print(f'{section.name.ljust(name_width)}  {section.address:#010x}  {section.size:>10}  {kind}')
+
+
+def read_footprint(elf: ElfFile, map_file: str) -> Footprint:
+    """
+    Read the footprint of the firmware from the map file.
+
+    The allocated sections of the firmware decide if an output section in the map uses flash, RAM or both.
+    Sections which are copied into the RAM at reset, like the code in `.ramfunc`, use both.
+
+    :param elf: The firmware.
+    :param map_file: The path to the map file written by the linker.
+    :return: The footprint.
+    """
+    alloc_sections = {}
+    for section in elf.sections:
+        if section.is_alloc:
+            alloc_sections[section.name] = (section.has_contents, section.is_writable or not section.has_contents
+                                            or elf.is_copied(section))
+    try:
+        return read_map_file(map_file, alloc_sections)
+    except MapFileError as e:
+        exit(str(e))
+
+
+def print_footprint(footprint: Footprint, previous: Optional[Footprint], top: int):
+    """
+    Print the largest symbols and objects and the changes since the previous build.
+
+    :param footprint: The footprint of the firmware.
+    :param previous: The footprint of the previous build, or None.
+    :param top: The number of entries to print for each list.
+    """
+    print('Largest symbols (flash / RAM in bytes):')
+    for entry in footprint.by_symbol()[:top]:
+        print(f'  {entry.flash:>8} {entry.ram:>8}  {entry.name} ({short_object_name(entry.object)})')
+    print('Largest objects (flash / RAM in bytes):')
+    for name, flash, ram in footprint.by_object()[:top]:
+        print(f'  {flash:>8} {ram:>8}  {short_object_name(name)}')
+    archives = [group for group in footprint.by_archive() if group[0].endswith('.a')]
+    if archives:
+        print('Largest archives (flash / RAM in bytes):')
+        for name, flash, ram in archives[:top]:
+            print(f'  {flash:>8} {ram:>8}  {Path(name).name}')
+    if previous is None:
+        return
+    changes = footprint.diff(previous)
+    if not changes:
+        print('No size changes since the previous build.')
+        return
+    flash_delta = sum(change[1] for change in changes)
+    ram_delta = sum(change[2] for change in changes)
+    print(f'Changes since the previous build: flash {flash_delta:+} B / RAM {ram_delta:+} B')
+    for entry, flash, ram in changes[:top]:
+        print(f'  {flash:>+8} {ram:>+8}  {entry.name} ({short_object_name(entry.object)})')
+
+
+def print_stack_usage(elf: ElfFile, stack_dir: str, ram_free: int, top: int) -> Optional[int]:
+    """
+    Print the worst case stack depth of every entry point of the firmware.
+
+    The worst case for the whole firmware is the depth of the reset handler, plus the deepest
+    interrupt handler with the registers stacked on exception entry. Nested interrupts with
+    different priorities are not considered.
+
+    :param elf: The firmware.
+    :param stack_dir: The build directory with the stack usage and call graph files.
+    :param ram_free: The RAM which is not used by variables.
+    :param top: The maximum number of entries to print.
+    :return: The worst case stack depth, or None if there is no call graph.
+    """
+    cache_path = elf.path.with_name(elf.path.name + '.stack-cache.json')
+    try:
+        graph = CallGraph.load(stack_dir, cache_path)
+        entries = vector_entries(elf, graph)
+    except (StackUsageError, OSError) as e:
+        print(f'Stack analysis failed: {e}')
+        return None
+    if not graph.has_calls:
+        print('No call graph found, the stack analysis requires GCC 10 or later. Largest stack frames:')
+        functions = sorted((f for f in graph.functions.values() if f.frame), key=lambda f: (-f.frame, f.name))
+        for function in functions[:top]:
+            print(f'  {function.frame:>8}  {function.name}')
+        return None
+    reset_name = entries[0] if entries else 'Reset_Handler'
+    reset_function = graph.functions.get(reset_name)
+    if reset_function is None or reset_function.frame is None:
+        print(f'Stack analysis failed: There is no stack frame for the reset handler {reset_name}, '
+              f'the startup code was compiled without -fstack-usage.')
+        return None
+    results = graph.analyze(entries)
+    print('Worst case stack depth (bytes):')
+    for result in results:
+        path = ' -> '.join(result.path)
+        if len(result.path) > 6:
+            path = ' -> '.join(result.path[:3] + ['...'] + result.path[-2:])
+        print(f'  {result.depth:>8}{"" if result.is_exact else "+"}  {path}')
+    is_exact = all(result.is_exact for result in results)
+    for title, names in [('Recursion', {n for r in results for n in r.recursion}),
+                         ('Indirect calls', {n for r in results for n in r.indirect}),
+                         ('Dynamic stack size', {n for r in results for n in r.dynamic}),
+                         ('No stack information', {n for r in results for n in r.unknown})]:
+        if names:
+            names = sorted(names)
+            more = f' and {len(names) - top} more' if len(names) > top else ''
+            print(f'  {title}: {", ".join(names[:top])}{more}')
+    reset = results[0]
+    handlers = results[1:]
+    worst = reset.depth
+    description = f'{format_bytes(reset.depth)} {reset.entry}'
+    if handlers:
+        handler = max(handlers, key=lambda r: r.depth)
+        worst += handler.depth + EXCEPTION_FRAME_SIZE
+        description += f' + {format_bytes(handler.depth)} {handler.entry} + ' \
+                       f'{format_bytes(EXCEPTION_FRAME_SIZE)} exception frame'
+    prefix = '' if is_exact else 'at least '
+    print(f'Stack {format_bytes(ram_free)} free: {prefix}{format_bytes(worst)} worst case ({description}) / '
+          f'{format_bytes(ram_free - worst)} headroom')
+    return worst
+
+
+def write_images(elf: ElfFile, binary: Optional[str], intel_hex: Optional[str], uf2: Optional[str],
+                 uf2_family: Optional[int]) -> str:
+    """
+    Write the binary image of the firmware in the requested formats.
+
+    :param elf: The firmware.
+    :param binary: The path for the raw binary file, identical to the output of `objcopy -O binary`, or None.
+    :param intel_hex: The path for the Intel HEX file, or None.
+    :param uf2: The path for the UF2 file, or None.
+    :param uf2_family: The UF2 family ID, or None.
+    :return: The SHA-256 hash of the image.
+    """
+    try:
+        image = create_image(elf)
+        if binary:
+            write_binary(binary, image)
+            Path(binary + '.sha256').write_text(f'{image.hash}  {Path(binary).name}\n', 'utf-8')
+        if intel_hex:
+            write_intel_hex(intel_hex, image)
+        if uf2:
+            write_uf2(uf2, image, uf2_family)
+    except ImageError as e:
+        exit(f'Could not create the firmware image: {e}')
+    except OSError as e:
+        exit(f'Could not write the firmware image: {e}')
+    print(f'Image {format_bytes(len(image.data))} at {image.address:#010x}, SHA-256: {image.hash}')
+    return image.hash
+
+
+def image_hash_of(elf: ElfFile) -> str:
+    """
+    Calculate the hash of the binary image of the firmware, without writing it.
+
+    :param elf: The firmware.
+    :return: The SHA-256 hash of the image.
+    """
+    try:
+        return create_image(elf).hash
+    except ImageError as e:
+        exit(f'Could not create the firmware image: {e}')
+
+
+def uf2_family(argument: str) -> int:
+    """
+    Convert a UF2 family argument into the family ID.
+
+    :param argument: The name of a known MCU family, like `samd21`, or a numeric family ID.
+    :return: The family ID.
+    """
+    if argument.lower() in UF2_FAMILY_IDS:
+        return UF2_FAMILY_IDS[argument.lower()]
+    try:
+        return int(argument, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Unknown UF2 family: {argument}')
+
+
+def check_budgets(text_size: int, initialized_size: int, uninitialized_size: int,
+                  flash_size: int, flash_start: int, ram_size: int,
+                  flash_budget: Optional[Budget], ram_budget: Optional[Budget],
+                  stack_budget: Optional[Budget], stack_depth: Optional[int] = None,
+                  ram_code: int = 0) -> List[str]:
+    """
+    Check the size of the firmware against the memory of the platform and the configured budgets.
+
+    :param text_size: The size of the text segment.
+    :param initialized_size: The size of the initialized variables.
+    :param uninitialized_size: The size of the uninitialized variables.
+    :param flash_size: The total size of the flash rom.
+    :param flash_start: The start of the firmware in the flash memory.
+    :param ram_size: The size of the RAM in the platform.
+    :param flash_budget: The maximum flash used by the firmware, or None.
+    :param ram_budget: The maximum RAM used by variables and code, or None.
+    :param stack_budget: The minimum RAM which has to stay free for the stack, or None.
+    :param stack_depth: The worst case stack depth from the stack analysis, or None.
+    :param ram_code: The size of the code copied into the RAM.
+    :return: A list with an error message for every exceeded limit.
+    """
+    errors = []
+    flash_available = flash_size - flash_start
+    flash_used = text_size + initialized_size
+    ram_used = initialized_size + uninitialized_size + ram_code
+    if flash_used > flash_available:
+        errors.append(f'The firmware uses {flash_used} bytes of flash, '
+                      f'but only {flash_available} bytes are available.')
+    elif flash_budget and flash_used > flash_budget.limit(flash_available):
+        errors.append(f'The firmware uses {flash_used} bytes of flash, '
+                      f'which exceeds the budget of {flash_budget.limit(flash_available)} bytes.')
+    if ram_used > ram_size:
+        errors.append(f'The firmware uses {ram_used} bytes of RAM, but only {ram_size} bytes are available.')
+    elif ram_budget and ram_used > ram_budget.limit(ram_size):
+        errors.append(f'The firmware uses {ram_used} bytes of RAM, '
+                      f'which exceeds the budget of {ram_budget.limit(ram_size)} bytes.')
+    if stack_budget and ram_size - ram_used < stack_budget.limit(ram_size):
+        errors.append(f'Only {max(ram_size - ram_used, 0)} bytes of RAM are left for the stack, '
+                      f'but the budget requires {stack_budget.limit(ram_size)} bytes.')
+    if stack_depth is not None and ram_size - ram_used < stack_depth:
+        errors.append(f'The worst case stack depth of {stack_depth} bytes exceeds the '
+                      f'{max(ram_size - ram_used, 0)} bytes of RAM left for the stack.')
+    return errors
+
+
+def print_trend(records: List[HistoryRecord], count: int):
+    """
+    Print the size trend from the last records of the history.
+
+    :param records: The records of the target, the oldest first.
+    :param count: The maximum number of records to print.
+    """
+    if not records:
+        print('There are no records in the size history.')
+        return
+    print(f'{"Date":<16}  {"Revision":<10}  {"Flash":>8} {"Change":>7}  {"RAM":>8} {"Change":>7}')
+    first_index = max(len(records) - count, 0)
+    for index in range(first_index, len(records)):
+        record = records[index]
+        flash_delta = ''
+        ram_delta = ''
+        if index > 0:
+            flash_delta = f'{record.flash - records[index - 1].flash:+}'
+            ram_delta = f'{record.ram - records[index - 1].ram:+}'
+        date = time.strftime('%Y-%m-%d %H:%M', time.localtime(record.time))
+        print(f'{date:<16}  {record.revision[:10]:<10}  {record.flash:>8} {flash_delta:>7}  '
+              f'{record.ram:>8} {ram_delta:>7}')
+    if len(records) > 1:
+        flash_delta = records[-1].flash - records[first_index].flash
+        ram_delta = records[-1].ram - records[first_index].ram
+        print(f'Total change over {len(records) - first_index} builds: '
+              f'flash {flash_delta:+} B / RAM {ram_delta:+} B')
+
+
+def budget(argument: str) -> Budget:
+    """
+    Convert a budget argument into a budget.
+
+    :param argument: Either a number of bytes, or a percentage like `90%`.
+    :return: The converted budget.
+    """
+    if argument.endswith('%'):
+        return Budget(value=float(argument[:-1]), is_percentage=True)
+    return Budget(value=int(argument, 0), is_percentage=False)
+
+
 def auto_int(argument: str) -> int:
     """
     Convert any int string into an int.
@@ -153,6 +476,38 @@ def auto_int(argument: str) -> int:
     return int(argument, 0)
 
 
+def run_batch(args):
+    """
+    Analyze many firmware files and write the consolidated report.
+
+    :param args: The parsed command line arguments.
+    """
+    default_layout = None
+    if args.flash_size is not None and args.ram_size is not None:
+        default_layout = MemoryLayout(flash_size=args.flash_size, flash_start=args.flash_start or 0,
+                                      ram_size=args.ram_size)
+    try:
+        firmware_paths = find_firmware(args.firmware)
+        with span('batch', 'size', images=len(firmware_paths)):
+            reports, errors = analyze_batch(firmware_paths=firmware_paths,
+                                            default_layout=default_layout,
+                                            config=Path(args.config) if args.config else None,
+                                            cache_path=None if args.no_size_cache else Path(args.size_cache),
+                                            jobs=max(1, args.jobs))
+        if args.json:
+            write_json(args.json, reports)
+        if args.csv:
+            write_csv(args.csv, reports)
+    except (BatchError, OSError) as e:
+        exit(f'ERROR! {e}')
+    if '-' not in (args.json, args.csv):
+        print_reports(reports)
+    errors += [f'{report.firmware} does not fit into the memory of {report.mcu or "the platform"}.'
+               for report in reports if not report.fits]
+    if errors:
+        exit('Batch size check failed:\n' + '\n'.join(f' - {error}' for error in errors))
+
+
 def main():
     """
     Parse the command line arguments.
@@ -162,33 +517,209 @@ def main():
                         dest='flash_size',
                         type=auto_int,
                         action='store',
-                        required=True,
-                        help='The size of the flash rom of the platform.')
+                        help='The size of the flash rom of the platform. Required for a single firmware.')
     parser.add_argument('--flash-start', '-b',
                         dest='flash_start',
                         type=auto_int,
                         action='store',
-                        required=True,
-                        help='The start for the firmware in the flash rom (bootloader).')
+                        help='The start for the firmware in the flash rom (bootloader). Required for a single '
+                             'firmware.')
     parser.add_argument('--ram-size', '-r',
                         dest='ram_size',
                         type=auto_int,
                         action='store',
-                        required=True,
-                        help='The size of the RAM of the platform.')
+                        help='The size of the RAM of the platform. Required for a single firmware.')
     parser.add_argument('--size-tool', '-t',
                         dest='size_tool',
                         type=str,
                         action='store',
-                        required=True,
-                        help='The absolute path to the size tool.')
-    parser.add_argument('firmware',
+                        help='The absolute path to an external size tool. If set, this tool is used '
+                             'instead of the built-in ELF reader.')
+    parser.add_argument('--sections', '-S',
+                        dest='sections',
+                        action='store_true',
+                        help='Also list all allocated sections of the firmware.')
+    parser.add_argument('--map', '-m',
+                        dest='map_file',
                         type=str,
                         action='store',
-                        help='The absolute path to the firmware file.')
+                        help='The map file of the firmware. If set, the largest symbols and objects and the '
+                             'changes since the previous build are displayed.')
+    parser.add_argument('--top', '-n',
+                        dest='top',
+                        type=int,
+                        action='store',
+                        default=10,
+                        help='The number of entries to display in the symbol and object lists.')
+    parser.add_argument('--flash-budget',
+                        dest='flash_budget',
+                        type=budget,
+                        action='store',
+                        help='The maximum flash used by the firmware, in bytes or as percentage of the '
+                             'available flash (e.g. 90%%). The command fails if the budget is exceeded.')
+    parser.add_argument('--ram-budget',
+                        dest='ram_budget',
+                        type=budget,
+                        action='store',
+                        help='The maximum RAM used by variables and RAM code, in bytes or as percentage of the RAM.')
+    parser.add_argument('--stack-budget',
+                        dest='stack_budget',
+                        type=budget,
+                        action='store',
+                        help='The minimum RAM which has to stay free for the stack, in bytes or as percentage '
+                             'of the RAM.')
+    parser.add_argument('--stack-dir',
+                        dest='stack_dir',
+                        type=str,
+                        action='store',
+                        help='The build directory with the stack usage (.su) and call graph (.ci) files. '
+                             'If set, the worst case stack depth of all entry points is calculated.')
+    parser.add_argument('--binary',
+                        dest='binary',
+                        type=str,
+                        action='store',
+                        help='Write the binary image of the firmware to this file, identical to the output of '
+                             '"objcopy -O binary". A file with the SHA-256 hash of the image is written next to it.')
+    parser.add_argument('--hex',
+                        dest='hex',
+                        type=str,
+                        action='store',
+                        help='Write the firmware as Intel HEX file.')
+    parser.add_argument('--uf2',
+                        dest='uf2',
+                        type=str,
+                        action='store',
+                        help='Write the firmware as UF2 file.')
+    parser.add_argument('--uf2-family',
+                        dest='uf2_family',
+                        type=uf2_family,
+                        action='store',
+                        help=f'The family for the UF2 file, one of {", ".join(sorted(UF2_FAMILY_IDS))} '
+                             f'or a numeric family ID.')
+    parser.add_argument('--history',
+                        dest='history',
+                        type=str,
+                        action='store',
+                        help='Append the size of the firmware to this size history file.')
+    parser.add_argument('--target',
+                        dest='target',
+                        type=str,
+                        action='store',
+                        help='The name of the target in the size history. Defaults to the name of the firmware.')
+    parser.add_argument('--source-dir',
+                        dest='source_dir',
+                        type=str,
+                        action='store',
+                        default='.',
+                        help='A directory in the git repository of the project, to record the revision.')
+    parser.add_argument('--trend',
+                        dest='trend',
+                        type=int,
+                        action='store',
+                        default=0,
+                        help='Only print the last N records of the size history for the target, without '
+                             'analyzing or recording the firmware. Requires --history.')
+    parser.add_argument('--batch',
+                        dest='batch',
+                        action='store_true',
+                        help='Analyze many firmware files or build directories in parallel. The memory sizes '
+                             'of each firmware are read from the configuration of its build directory.')
+    parser.add_argument('--config',
+                        dest='config',
+                        type=str,
+                        action='store',
+                        help='Use the memory sizes from this configuration for all firmware files of the batch.')
+    parser.add_argument('--json',
+                        dest='json',
+                        type=str,
+                        action='store',
+                        help='Write the batch report as JSON to this file, or "-" for the standard output.')
+    parser.add_argument('--csv',
+                        dest='csv',
+                        type=str,
+                        action='store',
+                        help='Write the batch report as CSV to this file, or "-" for the standard output.')
+    parser.add_argument('--jobs', '-j',
+                        dest='jobs',
+                        type=int,
+                        action='store',
+                        default=os.cpu_count() or 4,
+                        help='The number of parallel processes for the batch.')
+    parser.add_argument('--size-cache',
+                        dest='size_cache',
+                        type=str,
+                        action='store',
+                        default=str(SIZE_CACHE_PATH),
+                        help='The file with the cached sizes of the analyzed firmware files.')
+    parser.add_argument('--no-size-cache',
+                        dest='no_size_cache',
+                        action='store_true',
+                        help='Analyze all firmware files of the batch, without the cache.')
+    parser.add_argument('firmware',
+                        type=str,
+                        nargs='+',
+                        help='The absolute path to the firmware file. With --batch, any number of firmware '
+                             'files and build directories.')
     args = parser.parse_args()
-    text_size, initialized_size, uninitialized_size = retrieve_size(size_tool=args.size_tool, firmware=args.firmware)
-    print_results(text_size, initialized_size, uninitialized_size, args.flash_size, args.flash_start, args.ram_size)
+    if args.batch:
+        run_batch(args)
+        return
+    if len(args.firmware) != 1:
+        parser.error('Use --batch to analyze more than one firmware.')
+    if args.trend:
+        if not args.history:
+            parser.error('The argument --trend requires --history.')
+        print_trend(SizeHistory(args.history).records(args.target or Path(args.firmware[0]).name), args.trend)
+        return
+    if args.flash_size is None or args.flash_start is None or args.ram_size is None:
+        parser.error('The arguments --flash-size, --flash-start and --ram-size are required.')
+    args.firmware = args.firmware[0]
+    with open_firmware(args.firmware) as elf:
+        with span('read sizes', 'size'):
+            if args.size_tool:
+                text_size, initialized_size, uninitialized_size = retrieve_size_with_tool(size_tool=args.size_tool,
+                                                                                          firmware=args.firmware)
+            else:
+                text_size, initialized_size, uninitialized_size = elf.sizes()
+            ram_code = elf.ram_code_size()
+        image_hash = None
+        if args.binary or args.hex or args.uf2:
+            with span('write images', 'size'):
+                image_hash = write_images(elf, args.binary, args.hex, args.uf2, args.uf2_family)
+        elif args.history:
+            # The history always records the hash of the binary image, like the builds which write it.
+            image_hash = image_hash_of(elf)
+        print_results(text_size, initialized_size, uninitialized_size,
+                      args.flash_size, args.flash_start, args.ram_size, ram_code)
+        if args.sections:
+            print_sections(elf)
+        if args.map_file:
+            with span('footprint', 'size'):
+                footprint = read_footprint(elf, args.map_file)
+                footprint_path = Path(args.map_file).with_suffix('.footprint.json')
+                print_footprint(footprint, Footprint.load(footprint_path), args.top)
+                footprint.save(footprint_path)
+        stack_depth = None
+        if args.stack_dir:
+            ram_free = args.ram_size - initialized_size - uninitialized_size - ram_code
+            with span('stack usage', 'size'):
+                stack_depth = print_stack_usage(elf, args.stack_dir, ram_free, args.top)
+    if args.history:
+        history = SizeHistory(args.history)
+        target = args.target or Path(args.firmware).name
+        with span('history', 'size'):
+            history.append(create_record(target=target,
+                                         firmware=args.firmware,
+                                         source_dir=args.source_dir,
+                                         text=text_size,
+                                         data=initialized_size,
+                                         bss=uninitialized_size,
+                                         firmware_hash=image_hash))
+    errors = check_budgets(text_size, initialized_size, uninitialized_size,
+                           args.flash_size, args.flash_start, args.ram_size,
+                           args.flash_budget, args.ram_budget, args.stack_budget, stack_depth, ram_code)
+    if errors:
+        exit('Footprint check failed:\n' + '\n'.join(f' - {error}' for error in errors))
 
 
 if __name__ == '__main__':
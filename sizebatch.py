@@ -0,0 +1,380 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import csv
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from elffile import ELF_MAGIC, ElfError, ElfFile
+from sizehistory import file_hash
+
+assert sys.version_info >= (3, 7)
+
+
+SIZE_CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache'))/'hal-toolchain'/'size'/'sizes.json'
+SIZE_CACHE_FORMAT = 1
+# The maximum number of images in the cache. The images used least recently are removed first.
+SIZE_CACHE_LIMIT = 4096
+# The names of the linked firmware files searched in directories.
+FIRMWARE_NAMES = ('firmware', 'firmware.elf')
+
+RE_CONFIG_VARIABLE = re.compile(R'^\s*set\(\s*(\w+)\s+"([^"]*)"\s*\)', re.MULTILINE)
+RE_CACHE_ENTRY = re.compile(R'^(\w+):\w+=(.*)$', re.MULTILINE)
+
+
+class BatchError(Exception):
+    """
+    Exception if the images of a batch could not be analyzed.
+    """
+    pass
+
+
+@dataclass
+class MemoryLayout:
+    """The memory sizes of the platform of an image."""
+    flash_size: int
+    flash_start: int
+    ram_size: int
+    mcu: str = ''
+    profile: str = ''
+
+
+@dataclass
+class ImageSizes:
+    """The sizes read from one firmware, which only depend on the file contents."""
+    text: int
+    data: int
+    bss: int
+    ram_code: int
+
+
+@dataclass
+class ImageReport:
+    """The size report of one firmware."""
+    firmware: str
+    hash: str
+    mcu: str
+    profile: str
+    flash_used: int
+    flash_available: int
+    flash_percent: float
+    ram_used: int
+    ram_size: int
+    ram_percent: float
+    text: int
+    data: int
+    bss: int
+    ram_code: int
+
+    @property
+    def fits(self) -> bool:
+        return self.flash_used <= self.flash_available and self.ram_used <= self.ram_size
+
+
+def read_configuration(path: Path) -> MemoryLayout:
+    """
+    Read the memory layout from a configuration written by `configure.py`.
+
+    :param path: The path to the configuration file.
+    :return: The memory layout.
+    """
+    try:
+        variables = dict(RE_CONFIG_VARIABLE.findall(path.read_text('utf-8')))
+    except OSError as e:
+        raise BatchError(f'Could not read the configuration {path}: {e}')
+    try:
+        return MemoryLayout(flash_size=int(variables['FLASH_SIZE'], 0),
+                            flash_start=int(variables['FLASH_START'], 0),
+                            ram_size=int(variables['RAM_SIZE'], 0),
+                            mcu=variables.get('MCU_VARIANT', ''),
+                            profile=variables.get('OPTIMIZATION_PROFILE', ''))
+    except (KeyError, ValueError) as e:
+        raise BatchError(f'The configuration {path} has no valid memory layout: {e}')
+
+
+def read_cache_entries(firmware: Path) -> Dict[str, str]:
+    """
+    Read the entries of the `CMakeCache.txt` of the build directory containing a firmware.
+
+    :param firmware: The path to the firmware.
+    :return: The values by entry name, empty if there is no build directory.
+    """
+    for directory in firmware.resolve().parents:
+        cache_path = directory/'CMakeCache.txt'
+        if not cache_path.is_file():
+            continue
+        try:
+            return dict(RE_CACHE_ENTRY.findall(cache_path.read_text('utf-8', errors='replace')))
+        except OSError:
+            return {}
+    return {}
+
+
+def find_configuration(firmware: Path, entries: Optional[Dict[str, str]] = None) -> Optional[Path]:
+    """
+    Find the configuration of the build directory containing a firmware.
+
+    The configuration is read from the `CMakeCache.txt` of the build directory: either the file
+    selected with `HAL_CONFIGURATION`, or the default configuration next to the toolchain file.
+
+    :param firmware: The path to the firmware.
+    :param entries: The entries of the `CMakeCache.txt`, if they are already read.
+    :return: The path to the configuration, or None if there is no build directory.
+    """
+    if entries is None:
+        entries = read_cache_entries(firmware)
+    if entries.get('HAL_CONFIGURATION'):
+        return Path(entries['HAL_CONFIGURATION'])
+    if entries.get('CMAKE_TOOLCHAIN_FILE'):
+        return Path(entries['CMAKE_TOOLCHAIN_FILE']).parent/'configuration.cmake'
+    return None
+
+
+def _is_elf(path: Path) -> bool:
+    try:
+        with open(path, 'rb') as file:
+            return file.read(4) == ELF_MAGIC
+    except OSError:
+        return False
+
+
+def find_firmware(paths: List[str]) -> List[Path]:
+    """
+    Collect the firmware files of a batch.
+
+    :param paths: Firmware files, or directories which are searched for linked firmware files.
+    :return: The paths of all firmware files, without duplicates.
+    """
+    result = []
+    for name in paths:
+        path = Path(name)
+        if path.is_dir():
+            result += sorted(candidate for candidate in path.rglob('*')
+                             if candidate.name in FIRMWARE_NAMES and candidate.is_file() and _is_elf(candidate))
+        elif path.is_file():
+            result.append(path)
+        else:
+            raise BatchError(f'Firmware not found at path: {path}')
+    return list(dict.fromkeys(result))
+
+
+def read_sizes(path: Union[str, Path]) -> ImageSizes:
+    """
+    Read the sizes of a firmware.
+
+    :param path: The path to the firmware.
+    :return: The sizes.
+    """
+    with ElfFile(path) as elf:
+        text, data, bss = elf.sizes()
+        return ImageSizes(text=text, data=data, bss=bss, ram_code=elf.ram_code_size())
+
+
+def _hash_image(path: Path) -> Tuple[Optional[str], Optional[str]]:
+    try:
+        return file_hash(path), None
+    except OSError as e:
+        return None, f'Could not read {path}: {e}'
+
+
+def _analyze_image(path: Path) -> Tuple[Optional[ImageSizes], Optional[str]]:
+    try:
+        return read_sizes(path), None
+    except (ElfError, OSError) as e:
+        return None, f'Could not read the firmware {path}: {e}'
+
+
+def load_cache(path: Path) -> Dict[str, ImageSizes]:
+    """
+    Load the sizes of the already analyzed images.
+
+    :param path: The path to the cache file.
+    :return: The sizes by firmware hash, empty if there is no valid cache.
+    """
+    try:
+        data = json.loads(path.read_text('utf-8'))
+        if data.get('format') != SIZE_CACHE_FORMAT:
+            return {}
+        return {key: ImageSizes(**value) for key, value in data['images'].items()}
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        return {}
+
+
+def save_cache(path: Path, cache: Dict[str, ImageSizes]):
+    """
+    Save the sizes of the analyzed images.
+
+    Only the last `SIZE_CACHE_LIMIT` images of the cache are saved.
+
+    :param path: The path to the cache file.
+    :param cache: The sizes by firmware hash, the least recently used first.
+    """
+    items = list(cache.items())[-SIZE_CACHE_LIMIT:]
+    data = {'format': SIZE_CACHE_FORMAT, 'images': {key: asdict(value) for key, value in items}}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    temp_path.write_text(json.dumps(data, separators=(',', ':')), 'utf-8')
+    temp_path.replace(path)
+
+
+def create_report(firmware: Path, image_hash: str, sizes: ImageSizes, layout: MemoryLayout) -> ImageReport:
+    """
+    Combine the sizes of an image with the memory layout of its platform.
+
+    :param firmware: The path to the firmware.
+    :param image_hash: The hash of the firmware file.
+    :param sizes: The sizes of the firmware.
+    :param layout: The memory layout of the platform.
+    :return: The report.
+    """
+    flash_available = layout.flash_size - layout.flash_start
+    flash_used = sizes.text + sizes.data
+    ram_used = sizes.data + sizes.bss + sizes.ram_code
+    return ImageReport(firmware=str(firmware),
+                       hash=image_hash,
+                       mcu=layout.mcu,
+                       profile=layout.profile,
+                       flash_used=flash_used,
+                       flash_available=flash_available,
+                       flash_percent=round(flash_used * 100.0 / flash_available, 2) if flash_available > 0 else 0.0,
+                       ram_used=ram_used,
+                       ram_size=layout.ram_size,
+                       ram_percent=round(ram_used * 100.0 / layout.ram_size, 2) if layout.ram_size > 0 else 0.0,
+                       text=sizes.text,
+                       data=sizes.data,
+                       bss=sizes.bss,
+                       ram_code=sizes.ram_code)
+
+
+def analyze_batch(firmware_paths: List[Path], default_layout: Optional[MemoryLayout], config: Optional[Path],
+                  cache_path: Optional[Path], jobs: int) -> Tuple[List[ImageReport], List[str]]:
+    """
+    Analyze many firmware files in parallel.
+
+    Every file is hashed, and only the files which are not in the cache are read. The memory layout of
+    each image is read from the configuration of its build directory.
+
+    :param firmware_paths: The paths of the firmware files.
+    :param default_layout: The layout for images without configuration, or None.
+    :param config: A configuration for all images, or None to search the configuration of each image.
+    :param cache_path: The path to the cache file, or None to disable the cache.
+    :param jobs: The number of parallel processes.
+    :return: The reports, in the order of the paths, and the errors.
+    """
+    errors = []
+    configurations: Dict[Path, MemoryLayout] = {}
+    layouts: List[Optional[MemoryLayout]] = []
+    for path in firmware_paths:
+        entries = read_cache_entries(path)
+        config_path = config or find_configuration(path, entries)
+        if config_path is not None and config_path.is_file():
+            if config_path not in configurations:
+                configurations[config_path] = read_configuration(config_path)
+            layout = configurations[config_path]
+        elif default_layout is not None:
+            layout = default_layout
+        else:
+            layouts.append(None)
+            errors.append(f'No configuration found for {path}. Use --config or the memory size arguments.')
+            continue
+        # The profile of the configuration can be overridden for a build directory, see `toolchain.cmake`.
+        if entries.get('HAL_OPTIMIZATION_PROFILE'):
+            layout = replace(layout, profile=entries['HAL_OPTIMIZATION_PROFILE'])
+        layouts.append(layout)
+    cache = load_cache(cache_path) if cache_path else {}
+    chunk_size = max(1, len(firmware_paths) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        hashes = list(executor.map(_hash_image, firmware_paths, chunksize=chunk_size))
+        # Identical images are only read once.
+        missing: Dict[str, Path] = {}
+        for path, (image_hash, _) in zip(firmware_paths, hashes):
+            if image_hash is not None and image_hash not in cache:
+                missing.setdefault(image_hash, path)
+        results = executor.map(_analyze_image, list(missing.values()), chunksize=chunk_size)
+        for image_hash, (sizes, error) in zip(list(missing.keys()), results):
+            if sizes is not None:
+                cache[image_hash] = sizes
+            else:
+                errors.append(error)
+    if cache_path:
+        # Move the images of this batch to the end, so they are the last removed from the cache.
+        for image_hash, _ in hashes:
+            if image_hash in cache:
+                cache[image_hash] = cache.pop(image_hash)
+        save_cache(cache_path, cache)
+    reports = []
+    for path, (image_hash, error), layout in zip(firmware_paths, hashes, layouts):
+        if error:
+            errors.append(error)
+        elif image_hash in cache and layout is not None:
+            reports.append(create_report(path, image_hash, cache[image_hash], layout))
+    return reports, errors
+
+
+def write_json(path: str, reports: List[ImageReport]):
+    """
+    Write the reports as JSON.
+
+    :param path: The path of the file, or '-' for the standard output.
+    :param reports: The reports.
+    """
+    text = json.dumps({'images': [dict(asdict(report), fits=report.fits) for report in reports]}, indent=1)
+    if path == '-':
+        print(text)
+    else:
+        Path(path).write_text(text + '\n', 'utf-8')
+
+
+def write_csv(path: str, reports: List[ImageReport]):
+    """
+    Write the reports as CSV, with one row per image.
+
+    :param path: The path of the file, or '-' for the standard output.
+    :param reports: The reports.
+    """
+    names = [field.name for field in fields(ImageReport)] + ['fits']
+    file = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+    try:
+        writer = csv.writer(file)
+        writer.writerow(names)
+        for report in reports:
+            writer.writerow([getattr(report, name) for name in names])
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+def print_reports(reports: List[ImageReport]):
+    """
+    Print a table with the size of each image.
+
+    :param reports: The reports.
+    """
+    width = max([len(report.firmware) for report in reports] + [8])
+    print(f'{"Firmware":<{width}} {"MCU":<14} {"Flash":>8} {"Flash%":>7} {"RAM":>8} {"RAM%":>7}')
+    for report in reports:
+        marker = '' if report.fits else '  DOES NOT FIT'
+        print(f'{report.firmware:<{width}} {report.mcu:<14} {report.flash_used:>8} {report.flash_percent:>6.1f}% '
+              f'{report.ram_used:>8} {report.ram_percent:>6.1f}%{marker}')
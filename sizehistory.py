@@ -0,0 +1,218 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import hashlib
+import json
+import sys
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+assert sys.version_info >= (3, 7)
+
+
+TAIL_BLOCK_SIZE = 0x4000  # The size of the blocks read from the end of the history.
+
+
+@dataclass
+class HistoryRecord:
+    """One entry in the size history."""
+    time: int
+    target: str
+    revision: str
+    firmware_hash: str
+    text: int
+    data: int
+    bss: int
+
+    @property
+    def flash(self) -> int:
+        return self.text + self.data
+
+    @property
+    def ram(self) -> int:
+        return self.data + self.bss
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """
+    Calculate the SHA-256 hash of a file.
+
+    :param path: The path to the file.
+    :return: The hash as hex string.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def git_revision(path: Union[str, Path]) -> str:
+    """
+    Get the current git revision of the repository containing the given path.
+
+    The revision is read directly from the repository files, without starting git.
+
+    :param path: A path inside of the repository.
+    :return: The revision or an empty string if it can not be determined.
+    """
+    path = Path(path).resolve()
+    for directory in [path] + list(path.parents):
+        git_dir = directory / '.git'
+        if git_dir.is_file():
+            # A worktree or submodule, pointing to the actual git directory.
+            text = git_dir.read_text('utf-8').strip()
+            if not text.startswith('gitdir:'):
+                return ''
+            git_dir = (directory / text[7:].strip()).resolve()
+        if git_dir.is_dir():
+            return _read_head(git_dir)
+    return ''
+
+
+def _read_head(git_dir: Path) -> str:
+    try:
+        head = (git_dir / 'HEAD').read_text('utf-8').strip()
+    except OSError:
+        return ''
+    if not head.startswith('ref:'):
+        return head
+    ref = head[4:].strip()
+    common_dir = git_dir
+    if (git_dir / 'commondir').is_file():
+        common_dir = (git_dir / (git_dir / 'commondir').read_text('utf-8').strip()).resolve()
+    for base_dir in (git_dir, common_dir):
+        ref_path = base_dir / ref
+        if ref_path.is_file():
+            return ref_path.read_text('utf-8').strip()
+    packed_refs = common_dir / 'packed-refs'
+    if packed_refs.is_file():
+        for line in packed_refs.read_text('utf-8').splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+    return ''
+
+
+class SizeHistory:
+    """
+    An append-only history of firmware sizes, stored as one JSON object per line.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def records(self, target: Optional[str] = None) -> List[HistoryRecord]:
+        """
+        Read the records from the history.
+
+        :param target: If set, only return the records for this target.
+        :return: A list of records, the oldest first.
+        """
+        if not self.path.is_file():
+            return []
+        result = []
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = HistoryRecord(**json.loads(line))
+                except (ValueError, TypeError):
+                    continue
+                if target is None or record.target == target:
+                    result.append(record)
+        return result
+
+    def last_record(self, target: str) -> Optional[HistoryRecord]:
+        """
+        Get the last record of a target.
+
+        The history is read backwards from its end, so usually only the last block is read.
+
+        :param target: The target of the record.
+        :return: The last record of the target, or None if the history has no record for it.
+        """
+        if not self.path.is_file():
+            return None
+        for line in self._lines_from_end():
+            try:
+                record = HistoryRecord(**json.loads(line))
+            except (ValueError, TypeError):
+                continue
+            if record.target == target:
+                return record
+        return None
+
+    def _lines_from_end(self) -> Iterator[bytes]:
+        with open(self.path, 'rb') as file:
+            position = file.seek(0, 2)
+            rest = b''
+            while position > 0:
+                size = min(TAIL_BLOCK_SIZE, position)
+                position -= size
+                file.seek(position)
+                lines = (file.read(size) + rest).split(b'\n')
+                # The first line can be incomplete, until the start of the file is reached.
+                rest = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield line
+            if rest.strip():
+                yield rest
+
+    def append(self, record: HistoryRecord) -> bool:
+        """
+        Append a record to the history.
+
+        The record is not added if the last record of the same target has the same revision and firmware hash.
+
+        :param record: The record to add.
+        :return: True if the record was added.
+        """
+        last = self.last_record(record.target)
+        if last and last.revision == record.revision and last.firmware_hash == record.firmware_hash:
+            return False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(asdict(record), separators=(',', ':')) + '\n')
+        return True
+
+
+def create_record(target: str, firmware: Union[str, Path], source_dir: Union[str, Path],
+                  text: int, data: int, bss: int, firmware_hash: Optional[str] = None) -> HistoryRecord:
+    """
+    Create a new history record for the current build.
+
+    :param target: The name of the target.
+    :param firmware: The path to the firmware.
+    :param source_dir: A path inside the git repository of the project.
+    :param text: The size of the text segment.
+    :param data: The size of the initialized variables.
+    :param bss: The size of the uninitialized variables.
+    :param firmware_hash: The hash of the binary image, or None to hash the firmware file. Pass the image hash
+        for all records of a history, because only records with the same hash are recognized as duplicates.
+    :return: The new record.
+    """
+    return HistoryRecord(time=int(time.time()),
+                         target=target,
+                         revision=git_revision(source_dir),
+                         firmware_hash=firmware_hash or file_hash(firmware),
+                         text=text,
+                         data=data,
+                         bss=bss)
@@ -0,0 +1,381 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import json
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from elffile import ElfFile
+
+assert sys.version_info >= (3, 7)
+
+
+INDIRECT_CALL = '__indirect_call'
+VECTOR_SECTION = '.isr_vector'
+EXCEPTION_FRAME_SIZE = 32  # The registers stacked by the CPU on exception entry.
+CACHE_FORMAT = 1
+RECURSION_SEARCH_LIMIT = 100000  # The maximum number of paths searched in one recursive component.
+
+RE_NODE = re.compile(R'node:\s*\{\s*title:\s*"([^"]*)"\s*label:\s*"([^"]*)"')
+RE_EDGE = re.compile(R'edge:\s*\{\s*sourcename:\s*"([^"]*)"\s*targetname:\s*"([^"]*)"')
+RE_STACK = re.compile(R'\\n(\d+) bytes \(([a-z,]+)\)')
+RE_SU_LINE = re.compile(R'^(.*):([^:\t]+)\t(\d+)\t([a-z,]+)\s*$')
+
+
+class StackUsageError(Exception):
+    """
+    Exception if the stack usage can not be analyzed.
+    """
+    pass
+
+
+@dataclass
+class FunctionInfo:
+    """The stack frame and the calls of one function."""
+    name: str
+    frame: Optional[int] = None
+    dynamic: bool = False
+    calls: List[str] = field(default_factory=list)
+
+
+@dataclass
+class StackResult:
+    """The worst case stack depth of one entry point."""
+    entry: str
+    depth: int
+    path: List[str]
+    recursion: List[str]
+    indirect: List[str]
+    unknown: List[str]
+    dynamic: List[str]
+
+    @property
+    def is_exact(self) -> bool:
+        return not (self.recursion or self.indirect or self.unknown or self.dynamic)
+
+
+def read_callgraph_file(path: Path) -> Dict[str, FunctionInfo]:
+    """
+    Read a call graph file written by GCC with `-fcallgraph-info=su`.
+
+    :param path: The path to the `.ci` file.
+    :return: A dictionary with the functions from the file.
+    """
+    functions: Dict[str, FunctionInfo] = {}
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            if line.startswith('node:'):
+                match = RE_NODE.match(line)
+                if not match:
+                    continue
+                function = functions.setdefault(match.group(1), FunctionInfo(name=match.group(1)))
+                stack_match = RE_STACK.search(match.group(2))
+                if stack_match:
+                    function.frame = int(stack_match.group(1))
+                    function.dynamic = stack_match.group(2) != 'static'
+            elif line.startswith('edge:'):
+                match = RE_EDGE.match(line)
+                if not match:
+                    continue
+                function = functions.setdefault(match.group(1), FunctionInfo(name=match.group(1)))
+                if match.group(2) not in function.calls:
+                    function.calls.append(match.group(2))
+    return functions
+
+
+def read_stack_usage_file(path: Path) -> Dict[str, FunctionInfo]:
+    """
+    Read a stack usage file written by GCC with `-fstack-usage`.
+
+    :param path: The path to the `.su` file.
+    :return: A dictionary with the functions from the file, without calls.
+    """
+    functions: Dict[str, FunctionInfo] = {}
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            match = RE_SU_LINE.match(line)
+            if match:
+                name = match.group(2)
+                functions[name] = FunctionInfo(name=name,
+                                               frame=int(match.group(3)),
+                                               dynamic=match.group(4) != 'static')
+    return functions
+
+
+class CallGraph:
+    """
+    The call graph of a firmware, with the stack frame of each function.
+    """
+
+    def __init__(self, functions: Dict[str, FunctionInfo]):
+        self.functions = functions
+
+    @property
+    def has_calls(self) -> bool:
+        return any(function.calls for function in self.functions.values())
+
+    @staticmethod
+    def load(directory: Union[str, Path], cache_path: Optional[Union[str, Path]] = None) -> 'CallGraph':
+        """
+        Load the call graph from all `.ci` and `.su` files in a directory and its subdirectories.
+
+        The parsed contents of each file are cached, so only new or changed files are read again.
+
+        :param directory: The build directory.
+        :param cache_path: The path to the cache file, or None to disable the cache.
+        :return: The merged call graph.
+        """
+        directory = Path(directory)
+        if not directory.is_dir():
+            raise StackUsageError(f'The directory for the stack analysis does not exist: {directory}')
+        cache = {}
+        if cache_path:
+            try:
+                data = json.loads(Path(cache_path).read_text('utf-8'))
+                if data.get('format') == CACHE_FORMAT:
+                    cache = data['files']
+            except (OSError, ValueError, KeyError, AttributeError):
+                cache = {}
+        new_cache = {}
+        files = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith(('.ci', '.su')):
+                    files.append(Path(root)/name)
+        # The stack usage files are read first, so the call graph files replace their entries.
+        files.sort(key=lambda p: (p.suffix == '.ci', str(p)))
+        functions: Dict[str, FunctionInfo] = {}
+        for path in files:
+            stat = path.stat()
+            key = str(path)
+            cached = cache.get(key)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                file_functions = {values[0]: FunctionInfo(*values) for values in cached[2]}
+            elif path.suffix == '.ci':
+                file_functions = read_callgraph_file(path)
+            else:
+                file_functions = read_stack_usage_file(path)
+            new_cache[key] = [stat.st_size, stat.st_mtime_ns,
+                              [[f.name, f.frame, f.dynamic, list(f.calls)] for f in file_functions.values()]]
+            for name, function in file_functions.items():
+                existing = functions.get(name)
+                if existing is None:
+                    functions[name] = function
+                    continue
+                # External declarations in one file are merged with the definition from another file.
+                if function.frame is not None:
+                    existing.frame = function.frame
+                    existing.dynamic = function.dynamic
+                for call in function.calls:
+                    if call not in existing.calls:
+                        existing.calls.append(call)
+        if cache_path and new_cache != cache:
+            try:
+                temp_path = Path(cache_path).with_suffix(f'.{os.getpid()}.tmp')
+                temp_path.write_text(json.dumps({'format': CACHE_FORMAT, 'files': new_cache},
+                                                separators=(',', ':')), 'utf-8')
+                temp_path.replace(cache_path)
+            except OSError:
+                pass
+        return CallGraph(functions)
+
+    def analyze(self, entries: List[str]) -> List[StackResult]:
+        """
+        Calculate the worst case stack depth for each entry point.
+
+        The strongly connected components of the graph are found with an iterative version of
+        Tarjan's algorithm. Because the components are completed in reverse topological order,
+        the depth of every function is calculated in the same pass, in linear time.
+        For a recursive component, the depth is the longest path through the members without
+        repeating one, which is a lower bound for the real depth.
+
+        :param entries: The names of the entry points.
+        :return: The result for each entry point, in the given order.
+        """
+        depth: Dict[str, int] = {}
+        next_calls: Dict[str, List[str]] = {}
+        flags: Dict[str, tuple] = {}
+        index: Dict[str, int] = {}
+        low_link: Dict[str, int] = {}
+        component_stack: List[str] = []
+        on_stack = set()
+        counter = 0
+        for entry in entries:
+            if entry in index:
+                continue
+            work = [(entry, 0)]
+            while work:
+                name, call_index = work.pop()
+                if call_index == 0:
+                    index[name] = low_link[name] = counter
+                    counter += 1
+                    component_stack.append(name)
+                    on_stack.add(name)
+                calls = self._calls(name)
+                if call_index < len(calls):
+                    work.append((name, call_index + 1))
+                    callee = calls[call_index]
+                    if callee not in index:
+                        work.append((callee, 0))
+                    elif callee in on_stack:
+                        low_link[name] = min(low_link[name], index[callee])
+                    continue
+                if low_link[name] == index[name]:
+                    component = []
+                    while True:
+                        member = component_stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    self._finish_component(component, depth, next_calls, flags)
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[name])
+        results = []
+        for entry in entries:
+            path = [entry]
+            while next_calls.get(path[-1]):
+                path.extend(next_calls[path[-1]])
+            recursion, indirect, unknown, dynamic = (sorted(values) for values in flags[entry])
+            results.append(StackResult(entry=entry, depth=depth[entry], path=path, recursion=recursion,
+                                       indirect=indirect, unknown=unknown, dynamic=dynamic))
+        return results
+
+    def _calls(self, name: str) -> List[str]:
+        function = self.functions.get(name)
+        if function is None:
+            return []
+        return [call for call in function.calls if call != INDIRECT_CALL]
+
+    def _finish_component(self, component: List[str], depth: Dict[str, int],
+                          next_calls: Dict[str, List[str]], flags: Dict[str, tuple]):
+        members = set(component)
+        is_recursive = len(component) > 1 or component[0] in self._calls(component[0])
+        frames: Dict[str, int] = {}
+        exit_depth: Dict[str, int] = {}
+        exit_call: Dict[str, Optional[str]] = {}
+        recursion = set(component) if is_recursive else set()
+        indirect = set()
+        unknown = set()
+        dynamic = set()
+        for name in component:
+            function = self.functions.get(name)
+            if function is None or function.frame is None:
+                unknown.add(name)
+                frames[name] = 0
+            else:
+                frames[name] = function.frame
+                if function.dynamic:
+                    dynamic.add(name)
+                if INDIRECT_CALL in function.calls:
+                    indirect.add(name)
+            best_depth = 0
+            best_call = None
+            for callee in self._calls(name):
+                if callee in members:
+                    continue
+                recursion |= flags[callee][0]
+                indirect |= flags[callee][1]
+                unknown |= flags[callee][2]
+                dynamic |= flags[callee][3]
+                if depth[callee] > best_depth or best_call is None:
+                    best_depth = depth[callee]
+                    best_call = callee
+            exit_depth[name] = best_depth
+            exit_call[name] = best_call
+        # Every member of a component reaches all other members, so they share the flags.
+        component_flags = (frozenset(recursion), frozenset(indirect), frozenset(unknown), frozenset(dynamic))
+        for name in component:
+            chain = self._longest_chain(name, members, frames, exit_depth) if is_recursive else [name]
+            depth[name] = sum(frames[member] for member in chain) + exit_depth[chain[-1]]
+            next_calls[name] = chain[1:] + ([exit_call[chain[-1]]] if exit_call[chain[-1]] else [])
+            flags[name] = component_flags
+
+    def _longest_chain(self, start: str, members: set, frames: Dict[str, int],
+                       exit_depth: Dict[str, int]) -> List[str]:
+        """
+        Find the deepest chain of calls through a recursive component, without repeating a member.
+
+        The search is exhaustive up to `RECURSION_SEARCH_LIMIT` paths. Each path found is a real
+        chain of calls, so the result stays a lower bound if the search is stopped.
+
+        :return: The members along the chain, starting with `start`.
+        """
+        best_chain = [start]
+        best_depth = frames[start] + exit_depth[start]
+        chain = [start]
+        visited = {start}
+        chain_depth = frames[start]
+        work = [iter(self._calls(start))]
+        searched = 0
+        while work and searched < RECURSION_SEARCH_LIMIT:
+            callee = next(work[-1], None)
+            if callee is None:
+                work.pop()
+                visited.discard(chain[-1])
+                chain_depth -= frames[chain.pop()]
+                continue
+            if callee not in members or callee in visited:
+                continue
+            searched += 1
+            chain.append(callee)
+            visited.add(callee)
+            chain_depth += frames[callee]
+            if chain_depth + exit_depth[callee] > best_depth:
+                best_depth = chain_depth + exit_depth[callee]
+                best_chain = list(chain)
+            work.append(iter(self._calls(callee)))
+        return best_chain
+
+
+def vector_entries(elf: ElfFile, graph: Optional[CallGraph] = None) -> List[str]:
+    """
+    Get the names of all functions in the vector table of the firmware.
+
+    Handlers which are aliases of the same function are only listed once. If there are multiple
+    names for a function, the one used in the call graph is preferred.
+
+    :param elf: The firmware.
+    :param graph: The call graph, or None.
+    :return: The names of the entry points, starting with the reset handler.
+    """
+    section = elf.section(VECTOR_SECTION)
+    if section is None:
+        raise StackUsageError(f'The firmware has no "{VECTOR_SECTION}" section.')
+    names_by_address: Dict[int, List[str]] = {}
+    for symbol in elf.symbols:
+        if symbol.is_function and symbol.is_defined and symbol.name:
+            names_by_address.setdefault(symbol.address, []).append(symbol.name)
+    data = elf.section_data(section)
+    entries = []
+    for offset in range(4, len(data) - 3, 4):
+        address = elf.unpack_from('I', section.offset + offset)[0] & ~1
+        names = names_by_address.get(address)
+        if not address or not names:
+            continue
+        name = names[0]
+        if graph is not None:
+            name = next((n for n in names if n in graph.functions), name)
+        if name not in entries:
+            entries.append(name)
+    return entries
@@ -0,0 +1,200 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import bisect
+import sys
+from typing import List, Optional, Tuple
+
+from debugline import read_line_rows
+from elffile import ElfFile, Symbol, STB_GLOBAL
+
+assert sys.version_info >= (3, 7)
+
+
+class SymbolIndex:
+    """
+    A sorted index of the functions of a firmware, to map addresses to function names.
+    """
+
+    def __init__(self, symbols: List[Symbol]):
+        functions = [symbol for symbol in symbols if symbol.is_function and symbol.is_defined and symbol.name]
+        # For aliases at the same address, global names are preferred.
+        functions.sort(key=lambda s: (s.address, s.binding != STB_GLOBAL, s.name))
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._names: List[str] = []
+        for symbol in functions:
+            if self._starts and self._starts[-1] == symbol.address:
+                self._ends[-1] = max(self._ends[-1], symbol.address + symbol.size)
+                continue
+            self._starts.append(symbol.address)
+            self._ends.append(symbol.address + symbol.size)
+            self._names.append(symbol.name)
+        # Functions without a size, like the ones written in assembler, end at the next function.
+        for index in range(len(self._starts)):
+            if self._ends[index] == self._starts[index]:
+                if index + 1 < len(self._starts):
+                    self._ends[index] = self._starts[index + 1]
+                else:
+                    self._ends[index] = self._starts[index] + 1
+
+    @staticmethod
+    def from_elf(elf: ElfFile) -> 'SymbolIndex':
+        """
+        Create the index from the symbol table of a firmware.
+
+        :param elf: The firmware.
+        :return: The index.
+        """
+        return SymbolIndex(elf.symbols)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def to_data(self) -> list:
+        """
+        Convert the index into a list, which can be stored as JSON.
+
+        :return: The start, end and name of each function.
+        """
+        return [list(entry) for entry in zip(self._starts, self._ends, self._names)]
+
+    @staticmethod
+    def from_data(data: list) -> 'SymbolIndex':
+        """
+        Create the index from a list created with `to_data()`.
+
+        :param data: The list with the functions.
+        :return: The index.
+        """
+        index = SymbolIndex([])
+        for start, end, name in data:
+            index._starts.append(start)
+            index._ends.append(end)
+            index._names.append(name)
+        return index
+
+    def find(self, address: int) -> Optional[Tuple[str, int]]:
+        """
+        Find the function which contains an address, and the offset of the address in the function.
+
+        :param address: The address, the thumb bit is ignored.
+        :return: The name of the function and the offset, or None if the address is in no function.
+        """
+        address &= ~1
+        index = bisect.bisect_right(self._starts, address) - 1
+        if index < 0 or address >= self._ends[index]:
+            return None
+        return self._names[index], address - self._starts[index]
+
+    def lookup(self, address: int) -> Optional[str]:
+        """
+        Find the function which contains an address.
+
+        :param address: The address, the thumb bit is ignored.
+        :return: The name of the function, or None if the address is in no function.
+        """
+        result = self.find(address)
+        return result[0] if result else None
+
+
+class LineIndex:
+    """
+    A sorted index of the line table of a firmware, to map addresses to source lines.
+
+    Each row covers the addresses up to the next row. The end of a sequence is stored as row
+    with line zero, so addresses between sequences are not mapped.
+    """
+
+    def __init__(self, files: List[str], addresses: List[int], file_indexes: List[int], lines: List[int]):
+        self._files = files
+        self._addresses = addresses
+        self._file_indexes = file_indexes
+        self._lines = lines
+
+    @staticmethod
+    def from_elf(elf: ElfFile) -> 'LineIndex':
+        """
+        Create the index from the DWARF line table of a firmware.
+
+        :param elf: The firmware.
+        :return: The index, which is empty if the firmware has no debug information.
+        """
+        rows = read_line_rows(elf)
+        # The sort is stable, so the order of the rows at the same address is kept.
+        rows.sort(key=lambda row: row[0])
+        files: List[str] = []
+        file_numbers = {}
+        addresses: List[int] = []
+        file_indexes: List[int] = []
+        lines: List[int] = []
+        for address, file_name, line in rows:
+            if file_name is None:
+                file_index = -1
+            else:
+                file_index = file_numbers.get(file_name)
+                if file_index is None:
+                    file_index = len(files)
+                    file_numbers[file_name] = file_index
+                    files.append(file_name)
+            if addresses and addresses[-1] == address:
+                # Like addr2line, the last row for an address is used, but never the end of a sequence.
+                if line != 0:
+                    file_indexes[-1] = file_index
+                    lines[-1] = line
+                continue
+            addresses.append(address)
+            file_indexes.append(file_index)
+            lines.append(line)
+        return LineIndex(files, addresses, file_indexes, lines)
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def to_data(self) -> dict:
+        """
+        Convert the index into a dictionary, which can be stored as JSON.
+
+        :return: The files and the rows of the index.
+        """
+        return {'files': self._files, 'addresses': self._addresses,
+                'file_indexes': self._file_indexes, 'lines': self._lines}
+
+    @staticmethod
+    def from_data(data: dict) -> 'LineIndex':
+        """
+        Create the index from a dictionary created with `to_data()`.
+
+        :param data: The dictionary with the files and rows.
+        :return: The index.
+        """
+        return LineIndex(data['files'], data['addresses'], data['file_indexes'], data['lines'])
+
+    def lookup(self, address: int) -> Optional[Tuple[str, int]]:
+        """
+        Find the source line of an address.
+
+        :param address: The address, the thumb bit is ignored.
+        :return: The file name and the line, or None if there is no line for the address.
+        """
+        address &= ~1
+        index = bisect.bisect_right(self._addresses, address) - 1
+        if index < 0 or self._lines[index] == 0:
+            return None
+        return self._files[self._file_indexes[index]], self._lines[index]
@@ -0,0 +1,65 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stackusage import CallGraph, FunctionInfo
+
+
+def make_graph(*functions: FunctionInfo) -> CallGraph:
+    return CallGraph({function.name: function for function in functions})
+
+
+class CallGraphTest(unittest.TestCase):
+
+    def test_call_chain(self):
+        graph = make_graph(FunctionInfo('main', 16, calls=['a', 'b']),
+                           FunctionInfo('a', 8),
+                           FunctionInfo('b', 24, calls=['a']))
+        result = graph.analyze(['main'])[0]
+        self.assertEqual(result.depth, 48)
+        self.assertEqual(result.path, ['main', 'b', 'a'])
+        self.assertTrue(result.is_exact)
+
+    def test_recursion_through_all_members(self):
+        # E(8) -> A(16) <-> B(32) -> C(100): the path through both members of the recursion counts.
+        graph = make_graph(FunctionInfo('E', 8, calls=['A']),
+                           FunctionInfo('A', 16, calls=['B']),
+                           FunctionInfo('B', 32, calls=['A', 'C']),
+                           FunctionInfo('C', 100))
+        entry, member_a, member_b = graph.analyze(['E', 'A', 'B'])
+        self.assertEqual(entry.depth, 156)
+        self.assertEqual(entry.path, ['E', 'A', 'B', 'C'])
+        self.assertEqual(entry.recursion, ['A', 'B'])
+        self.assertFalse(entry.is_exact)
+        self.assertEqual(member_a.depth, 148)
+        self.assertEqual(member_b.depth, 132)
+
+    def test_unknown_function(self):
+        graph = make_graph(FunctionInfo('main', 16, calls=['missing']))
+        result = graph.analyze(['main'])[0]
+        self.assertEqual(result.depth, 16)
+        self.assertEqual(result.unknown, ['missing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from elffile import ElfFile
+from symbolindex import LineIndex, SymbolIndex
+
+assert sys.version_info >= (3, 7)
+
+
+# The names of the data processing instructions, by their opcode.
+DATA_PROCESSING_NAMES = ['ands', 'eors', 'lsls', 'lsrs', 'asrs', 'adcs', 'sbcs', 'rors',
+                         'tst', 'rsbs', 'cmp', 'cmn', 'orrs', 'muls', 'bics', 'mvns']
+# The names of the load and store instructions with register offset, by their opcode.
+REGISTER_OFFSET_NAMES = ['str', 'strh', 'strb', 'ldrsb', 'ldr', 'ldrh', 'ldrb', 'ldrsh']
+# The names of the condition codes.
+CONDITION_NAMES = ['eq', 'ne', 'cs', 'cc', 'mi', 'pl', 'vs', 'vc', 'hi', 'ls', 'ge', 'lt', 'gt', 'le']
+
+# The cycles of the Cortex-M0+, from the technical reference manual, with the single cycle multiplier.
+CYCLES_DEFAULT = 1
+CYCLES_LOAD_STORE = 2
+CYCLES_BRANCH = 2
+CYCLES_BRANCH_NOT_TAKEN = 1
+CYCLES_BRANCH_LINK = 3
+CYCLES_BARRIER = 3
+CYCLES_SPECIAL_REGISTER = 3
+CYCLES_POP_PC = 3
+
+
+@dataclass
+class Instruction:
+    """
+    One decoded Thumb instruction, with its estimated cycles on the Cortex-M0+.
+
+    The cycles of a conditional branch use a static prediction: backward branches are
+    loop branches, which are assumed to be taken, forward branches are assumed not taken.
+    """
+    address: int
+    size: int
+    mnemonic: str
+    cycles: int
+    target: Optional[int] = None
+
+    @property
+    def is_call(self) -> bool:
+        return self.mnemonic == 'bl'
+
+
+def _sign_extend(value: int, bits: int) -> int:
+    if value & (1 << (bits - 1)):
+        return value - (1 << bits)
+    return value
+
+
+def _decode_32bit(first: int, second: int, address: int) -> Instruction:
+    if (first & 0xF800) == 0xF000 and (second & 0xD000) == 0xD000:
+        sign = (first >> 10) & 1
+        i1 = 1 - (((second >> 13) & 1) ^ sign)
+        i2 = 1 - (((second >> 11) & 1) ^ sign)
+        offset = (sign << 24) | (i1 << 23) | (i2 << 22) | ((first & 0x3FF) << 12) | ((second & 0x7FF) << 1)
+        return Instruction(address, 4, 'bl', CYCLES_BRANCH_LINK, address + 4 + _sign_extend(offset, 25))
+    if (first & 0xFFF0) == 0xF3B0 and (second & 0xFF00) == 0x8F00:
+        barrier = {4: 'dsb', 5: 'dmb', 6: 'isb'}.get((second >> 4) & 0xF, 'udf.w')
+        return Instruction(address, 4, barrier, CYCLES_BARRIER)
+    if (first & 0xFFE0) == 0xF3E0:
+        return Instruction(address, 4, 'mrs', CYCLES_SPECIAL_REGISTER)
+    if (first & 0xFFE0) == 0xF380:
+        return Instruction(address, 4, 'msr', CYCLES_SPECIAL_REGISTER)
+    return Instruction(address, 4, 'udf.w', CYCLES_DEFAULT)
+
+
+def _decode_misc(word: int, address: int) -> Instruction:
+    if (word >> 8) == 0xB0:
+        return Instruction(address, 2, 'sub' if word & 0x80 else 'add', CYCLES_DEFAULT)
+    if (word >> 8) == 0xB2:
+        return Instruction(address, 2, ['sxth', 'sxtb', 'uxth', 'uxtb'][(word >> 6) & 3], CYCLES_DEFAULT)
+    if (word >> 9) == 0b1011010:
+        count = bin(word & 0x1FF).count('1')
+        return Instruction(address, 2, 'push', 1 + count)
+    if (word >> 9) == 0b1011110:
+        count = bin(word & 0x1FF).count('1')
+        if word & 0x100:
+            return Instruction(address, 2, 'pop', CYCLES_POP_PC + count)
+        return Instruction(address, 2, 'pop', 1 + count)
+    if (word & 0xFFE8) == 0xB660:
+        return Instruction(address, 2, 'cps', CYCLES_DEFAULT)
+    if (word >> 8) == 0xBA:
+        return Instruction(address, 2, ['rev', 'rev16', 'udf', 'revsh'][(word >> 6) & 3], CYCLES_DEFAULT)
+    if (word >> 8) == 0xBE:
+        return Instruction(address, 2, 'bkpt', CYCLES_DEFAULT)
+    if (word >> 8) == 0xBF:
+        return Instruction(address, 2, ['nop', 'yield', 'wfe', 'wfi', 'sev'][min((word >> 4) & 0xF, 4)],
+                           CYCLES_DEFAULT)
+    return Instruction(address, 2, 'udf', CYCLES_DEFAULT)
+
+
+def decode(word: int, next_word: int, address: int) -> Instruction:
+    """
+    Decode one ARMv6-M Thumb instruction.
+
+    :param word: The first halfword of the instruction.
+    :param next_word: The following halfword, which is only used for 32-bit instructions.
+    :param address: The address of the instruction.
+    :return: The decoded instruction.
+    """
+    if (word >> 11) in (0b11101, 0b11110, 0b11111):
+        return _decode_32bit(word, next_word, address)
+    if (word >> 13) == 0b000:
+        if (word >> 11) == 0b00011:
+            return Instruction(address, 2, 'subs' if word & 0x200 else 'adds', CYCLES_DEFAULT)
+        return Instruction(address, 2, ['lsls', 'lsrs', 'asrs'][(word >> 11) & 3], CYCLES_DEFAULT)
+    if (word >> 13) == 0b001:
+        return Instruction(address, 2, ['movs', 'cmp', 'adds', 'subs'][(word >> 11) & 3], CYCLES_DEFAULT)
+    if (word >> 10) == 0b010000:
+        return Instruction(address, 2, DATA_PROCESSING_NAMES[(word >> 6) & 0xF], CYCLES_DEFAULT)
+    if (word >> 10) == 0b010001:
+        operation = (word >> 8) & 3
+        if operation == 3:
+            return Instruction(address, 2, 'blx' if word & 0x80 else 'bx', CYCLES_BRANCH)
+        destination = (word & 7) | ((word >> 4) & 8)
+        cycles = CYCLES_BRANCH if operation != 1 and destination == 15 else CYCLES_DEFAULT
+        return Instruction(address, 2, ['add', 'cmp', 'mov'][operation], cycles)
+    if (word >> 11) == 0b01001:
+        return Instruction(address, 2, 'ldr', CYCLES_LOAD_STORE)
+    if (word >> 12) == 0b0101:
+        return Instruction(address, 2, REGISTER_OFFSET_NAMES[(word >> 9) & 7], CYCLES_LOAD_STORE)
+    if (word >> 13) == 0b011:
+        name = ('ldr' if word & 0x800 else 'str') + ('b' if word & 0x1000 else '')
+        return Instruction(address, 2, name, CYCLES_LOAD_STORE)
+    if (word >> 12) == 0b1000:
+        return Instruction(address, 2, 'ldrh' if word & 0x800 else 'strh', CYCLES_LOAD_STORE)
+    if (word >> 12) == 0b1001:
+        return Instruction(address, 2, 'ldr' if word & 0x800 else 'str', CYCLES_LOAD_STORE)
+    if (word >> 12) == 0b1010:
+        return Instruction(address, 2, 'add' if word & 0x800 else 'adr', CYCLES_DEFAULT)
+    if (word >> 12) == 0b1011:
+        return _decode_misc(word, address)
+    if (word >> 12) == 0b1100:
+        count = bin(word & 0xFF).count('1')
+        return Instruction(address, 2, 'ldm' if word & 0x800 else 'stm', 1 + count)
+    if (word >> 12) == 0b1101:
+        condition = (word >> 8) & 0xF
+        if condition == 0xE:
+            return Instruction(address, 2, 'udf', CYCLES_DEFAULT)
+        if condition == 0xF:
+            return Instruction(address, 2, 'svc', CYCLES_DEFAULT)
+        offset = _sign_extend(word & 0xFF, 8) * 2
+        cycles = CYCLES_BRANCH if offset < 0 else CYCLES_BRANCH_NOT_TAKEN
+        return Instruction(address, 2, 'b' + CONDITION_NAMES[condition], cycles, address + 4 + offset)
+    # The only remaining encoding is the unconditional branch.
+    offset = _sign_extend(word & 0x7FF, 11) * 2
+    return Instruction(address, 2, 'b', CYCLES_BRANCH, address + 4 + offset)
+
+
+def _code_ranges(elf: ElfFile) -> List[Tuple[int, int, bytes]]:
+    """
+    Get the ranges with Thumb code, using the ARM mapping symbols to skip literal pools.
+
+    :return: The start and end address of each range, with the contents of its section.
+    """
+    ranges = []
+    for section in elf.sections:
+        if not (section.is_alloc and section.is_code and section.has_contents):
+            continue
+        data = bytes(elf.section_data(section))
+        markers = sorted((symbol.value, symbol.name[:2]) for symbol in elf.symbols
+                         if symbol.section_index == section.index and symbol.name[:2] in ('$t', '$d', '$a'))
+        if not markers:
+            ranges.append((section.address, section.address + section.size, data, section.address))
+            continue
+        for index, (address, kind) in enumerate(markers):
+            if kind != '$t':
+                continue
+            end = markers[index + 1][0] if index + 1 < len(markers) else section.address + section.size
+            ranges.append((address, end, data, section.address))
+    return [(start, end, data[start - base:end - base]) for start, end, data, base in ranges]
+
+
+class ThumbProgram:
+    """
+    The decoded instructions of a firmware, grouped by function.
+    """
+
+    def __init__(self, functions: Dict[str, List[Instruction]], symbols: SymbolIndex, lines: LineIndex):
+        self.functions = functions
+        self.symbols = symbols
+        self.lines = lines
+
+    @staticmethod
+    def from_elf(elf: ElfFile) -> 'ThumbProgram':
+        """
+        Decode all functions of a firmware.
+
+        :param elf: The firmware, built with debug information for the line mapping.
+        :return: The decoded program.
+        """
+        symbols = SymbolIndex.from_elf(elf)
+        functions: Dict[str, List[Instruction]] = {}
+        for start, end, data in _code_ranges(elf):
+            offset = 0
+            while offset + 2 <= len(data):
+                word = int.from_bytes(data[offset:offset + 2], 'little')
+                next_word = int.from_bytes(data[offset + 2:offset + 4], 'little') if offset + 4 <= len(data) else 0
+                instruction = decode(word, next_word, start + offset)
+                offset += instruction.size
+                location = symbols.find(instruction.address)
+                if location is None:
+                    continue
+                functions.setdefault(location[0], []).append(instruction)
+        return ThumbProgram(functions, symbols, LineIndex.from_elf(elf))
+
+    def single_pass_cycles(self, name: str) -> int:
+        """
+        Estimate the cycles of a function as one pass through all of its instructions.
+
+        This is used for functions without line counts, like the helpers of the compiler library.
+
+        :param name: The name of the function.
+        :return: The sum of the cycles of all instructions, or zero for an unknown function.
+        """
+        return sum(instruction.cycles for instruction in self.functions.get(name, []))
@@ -21,11 +21,19 @@
 # Set the system name
 set(CMAKE_SYSTEM_NAME Generic)
 
-# Read the configuration.
-if(NOT EXISTS "${CMAKE_CURRENT_LIST_DIR}/configuration.cmake")
+# Read the configuration. Use -DHAL_CONFIGURATION=<file> to select one of the configurations
+# written with 'python3 configure.py --matrix ...'.
+if(NOT HAL_CONFIGURATION)
+    set(HAL_CONFIGURATION "${CMAKE_CURRENT_LIST_DIR}/configuration.cmake")
+endif()
+list(APPEND CMAKE_TRY_COMPILE_PLATFORM_VARIABLES HAL_CONFIGURATION)
+if(NOT EXISTS "${HAL_CONFIGURATION}")
     message(FATAL_ERROR "Missing configuration! Please run 'python3 configure.py'...")
 endif()
-include("${CMAKE_CURRENT_LIST_DIR}/configuration.cmake")
+include("${HAL_CONFIGURATION}")
+if(NOT MCU_INCLUDE_DIR)
+    set(MCU_INCLUDE_DIR "include")
+endif()
 
 # Additional paths
 set(TOOLCHAIN_DIR "${CMAKE_CURRENT_LIST_DIR}")
@@ -33,14 +41,109 @@ set(CMSIS_ROOT_PATH "${TOOLCHAIN_DIR}/cmsis/${MCU_NAME}")
 set(CMSIS_ATMEL_PATH "${TOOLCHAIN_DIR}/cmsis-atmel")
 
 # Include Paths
-set(INCLUDE_PATHS "-I${CMSIS_ROOT_PATH}/include -I${CMSIS_ROOT_PATH}/source -I${CMSIS_ATMEL_PATH}/Include")
+set(INCLUDE_PATHS "-I${CMSIS_ROOT_PATH}/${MCU_INCLUDE_DIR} -I${CMSIS_ROOT_PATH}/source -I${CMSIS_ATMEL_PATH}/Include")
 set(INCLUDE_PATHS "${INCLUDE_PATHS} -I${TOOLCHAIN_DIR}/platform/${MCU_NAME}")
 
+# The FPU and float ABI of the CPU.
+if(NOT DEFINED CPU_FPU)
+    set(CPU_FPU "")
+endif()
+if(NOT DEFINED CPU_FLOAT_ABI)
+    set(CPU_FLOAT_ABI "soft")
+endif()
+
+# Select the CMSIS DSP library matching the CPU, FPU and float ABI.
+if(CPU_TARGET STREQUAL "cortex-m0plus")
+    set(DSP_MATH_DEFINE "ARM_MATH_CM0PLUS")
+    set(DSP_LIBRARY_NAME "arm_cortexM0l_math")
+elseif(CPU_TARGET STREQUAL "cortex-m0")
+    set(DSP_MATH_DEFINE "ARM_MATH_CM0")
+    set(DSP_LIBRARY_NAME "arm_cortexM0l_math")
+elseif(CPU_TARGET STREQUAL "cortex-m3")
+    set(DSP_MATH_DEFINE "ARM_MATH_CM3")
+    set(DSP_LIBRARY_NAME "arm_cortexM3l_math")
+elseif(CPU_TARGET STREQUAL "cortex-m4")
+    set(DSP_MATH_DEFINE "ARM_MATH_CM4")
+    set(DSP_LIBRARY_NAME "arm_cortexM4l_math")
+    if(CPU_FPU AND NOT CPU_FLOAT_ABI STREQUAL "soft")
+        set(DSP_LIBRARY_NAME "arm_cortexM4lf_math")
+    endif()
+elseif(CPU_TARGET STREQUAL "cortex-m7")
+    set(DSP_MATH_DEFINE "ARM_MATH_CM7")
+    set(DSP_LIBRARY_NAME "arm_cortexM7l_math")
+    if(CPU_FPU MATCHES "sp-" AND NOT CPU_FLOAT_ABI STREQUAL "soft")
+        set(DSP_LIBRARY_NAME "arm_cortexM7lfsp_math")
+    elseif(CPU_FPU AND NOT CPU_FLOAT_ABI STREQUAL "soft")
+        set(DSP_LIBRARY_NAME "arm_cortexM7lfdp_math")
+    endif()
+else()
+    message(FATAL_ERROR "There is no CMSIS DSP library for the CPU: ${CPU_TARGET}")
+endif()
+if(CPU_FLOAT_ABI STREQUAL "softfp" AND DSP_LIBRARY_NAME MATCHES "lf")
+    set(DSP_LIBRARY_NAME "${DSP_LIBRARY_NAME}_softfp")
+endif()
+
+# The DSP library to link: "prebuilt", "lto" to build an LTO variant once, or "none".
+if(NOT DEFINED HAL_DSP_LIBRARY)
+    set(HAL_DSP_LIBRARY "prebuilt" CACHE STRING "The CMSIS DSP library to link: prebuilt, lto or none.")
+endif()
+# The transforms used by the firmware, like "cfft_q15_256;rfft_fast_f32_1024". If set, the LTO variant
+# of the DSP library contains only the tables for these transforms.
+if(NOT DEFINED HAL_DSP_TRANSFORMS)
+    set(HAL_DSP_TRANSFORMS "" CACHE STRING "The DSP transforms used by the firmware, for the LTO library.")
+endif()
+
+# Select the optimization profile. The profile from the configuration can be overridden
+# with -DHAL_OPTIMIZATION_PROFILE=<profile>.
+if(HAL_OPTIMIZATION_PROFILE)
+    set(OPTIMIZATION_PROFILE "${HAL_OPTIMIZATION_PROFILE}")
+elseif(NOT OPTIMIZATION_PROFILE)
+    set(OPTIMIZATION_PROFILE "size")
+endif()
+list(APPEND CMAKE_TRY_COMPILE_PLATFORM_VARIABLES HAL_OPTIMIZATION_PROFILE)
+if(OPTIMIZATION_PROFILE MATCHES "^size(-lto)?$")
+    set(OPTIMIZATION_FLAGS "-Os --param max-inline-insns-single=500")
+elseif(OPTIMIZATION_PROFILE MATCHES "^speed(-lto)?$")
+    set(OPTIMIZATION_FLAGS "-O2")
+elseif(OPTIMIZATION_PROFILE MATCHES "^fast(-lto)?$")
+    set(OPTIMIZATION_FLAGS "-O3")
+else()
+    message(FATAL_ERROR "Unknown optimization profile: ${OPTIMIZATION_PROFILE}")
+endif()
+set(OPTIMIZATION_LTO OFF)
+if(OPTIMIZATION_PROFILE MATCHES "-lto$")
+    set(OPTIMIZATION_LTO ON)
+    set(OPTIMIZATION_FLAGS "${OPTIMIZATION_FLAGS} -flto")
+endif()
+
 # Collect flags
-set(OPTIMIZATION_FLAGS "-Os")
 set(WARNING_FLAGS "-Wall -Wno-unknown-pragmas")
 set(CPU_TARGET_FLAGS "-mcpu=${CPU_TARGET} -m${CPU_INST}")
-set(MORE_FLAGS "-ffunction-sections -fdata-sections -nostdlib --param max-inline-insns-single=500")
+if(CPU_FPU)
+    set(CPU_TARGET_FLAGS "${CPU_TARGET_FLAGS} -mfpu=${CPU_FPU} -mfloat-abi=${CPU_FLOAT_ABI}")
+endif()
+set(MORE_FLAGS "-ffunction-sections -fdata-sections -nostdlib")
+
+# Write the stack usage and call graph of every function, for the stack analysis after linking.
+if(NOT DEFINED HAL_STACK_ANALYSIS)
+    set(HAL_STACK_ANALYSIS ON CACHE BOOL "Analyze the worst case stack depth of the firmware.")
+endif()
+set(STACK_ANALYSIS_FLAGS "")
+if(HAL_STACK_ANALYSIS)
+    set(STACK_ANALYSIS_FLAGS "-fstack-usage")
+    if(COMPILER_VERSION VERSION_GREATER_EQUAL 10)
+        set(STACK_ANALYSIS_FLAGS "${STACK_ANALYSIS_FLAGS} -fcallgraph-info=su")
+    endif()
+    set(MORE_FLAGS "${MORE_FLAGS} ${STACK_ANALYSIS_FLAGS}")
+endif()
+
+# Additional image formats written after linking, next to the raw binary file.
+if(NOT DEFINED HAL_FIRMWARE_HEX)
+    set(HAL_FIRMWARE_HEX OFF CACHE BOOL "Write the firmware also as Intel HEX file.")
+endif()
+if(NOT DEFINED HAL_FIRMWARE_UF2)
+    set(HAL_FIRMWARE_UF2 OFF CACHE BOOL "Write the firmware also as UF2 file.")
+endif()
 set(CXX_FLAGS "-std=gnu++1z -fno-threadsafe-statics -fno-rtti -fno-exceptions -Wno-register")
 set(C_FLAGS "-std=gnu11")
 
@@ -48,8 +151,48 @@ set(C_FLAGS "-std=gnu11")
 set(CMAKE_CXX_FLAGS "${CPU_TARGET_FLAGS} ${CXX_FLAGS} ${WARNING_FLAGS} ${OPTIMIZATION_FLAGS} ${MORE_FLAGS}")
 set(CMAKE_C_FLAGS "${CPU_TARGET_FLAGS} ${C_FLAGS} ${WARNING_FLAGS} ${OPTIMIZATION_FLAGS} ${MORE_FLAGS}")
 
+# Measure the boot time from the reset until `main()`, see `hal-core/BootTime.h`.
+if(NOT DEFINED HAL_BOOT_TIME)
+    set(HAL_BOOT_TIME OFF CACHE BOOL "Record the SysTick ticks from the reset until main().")
+endif()
+
+# Select the clock until the main clock is locked to the crystal, see `hal-core/BootClock.h`. The clock
+# from the configuration can be overridden with -DHAL_BOOT_CLOCK=<clock>.
+if(HAL_BOOT_CLOCK)
+    set(BOOT_CLOCK "${HAL_BOOT_CLOCK}")
+elseif(NOT BOOT_CLOCK)
+    set(BOOT_CLOCK "locked")
+endif()
+if(NOT BOOT_CLOCK MATCHES "^(locked|dfll|osc8m)$")
+    message(FATAL_ERROR "Unknown boot clock: ${BOOT_CLOCK}")
+endif()
+
+# Sample the interrupted code in the SysTick exception, see `hal-core/Profiler.h`.
+if(NOT DEFINED HAL_PROFILER)
+    set(HAL_PROFILER OFF CACHE BOOL "Enable the sampling profiler in the SysTick exception.")
+endif()
+
+# Save a crash dump in the HardFault exception, see `hal-core/CrashDump.h`.
+if(NOT DEFINED HAL_CRASH_DUMP)
+    set(HAL_CRASH_DUMP OFF CACHE BOOL "Save the registers and the stack in the HardFault exception.")
+endif()
+
 # Set the default definitions.
-set(d_list F_CPU=48000000L ARM_MATH_CM0PLUS __${MCU_VARIANT}__)
+set(d_list F_CPU=48000000L ${DSP_MATH_DEFINE} __${MCU_VARIANT}__)
+if(HAL_BOOT_TIME)
+    list(APPEND d_list HAL_BOOT_TIME)
+endif()
+if(BOOT_CLOCK STREQUAL "dfll")
+    list(APPEND d_list HAL_BOOT_CLOCK_DFLL)
+elseif(BOOT_CLOCK STREQUAL "osc8m")
+    list(APPEND d_list HAL_BOOT_CLOCK_OSC8M)
+endif()
+if(HAL_PROFILER)
+    list(APPEND d_list HAL_PROFILER)
+endif()
+if(HAL_CRASH_DUMP)
+    list(APPEND d_list HAL_CRASH_DUMP)
+endif()
 list(TRANSFORM d_list PREPEND "-D")
 list(JOIN d_list " " d_flags)
 set(CMAKE_CXX_FLAGS "${CMAKE_CXX_FLAGS} ${d_flags}")
@@ -63,9 +206,79 @@ set(CMAKE_C_FLAGS "${CMAKE_C_FLAGS} ${INCLUDE_PATHS}")
 set(CMAKE_CXX_COMPILER "${APP_TOOLS_PATH}/arm-none-eabi-g++")
 set(CMAKE_C_COMPILER "${APP_TOOLS_PATH}/arm-none-eabi-gcc")
 set(CMAKE_AR "${APP_TOOLS_PATH}/arm-none-eabi-ar")
+set(TOOL_GCC_AR "${APP_TOOLS_PATH}/arm-none-eabi-gcc-ar")
+if(OPTIMIZATION_LTO)
+    # Libraries with LTO objects need an index created with the linker plugin.
+    set(CMAKE_AR "${TOOL_GCC_AR}")
+    set(CMAKE_RANLIB "${APP_TOOLS_PATH}/arm-none-eabi-gcc-ranlib")
+endif()
 set(TOOL_OBJCOPY "${APP_TOOLS_PATH}/arm-none-eabi-objcopy")
 set(TOOL_SIZE "${APP_TOOLS_PATH}/arm-none-eabi-size")
 
+# Precompiled headers for the MCU and DSP headers, used by `hal_precompile_headers()`.
+if(NOT DEFINED HAL_PRECOMPILE_HEADERS)
+    set(HAL_PRECOMPILE_HEADERS OFF CACHE BOOL "Precompile the MCU and DSP headers for the firmware.")
+endif()
+set(HAL_PRECOMPILED_HEADERS "<${MCU_NAME}.h>" "<arm_math.h>")
+if(HAL_PRECOMPILE_HEADERS)
+    foreach(lang C CXX)
+        if(CMAKE_${lang}_COMPILER_LAUNCHER MATCHES "(^|/)ccache$")
+            # Without this setting, ccache never uses cached results for sources with precompiled headers.
+            set(CMAKE_${lang}_COMPILER_LAUNCHER "${CMAKE_COMMAND}" "-E" "env"
+                "CCACHE_SLOPPINESS=pch_defines,time_macros" "${CMAKE_${lang}_COMPILER_LAUNCHER}")
+        endif()
+    endforeach()
+endif()
+
+# Record the time of the compiler, linker and toolchain scripts in a Chrome trace file, see `tracing.py`.
+# Use -DHAL_TRACE_FILE=<file>, or set the environment variable with the same name.
+if(NOT DEFINED HAL_TRACE_FILE)
+    set(HAL_TRACE_FILE "$ENV{HAL_TRACE_FILE}" CACHE FILEPATH "The Chrome trace file for the build timing.")
+endif()
+# The compiler checks of CMake are not part of the build and are not recorded.
+get_property(in_try_compile GLOBAL PROPERTY IN_TRY_COMPILE)
+if(HAL_TRACE_FILE AND NOT in_try_compile)
+    # Prefix for the commands of the toolchain scripts, which record their own spans.
+    set(HAL_TRACE_COMMAND "${CMAKE_COMMAND}" "-E" "env" "HAL_TRACE_FILE=${HAL_TRACE_FILE}")
+    set(trace_launcher "\"${PYTHON3_PATH}\" \"${TOOLCHAIN_DIR}/tracing.py\" \"--trace-file=${HAL_TRACE_FILE}\" exec")
+    set_property(GLOBAL PROPERTY RULE_LAUNCH_COMPILE "${trace_launcher} compile --")
+    set_property(GLOBAL PROPERTY RULE_LAUNCH_LINK "${trace_launcher} link --")
+else()
+    set(HAL_TRACE_COMMAND "")
+endif()
+
+# Generate the linker script for the memory layout of the configuration. The generated scripts are
+# cached in `~/.cache/hal-toolchain/ld`. Use -DHAL_LINKER_SCRIPT=<file> to use an own linker script.
+if(NOT DEFINED HAL_RAM_CODE)
+    set(HAL_RAM_CODE ON CACHE BOOL "Execute the functions marked with HAL_RAM_FUNCTION from the RAM.")
+endif()
+if(NOT DEFINED HAL_NOINIT_SIZE)
+    set(HAL_NOINIT_SIZE 0 CACHE STRING "The size of a RAM region for variables which keep their value across resets.")
+endif()
+if(NOT DEFINED RAM_START)
+    set(RAM_START "0x20000000")
+endif()
+if(HAL_LINKER_SCRIPT)
+    set(LINKER_SCRIPT "${HAL_LINKER_SCRIPT}")
+else()
+    set(ld_args "--flash-size=${FLASH_SIZE}" "--flash-start=${FLASH_START}"
+        "--ram-start=${RAM_START}" "--ram-size=${RAM_SIZE}" "--noinit-size=${HAL_NOINIT_SIZE}")
+    if(LP_RAM_SIZE)
+        list(APPEND ld_args "--lp-ram-start=${LP_RAM_START}" "--lp-ram-size=${LP_RAM_SIZE}")
+    endif()
+    if(NOT HAL_RAM_CODE)
+        list(APPEND ld_args "--no-ram-code")
+    endif()
+    execute_process(COMMAND ${HAL_TRACE_COMMAND} "${PYTHON3_PATH}" "${TOOLCHAIN_DIR}/linkerscript.py" ${ld_args}
+        OUTPUT_VARIABLE LINKER_SCRIPT
+        ERROR_VARIABLE ld_error
+        RESULT_VARIABLE ld_result
+        OUTPUT_STRIP_TRAILING_WHITESPACE)
+    if(NOT ld_result EQUAL 0)
+        message(FATAL_ERROR "Could not generate the linker script: ${ld_error}")
+    endif()
+endif()
+
 # Disable searching the local libraries.
 set(CMAKE_FIND_ROOT_PATH_MODE_PROGRAM NEVER)
 set(CMAKE_FIND_ROOT_PATH_MODE_LIBRARY ONLY)
@@ -78,7 +291,7 @@ set(lf_list
     "${WARNING_FLAGS}"
     "${OPTIMIZATION_FLAGS}"
     "${d_flags}"
-    "-T${TOOLCHAIN_DIR}/platform/${TARGET_PLATFORM}/flash_with_bootloader.ld"
+    "-T${LINKER_SCRIPT}"
     "-Wl,--gc-sections"
     "-Wl,-Map,firmware.map"
     "--specs=nano.specs"
@@ -90,13 +303,21 @@ set(lf_list
     "-Wl,--warn-section-align"
     "-Wl,--entry=Reset_Handler"
     "-Wl,--start-group"
-#    "-L${CMSIS_ROOT_PATH}/Lib/GCC/ -larm_cortexM0l_math"
+    "-L${CMSIS_ATMEL_PATH}/Lib/GCC"
     "-lm"
     "-Wl,--end-group"
-    "-I${CMSIS_ROOT_PATH}/include"
+    "-I${CMSIS_ROOT_PATH}/${MCU_INCLUDE_DIR}"
     "-I${CMSIS_ROOT_PATH}/source"
     "-I${CMSIS_ATMEL_PATH}/Include"
     "-I${TOOLCHAIN_DIR}/platform/${MCU_NAME}")
+if(HAL_CRASH_DUMP)
+    # The build ID identifies the firmware of a crash dump.
+    list(APPEND lf_list "-Wl,--build-id=sha1")
+endif()
+if(HAL_STACK_ANALYSIS)
+    # The startup code and the handlers are compiled while linking, see `arm_gcc_link()`.
+    list(APPEND lf_list "${STACK_ANALYSIS_FLAGS}")
+endif()
 list(JOIN lf_list " " lf_flags)
 set(CMAKE_EXE_LINKER_FLAGS ${lf_flags})
 
@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+#
+# (c)2019 by Lucky Resistor. See LICENSE for details.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import fcntl
+import json
+import os
+import subprocess
+import threading
+import time
+import argparse
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+assert sys.version_info >= (3, 7)
+
+
+# The environment variable with the path to the trace file. Tracing is disabled if it is not set.
+TRACE_FILE_VARIABLE = 'HAL_TRACE_FILE'
+DEFAULT_CATEGORY = 'toolchain'
+
+
+class Tracer:
+    """
+    Write timing spans into a trace file, in the Chrome trace event format.
+
+    All processes of a build append their events to the same file, which uses the JSON array
+    format without the closing bracket. This is allowed by the format, so the file can be opened
+    with `chrome://tracing` or Perfetto at any time. The timestamps are microseconds since the
+    epoch, so the events of all processes are on the same time line.
+    """
+
+    def __init__(self, path: Optional[Path], process_name: str):
+        self.path = path
+        self.process_name = process_name
+        self._lock = threading.Lock()
+        self._has_name = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    @contextmanager
+    def span(self, name: str, category: str = DEFAULT_CATEGORY, **args):
+        """
+        Record the time of a block as complete event.
+
+        :param name: The name of the span.
+        :param category: The category of the span.
+        :param args: Additional values shown with the span.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.time_ns() // 1000
+        try:
+            yield
+        finally:
+            end = time.time_ns() // 1000
+            self.write_events([{'name': name, 'cat': category, 'ph': 'X', 'ts': start, 'dur': end - start,
+                                'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}])
+
+    def write_events(self, events: List[dict]):
+        """
+        Append events to the trace file.
+
+        The file is locked while writing, so the events of parallel processes are not mixed.
+
+        :param events: The events.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if not self._has_name:
+                events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                           'args': {'name': self.process_name}}] + events
+                self._has_name = True
+            text = ''.join(json.dumps(event, separators=(',', ':')) + ',\n' for event in events)
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    fcntl.flock(file, fcntl.LOCK_EX)
+                    if os.fstat(file.fileno()).st_size == 0:
+                        text = '[\n' + text
+                    file.write(text)
+            except OSError:
+                # Tracing must never break the build.
+                pass
+
+
+_tracer: Optional[Tracer] = None
+
+
+def tracer() -> Tracer:
+    """
+    Get the tracer of this process, configured by the `HAL_TRACE_FILE` environment variable.
+
+    :return: The tracer, which does nothing if tracing is disabled.
+    """
+    global _tracer
+    if _tracer is None:
+        path = os.environ.get(TRACE_FILE_VARIABLE)
+        _tracer = Tracer(Path(path) if path else None, Path(sys.argv[0]).name or 'python')
+    return _tracer
+
+
+def span(name: str, category: str = DEFAULT_CATEGORY, **args):
+    """
+    Record the time of a block, if tracing is enabled.
+
+    :param name: The name of the span.
+    :param category: The category of the span.
+    :param args: Additional values shown with the span.
+    :return: A context manager for the block.
+    """
+    return tracer().span(name, category, **args)
+
+
+def read_events(path: Path) -> List[dict]:
+    """
+    Read all events from a trace file.
+
+    :param path: The path to the trace file.
+    :return: The events, in the order they were written.
+    """
+    events = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip().rstrip(',')
+            if line in ('', '[', ']'):
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+
+def stage_durations(events: List[dict]) -> Dict[str, float]:
+    """
+    Sum the durations of the spans with the same category and name.
+
+    :param events: The events of a trace.
+    :return: The total duration in seconds for each stage, named "<category>: <name>".
+    """
+    result: Dict[str, float] = {}
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        stage = f'{event.get("cat", DEFAULT_CATEGORY)}: {event["name"]}'
+        result[stage] = result.get(stage, 0.0) + event.get('dur', 0) / 1e6
+    return result
+
+
+def _output_argument(command: List[str]) -> str:
+    for index, argument in enumerate(command[:-1]):
+        if argument == '-o':
+            return Path(command[index + 1]).name
+    return ''
+
+
+def run_command(name: str, category: str, command: List[str]) -> int:
+    """
+    Run a command and record its time.
+
+    This is used as launcher for the compiler and linker, and to trace commands like CMake.
+
+    :param name: The name of the span.
+    :param category: The category of the span.
+    :param command: The command to run.
+    :return: The exit code of the command.
+    """
+    with span(name, category, output=_output_argument(command), command=Path(command[0]).name):
+        try:
+            return subprocess.call(command)
+        except OSError as e:
+            print(f'ERROR! Could not run {command[0]}: {e}', file=sys.stderr)
+            return 127
+
+
+def print_summary(path: Path):
+    """
+    Print the total time of each stage in a trace file.
+
+    :param path: The path to the trace file.
+    """
+    events = read_events(path)
+    counts: Dict[str, int] = {}
+    for event in events:
+        if event.get('ph') == 'X':
+            stage = f'{event.get("cat", DEFAULT_CATEGORY)}: {event["name"]}'
+            counts[stage] = counts.get(stage, 0) + 1
+    durations = stage_durations(events)
+    width = max([len(stage) for stage in durations] + [5])
+    print(f'{"Stage":<{width}} {"Count":>6} {"Total":>10}')
+    for stage, duration in sorted(durations.items(), key=lambda item: -item[1]):
+        print(f'{stage:<{width}} {counts[stage]:>6} {duration:>9.3f}s')
+
+
+def main():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Record the time of toolchain commands in a Chrome trace file.')
+    parser.add_argument('--trace-file',
+                        dest='trace_file',
+                        type=str,
+                        action='store',
+                        help=f'The trace file. Defaults to the ${TRACE_FILE_VARIABLE} environment variable.')
+    subparsers = parser.add_subparsers(dest='command')
+    exec_parser = subparsers.add_parser('exec', help='Run a command and record its time.')
+    exec_parser.add_argument('name',
+                             help='The name of the span, like "compile".')
+    exec_parser.add_argument('--category', '-c',
+                             dest='category',
+                             type=str,
+                             action='store',
+                             default='build',
+                             help='The category of the span.')
+    exec_parser.add_argument('arguments',
+                             nargs=argparse.REMAINDER,
+                             help='The command to run, after "--".')
+    summary_parser = subparsers.add_parser('summary', help='Print the total time of each stage in a trace file.')
+    summary_parser.add_argument('trace',
+                                help='The trace file.')
+    args = parser.parse_args()
+    if args.trace_file:
+        os.environ[TRACE_FILE_VARIABLE] = args.trace_file
+    if args.command == 'exec':
+        command = args.arguments[1:] if args.arguments[:1] == ['--'] else args.arguments
+        if not command:
+            parser.error('Missing the command to run.')
+        exit(run_command(args.name, args.category, command))
+    elif args.command == 'summary':
+        try:
+            print_summary(Path(args.trace))
+        except OSError as e:
+            exit(f'ERROR! {e}')
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -18,16 +18,33 @@
 #
 
 import os
+import queue
 import subprocess
+import tempfile
 import termios
+import threading
 import time
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable, IO, List, Optional, Set, Tuple
+
+from frames import FRAME_TYPE_LOG, FrameDecoder
+from logformat import LOG_CACHE_DIR, LogDecoder, LogFormatError, LogTable
+from samba import SambaClient, SambaError, SerialPort
+from tracing import span
 
 assert sys.version_info >= (3, 7)
 
 
+POLL_INTERVAL = 0.02  # The interval in seconds to check for device changes.
+RESET_ATTEMPTS = 3  # The number of times the port is opened at 1200 baud, until it disappears.
+BOOTLOADER_PROBE_TIMEOUT = 0.5  # The time in seconds to wait for the answer of a boot loader.
+MONITOR_READ_SIZE = 0x10000
+
+
 class PortNotFound(Exception):
     """
     Exception if a given port is not found.
@@ -35,14 +52,30 @@ class PortNotFound(Exception):
     pass
 
 
-def find_port(port: str) -> str:
+class UploadError(Exception):
     """
-    Try to find the specified port.
+    Exception if the reset or upload of a board fails.
+    """
+    pass
 
-    In case the user provided wildcard arguments, find the first matching port.
 
-    :param port: The configured port.
-    :return: The first port or empty string if no matching port is found.
+@dataclass
+class BoardResult:
+    """The result of flashing one board."""
+    port: str
+    success: bool = False
+    message: str = ''
+    reset_time: float = 0.0
+    upload_time: float = 0.0
+    log_path: Optional[Path] = None
+
+
+def find_ports(port: str) -> List[str]:
+    """
+    Find all ports matching the specified port.
+
+    :param port: The configured port, which can contain wildcards in the last path element.
+    :return: A sorted list with all matching ports.
     """
     if not port or not (port[0].isalnum() or port[0] == '/') or '../' in port or './' in port:
         # Catch some common misuses.
@@ -58,22 +91,132 @@ def find_port(port: str) -> str:
         if not paths:
             raise PortNotFound('No path found matching the specified port pattern.')
         paths.sort()
-        port_path = paths[0]
-    if not port_path.exists():
-        raise PortNotFound('The port path does not exists.')
-    if port_path.is_block_device() or port_path.is_char_device():
-        return str(port_path)
     else:
+        paths = [port_path]
+    if not paths[0].exists():
+        raise PortNotFound('The port path does not exists.')
+    paths = [path for path in paths if path.is_block_device() or path.is_char_device()]
+    if not paths:
         raise PortNotFound('The specified port is no valid block or character device.')
+    return [str(path) for path in paths]
 
 
-def reset(port: str):
+def find_port(port: str) -> str:
     """
-    Open/close the port at 1200 baud will reset the MCU and put it into boot loader mode.
+    Try to find the specified port.
+
+    In case the user provided wildcard arguments, find the first matching port.
+
+    :param port: The configured port.
+    :return: The first port or empty string if no matching port is found.
+    """
+    return find_ports(port)[0]
+
+
+def port_pattern(port: str, pattern: str) -> str:
+    """
+    Get the pattern to detect the port after a reset.
+
+    The device of the boot loader may get a different name than the device of the firmware.
+
+    :param port: The path to the port before the reset.
+    :param pattern: The port pattern configured by the user.
+    :return: A pattern with wildcards for the last path element.
+    """
+    if '*' in pattern or '?' in pattern:
+        if not Path(pattern).is_absolute():
+            return str(Path('/dev')/pattern)
+        return pattern
+    return port.rstrip('0123456789') + '*'
+
+
+def matching_ports(pattern: str) -> Set[str]:
+    """
+    Get all devices matching a pattern.
+
+    :param pattern: The pattern with wildcards in the last path element.
+    :return: A set with the paths to all matching devices.
+    """
+    pattern_path = Path(pattern)
+    try:
+        return set(str(path) for path in pattern_path.parent.glob(pattern_path.name))
+    except OSError:
+        return set()
+
+
+def wait_for_removal(port: str, timeout: float) -> bool:
+    """
+    Wait until a port disappears.
+
+    :param port: The path to the port.
+    :param timeout: The maximum time in seconds to wait.
+    :return: True if the port disappeared, False after the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while Path(port).exists():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+    return True
+
+
+def find_bootloader(port: str, pattern: str, known_ports: Set[str], appear_timeout: float,
+                    claim: Callable[[str], bool] = lambda candidate: True) -> str:
+    """
+    Wait until the device of the boot loader shows up, after the port disappeared.
+
+    :param port: The path to the port before the reset.
+    :param pattern: The pattern to detect the device of the boot loader.
+    :param known_ports: All devices matching the pattern before the reset.
+    :param appear_timeout: The maximum time in seconds to wait for the boot loader to appear.
+    :param claim: A function to claim a new device, returning False if it was already taken by another board.
+    :return: The path to the device of the boot loader.
+    """
+    deadline = time.monotonic() + appear_timeout
+    while True:
+        ports = matching_ports(pattern)
+        if port in ports:
+            candidates = [port]
+        else:
+            candidates = sorted(ports - known_ports)
+        for candidate in candidates:
+            if os.access(candidate, os.R_OK | os.W_OK) and claim(candidate):
+                return candidate
+        if time.monotonic() > deadline:
+            raise UploadError(f'The boot loader did not appear within {appear_timeout} seconds.')
+        time.sleep(POLL_INTERVAL)
+
+
+def is_bootloader(port: str, timeout: float = BOOTLOADER_PROBE_TIMEOUT) -> bool:
+    """
+    Check if a port is the SAM-BA boot loader, which answers the `N#` command with a line break.
+
+    :param port: The port to check.
+    :param timeout: The maximum time in seconds to wait for the answer.
+    :return: True if the port answered like the boot loader.
+    """
+    try:
+        with SerialPort(port, timeout=timeout) as serial_port:
+            serial_port.write(b'N#')
+            response = bytearray()
+            deadline = time.monotonic() + timeout
+            while len(response) < 2 and time.monotonic() < deadline:
+                response.extend(serial_port.read_available(deadline - time.monotonic()))
+            return bytes(response) == b'\n\r'
+    except SambaError:
+        return False
+
+
+def touch_port(port: str, hold_time: float, log: Callable[[str], None] = print):
+    """
+    Open the port at 1200 baud and close it again, which requests the boot loader.
+
     :param port: The port to use.
+    :param hold_time: The time in seconds to keep the port open at 1200 baud.
+    :param log: The function to print messages.
     """
     try:
-        print('Try to open the port at 1200baud...')
+        log('Try to open the port at 1200baud...')
         # Open the port
         fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
         # Prepare the configuration.
@@ -86,24 +229,88 @@ def reset(port: str):
         oflag &= ~(termios.OPOST | termios.ONLCR | termios.OCRNL)
         iflag &= ~(termios.INLCR | termios.IGNCR | termios.ICRNL | termios.IGNBRK | termios.INPCK | termios.ISTRIP)
         # Configure / 1200 baud
-        print(f'updating attr {port} {ispeed} {ospeed}')
+        log(f'updating attr {port} {ispeed} {ospeed}')
         custom_baud = termios.B1200
         termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, custom_baud, custom_baud, cc])
         # Wait
-        print('Wait 2 seconds...')
-        time.sleep(2)
-        print('Close the port and wait 4 seconds for the reset...')
+        time.sleep(hold_time)
+        log('Close the port and wait for the boot loader...')
         # Close
         os.close(fd)
-        # Wait again.
-        time.sleep(4)
     except FileNotFoundError:
-        exit(f"Could not find port '{port}'.")
+        raise UploadError(f"Could not find port '{port}'.")
     except termios.error as e:
-        exit(f"The path '{port}' is no USB serial line: {e}")
+        raise UploadError(f"The path '{port}' is no USB serial line: {e}")
+
+
+def reset(port: str, pattern: str, hold_time: float, disappear_timeout: float, appear_timeout: float,
+          known_ports: Optional[Set[str]] = None,
+          claim: Callable[[str], bool] = lambda candidate: True,
+          log: Callable[[str], None] = print) -> str:
+    """
+    Open/close the port at 1200 baud will reset the MCU and put it into boot loader mode.
+
+    Instead of waiting a fixed time, the devices are watched until the boot loader shows up. If the
+    port does not disappear, it is checked if the board already runs the boot loader, like after a
+    double tap on the reset button. Otherwise, the reset is tried again, up to `RESET_ATTEMPTS` times.
+
+    :param port: The port to use.
+    :param pattern: The port pattern configured by the user.
+    :param hold_time: The time in seconds to keep the port open at 1200 baud.
+    :param disappear_timeout: The maximum time in seconds to wait for the port to disappear.
+    :param appear_timeout: The maximum time in seconds to wait for the boot loader to appear.
+    :param known_ports: All devices matching the pattern before any board was reset, or None.
+    :param claim: A function to claim a new device, returning False if it was already taken by another board.
+    :param log: The function to print messages.
+    :return: The path to the device of the boot loader.
+    """
+    pattern = port_pattern(port, pattern)
+    if known_ports is None:
+        known_ports = matching_ports(pattern)
+    for attempt in range(1, RESET_ATTEMPTS + 1):
+        with span('reset', 'upload', port=port, attempt=attempt):
+            touch_port(port, hold_time, log)
+        with span('wait for port removal', 'upload', port=port):
+            removed = wait_for_removal(port, disappear_timeout)
+        if removed:
+            break
+        with span('probe boot loader', 'upload', port=port):
+            answered = is_bootloader(port)
+        if answered and claim(port):
+            log(f'The port {port} did not disappear, but already answers as boot loader.')
+            return port
+        if attempt == RESET_ATTEMPTS:
+            raise UploadError(f'The port {port} did not disappear after {RESET_ATTEMPTS} resets, '
+                              f'the board did not enter the boot loader.')
+        log(f'The port did not disappear within {disappear_timeout} seconds, trying the reset again...')
+    log('The port disappeared, waiting for the boot loader...')
+    start_time = time.monotonic()
+    with span('wait for boot loader', 'upload', port=port):
+        bootloader_port = find_bootloader(port, pattern, known_ports, appear_timeout, claim=claim)
+    log(f'Boot loader found at {bootloader_port} after {time.monotonic() - start_time:.2f} seconds.')
+    return bootloader_port
+
+
+def run_tool(args: List[str], log: Callable[[str], None], output: Optional[IO]) -> bool:
+    """
+    Run the upload tool.
+
+    :param args: The command line for the tool.
+    :param log: The function to print messages.
+    :param output: A file for the output of the tool, or None to print it.
+    :return: True if the tool was successful.
+    """
+    log(' '.join(args))
+    try:
+        with span('upload tool', 'upload', tool=Path(args[0]).name):
+            result = subprocess.run(args, stdout=output, stderr=subprocess.STDOUT if output else None)
+    except OSError as e:
+        raise UploadError(f'Could not start the upload tool: {e}')
+    return result.returncode == 0
 
 
-def upload(port: str, firmware: str, tool: str, tool_path: str, flash_start: int):
+def upload(port: str, firmware: str, tool: str, tool_path: str, flash_start: int,
+           log: Callable[[str], None] = print, output: Optional[IO] = None) -> bool:
     """
     Upload the firmware to the platform.
 
@@ -112,13 +319,18 @@ def upload(port: str, firmware: str, tool: str, tool_path: str, flash_start: int
     :param tool: The selected tool for the upload.
     :param tool_path: The path to the selected tool.
     :param flash_start: The start address of the firmware in the flash rom.
+    :param log: The function to print messages.
+    :param output: A file for the output of the tool, or None to print it.
+    :return: True if the upload was successful.
     """
-    print(f'Try to upload the firmware using {tool}...')
+    log(f'Try to upload the firmware using {tool}...')
+    if not firmware:
+        firmware = 'firmware'
+    if tool == 'samba':
+        return upload_samba(port, firmware, flash_start, log)
     if not tool_path:
         if tool == 'bossac':
             tool_path = 'bossac'
-    if not firmware:
-        firmware = 'firmware'
     args = [
         tool_path,
         '-o', f'{flash_start:#010x}',
@@ -126,8 +338,480 @@ def upload(port: str, firmware: str, tool: str, tool_path: str, flash_start: int
         '-R', '-U', '-e', '-w', '-v',
         firmware
     ]
-    print(' '.join(args))
-    subprocess.run(args)
+    return run_tool(args, log, output)
+
+
+def upload_samba(port: str, firmware: str, flash_start: int, log: Callable[[str], None] = print,
+                 old_image: Optional[bytes] = None, row_size: int = 0x100) -> bool:
+    """
+    Upload the firmware using the built-in SAM-BA client.
+
+    The written firmware is verified using the checksum calculated by the boot loader. If an old image
+    is given, only the changed rows are erased and written. If the checksum of the whole firmware
+    does not match after an incremental upload, the whole firmware is written again.
+
+    :param port: The port for the upload.
+    :param firmware: The absolute path to the firmware.
+    :param flash_start: The start address of the firmware in the flash rom.
+    :param log: The function to print messages.
+    :param old_image: The image which was last written to the board, or None to write the whole firmware.
+    :param row_size: The size of the smallest erasable area of the flash memory.
+    :return: True if the upload was successful.
+    """
+    image = Path(firmware).read_bytes()
+    try:
+        with SerialPort(port) as serial:
+            client = SambaClient(serial)
+            log(f'Boot loader version: {client.version()}')
+            start_time = time.monotonic()
+            written = 0
+            if old_image is not None:
+                ranges = changed_ranges(old_image, image, row_size, merge_gap=0)
+                log(f'{sum(end - start for start, end in ranges)} of {len(image)} bytes changed '
+                    f'in {len(ranges)} ranges.')
+                with span('write changes', 'upload', ranges=len(ranges)):
+                    for start, end in ranges:
+                        for row in range(start, end, row_size):
+                            client.erase_row(flash_start + row)
+                        client.write(flash_start + start, image[start:end])
+                        written += end - start
+                with span('verify', 'upload'):
+                    verified = client.verify(flash_start, image)
+                if not verified:
+                    log('The checksum of the firmware does not match, writing the whole firmware...')
+                    old_image = None
+            if old_image is None:
+                progress = _progress_printer(len(image), log)
+                with span('erase', 'upload'):
+                    client.erase(flash_start)
+                with span('write', 'upload', size=len(image)):
+                    client.write(flash_start, image, progress)
+                written += len(image)
+                with span('verify', 'upload'):
+                    verified = client.verify(flash_start, image)
+                if not verified:
+                    log('Verify failed, the checksum of the written firmware does not match.')
+                    return False
+            elapsed = time.monotonic() - start_time
+            log(f'Wrote and verified {written} bytes in {elapsed:.2f} seconds '
+                f'({written / max(elapsed, 1e-6) / 1024:.1f} KiB/s).')
+            with span('start firmware', 'upload'):
+                client.reset()
+    except SambaError as e:
+        raise UploadError(str(e))
+    return True
+
+
+def _progress_printer(total: int, log: Callable[[str], None]) -> Callable[[int], None]:
+    last_step = [0]
+
+    def progress(written: int):
+        step = written * 10 // max(total, 1)
+        if step > last_step[0]:
+            last_step[0] = step
+            log(f'Written {written} of {total} bytes ({step * 10}%).')
+    return progress
+
+
+def board_serial(port: str) -> str:
+    """
+    Get the USB serial number of the board connected to the given port.
+
+    :param port: The path to the port.
+    :return: The serial number, or an empty string if it can not be determined.
+    """
+    device_path = Path('/sys/class/tty')/Path(port).name/'device'
+    if not device_path.exists():
+        return ''
+    # The device is the USB interface, the serial number is an attribute of the USB device.
+    for directory in list(device_path.resolve().parents)[:3]:
+        serial_path = directory/'serial'
+        if serial_path.is_file():
+            return serial_path.read_text('utf-8').strip()
+    return ''
+
+
+def changed_ranges(old_image: bytes, new_image: bytes, row_size: int, merge_gap: int) -> List[Tuple[int, int]]:
+    """
+    Compare two firmware images row by row.
+
+    :param old_image: The image which was last written to the board.
+    :param new_image: The new image.
+    :param row_size: The size of the smallest erasable area of the flash memory.
+    :param merge_gap: Ranges which are separated by this number of unchanged rows or less are merged.
+    :return: A list of ranges with the start and end offset in the new image.
+    """
+    ranges = []
+    for start in range(0, len(new_image), row_size):
+        end = min(start + row_size, len(new_image))
+        if old_image[start:end] == new_image[start:end]:
+            continue
+        if ranges and start - ranges[-1][1] <= merge_gap * row_size:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def cached_image_path(cache_dir: Path, board_id: str, flash_start: int) -> Path:
+    """
+    Get the path of the image last written to a board.
+
+    :param cache_dir: The directory for the cached images.
+    :param board_id: The unique identifier of the board.
+    :param flash_start: The start address of the firmware in the flash rom.
+    :return: The path to the cached image.
+    """
+    safe_id = ''.join(c if c.isalnum() or c in '-_' else '_' for c in board_id)
+    return cache_dir/f'{safe_id}-{flash_start:08x}.bin'
+
+
+def upload_incremental(port: str, firmware: str, tool: str, tool_path: str, flash_start: int, board_id: str,
+                       cache_dir: Path, row_size: int,
+                       log: Callable[[str], None] = print, output: Optional[IO] = None) -> bool:
+    """
+    Upload only the rows of the firmware which changed since the last upload to this board.
+
+    The image last written to each board is kept in the cache directory. If there is no cached image,
+    the whole firmware is written. The cached image is removed before writing, so a failed or
+    interrupted upload always results in a full upload next time. After writing the changes, the
+    whole firmware is verified, and written again if it does not match.
+
+    :param port: The port for the upload.
+    :param firmware: The absolute path to the firmware.
+    :param tool: The selected tool for the upload.
+    :param tool_path: The path to the upload tool.
+    :param flash_start: The start address of the firmware in the flash rom.
+    :param board_id: The unique identifier of the board.
+    :param cache_dir: The directory for the cached images.
+    :param row_size: The size of the smallest erasable area of the flash memory.
+    :param log: The function to print messages.
+    :param output: A file for the output of the tool, or None to print it.
+    :return: True if the upload was successful.
+    """
+    if not tool_path:
+        tool_path = 'bossac'
+    if not firmware:
+        firmware = 'firmware'
+    new_image = Path(firmware).read_bytes()
+    cache_path = cached_image_path(cache_dir, board_id, flash_start)
+    if not cache_path.is_file():
+        log(f'No cached image for board {board_id}, uploading the whole firmware...')
+        if not upload(port, firmware, tool, tool_path, flash_start, log, output):
+            return False
+    elif tool == 'samba':
+        old_image = cache_path.read_bytes()
+        cache_path.unlink()
+        if not upload_samba(port, firmware, flash_start, log, old_image, row_size):
+            return False
+    else:
+        old_image = cache_path.read_bytes()
+        cache_path.unlink()
+        ranges = changed_ranges(old_image, new_image, row_size, merge_gap=4)
+        changed_size = sum(end - start for start, end in ranges)
+        log(f'{changed_size} of {len(new_image)} bytes changed in {len(ranges)} ranges.')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for index, (start, end) in enumerate(ranges):
+                chunk_path = Path(temp_dir)/f'chunk{index}.bin'
+                chunk_path.write_bytes(new_image[start:end])
+                args = [
+                    tool_path,
+                    '-o', f'{flash_start + start:#010x}',
+                    '-i', f'--port={port}',
+                    '-U', '-w',
+                    str(chunk_path)
+                ]
+                if not run_tool(args, log, output):
+                    return False
+        # Verify the whole firmware, which uses the checksum of the boot loader if it is supported.
+        args = [
+            tool_path,
+            '-o', f'{flash_start:#010x}',
+            '-i', f'--port={port}',
+            '-U', '-v', '-R',
+            firmware
+        ]
+        with span('verify', 'upload'):
+            verified = run_tool(args, log, output)
+        if not verified:
+            log('The firmware on the board does not match, writing the whole firmware...')
+            if not upload(port, firmware, tool, tool_path, flash_start, log, output):
+                return False
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache_path.write_bytes(new_image)
+    return True
+
+
+def upload_firmware(port: str, args, log: Callable[[str], None] = print, output: Optional[IO] = None) -> bool:
+    """
+    Upload the firmware, using the upload method selected by the command line arguments.
+
+    :param port: The port for the upload.
+    :param args: The parsed command line arguments.
+    :param log: The function to print messages.
+    :param output: A file for the output of the tool, or None to print it.
+    :return: True if the upload was successful.
+    """
+    board_id = args.board_id or board_serial(port)
+    cache_dir = Path(args.cache_dir).expanduser()
+    if args.incremental:
+        if board_id:
+            log(f'Try to upload the changes of the firmware to board {board_id} using {args.tool}...')
+            return upload_incremental(port=port,
+                                      firmware=args.firmware,
+                                      tool=args.tool,
+                                      tool_path=args.tool_path,
+                                      flash_start=args.flash_start,
+                                      board_id=board_id,
+                                      cache_dir=cache_dir,
+                                      row_size=args.row_size,
+                                      log=log,
+                                      output=output)
+        log('Could not identify the board, use --board-id to enable incremental uploads.')
+    success = upload(port=port,
+                     firmware=args.firmware,
+                     tool=args.tool,
+                     tool_path=args.tool_path,
+                     flash_start=args.flash_start,
+                     log=log,
+                     output=output)
+    if board_id:
+        # Keep the cached image of the board up to date, for the next incremental upload.
+        cache_path = cached_image_path(cache_dir, board_id, args.flash_start)
+        try:
+            if success:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                cache_path.write_bytes(Path(args.firmware or 'firmware').read_bytes())
+            elif cache_path.exists():
+                cache_path.unlink()
+        except OSError as e:
+            log(f'Could not update the cached image {cache_path}: {e}')
+    return success
+
+
+def flash_board(port: str, args, known_ports: Set[str], claim: Callable[[str], bool],
+                log_dir: Path) -> BoardResult:
+    """
+    Reset and upload the firmware to one of many boards.
+
+    All messages and the output of the upload tool are written into a log file for the board.
+
+    :param port: The port of the board.
+    :param args: The parsed command line arguments.
+    :param known_ports: All devices matching the port pattern before any board was reset.
+    :param claim: A function to claim the device of a boot loader.
+    :param log_dir: The directory for the log files.
+    :return: The result for this board.
+    """
+    result = BoardResult(port=port, log_path=log_dir/f'upload-{Path(port).name}.log')
+    with open(result.log_path, 'w', encoding='utf-8') as log_file:
+        def log(text: str):
+            log_file.write(f'{time.strftime("%H:%M:%S")} {text}\n')
+            log_file.flush()
+        try:
+            start_time = time.monotonic()
+            if args.reset:
+                bootloader_port = reset(port=port,
+                                        pattern=args.port,
+                                        hold_time=args.reset_hold,
+                                        disappear_timeout=args.reset_timeout,
+                                        appear_timeout=args.bootloader_timeout,
+                                        known_ports=known_ports,
+                                        claim=claim,
+                                        log=log)
+                port = find_port(bootloader_port)
+            result.reset_time = time.monotonic() - start_time
+            result.success = True
+            if args.upload:
+                start_time = time.monotonic()
+                result.success = upload_firmware(port=port, args=args, log=log, output=log_file)
+                result.upload_time = time.monotonic() - start_time
+                if not result.success:
+                    result.message = 'The upload tool reported an error.'
+        except (UploadError, PortNotFound) as e:
+            result.message = str(e)
+        log(f'Result: {"success" if result.success else "failure"} {result.message}')
+    return result
+
+
+def flash_all_boards(ports: List[str], args, jobs: int, log_dir: Path) -> List[BoardResult]:
+    """
+    Reset and upload the firmware to all given boards in parallel.
+
+    :param ports: The ports of all boards.
+    :param args: The parsed command line arguments.
+    :param jobs: The maximum number of boards to flash at the same time.
+    :param log_dir: The directory for the log files.
+    :return: The results for all boards, in the order of the ports.
+    """
+    log_dir.mkdir(parents=True, exist_ok=True)
+    known_ports = set()
+    for port in ports:
+        known_ports |= matching_ports(port_pattern(port, args.port))
+    claimed_ports = set()
+    claim_lock = threading.Lock()
+
+    def claim(candidate: str) -> bool:
+        with claim_lock:
+            if candidate in claimed_ports:
+                return False
+            claimed_ports.add(candidate)
+            return True
+
+    print(f'Flashing {len(ports)} boards, {jobs} at the same time...')
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(flash_board, port, args, known_ports, claim, log_dir) for port in ports]
+        results = []
+        for future in futures:
+            result = future.result()
+            print(f'{result.port}: {"OK" if result.success else "FAILED"}')
+            results.append(result)
+    return results
+
+
+def print_summary(results: List[BoardResult], total_time: float):
+    """
+    Print a summary table for flashing multiple boards.
+
+    :param results: The results of all boards.
+    :param total_time: The total time in seconds.
+    """
+    port_width = max([len(result.port) for result in results] + [4])
+    print(f'{"Port".ljust(port_width)}  {"Result":<7}  {"Reset":>6}  {"Upload":>6}  Log / Message')
+    for result in results:
+        status = 'OK' if result.success else 'FAILED'
+        details = str(result.log_path)
+        if result.message:
+            details += f' / {result.message}'
+        print(f'{result.port.ljust(port_width)}  {status:<7}  {result.reset_time:>5.1f}s  '
+              f'{result.upload_time:>5.1f}s  {details}')
+    success_count = len([result for result in results if result.success])
+    print(f'{success_count} of {len(results)} boards flashed successfully in {total_time:.1f} seconds.')
+
+
+def wait_for_port(port: str, pattern: str, disappear_timeout: float, appear_timeout: float) -> str:
+    """
+    Wait until the device of the boot loader disappears and the firmware shows up after an upload.
+
+    :param port: The path to the device of the boot loader.
+    :param pattern: The port pattern configured by the user.
+    :param disappear_timeout: The maximum time in seconds to wait for the boot loader to disappear.
+    :param appear_timeout: The maximum time in seconds to wait for the firmware to appear.
+    :return: The path to the device of the firmware.
+    """
+    deadline = time.monotonic() + disappear_timeout
+    while Path(port).exists() and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+    pattern = port_pattern(port, pattern)
+    deadline = time.monotonic() + appear_timeout
+    while True:
+        ports = sorted(matching_ports(pattern))
+        if port in ports:
+            ports = [port]
+        for candidate in ports:
+            if os.access(candidate, os.R_OK | os.W_OK):
+                return candidate
+        if time.monotonic() > deadline:
+            raise UploadError(f'The firmware did not appear within {appear_timeout} seconds.')
+        time.sleep(POLL_INTERVAL)
+
+
+def _read_port(serial_port: SerialPort, chunks: queue.Queue, stop: threading.Event):
+    """
+    Read the port as fast as possible and pass the received data to the main thread.
+    """
+    try:
+        while not stop.is_set():
+            data = serial_port.read_available(timeout=0.1, size=MONITOR_READ_SIZE)
+            if data:
+                chunks.put(data)
+    except SambaError as e:
+        chunks.put(e)
+    finally:
+        chunks.put(None)
+
+
+def monitor(port: str, table: LogTable, duration: float, output: IO = sys.stdout):
+    """
+    Print the log records sent by the firmware.
+
+    A separate thread reads the port, so no data is lost while the records are expanded and
+    printed. All data received in the meantime is decoded at once and written in one block.
+
+    :param port: The port of the firmware.
+    :param table: The format strings of the firmware.
+    :param duration: The time in seconds to monitor the port, or zero to monitor until interrupted.
+    :param output: The stream for the log lines.
+    """
+    frame_decoder = FrameDecoder([FRAME_TYPE_LOG])
+    log_decoder = LogDecoder(table)
+    chunks: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    end_time = time.monotonic() + duration if duration > 0 else None
+    try:
+        with SerialPort(port) as serial_port:
+            reader = threading.Thread(target=_read_port, args=(serial_port, chunks, stop), daemon=True)
+            reader.start()
+            try:
+                finished = False
+                while not finished:
+                    timeout = 0.5 if end_time is None else end_time - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        received = [chunks.get(timeout=timeout)]
+                    except queue.Empty:
+                        continue
+                    while True:
+                        try:
+                            received.append(chunks.get_nowait())
+                        except queue.Empty:
+                            break
+                    data = bytearray()
+                    for chunk in received:
+                        if chunk is None:
+                            finished = True
+                        elif isinstance(chunk, SambaError):
+                            raise UploadError(f'Lost the connection to the firmware: {chunk}')
+                        else:
+                            data.extend(chunk)
+                    lines = []
+                    for frame in frame_decoder.feed(bytes(data)):
+                        line = log_decoder.add_frame(frame)
+                        if line is not None:
+                            lines.append(line + '\n')
+                    if lines:
+                        output.write(''.join(lines))
+                        output.flush()
+            finally:
+                stop.set()
+                reader.join()
+    except KeyboardInterrupt:
+        pass
+    except SambaError as e:
+        raise UploadError(str(e))
+    print(f'{log_decoder.record_count} log records, {log_decoder.dropped_count} dropped on the board, '
+          f'{frame_decoder.skipped} bytes skipped.', file=sys.stderr)
+
+
+def run_monitor(port: str, args):
+    """
+    Monitor the log of the firmware, using the command line arguments.
+
+    :param port: The port of the firmware.
+    :param args: The parsed command line arguments.
+    """
+    elf_path = args.elf
+    if not elf_path and args.firmware:
+        elf_path = args.firmware[:-4] if args.firmware.endswith('.bin') else args.firmware
+    if not elf_path:
+        raise UploadError('Please specify the firmware ELF file with --elf to expand the log.')
+    try:
+        table = LogTable.load(elf_path, cache_dir=Path(args.log_cache_dir).expanduser())
+    except (LogFormatError, OSError) as e:
+        raise UploadError(f'Could not read the log formats: {e}')
+    print(f'Monitoring the log of {port} ({len(table.formats)} formats)...', file=sys.stderr)
+    monitor(port, table, args.monitor_time)
 
 
 def auto_int(argument: str) -> int:
@@ -156,6 +840,25 @@ def main():
                         dest='reset',
                         action='store_true',
                         help='If set, the port is set to 1200baud to reset the platform.')
+    parser.add_argument('--reset-hold',
+                        dest='reset_hold',
+                        type=float,
+                        action='store',
+                        default=0.5,
+                        help='The time in seconds to keep the port open at 1200baud. Some USB stacks '
+                             'need this time to notice the change of the baud rate.')
+    parser.add_argument('--reset-timeout',
+                        dest='reset_timeout',
+                        type=float,
+                        action='store',
+                        default=2.0,
+                        help='The maximum time in seconds to wait for the port to disappear after the reset.')
+    parser.add_argument('--bootloader-timeout',
+                        dest='bootloader_timeout',
+                        type=float,
+                        action='store',
+                        default=10.0,
+                        help='The maximum time in seconds to wait for the boot loader device to appear.')
     parser.add_argument('--upload', '-u',
                         dest='upload',
                         action='store_true',
@@ -170,8 +873,9 @@ def main():
                         type=str,
                         action='store',
                         default='bossac',
-                        choices=['bossac'],
-                        help='The tool to use.')
+                        choices=['bossac', 'samba'],
+                        help='The tool to use. "samba" uses the built-in SAM-BA client instead of an '
+                             'external tool.')
     parser.add_argument('--tool-path', '-x',
                         dest='tool_path',
                         type=str,
@@ -183,25 +887,116 @@ def main():
                         action='store',
                         default=0x2000,
                         help='The base address of the firmware.')
+    parser.add_argument('--incremental', '-I',
+                        dest='incremental',
+                        action='store_true',
+                        help='Only write the flash rows which changed since the last upload to the board.')
+    parser.add_argument('--board-id',
+                        dest='board_id',
+                        type=str,
+                        action='store',
+                        help='The identifier of the board for incremental uploads. '
+                             'Defaults to the USB serial number of the board.')
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        type=str,
+                        action='store',
+                        default='~/.cache/hal-toolchain/flash',
+                        help='The directory for the images last written to each board.')
+    parser.add_argument('--row-size',
+                        dest='row_size',
+                        type=auto_int,
+                        action='store',
+                        default=0x100,
+                        help='The size of the smallest erasable flash area.')
+    parser.add_argument('--all', '-a',
+                        dest='all',
+                        action='store_true',
+                        help='Reset and upload all devices matching the port pattern in parallel.')
+    parser.add_argument('--jobs', '-j',
+                        dest='jobs',
+                        type=int,
+                        action='store',
+                        default=8,
+                        help='The maximum number of boards to flash at the same time, if --all is used.')
+    parser.add_argument('--log-dir',
+                        dest='log_dir',
+                        type=str,
+                        action='store',
+                        default='.',
+                        help='The directory for the log files of the boards, if --all is used.')
+    parser.add_argument('--monitor', '-m',
+                        dest='monitor',
+                        action='store_true',
+                        help='Print the log of the firmware, after the upload if -u is used. '
+                             'Together with -r, the upload is required.')
+    parser.add_argument('--elf',
+                        dest='elf',
+                        type=str,
+                        action='store',
+                        help='The firmware ELF file with the log formats. '
+                             'Defaults to the firmware path without the ".bin" suffix.')
+    parser.add_argument('--monitor-time',
+                        dest='monitor_time',
+                        type=float,
+                        action='store',
+                        default=0.0,
+                        help='The time in seconds to print the log. Use 0 to print it until Ctrl+C is pressed.')
+    parser.add_argument('--log-cache-dir',
+                        dest='log_cache_dir',
+                        type=str,
+                        action='store',
+                        default=str(LOG_CACHE_DIR),
+                        help='The directory for the cached log formats of each firmware.')
 
     args = parser.parse_args()
-    if not (args.reset or args.upload):
-        print('Please specify upload (-u) or reset (-r) or both.')
+    if not (args.reset or args.upload or args.monitor):
+        print('Please specify upload (-u), reset (-r), monitor (-m) or a combination.')
         parser.print_help()
         exit(1)
+    if args.reset and args.monitor and not args.upload:
+        parser.error('A reset (-r) starts the boot loader, use it with the monitor (-m) only together with an '
+                     'upload (-u).')
+    if args.all:
+        try:
+            ports = find_ports(args.port)
+        except PortNotFound as e:
+            exit(f'Port "{args.port}" not found: {e}')
+            return
+        start_time = time.monotonic()
+        results = flash_all_boards(ports, args, max(args.jobs, 1), Path(args.log_dir))
+        print_summary(results, time.monotonic() - start_time)
+        if not all(result.success for result in results):
+            exit(1)
+        return
     try:
         port = find_port(args.port)
     except PortNotFound as e:
         exit(f'Port "{args.port}" not found: {e}')
         return
-    if args.reset:
-        reset(port=port)
-    if args.upload:
-        upload(port=port,
-               firmware=args.firmware,
-               tool=args.tool,
-               tool_path=args.tool_path,
-               flash_start=args.flash_start)
+    try:
+        if args.reset:
+            bootloader_port = reset(port=port,
+                                    pattern=args.port,
+                                    hold_time=args.reset_hold,
+                                    disappear_timeout=args.reset_timeout,
+                                    appear_timeout=args.bootloader_timeout)
+            try:
+                port = find_port(bootloader_port)
+            except PortNotFound as e:
+                exit(f'Boot loader port "{bootloader_port}" not found: {e}')
+        if args.upload:
+            if not upload_firmware(port=port, args=args):
+                exit('The upload tool reported an error.')
+            if args.monitor:
+                port = wait_for_port(port=port,
+                                     pattern=args.port,
+                                     disappear_timeout=args.reset_timeout,
+                                     appear_timeout=args.bootloader_timeout)
+        if args.monitor:
+            run_monitor(port, args)
+    except UploadError as e:
+        exit(str(e))
 
 
 if __name__ == '__main__':